@@ -23,31 +23,65 @@ import datetime
 import logging
 import os
 import shutil
+import stat
 from contextlib import closing
 from glob import glob
+from multiprocessing.dummy import Pool as ThreadPool
 
 import dateutil.parser
 import dateutil.tz
 
-from barman import output, xlog
+from barman import chunkstore, output, tarstorage, xlog
 from barman.backup_executor import (PassiveBackupExecutor,
                                     PostgresBackupExecutor,
                                     RsyncBackupExecutor)
+from barman.chunkstore import CHUNK_DIRECTORY, ChunkStore, FileRecipe
 from barman.compression import CompressionManager
 from barman.config import BackupOptions
 from barman.exceptions import (AbortedRetryHookScript,
                                CompressionIncompatibility, SshCommandException,
                                UnknownBackupIdException)
 from barman.hooks import HookScriptRunner, RetryHookScriptRunner
-from barman.infofile import BackupInfo, LocalBackupInfo, WalFileInfo
+from barman.infofile import (BackupInfo, FileManifest, LocalBackupInfo,
+                             WalFileInfo)
 from barman.lockfile import ServerBackupSyncLock
 from barman.recovery_executor import RecoveryExecutor
 from barman.remote_status import RemoteStatusMixin
 from barman.utils import (force_str, fsync_dir, fsync_file,
-                          human_readable_timedelta, pretty_size)
+                          human_readable_timedelta, pretty_size, syncfs)
 
 _logger = logging.getLogger(__name__)
 
+# Minimum number of threads used to sync the files of a backup
+FSYNC_WORKERS = 8
+
+
+def _list_directory(dir_path):
+    """
+    List the content of a directory, returning the stat of every entry.
+
+    Like os.walk, symbolic links to directories are not followed, while
+    symbolic links to files are reported with the stat of the target file.
+
+    :param str dir_path: the directory to list
+    :return tuple[list,list]: the subdirectories and the files contained
+        in the directory, as (path, stat) pairs
+    """
+    dirs = []
+    files = []
+    for name in os.listdir(dir_path):
+        path = os.path.join(dir_path, name)
+        entry_stat = os.lstat(path)
+        if stat.S_ISDIR(entry_stat.st_mode):
+            dirs.append((path, entry_stat))
+            continue
+        if stat.S_ISLNK(entry_stat.st_mode):
+            entry_stat = os.stat(path)
+            if stat.S_ISDIR(entry_stat.st_mode):
+                continue
+        files.append((path, entry_stat))
+    return dirs, files
+
 
 class BackupManager(RemoteStatusMixin):
     """Manager of the backup archive for a server"""
@@ -269,6 +303,20 @@ class BackupManager(RemoteStatusMixin):
                            minimum_redundancy,
                            len(available_backups))
             return False
+        # Backups containing page deltas need their base backup
+        dependent_backups = [
+            dependent.backup_id for dependent in
+            self.get_available_backups(
+                status_filter=BackupInfo.STATUS_ALL).values()
+            if dependent.delta_base == backup.backup_id]
+        if dependent_backups:
+            output.warning("Skipping delete of backup %s for server %s "
+                           "as it is the base of the page deltas "
+                           "of backups: %s",
+                           backup.backup_id,
+                           self.config.name,
+                           ', '.join(sorted(dependent_backups)))
+            return False
         # Keep track of when the delete operation started.
         delete_start_time = datetime.datetime.now()
 
@@ -393,6 +441,8 @@ class BackupManager(RemoteStatusMixin):
                 self.server,
                 backup_id=datetime.datetime.now().strftime('%Y%m%dT%H%M%S'))
             backup_info.set_attribute('systemid', self.server.systemid)
+            backup_info.set_attribute('backup_storage',
+                                      self.config.backup_storage)
             backup_info.save()
             self.backup_cache_add(backup_info)
             output.info(
@@ -422,6 +472,12 @@ class BackupManager(RemoteStatusMixin):
             # Free the Postgres connection
             self.server.postgres.close()
 
+            # Store the files of the backup as set by backup_storage
+            if backup_info.backup_storage == 'chunks':
+                self.store_backup_chunks(backup_info)
+            elif backup_info.backup_storage == 'tar':
+                self.store_backup_archives(backup_info)
+
             # Compute backup size and fsync it on disk
             self.backup_fsync_and_set_sizes(backup_info)
 
@@ -611,7 +667,12 @@ class BackupManager(RemoteStatusMixin):
             available_backups = self.get_available_backups(
                 BackupInfo.STATUS_ALL)
             retention_status = self.config.retention_policy.report()
-            for bid in sorted(retention_status.keys()):
+            # The backups containing page deltas are removed before the
+            # full backups they depend on
+            for bid in sorted(retention_status.keys(),
+                              key=lambda bid: (
+                                  not available_backups[bid].delta_base,
+                                  bid)):
                 if retention_status[bid] == BackupInfo.OBSOLETE:
                     output.info(
                         "Enforcing retention policy: removing backup %s for "
@@ -652,6 +713,24 @@ class BackupManager(RemoteStatusMixin):
             _logger.debug("Deleting PGDATA directory: %s" % pg_data)
             shutil.rmtree(pg_data)
 
+        if backup.backup_storage == 'tar':
+            backup_dir = backup.get_basebackup_directory()
+            for name in tarstorage.list_archives(backup_dir):
+                archive = os.path.join(backup_dir,
+                                       name + tarstorage.TAR_SUFFIX)
+                _logger.debug("Deleting archive: %s" % archive)
+                os.unlink(archive)
+
+        # Remove the chunks not used by any other backup from the store
+        chunk_dir = os.path.join(backup.get_basebackup_directory(),
+                                 CHUNK_DIRECTORY)
+        if os.path.exists(chunk_dir):
+            _logger.debug("Deleting chunks directory: %s" % chunk_dir)
+            count, size = ChunkStore(
+                self.config.chunk_store_directory).remove_backup(chunk_dir)
+            _logger.info("Removed %s unused chunks (%s) from the chunk store",
+                         count, pretty_size(size))
+
     def delete_wal(self, wal_info):
         """
         Delete a WAL segment, with the given WalFileInfo
@@ -1012,33 +1091,156 @@ class BackupManager(RemoteStatusMixin):
             # If no backup is available return false
             return False, "No available backups"
 
+    def store_backup_chunks(self, backup_info):
+        """
+        Move the data and tablespace directories of a backup in the chunk
+        store, replacing them with the recipe of the backup files and the
+        links to the chunks composing them.
+
+        :param LocalBackupInfo backup_info: the backup to store
+        """
+        self.executor.current_action = "storing the backup in the chunk store"
+        _logger.debug(self.executor.current_action)
+        stored = chunkstore.store_backup(
+            backup_info.get_basebackup_directory(),
+            self._backup_directories(backup_info),
+            ChunkStore(self.config.chunk_store_directory),
+            workers=self.config.parallel_jobs)
+        _logger.info("%s files of backup %s stored in the chunk store %s",
+                     stored, backup_info.backup_id,
+                     self.config.chunk_store_directory)
+
+    def store_backup_archives(self, backup_info):
+        """
+        Replace the data and tablespace directories of a backup with
+        compressed tar archives, writing the manifest of the archived files.
+
+        :param LocalBackupInfo backup_info: the backup to store
+        """
+        self.executor.current_action = "archiving the backup"
+        _logger.debug(self.executor.current_action)
+        backup_dest = backup_info.get_basebackup_directory()
+        files = tarstorage.store_backup(
+            backup_dest,
+            self._backup_directories(backup_info),
+            workers=max(self.config.parallel_jobs, FSYNC_WORKERS))
+        manifest = FileManifest(backup_info.get_manifest_filename())
+        with manifest.writer() as add_to_manifest:
+            for file_path, file_stat in files:
+                add_to_manifest(file_path, file_stat)
+        _logger.info("%s files of backup %s stored in compressed archives",
+                     len(files), backup_info.backup_id)
+
+    @staticmethod
+    def _backup_directories(backup_info):
+        """
+        List the data and tablespace directories present in a backup
+
+        :param LocalBackupInfo backup_info: the backup
+        :return list[str]: the directories, relative to the backup directory
+        """
+        backup_dest = backup_info.get_basebackup_directory()
+        directories = ['data']
+        if backup_info.tablespaces:
+            directories += [str(tablespace.oid)
+                            for tablespace in backup_info.tablespaces]
+        return [directory for directory in directories
+                if os.path.isdir(os.path.join(backup_dest, directory))]
+
     def backup_fsync_and_set_sizes(self, backup_info):
         """
         Fsync all files in a backup and set the actual size on disk
         of a backup.
 
         Also evaluate the deduplication ratio and the deduplicated size if
-        applicable.
+        applicable, and write the manifest of the backup files, which
+        allows the next backup to skip listing them when reusing this one.
+
+        The backup is walked and synced by a pool of threads, using a single
+        syncfs() call when the backup is contained in one filesystem.
 
         :param LocalBackupInfo backup_info: the backup to update
         """
         # Calculate the base backup size
         self.executor.current_action = "calculating backup size"
         _logger.debug(self.executor.current_action)
+        backup_dest = backup_info.get_basebackup_directory()
+        pool = ThreadPool(max(self.config.parallel_jobs, FSYNC_WORKERS))
+        try:
+            # Walk the backup one level at a time, listing in parallel
+            # all the directories of the same level
+            dirs = []
+            files = []
+            level = [backup_dest]
+            devices = set([os.stat(backup_dest).st_dev])
+            while level:
+                dirs.extend(level)
+                next_level = []
+                for sub_dirs, dir_files in pool.map(_list_directory, level):
+                    for path, entry_stat in sub_dirs + dir_files:
+                        devices.add(entry_stat.st_dev)
+                    next_level.extend(path for path, _ in sub_dirs)
+                    files.extend(dir_files)
+                level = next_level
+            # When the whole backup lives on a single filesystem, a single
+            # syncfs() is much faster than executing fsync() on every
+            # file and directory. Otherwise, do it in parallel.
+            if len(devices) > 1 or not syncfs(backup_dest):
+                if backup_info.backup_storage == 'chunks':
+                    # The chunks have been linked in the chunk store too
+                    store_dir = self.config.chunk_store_directory
+                    dirs.extend(os.path.join(store_dir, name)
+                                for name in os.listdir(store_dir))
+                paths = [path for path, _ in files]
+                files = list(zip(paths, pool.map(fsync_file, paths)))
+                pool.map(fsync_dir, dirs)
+        finally:
+            pool.terminate()
+            pool.join()
+
         backup_size = 0
         deduplicated_size = 0
-        backup_dest = backup_info.get_basebackup_directory()
-        for dir_path, _, file_names in os.walk(backup_dest):
-            # execute fsync() on the containing directory
-            fsync_dir(dir_path)
-            # execute fsync() on all the contained files
-            for filename in file_names:
-                file_path = os.path.join(dir_path, filename)
-                file_stat = fsync_file(file_path)
-                backup_size += file_stat.st_size
-                # Excludes hard links from real backup size
-                if file_stat.st_nlink == 1:
+        archived = backup_info.backup_storage == 'tar'
+        chunk_dir = os.path.join(backup_dest, CHUNK_DIRECTORY)
+        manifest = FileManifest(backup_info.get_manifest_filename())
+        manifest_entries = []
+        for file_path, file_stat in files:
+            # The chunks are linked by the chunk store too, so they
+            # are only used by this backup if they have two links.
+            # The backup size is the size of the files they compose.
+            if os.path.dirname(os.path.dirname(file_path)) == chunk_dir:
+                if file_stat.st_nlink == 2:
                     deduplicated_size += file_stat.st_size
+                continue
+            # Likewise, the compressed archives are only part of the
+            # size on disk
+            if archived and os.path.dirname(file_path) == backup_dest and \
+                    file_path.endswith(tarstorage.TAR_SUFFIX):
+                deduplicated_size += file_stat.st_size
+                continue
+            backup_size += file_stat.st_size
+            # Excludes hard links from real backup size
+            if file_stat.st_nlink == 1:
+                deduplicated_size += file_stat.st_size
+            # Files in the top directory, like backup.info, can be
+            # changed later, so they are not part of the manifest
+            if os.path.dirname(file_path) != backup_dest:
+                manifest_entries.append(
+                    (os.path.relpath(file_path, backup_dest), file_stat))
+        if archived:
+            # The manifest of the archived files has been written
+            # while archiving them
+            backup_size += sum(entry.size for entry in manifest.read())
+        else:
+            with manifest.writer() as add_to_manifest:
+                for file_path, file_stat in manifest_entries:
+                    add_to_manifest(file_path, file_stat)
+        recipe = FileRecipe(
+            os.path.join(backup_dest, FileRecipe.FILENAME))
+        if recipe.exists():
+            backup_size += sum(
+                size for mode, size, _, _, _ in recipe.read()
+                if stat.S_ISREG(mode))
         # Save size into BackupInfo object
         backup_info.set_attribute('size', backup_size)
         backup_info.set_attribute('deduplicated_size', deduplicated_size)
@@ -1048,7 +1250,8 @@ class BackupManager(RemoteStatusMixin):
         else:
             deduplication_ratio = 0
 
-        if self.config.reuse_backup == 'link':
+        if self.config.reuse_backup in ('link', 'delta') or \
+                backup_info.backup_storage != 'plain':
             output.info(
                 "Backup size: %s. Actual size on disk: %s"
                 " (-%s deduplication ratio)." % (
@@ -46,13 +46,22 @@ from barman.exceptions import (CommandFailedException, DataTransferFailure,
                                PostgresIsInRecovery, SshCommandException)
 from barman.fs import UnixLocalCommand, UnixRemoteCommand
 from barman.infofile import BackupInfo
+from barman.pagedelta import store_directory_deltas
 from barman.postgres_plumbing import EXCLUDE_LIST, PGDATA_EXCLUDE_LIST
 from barman.remote_status import RemoteStatusMixin
 from barman.utils import (force_str, human_readable_timedelta, mkpath,
-                          total_seconds, with_metaclass)
+                          pretty_size, total_seconds, with_metaclass)
 
 _logger = logging.getLogger(__name__)
 
+# Maximum number of backups storing page deltas against the same full
+# backup (reuse_backup = delta)
+MAX_DELTA_BACKUPS = 6
+
+# Maximum size of the data stored by a backup containing page deltas,
+# as a fraction of the size of its full backup
+MAX_DELTA_RATIO = 0.5
+
 
 class BackupExecutor(with_metaclass(ABCMeta, RemoteStatusMixin)):
     """
@@ -257,7 +266,7 @@ class PostgresBackupExecutor(BackupExecutor):
 
         # Forbid reuse_backup option.
         # It works only with rsync based backups.
-        if self.config.reuse_backup in ('copy', 'link'):
+        if self.config.reuse_backup in ('copy', 'link', 'delta'):
             self.server.config.disabled = True
             # Report the error in the configuration errors message list
             self.server.config.msg_list.append(
@@ -1086,15 +1095,36 @@ class RsyncBackupExecutor(FsBackupExecutor):
             backup_info.backup_id)
         safe_horizon = None
         reuse_backup = None
+        reuse_manifest = None
+        delta_base = None
 
         # Store the start time
         self.copy_start_time = datetime.datetime.now()
 
+        if previous_backup and previous_backup.backup_storage != 'plain':
+            # The files of a backup stored in the chunk store or in
+            # archives are not available to be reused
+            previous_backup = None
+
+        if previous_backup and self.config.reuse_backup == 'delta' and \
+                backup_info.backup_storage == 'plain':
+            # Page deltas are always stored against a full backup, which
+            # is the one reused to link the unchanged files. They are only
+            # stored in plain backups, as the files of the other backups
+            # are moved in the chunk store or in archives.
+            delta_base = self._delta_base(backup_info, previous_backup)
+            previous_backup = delta_base
+
         if previous_backup:
             # safe_horizon is a tz-aware timestamp because BackupInfo class
             # ensures that property
             reuse_backup = self.config.reuse_backup
+            if reuse_backup == 'delta':
+                reuse_backup = 'link'
             safe_horizon = previous_backup.begin_time
+            # The file manifest of the previous backup, if present, avoids
+            # listing its content when looking for files to reuse
+            reuse_manifest = previous_backup.get_manifest_filename()
 
         # Create the copy controller object, specific for rsync,
         # which will drive all the copy operations. Items to be
@@ -1152,6 +1182,7 @@ class RsyncBackupExecutor(FsBackupExecutor):
                              self.server.postgres.server_major_version],
                     bwlimit=self.config.get_bwlimit(tablespace),
                     reuse=self._reuse_path(previous_backup, tablespace),
+                    reuse_manifest=reuse_manifest,
                     item_class=controller.TABLESPACE_CLASS,
                 )
 
@@ -1170,6 +1201,7 @@ class RsyncBackupExecutor(FsBackupExecutor):
             exclude_and_protect=exclude_and_protect,
             bwlimit=self.config.get_bwlimit(),
             reuse=self._reuse_path(previous_backup),
+            reuse_manifest=reuse_manifest,
             item_class=controller.PGDATA_CLASS,
         )
 
@@ -1215,6 +1247,11 @@ class RsyncBackupExecutor(FsBackupExecutor):
             raise DataTransferFailure.from_command_error(
                 'rsync', e, msg)
 
+        # Replace the changed relation files with their page deltas
+        if delta_base:
+            backup_info.set_attribute('delta_base', delta_base.backup_id)
+            self._store_page_deltas(backup_info, delta_base)
+
         # Store the end time
         self.copy_end_time = datetime.datetime.now()
 
@@ -1239,6 +1276,103 @@ class RsyncBackupExecutor(FsBackupExecutor):
             else:
                 _logger.debug(msg)
 
+    def _delta_base(self, backup_info, previous_backup):
+        """
+        Find the full backup which the page deltas of a new backup
+        can be stored against.
+
+        It is the base of the previous backup, if it contains page deltas,
+        or the previous backup itself. Page LSNs can only be compared
+        within the same PostgreSQL cluster, so no base is returned if the
+        system identifier changed.
+
+        No base is returned either, starting a new full backup, when
+        the base is obsolete according to the retention policy, when
+        MAX_DELTA_BACKUPS backups already store page deltas against it, or
+        when the previous backup stored more than MAX_DELTA_RATIO of its
+        size. Otherwise the full backup could never be removed, and the
+        page deltas would grow until they contain the whole cluster.
+
+        :param barman.infofile.LocalBackupInfo backup_info: the new backup
+        :param barman.infofile.LocalBackupInfo previous_backup: the
+            previous backup
+        :rtype: barman.infofile.LocalBackupInfo|None
+        """
+        delta_base = previous_backup
+        if previous_backup.delta_base:
+            delta_base = self.backup_manager.get_backup(
+                previous_backup.delta_base)
+            if delta_base is None:
+                output.warning(
+                    "The base backup %s of backup %s is not available, "
+                    "taking a full backup",
+                    previous_backup.delta_base, previous_backup.backup_id)
+                return None
+        if delta_base.systemid != backup_info.systemid:
+            output.warning(
+                "The system identifier of backup %s differs from the "
+                "current one, taking a full backup",
+                delta_base.backup_id)
+            return None
+        retention_policy = self.config.retention_policy
+        if retention_policy and retention_policy.report().get(
+                delta_base.backup_id) == BackupInfo.OBSOLETE:
+            output.info(
+                "Backup %s is obsolete according to the retention policy, "
+                "taking a full backup", delta_base.backup_id)
+            return None
+        delta_backups = [
+            backup for backup in self.backup_manager.get_available_backups(
+                BackupInfo.STATUS_NOT_EMPTY).values()
+            if backup.delta_base == delta_base.backup_id]
+        if len(delta_backups) >= MAX_DELTA_BACKUPS:
+            output.info(
+                "%s backups store page deltas against backup %s, "
+                "taking a full backup",
+                len(delta_backups), delta_base.backup_id)
+            return None
+        if previous_backup.delta_base and delta_base.size and \
+                previous_backup.deduplicated_size is not None and \
+                previous_backup.deduplicated_size > \
+                delta_base.size * MAX_DELTA_RATIO:
+            output.info(
+                "Backup %s stored %s of page deltas and changed files "
+                "against backup %s (%s), taking a full backup",
+                previous_backup.backup_id,
+                pretty_size(previous_backup.deduplicated_size),
+                delta_base.backup_id, pretty_size(delta_base.size))
+            return None
+        return delta_base
+
+    def _store_page_deltas(self, backup_info, delta_base):
+        """
+        Replace the relation files changed since the base backup with
+        their page deltas, containing only the pages changed after the
+        start of the base backup.
+
+        :param barman.infofile.LocalBackupInfo backup_info: the backup
+        :param barman.infofile.LocalBackupInfo delta_base: the full backup
+            the page deltas are stored against
+        """
+        self.current_action = "storing page deltas"
+        _logger.debug(self.current_action)
+        lsn = xlog.parse_lsn(delta_base.begin_xlog)
+        oids = [None]
+        if backup_info.tablespaces:
+            oids += [tablespace.oid for tablespace in backup_info.tablespaces]
+        stored = 0
+        for oid in oids:
+            try:
+                base_directory = delta_base.get_data_directory(oid)
+            except ValueError:
+                # The tablespace did not exist in the base backup
+                continue
+            stored += store_directory_deltas(
+                backup_info.get_data_directory(oid), base_directory, lsn,
+                workers=self.config.parallel_jobs)
+        _logger.info("%s changed relation files stored as page deltas "
+                     "against backup %s", stored, delta_base.backup_id)
+
     def _reuse_path(self, previous_backup_info, tablespace=None):
         """
         If reuse_backup is 'copy' or 'link', builds the path of the directory
@@ -1258,7 +1392,7 @@ class RsyncBackupExecutor(FsBackupExecutor):
         oid = None
         if tablespace:
             oid = tablespace.oid
-        if self.config.reuse_backup in ('copy', 'link') and \
+        if self.config.reuse_backup in ('copy', 'link', 'delta') and \
                 previous_backup_info is not None:
             try:
                 return previous_backup_info.get_data_directory(oid)
@@ -0,0 +1,391 @@
+# Copyright (C) 2011-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module stores the files of a backup in a content-addressed
+chunk store.
+
+Every file is split in chunks of CHUNK_SIZE bytes, which are stored once
+in the chunk store, named after the SHA-256 digest of their content.
+Every backup contains a hard link to each chunk it uses, so the number
+of links of a chunk in the store is one more than the number of backups
+referencing it, and the backup directory contains all its data.
+The files of the backup are described by a recipe, listing the chunks
+composing every file.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import threading
+from contextlib import contextmanager
+from multiprocessing.dummy import Pool as ThreadPool
+
+from barman.utils import fsync_dir, mkpath
+
+_logger = logging.getLogger(__name__)
+
+#: Size of a chunk. PostgreSQL updates the pages of a relation file in
+#: place, so fixed size chunks, aligned to the pages, are enough to
+#: deduplicate the unchanged parts of a relation file.
+CHUNK_SIZE = 1024 * 1024
+
+#: Name of the directory containing the chunks of a backup
+CHUNK_DIRECTORY = 'chunks'
+
+
+def _make_fanout(directory):
+    """
+    Create the 256 subdirectories of a chunk directory, named after the
+    first two digits of the chunk digests
+
+    :param str directory: the chunk directory
+    """
+    for prefix in range(256):
+        mkpath(os.path.join(directory, '%02x' % prefix))
+
+
+def _chunk_name(digest):
+    """
+    Relative path of a chunk inside a chunk directory
+
+    :param str digest: the digest of the chunk
+    :rtype: str
+    """
+    return os.path.join(digest[:2], digest)
+
+
+class ChunkStore(object):
+    """
+    A directory containing chunks, shared by the backups of one or more
+    servers. It must be on the same filesystem of the backups.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: the directory of the chunk store
+        """
+        self.path = path
+
+    def init(self):
+        """
+        Create the chunk store directory, if needed
+        """
+        _make_fanout(self.path)
+
+    def chunk_path(self, digest):
+        """
+        Path of a chunk inside the chunk store
+
+        :param str digest: the digest of the chunk
+        :rtype: str
+        """
+        return os.path.join(self.path, _chunk_name(digest))
+
+    def store(self, data, chunk_dir):
+        """
+        Store a chunk, unless already present, and link it in the
+        chunk directory of a backup
+
+        :param bytes data: the content of the chunk
+        :param str chunk_dir: the chunk directory of the backup
+        :return str: the digest of the chunk
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        link = os.path.join(chunk_dir, _chunk_name(digest))
+        if os.path.exists(link):
+            return digest
+        try:
+            os.link(path, link)
+            return digest
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return digest
+            if e.errno != errno.ENOENT:
+                raise
+        # The chunk is not in the store: write it in a temporary file, then
+        # publish it without replacing a chunk stored in the meantime
+        tmp_path = '%s.%s-%s.tmp' % (path, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            with open(tmp_path, 'wb') as chunk:
+                chunk.write(data)
+            try:
+                os.link(tmp_path, path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                os.link(tmp_path, link)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.unlink(tmp_path)
+        return digest
+
+    def remove_backup(self, chunk_dir):
+        """
+        Remove the chunk directory of a backup, then remove from the
+        store the chunks not used by any other backup
+
+        :param str chunk_dir: the chunk directory of the backup
+        :return tuple[int,int]: the number and the size of the chunks
+            removed from the store
+        """
+        digests = []
+        for _, _, file_names in os.walk(chunk_dir):
+            digests.extend(file_names)
+        shutil.rmtree(chunk_dir)
+        return self.collect_garbage(digests)
+
+    def collect_garbage(self, digests):
+        """
+        Remove from the store the given chunks, if they are not linked
+        by any backup
+
+        :param collections.Iterable[str] digests: the chunks to check
+        :return tuple[int,int]: the number and the size of the chunks
+            removed from the store
+        """
+        count = 0
+        size = 0
+        for digest in digests:
+            path = self.chunk_path(digest)
+            try:
+                chunk_stat = os.stat(path)
+                if chunk_stat.st_nlink > 1:
+                    continue
+                os.unlink(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            count += 1
+            size += chunk_stat.st_size
+        _logger.debug("Removed %s unused chunks (%s bytes) from %s",
+                      count, size, self.path)
+        return count, size
+
+
+class FileRecipe(object):
+    """
+    Description of the files of a backup stored in a chunk store.
+
+    Every line of the file describes an entry using tab separated fields:
+    mode (in octal), size, modification time (seconds since the epoch),
+    content and path, relative to the directory containing the recipe.
+    The content is the comma separated list of the chunk digests for
+    regular files, the target for symbolic links and empty for
+    directories.
+    """
+
+    FILENAME = 'files.recipe'
+
+    def __init__(self, filename):
+        """
+        :param str filename: the path of the recipe file
+        """
+        self.filename = filename
+
+    def exists(self):
+        """
+        Whether the recipe file exists
+        """
+        return os.path.exists(self.filename)
+
+    @contextmanager
+    def writer(self):
+        """
+        Context manager to write the recipe, yielding a function which
+        accepts the path of an entry (relative to the recipe directory),
+        its stat result and its content.
+
+        The recipe is written in a temporary file, which replaces the
+        final one only if the block terminates without errors.
+        """
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as recipe:
+                def add(path, file_stat, content):
+                    recipe.write('%o\t%d\t%d\t%s\t%s\n' % (
+                        file_stat.st_mode, file_stat.st_size,
+                        int(file_stat.st_mtime), content, path))
+                yield add
+                recipe.flush()
+                os.fsync(recipe.fileno())
+            os.rename(tmp_filename, self.filename)
+            fsync_dir(os.path.dirname(self.filename))
+        finally:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+
+    def read(self):
+        """
+        Read the recipe, yielding a tuple for every entry
+
+        :rtype: collections.Iterable[tuple[int,int,int,str,str]]
+        :return: mode, size, modification time, content and path
+        """
+        with open(self.filename) as recipe:
+            for line in recipe:
+                mode, size, mtime, content, path = \
+                    line.rstrip('\n').split('\t', 4)
+                yield int(mode, 8), int(size), int(mtime), content, path
+
+
+def _store_file(store, path, chunk_dir):
+    """
+    Split a file in chunks, store them and remove the file
+
+    :param ChunkStore store: the chunk store
+    :param str path: the file to store
+    :param str chunk_dir: the chunk directory of the backup
+    :return str: the comma separated list of the chunk digests
+    """
+    digests = []
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            digests.append(store.store(data, chunk_dir))
+    os.unlink(path)
+    return ','.join(digests)
+
+
+def store_backup(backup_dir, directories, store, workers=1):
+    """
+    Move the content of some directories of a backup in the chunk store,
+    writing the recipe of the backup.
+
+    :param str backup_dir: the backup directory
+    :param list[str] directories: the directories to store, relative to
+        the backup directory
+    :param ChunkStore store: the chunk store
+    :param int workers: number of files stored in parallel
+    :return int: the number of stored files
+    """
+    store.init()
+    chunk_dir = os.path.join(backup_dir, CHUNK_DIRECTORY)
+    _make_fanout(chunk_dir)
+    entries = []
+    for directory in directories:
+        for dir_path, dir_names, file_names in os.walk(
+                os.path.join(backup_dir, directory)):
+            entries.append((dir_path, os.lstat(dir_path)))
+            for name in dir_names + file_names:
+                path = os.path.join(dir_path, name)
+                entry_stat = os.lstat(path)
+                # Directories are listed when walked
+                if not stat.S_ISDIR(entry_stat.st_mode):
+                    entries.append((path, entry_stat))
+
+    def store_entry(entry):
+        path, entry_stat = entry
+        if stat.S_ISREG(entry_stat.st_mode):
+            return _store_file(store, path, chunk_dir)
+        if stat.S_ISLNK(entry_stat.st_mode):
+            return os.readlink(path)
+        return ''
+
+    count = 0
+    recipe = FileRecipe(os.path.join(backup_dir, FileRecipe.FILENAME))
+    pool = ThreadPool(workers)
+    try:
+        with recipe.writer() as add_to_recipe:
+            for (path, entry_stat), content in zip(
+                    entries, pool.imap(store_entry, entries)):
+                add_to_recipe(os.path.relpath(path, backup_dir),
+                              entry_stat, content)
+                if stat.S_ISREG(entry_stat.st_mode):
+                    count += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    for directory in directories:
+        shutil.rmtree(os.path.join(backup_dir, directory))
+    return count
+
+
+def _restore_file(chunk_dir, content, path):
+    """
+    Write a file concatenating its chunks
+
+    :param str chunk_dir: the chunk directory of the backup
+    :param str content: the comma separated list of the chunk digests
+    :param str path: the file to write
+    """
+    with open(path, 'wb') as f:
+        for digest in content.split(','):
+            if not digest:
+                continue
+            with open(os.path.join(chunk_dir, _chunk_name(digest)),
+                      'rb') as chunk:
+                shutil.copyfileobj(chunk, f)
+
+
+def restore_backup(backup_dir, dst_dir, workers=1, paths=None):
+    """
+    Rebuild in dst_dir the directories of a backup stored in the chunk
+    store, using the recipe and the chunks linked in the backup.
+
+    :param str backup_dir: the backup directory
+    :param str dst_dir: the directory where files are restored, which
+        gets the same layout as the backup directory
+    :param int workers: number of files restored in parallel
+    :param collections.Container[str]|None paths: if present, restore
+        only these entries, relative to the backup directory
+    :return int: the number of restored files
+    """
+    chunk_dir = os.path.join(backup_dir, CHUNK_DIRECTORY)
+    recipe = FileRecipe(os.path.join(backup_dir, FileRecipe.FILENAME))
+    files = []
+    dirs = []
+    for mode, _, mtime, content, path in recipe.read():
+        if paths is not None:
+            if path not in paths:
+                continue
+            mkpath(os.path.dirname(os.path.join(dst_dir, path)))
+        dst = os.path.join(dst_dir, path)
+        if stat.S_ISDIR(mode):
+            mkpath(dst)
+            dirs.append((dst, mode))
+        elif stat.S_ISLNK(mode):
+            os.symlink(content, dst)
+        else:
+            files.append((dst, mode, mtime, content))
+
+    def restore_entry(entry):
+        dst, mode, mtime, content = entry
+        _restore_file(chunk_dir, content, dst)
+        os.chmod(dst, stat.S_IMODE(mode))
+        os.utime(dst, (mtime, mtime))
+
+    pool = ThreadPool(workers)
+    try:
+        pool.map(restore_entry, files)
+    finally:
+        pool.terminate()
+        pool.join()
+    for dst, mode in dirs:
+        os.chmod(dst, stat.S_IMODE(mode))
+    return len(files)
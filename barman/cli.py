@@ -884,6 +884,12 @@ def get_wal(args):
           'WAL files.',
      action='store_true',
      default=SUPPRESS)
+@arg('--compressed',
+     help='declare that the WAL files can be compressed by the client. '
+          'Barman versions not supporting compressed WAL files reject '
+          'this option, so that the client can report it.',
+     action='store_true',
+     default=SUPPRESS)
 @expects_obj
 def put_wal(args):
     """
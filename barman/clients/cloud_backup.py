@@ -93,7 +93,8 @@ def main(args=None):
                 encryption=config.encryption,
                 jobs=config.jobs,
                 profile_name=config.profile,
-                endpoint_url=config.endpoint_url)
+                endpoint_url=config.endpoint_url,
+                max_buffer_memory=config.max_buffer_memory)
 
             if not cloud_interface.test_connectivity():
                 raise SystemExit(1)
@@ -111,6 +112,8 @@ def main(args=None):
                     compression=config.compression,
                     postgres=postgres,
                     max_archive_size=config.max_archive_size,
+                    archive_jobs=config.archive_jobs,
+                    indexed=config.index,
                     cloud_interface=cloud_interface)
 
                 # Perform the backup
@@ -230,6 +233,25 @@ def parse_arguments(args=None):
         help="maximum size of an archive when uploading to S3 "
              "(default: 100GB)",
         default='100GB')
+    parser.add_argument(
+        '--archive-jobs',
+        type=check_positive,
+        help="number of archives built and compressed in parallel, "
+             "splitting the PGDATA files among them (default: 1)",
+        default=1)
+    parser.add_argument(
+        '--index',
+        help="compress the files in independent streams, listed in the "
+             "backup.index file, allowing the restore of single paths. "
+             "The backup cannot be restored by older versions of "
+             "barman-cloud-restore",
+        action='store_true')
+    parser.add_argument(
+        '--max-buffer-memory',
+        type=check_size,
+        help="maximum memory used to buffer the parts waiting to be "
+             "uploaded to S3 (default: 512MB)",
+        default='512MB')
     parser.add_argument(
         "--endpoint-url",
         help="Override default S3 endpoint URL with the given one",
@@ -0,0 +1,325 @@
+# Copyright (C) 2018-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+from contextlib import closing
+
+import barman
+from barman.cloud import CloudInterface, S3BackupCatalog, configure_logging
+from barman.infofile import BackupInfo
+from barman.retention_policies import (RecoveryWindowRetentionPolicy,
+                                       RedundancyRetentionPolicy)
+from barman.utils import check_positive, force_str
+
+try:
+    import argparse
+except ImportError:
+    raise SystemExit("Missing required python module: argparse")
+
+
+def main(args=None):
+    """
+    The main script entry point
+
+    :param list[str] args: the raw arguments list. When not provided
+        it defaults to sys.args[1:]
+    """
+    config = parse_arguments(args)
+    configure_logging(config)
+
+    try:
+        retention_policy = create_retention_policy(config)
+
+        cloud_interface = CloudInterface(
+            url=config.source_url,
+            encryption=config.encryption,
+            jobs=config.jobs,
+            profile_name=config.profile,
+            endpoint_url=config.endpoint_url)
+
+        with closing(cloud_interface):
+            deleter = S3BackupDeleter(
+                cloud_interface=cloud_interface,
+                server_name=config.server_name,
+                retention_policy=retention_policy)
+
+            if not cloud_interface.test_connectivity():
+                raise SystemExit(1)
+            # If test is requested, just exit after connectivity test
+            elif config.test:
+                raise SystemExit(0)
+
+            if not cloud_interface.bucket_exists:
+                logging.error("Bucket %s does not exist",
+                              cloud_interface.bucket_name)
+                raise SystemExit(1)
+
+            if not deleter.delete_obsolete(config.dry_run):
+                raise SystemExit(1)
+
+    except Exception as exc:
+        logging.error("Barman cloud backup delete exception: %s",
+                      force_str(exc))
+        logging.debug('Exception details:', exc_info=exc)
+        raise SystemExit(1)
+
+
+def create_retention_policy(config):
+    """
+    Create the retention policy of the backups
+
+    :param argparse.Namespace config: the configuration from command line
+    :rtype: barman.retention_policies.RetentionPolicy
+    """
+    # The retention policies only need the name and the minimum
+    # redundancy from the configuration of the server
+    server = argparse.Namespace(config=argparse.Namespace(
+        name=config.server_name,
+        minimum_redundancy=config.minimum_redundancy))
+    for policy_class in (RedundancyRetentionPolicy,
+                         RecoveryWindowRetentionPolicy):
+        policy = policy_class.create(server, 'BASE', config.retention_policy)
+        if policy:
+            return policy
+    raise ValueError('Cannot parse retention policy: %s' %
+                     config.retention_policy)
+
+
+def parse_arguments(args=None):
+    """
+    Parse command line arguments
+
+    :return: The options parsed
+    """
+
+    parser = argparse.ArgumentParser(
+        description='This script can be used to delete the backups '
+                    'made with barman-cloud-backup command, and the WAL '
+                    'files archived with barman-cloud-wal-archive, '
+                    'which are obsolete according to a retention policy. '
+                    'Currently only AWS S3 is supported.',
+        add_help=False
+    )
+
+    parser.add_argument(
+        'source_url',
+        help='URL of the cloud source, such as a bucket in AWS S3.'
+             ' For example: `s3://bucket/path/to/folder`.'
+    )
+    parser.add_argument(
+        'server_name',
+        help='the name of the server as configured in Barman.'
+    )
+    parser.add_argument(
+        '-r', '--retention-policy',
+        required=True,
+        help="the retention policy, such as 'REDUNDANCY 2' or "
+             "'RECOVERY WINDOW OF 4 WEEKS'",
+    )
+    parser.add_argument(
+        '-m', '--minimum-redundancy',
+        type=int,
+        default=0,
+        help='the minimum number of backups to keep (default: 0)',
+    )
+    parser.add_argument(
+        '-V', '--version',
+        action='version', version='%%(prog)s %s' % barman.__version__
+    )
+    parser.add_argument(
+        '--help',
+        action='help',
+        help='show this help message and exit')
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        '-v', '--verbose',
+        action='count',
+        default=0,
+        help='increase output verbosity (e.g., -vv is more than -v)')
+    verbosity.add_argument(
+        '-q', '--quiet',
+        action='count',
+        default=0,
+        help='decrease output verbosity (e.g., -qq is less than -q)')
+    parser.add_argument(
+        '-P', '--profile',
+        help='profile name (e.g. INI section in AWS credentials file)',
+    )
+    parser.add_argument(
+        "-e", "--encryption",
+        help="Enable server-side encryption for the transfer. "
+             "Allowed values: 'AES256', 'aws:kms'",
+        choices=['AES256', 'aws:kms'],
+        metavar="ENCRYPTION",
+    )
+    parser.add_argument(
+        "-t", "--test",
+        help="Test cloud connectivity and exit",
+        action="store_true",
+        default=False
+    )
+    parser.add_argument(
+        '-J', '--jobs',
+        type=check_positive,
+        help='number of delete requests executed in parallel '
+             '(default: 2)',
+        default=2)
+    parser.add_argument(
+        '-n', '--dry-run',
+        help='only report the backups and the WAL files which would be '
+             'deleted',
+        action='store_true',
+        default=False)
+    parser.add_argument(
+        "--endpoint-url",
+        help="Override default S3 endpoint URL with the given one",
+    )
+    return parser.parse_args(args=args)
+
+
+class S3BackupDeleter(object):
+    """
+    S3 delete client
+    """
+
+    # Allowed compression algorithms
+    ALLOWED_COMPRESSIONS = ('.gz', '.bz2')
+
+    def __init__(self, cloud_interface, server_name, retention_policy):
+        """
+        Object responsible for handling interactions with S3
+
+        :param CloudInterface cloud_interface: The interface to use to
+          delete the backups
+        :param str server_name: The name of the server as configured in Barman
+        :param RetentionPolicy retention_policy: the retention policy of
+          the backups
+        """
+
+        self.cloud_interface = cloud_interface
+        self.server_name = server_name
+        self.retention_policy = retention_policy
+        self.catalog = S3BackupCatalog(cloud_interface, server_name)
+
+    def delete_obsolete(self, dry_run=False):
+        """
+        Delete the backups which are obsolete according to the retention
+        policy, and the WAL files preceding the oldest retained backup
+
+        The backup.info file of a backup is deleted after its archives,
+        so an interrupted deletion is completed by the next run.
+
+        :param bool dry_run: whether to only report the objects to delete
+        :return bool: False if some object could not be deleted
+        """
+        backup_list = self.catalog.get_backup_list()
+        report = self.retention_policy.report(source=backup_list,
+                                              context='BASE')
+        obsolete = sorted(backup_id for backup_id in report
+                          if report[backup_id] == BackupInfo.OBSOLETE)
+        retained = sorted(backup_id for backup_id in report
+                          if report[backup_id] in (
+                              BackupInfo.VALID,
+                              BackupInfo.POTENTIALLY_OBSOLETE))
+        if not retained:
+            logging.warning("No backup of server %s is retained by the "
+                            "retention policy %s, nothing to delete",
+                            self.server_name, self.retention_policy)
+            return True
+        begin_wal = backup_list[retained[0]].begin_wal
+
+        action = "Would delete" if dry_run else "Deleting"
+        for backup_id in obsolete:
+            print("%s backup %s" % (action, backup_id))
+
+        failed = []
+        counter = [0]
+
+        def count(keys):
+            for key in keys:
+                counter[0] += 1
+                yield key
+
+        if dry_run:
+            for _ in count(self._obsolete_wals(begin_wal)):
+                pass
+        else:
+            failed += self.cloud_interface.delete_objects(
+                self._backup_archives(obsolete))
+            # Keep the backup.info files if an archive is left
+            if not failed:
+                failed += self.cloud_interface.delete_objects(
+                    os.path.join(self.catalog.prefix, backup_id,
+                                 'backup.info')
+                    for backup_id in obsolete)
+            failed += self.cloud_interface.delete_objects(
+                count(self._obsolete_wals(begin_wal)))
+        print("%s %s WAL files older than %s" % (
+            action, counter[0], begin_wal))
+
+        if failed:
+            logging.error("%s objects could not be deleted", len(failed))
+            return False
+        return True
+
+    def _backup_archives(self, backup_ids):
+        """
+        List the objects of some backups, except their backup.info file
+
+        :param list[str] backup_ids: the backups
+        :rtype: collections.Iterable[str]
+        """
+        for backup_id in backup_ids:
+            source_dir = os.path.join(self.catalog.prefix, backup_id)
+            for key in self.cloud_interface.list_bucket(source_dir + '/',
+                                                        delimiter=''):
+                if os.path.basename(key) != 'backup.info':
+                    yield key
+
+    def _obsolete_wals(self, begin_wal):
+        """
+        List the WAL files preceding a WAL file. The history files are
+        always kept.
+
+        Only the hash directories up to the one of begin_wal are listed.
+
+        :param str begin_wal: the first WAL file to keep
+        :rtype: collections.Iterable[str]
+        """
+        source_dir = os.path.join(self.cloud_interface.path,
+                                  self.server_name, 'wals')
+        begin_hash_dir = begin_wal[:16]
+        for item in self.cloud_interface.list_bucket(source_dir + '/'):
+            # The history files are stored outside the hash directories
+            if not item.endswith('/'):
+                continue
+            hash_dir = os.path.basename(item.rstrip('/'))
+            if len(hash_dir) != 16 or hash_dir > begin_hash_dir:
+                continue
+            for key in self.cloud_interface.list_bucket(item, delimiter=''):
+                name = os.path.basename(key)
+                for ext in self.ALLOWED_COMPRESSIONS:
+                    if name.endswith(ext):
+                        name = name[:-len(ext)]
+                        break
+                if hash_dir < begin_hash_dir or name < begin_wal:
+                    yield key
+
+
+if __name__ == '__main__':
+    main()
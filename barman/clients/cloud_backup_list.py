@@ -22,7 +22,7 @@ from contextlib import closing
 import barman
 from barman.cloud import CloudInterface, S3BackupCatalog, configure_logging
 from barman.infofile import BackupInfo
-from barman.utils import force_str
+from barman.utils import check_positive, force_str
 
 try:
     import argparse
@@ -44,13 +44,15 @@ def main(args=None):
         cloud_interface = CloudInterface(
             url=config.source_url,
             encryption=config.encryption,
+            jobs=config.jobs,
             profile_name=config.profile,
             endpoint_url=config.endpoint_url)
 
         with closing(cloud_interface):
             catalog = S3BackupCatalog(
                 cloud_interface=cloud_interface,
-                server_name=config.server_name)
+                server_name=config.server_name,
+                cache_dir=config.cache_dir)
 
             if not cloud_interface.test_connectivity():
                 raise SystemExit(1)
@@ -153,6 +155,17 @@ def parse_arguments(args=None):
         default="console",
         help="Output format (console or json). Default console."
     )
+    parser.add_argument(
+        '-J', '--jobs',
+        type=check_positive,
+        help='number of backup.info files downloaded in parallel '
+             '(default: 2)',
+        default=2)
+    parser.add_argument(
+        '--cache-dir',
+        help='local directory caching the backup.info files, which are '
+             'downloaded again only when changed',
+    )
     parser.add_argument(
         "--endpoint-url",
         help="Override default S3 endpoint URL with the given one",
@@ -17,10 +17,12 @@
 import logging
 import os
 from contextlib import closing
+from multiprocessing.dummy import Pool as ThreadPool
 
 import barman
-from barman.cloud import CloudInterface, S3BackupCatalog, configure_logging
-from barman.utils import force_str
+from barman.cloud import (CloudInterface, RestoreJournal, S3BackupCatalog,
+                          configure_logging)
+from barman.utils import check_positive, force_str
 
 try:
     import argparse
@@ -28,6 +30,10 @@ except ImportError:
     raise SystemExit("Missing required python module: argparse")
 
 
+#: Name of the journal file of a restore, stored in the PGDATA destination
+RESTORE_JOURNAL = '.barman-cloud-restore.journal'
+
+
 def main(args=None):
     """
     The main script entry point
@@ -38,8 +44,11 @@ def main(args=None):
     config = parse_arguments(args)
     configure_logging(config)
 
-    # Validate the destination directory before starting recovery
-    if os.path.exists(config.recovery_dir) and os.listdir(config.recovery_dir):
+    # Validate the destination directory before starting recovery.
+    # Single paths can be restored in an existing directory.
+    if not config.resume and not config.paths \
+            and os.path.exists(config.recovery_dir) \
+            and os.listdir(config.recovery_dir):
         logging.error("Destination %s already exists and it is not empty",
                       config.recovery_dir)
         raise SystemExit(1)
@@ -48,6 +57,7 @@ def main(args=None):
         cloud_interface = CloudInterface(
             url=config.source_url,
             encryption=config.encryption,
+            jobs=config.jobs,
             profile_name=config.profile,
             endpoint_url=config.endpoint_url)
 
@@ -67,7 +77,8 @@ def main(args=None):
                               cloud_interface.bucket_name)
                 raise SystemExit(1)
 
-            downloader.download_backup(config.backup_id, config.recovery_dir)
+            downloader.download_backup(config.backup_id, config.recovery_dir,
+                                       config.resume, config.paths)
 
     except KeyboardInterrupt as exc:
         logging.error("Barman cloud restore was interrupted by the user")
@@ -147,6 +158,27 @@ def parse_arguments(args=None):
         action="store_true",
         default=False
     )
+    parser.add_argument(
+        '-J', '--jobs',
+        type=check_positive,
+        help='number of archives extracted in parallel, and of parallel '
+             'downloads of the content of every archive (default: 2)',
+        default=2)
+    parser.add_argument(
+        '--resume',
+        help='resume an interrupted restore, skipping the archives and '
+             'the files already extracted',
+        action='store_true',
+        default=False)
+    parser.add_argument(
+        '--path',
+        dest='paths',
+        metavar='PATH',
+        action='append',
+        help='restore only the given file or directory, relative to '
+             'PGDATA, overwriting it if it exists. The content of a '
+             'tablespace is under pg_tblspc/OID. '
+             'Can be specified more than once.')
     parser.add_argument(
         "--endpoint-url",
         help="Override default S3 endpoint URL with the given one",
@@ -173,12 +205,21 @@ class S3BackupDownloader(object):
         self.server_name = server_name
         self.catalog = S3BackupCatalog(cloud_interface, server_name)
 
-    def download_backup(self, backup_id, destination_dir):
+    def download_backup(self, backup_id, destination_dir, resume=False,
+                        paths=None):
         """
         Download a backup from S3
 
-        :param str wal_name: Name of the WAL file
-        :param str wal_dest: Full path of the destination WAL file
+        The progress of the restore is recorded in a journal file inside
+        destination_dir, which is removed when the restore is complete.
+
+        :param str backup_id: the backup ID
+        :param str destination_dir: the destination of PGDATA
+        :param bool resume: whether to resume an interrupted restore,
+          skipping the content already extracted
+        :param list[str]|None paths: restore only these paths, relative
+          to PGDATA, downloading only the parts of the archives
+          containing them
         """
 
         backup_info = self.catalog.get_backup_info(backup_id)
@@ -210,7 +251,8 @@ class S3BackupDownloader(object):
                         "in backupinfo.tablespaces list")
 
             # Validate the destination directory before starting recovery
-            if os.path.exists(target_dir) and os.listdir(target_dir):
+            if not resume and not paths and os.path.exists(target_dir) \
+                    and os.listdir(target_dir):
                 logging.error(
                     "Destination %s already exists and it is not empty",
                     target_dir)
@@ -219,15 +261,119 @@ class S3BackupDownloader(object):
             for additional_file in file_info.additional_files:
                 copy_jobs.append([additional_file, target_dir])
 
-        # Now it's time to download the files
+        if paths:
+            self._download_paths(backup_info, copy_jobs, paths)
+            return
+
+        # Now it's time to download the files. Every archive is extracted
+        # by a thread of the extract pool, while its content is downloaded
+        # in advance by the threads of the download pool.
+        if not os.path.exists(destination_dir):
+            os.makedirs(destination_dir)
+        journal = RestoreJournal(
+            os.path.join(destination_dir, RESTORE_JOURNAL))
+        if resume:
+            journal.load()
+        journal.open()
+        jobs = self.cloud_interface.worker_processes_count
+        download_pool = ThreadPool(jobs)
+        extract_pool = ThreadPool(jobs)
+        try:
+            results = [extract_pool.apply_async(self._extract_file,
+                                                (job, download_pool, journal))
+                       for job in copy_jobs]
+            for result in results:
+                result.get()
+        finally:
+            extract_pool.terminate()
+            extract_pool.join()
+            download_pool.terminate()
+            download_pool.join()
+            journal.close()
+        journal.remove()
+
+    def _extract_file(self, copy_job, download_pool, journal):
+        """
+        Download and extract a file of the backup
+
+        :param list copy_job: the BackupFileInfo of the file and the
+          destination directory
+        :param multiprocessing.pool.ThreadPool download_pool: the pool
+          downloading the content of the file
+        :param RestoreJournal journal: the journal of the restore
+        """
+        file_info, target_dir = copy_job
+        logging.debug("Extracting %s to %s (%s)",
+                      file_info.path, target_dir,
+                      "decompressing " + file_info.compression
+                      if file_info.compression
+                      else "no compression")
+        self.cloud_interface.extract_tar(file_info.path, target_dir,
+                                         download_pool, journal)
+
+    def _download_paths(self, backup_info, copy_jobs, paths):
+        """
+        Download some paths of a backup, fetching from every archive only
+        the ranges containing their members, as listed in the backup index
+
+        :param BackupInfo backup_info: the backup information
+        :param list copy_jobs: the BackupFileInfo of every archive and
+          its destination directory
+        :param list[str] paths: the paths to restore, relative to PGDATA
+        """
+        index = self.catalog.get_backup_index(backup_info)
+        if index is None:
+            logging.error("Backup %s has no index of its content, "
+                          "as it was not taken with the --index option: "
+                          "single paths cannot be restored",
+                          backup_info.backup_id)
+            raise SystemExit(1)
+
+        paths = [os.path.normpath(path).strip('/') for path in paths]
+        found = set()
+        ranges = []
         for file_info, target_dir in copy_jobs:
-            # Download the file
-            logging.debug("Extracting %s to %s (%s)",
-                          file_info.path, target_dir,
-                          "decompressing " + file_info.compression
-                          if file_info.compression
-                          else "no compression")
-            self.cloud_interface.extract_tar(file_info.path, target_dir)
+            # The archives of a tablespace are restored under
+            # pg_tblspc/OID, that is in the tablespace location
+            prefix = '' if file_info.oid is None \
+                else 'pg_tblspc/%s' % file_info.oid
+            members = index.get(os.path.basename(file_info.path), [])
+            for name, offset, length in members:
+                restored_name = os.path.normpath(os.path.join(prefix, name))
+                for path in paths:
+                    if restored_name == path or \
+                            restored_name.startswith(path + '/'):
+                        found.add(path)
+                        break
+                else:
+                    continue
+                # Merge the members of the same stream, and the contiguous
+                # streams, in a single range
+                last = ranges[-1] if ranges else None
+                if last and last[0] == file_info.path \
+                        and last[1] <= offset <= last[1] + last[2]:
+                    last[2] = max(last[2], offset + length - last[1])
+                    last[4].append(name)
+                else:
+                    ranges.append([file_info.path, offset, length,
+                                   target_dir, [name]])
+
+        missing = [path for path in paths if path not in found]
+        if missing:
+            logging.error("Paths not found in backup %s: %s",
+                          backup_info.backup_id, ', '.join(missing))
+            raise SystemExit(1)
+
+        pool = ThreadPool(self.cloud_interface.worker_processes_count)
+        try:
+            results = [pool.apply_async(
+                self.cloud_interface.extract_tar_range, job)
+                for job in ranges]
+            for result in results:
+                result.get()
+        finally:
+            pool.terminate()
+            pool.join()
 
 
 if __name__ == '__main__':
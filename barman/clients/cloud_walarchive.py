@@ -16,16 +16,17 @@
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
 import bz2
-import gzip
+import hashlib
 import logging
 import os
 import os.path
-import shutil
+import zlib
 from contextlib import closing
-from io import BytesIO
+from io import RawIOBase
+from multiprocessing.dummy import Pool as ThreadPool
 
 import barman
-from barman.cloud import CloudInterface, configure_logging
+from barman.cloud import BUFSIZE, CloudInterface, configure_logging
 from barman.utils import force_str
 from barman.xlog import hash_dir, is_any_xlog_file
 
@@ -34,6 +35,8 @@ try:
 except ImportError:
     raise SystemExit("Missing required python module: argparse")
 
+DEFAULT_STATE_DIR = '/var/tmp/walarchive-cloud'
+
 
 def main(args=None):
     """
@@ -50,6 +53,10 @@ def main(args=None):
         logging.error('%s is an invalid name for a WAL file' % config.wal_path)
         raise SystemExit(1)
 
+    # If the WAL file has already been uploaded by a batch, terminate
+    if config.batch and try_skip_uploaded(config):
+        raise SystemExit(0)
+
     try:
         cloud_interface = CloudInterface(
             url=config.destination_url,
@@ -72,7 +79,13 @@ def main(args=None):
             # TODO: Should the setup be optional?
             cloud_interface.setup_bucket()
 
-            uploader.upload_wal(config.wal_path)
+            if config.batch:
+                uploaded = uploader.upload_wal_batch(
+                    config.wal_path,
+                    find_ready_wals(config.wal_path, config.batch))
+                record_uploaded(config, uploaded)
+            else:
+                uploader.upload_wal(config.wal_path)
     except Exception as exc:
         logging.error("Barman cloud WAL archiver exception: %s",
                       force_str(exc))
@@ -80,6 +93,147 @@ def main(args=None):
         raise SystemExit(1)
 
 
+def get_state_file(config):
+    """
+    Get the path of the file listing the WAL files uploaded in advance
+
+    The file is named after the server name and the destination URL, as
+    the same server can archive its WAL files to different destinations.
+
+    :param argparse.Namespace config: the configuration from command line
+    :rtype: str
+    """
+    destination = hashlib.sha1(
+        config.destination_url.encode('utf-8')).hexdigest()
+    return os.path.join(config.state_dir, '%s-%s.uploaded' % (
+        config.server_name, destination[:16]))
+
+
+def wal_file_state(wal_path):
+    """
+    Get the size and the modification time of a WAL file, which identify
+    the content uploaded in advance
+
+    :param str wal_path: the path of the WAL file
+    :return tuple[str,str]: the size and the modification time
+    """
+    wal_stat = os.stat(wal_path)
+    return str(wal_stat.st_size), repr(wal_stat.st_mtime)
+
+
+def read_uploaded(state_file):
+    """
+    Read the WAL files uploaded in advance
+
+    :param str state_file: the path of the state file
+    :return dict[str,tuple[str,str]]: the size and the modification time
+        of every WAL file, by name
+    """
+    uploaded = {}
+    try:
+        with open(state_file) as state:
+            for line in state:
+                fields = line.split()
+                # Ignore the lines not recording the state of the file
+                if len(fields) == 3:
+                    uploaded[fields[0]] = tuple(fields[1:])
+    except EnvironmentError:
+        pass
+    return uploaded
+
+
+def write_uploaded(state_file, uploaded):
+    """
+    Atomically replace the WAL files uploaded in advance
+
+    :param str state_file: the path of the state file
+    :param dict[str,tuple[str,str]] uploaded: the size and the
+        modification time of every WAL file, by name
+    """
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as state:
+        for name in sorted(uploaded):
+            state.write('%s %s %s\n' % ((name,) + tuple(uploaded[name])))
+        state.flush()
+        os.fsync(state.fileno())
+    os.rename(tmp_file, state_file)
+
+
+def try_skip_uploaded(config):
+    """
+    Check whether the requested WAL file has been uploaded in advance by
+    a previous batch, forgetting it in that case.
+
+    The WAL file is skipped only if its size and modification time are
+    the ones it had when it was uploaded, so a different file with the
+    same name, for example after restoring the PostgreSQL server, is
+    always archived.
+
+    :param argparse.Namespace config: the configuration from command line
+    :return bool: whether the WAL file has already been uploaded
+    """
+    state_file = get_state_file(config)
+    uploaded = read_uploaded(state_file)
+    wal_name = os.path.basename(config.wal_path)
+    if wal_name not in uploaded:
+        return False
+    recorded = uploaded.pop(wal_name)
+    write_uploaded(state_file, uploaded)
+    try:
+        current = wal_file_state(config.wal_path)
+    except EnvironmentError:
+        return False
+    if current != recorded:
+        logging.info("WAL file %s changed after being uploaded, "
+                     "uploading it again", wal_name)
+        return False
+    logging.info("WAL file %s already uploaded", wal_name)
+    return True
+
+
+def record_uploaded(config, wal_paths):
+    """
+    Record the WAL files uploaded in advance, so that the next invocations
+    for them terminate immediately
+
+    :param argparse.Namespace config: the configuration from command line
+    :param list[str] wal_paths: the WAL files uploaded in advance
+    """
+    if not wal_paths:
+        return
+    if not os.path.exists(config.state_dir):
+        os.makedirs(config.state_dir)
+    state_file = get_state_file(config)
+    uploaded = read_uploaded(state_file)
+    for wal_path in wal_paths:
+        uploaded[os.path.basename(wal_path)] = wal_file_state(wal_path)
+    write_uploaded(state_file, uploaded)
+
+
+def find_ready_wals(wal_path, count):
+    """
+    Find the WAL files ready to be archived, besides the requested one,
+    looking at the '.ready' files in the archive_status directory
+
+    :param str wal_path: the path of the requested WAL file
+    :param int count: the maximum number of WAL files
+    :return list[str]: the paths of the WAL files
+    """
+    wal_dir = os.path.dirname(wal_path)
+    wal_name = os.path.basename(wal_path)
+    try:
+        status_files = os.listdir(os.path.join(wal_dir, 'archive_status'))
+    except EnvironmentError as e:
+        logging.warning("Cannot list the archive status directory: %s", e)
+        return []
+    names = []
+    for status_file in status_files:
+        name, ext = os.path.splitext(status_file)
+        if ext == '.ready' and name != wal_name and is_any_xlog_file(name):
+            names.append(name)
+    return [os.path.join(wal_dir, name) for name in sorted(names)[:count]]
+
+
 def parse_arguments(args=None):
     """
     Parse command line arguments
@@ -158,6 +312,22 @@ def parse_arguments(args=None):
         action="store_true",
         default=False
     )
+    parser.add_argument(
+        "-b", "--batch",
+        default=0,
+        type=int,
+        metavar="BATCH",
+        help="Upload also up to BATCH other WAL files ready to be "
+             "archived, in parallel. Defaults to 0 (disabled).",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=DEFAULT_STATE_DIR,
+        metavar="STATE_DIR",
+        help="Specifies the directory recording the WAL files uploaded in "
+             "advance by a batch. Defaults to "
+             "'{0}'.".format(DEFAULT_STATE_DIR)
+    )
     parser.add_argument(
         "--endpoint-url",
         help="Override default S3 endpoint URL with the given one",
@@ -165,6 +335,53 @@ def parse_arguments(args=None):
     return parser.parse_args(args=args)
 
 
+class CompressedFileIO(RawIOBase):
+    """
+    Readable stream of the compressed content of a file.
+
+    The file is read and compressed one block at a time while the stream
+    is read, so the used memory does not depend on the size of the file.
+    """
+
+    def __init__(self, fileobj, compression):
+        """
+        :param file fileobj: the file to compress, open in binary mode
+        :param str compression: the compression, 'gzip' or 'bzip2'
+        """
+        self.fileobj = fileobj
+        if compression == 'gzip':
+            # Produce the gzip format, with the default level of GzipFile
+            self.compressor = zlib.compressobj(9, zlib.DEFLATED,
+                                               16 + zlib.MAX_WBITS)
+        elif compression == 'bzip2':
+            self.compressor = bz2.BZ2Compressor()
+        else:
+            raise ValueError("Unknown compression type: %s" % compression)
+        self.buffer = bytearray()
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        while not self.eof and (n < 0 or len(self.buffer) < n):
+            data = self.fileobj.read(BUFSIZE)
+            if data:
+                self.buffer += self.compressor.compress(data)
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+        if n < 0:
+            n = len(self.buffer)
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def close(self):
+        self.fileobj.close()
+        super(CompressedFileIO, self).close()
+
+
 class S3WalUploader(object):
     """
     S3 upload client
@@ -209,21 +426,47 @@ class S3WalUploader(object):
             fileobj=file_object,
             key=destination)
 
+    def upload_wal_batch(self, wal_path, additional_paths):
+        """
+        Upload a WAL file together with other WAL files, in parallel
+
+        Failures of the additional WAL files are only logged, as they will
+        be uploaded again when requested.
+
+        :param str wal_path: Full path of the WAL file
+        :param list[str] additional_paths: Full path of the other WAL files
+        :return list[str]: the additional WAL files successfully uploaded
+        """
+        pool = ThreadPool(len(additional_paths) + 1)
+        try:
+            result = pool.apply_async(self.upload_wal, (wal_path,))
+            additional_results = [
+                (path, pool.apply_async(self.upload_wal, (path,)))
+                for path in additional_paths]
+            result.get()
+            uploaded = []
+            for path, additional_result in additional_results:
+                try:
+                    additional_result.get()
+                    uploaded.append(path)
+                except Exception as exc:
+                    logging.warning("Failure uploading %s: %s",
+                                    path, force_str(exc))
+                    logging.debug('Exception details:', exc_info=exc)
+            return uploaded
+        finally:
+            pool.terminate()
+            pool.join()
+
     def retrieve_file_obj(self, wal_path):
         """
         Create the correct type of file object necessary for the file transfer.
 
         If no compression is required a simple File object is returned.
 
-        In case of compression, a BytesIO object is returned, containing the
-        result of the compression.
-
-        NOTE: the Wal files are actually compressed straight into memory,
-        thanks to the usual small dimension of the WAL.
-        This could change in the future because the WAL files dimension could
-        be more than 16MB on some postgres install.
-
-        TODO: Evaluate using tempfile if the WAL is bigger than 16MB
+        In case of compression, a CompressedFileIO object is returned, which
+        compresses the WAL file while it is read by the upload. The WAL file
+        is never kept in memory, whatever its size.
 
         :param str wal_path:
         :return File: simple or compressed file object
@@ -234,21 +477,8 @@ class S3WalUploader(object):
         if not self.compression:
             return wal_file
 
-        if self.compression == 'gzip':
-            # Create a BytesIO for in memory compression
-            in_mem_gzip = BytesIO()
-            # TODO: closing is redundant with python >= 2.7
-            with closing(gzip.GzipFile(fileobj=in_mem_gzip, mode='wb')) as gz:
-                # copy the gzipped data in memory
-                shutil.copyfileobj(wal_file, gz)
-            in_mem_gzip.seek(0)
-            return in_mem_gzip
-
-        elif self.compression == 'bzip2':
-            # Create a BytesIO for in memory compression
-            in_mem_bz2 = BytesIO(bz2.compress(wal_file.read()))
-            in_mem_bz2.seek(0)
-            return in_mem_bz2
+        if self.compression in ('gzip', 'bzip2'):
+            return CompressedFileIO(wal_file, self.compression)
         else:
             raise ValueError("Unknown compression type: %s" % self.compression)
 
@@ -17,18 +17,22 @@
 
 import logging
 import os
+import shutil
 from contextlib import closing
+from multiprocessing.dummy import Pool as ThreadPool
 
 import barman
 from barman.cloud import CloudInterface, configure_logging
 from barman.utils import force_str
-from barman.xlog import hash_dir, is_any_xlog_file, is_backup_file
+from barman.xlog import hash_dir, is_any_xlog_file, is_backup_file, is_wal_file
 
 try:
     import argparse
 except ImportError:
     raise SystemExit("Missing required python module: argparse")
 
+DEFAULT_SPOOL_DIR = '/var/tmp/walrestore-cloud'
+
 
 def main(args=None):
     """
@@ -45,6 +49,10 @@ def main(args=None):
         logging.error('%s is an invalid name for a WAL file' % config.wal_name)
         raise SystemExit(1)
 
+    # If the file has been prefetched in SPOOL_DIR use it and terminate
+    if config.parallel and try_deliver_from_spool(config):
+        raise SystemExit(0)
+
     try:
         cloud_interface = CloudInterface(
             url=config.source_url,
@@ -68,7 +76,8 @@ def main(args=None):
                               cloud_interface.bucket_name)
                 raise SystemExit(1)
 
-            downloader.download_wal(config.wal_name, config.wal_dest)
+            downloader.download_wal(config.wal_name, config.wal_dest,
+                                    config.parallel, config.spool_dir)
 
     except Exception as exc:
         logging.error("Barman cloud WAL restore exception: %s",
@@ -77,6 +86,31 @@ def main(args=None):
         raise SystemExit(1)
 
 
+def try_deliver_from_spool(config):
+    """
+    Search for the requested file in the spool directory.
+    If is already present, then move it to the destination.
+
+    :param argparse.Namespace config: the configuration from command line
+    :return bool: whether the file has been delivered
+    """
+    spool_file = os.path.join(config.spool_dir, config.wal_name)
+
+    # if the file is not present, give up
+    if not os.path.exists(spool_file):
+        return False
+
+    try:
+        shutil.copyfile(spool_file, config.wal_dest)
+        os.unlink(spool_file)
+    except EnvironmentError as e:
+        logging.error("Failure copying %s to %s: %s",
+                      spool_file, config.wal_dest, e)
+        raise SystemExit(1)
+    logging.info("Delivered %s from the spool directory", config.wal_name)
+    return True
+
+
 def parse_arguments(args=None):
     """
     Parse command line arguments
@@ -147,6 +181,20 @@ def parse_arguments(args=None):
         action="store_true",
         default=False
     )
+    parser.add_argument(
+        "-p", "--parallel", default=0,
+        type=int,
+        metavar="JOBS",
+        help="Specifies the number of following WAL files to prefetch "
+             "in parallel in the spool directory. "
+             "Defaults to 0 (disabled).",
+    )
+    parser.add_argument(
+        "--spool-dir", default=DEFAULT_SPOOL_DIR,
+        metavar="SPOOL_DIR",
+        help="Specifies spool directory for WAL files. Defaults to "
+             "'{0}'.".format(DEFAULT_SPOOL_DIR)
+    )
     parser.add_argument(
         "--endpoint-url",
         help="Override default S3 endpoint URL with the given one",
@@ -175,12 +223,20 @@ class S3WalDownloader(object):
         self.cloud_interface = cloud_interface
         self.server_name = server_name
 
-    def download_wal(self, wal_name, wal_dest):
+    def download_wal(self, wal_name, wal_dest, parallel=0, spool_dir=None):
         """
         Download a WAL file from S3
 
+        When parallel is greater than zero, up to parallel WAL files
+        following the requested one are downloaded at the same time in
+        spool_dir, to be delivered by the next calls. They are looked for
+        in the hash directory of the requested WAL file and, if not
+        enough, in the following one.
+
         :param str wal_name: Name of the WAL file
         :param str wal_dest: Full path of the destination WAL file
+        :param int parallel: the number of WAL files to prefetch
+        :param str|None spool_dir: the directory of the prefetched files
         """
 
         # Correctly format the source path on s3
@@ -199,7 +255,8 @@ class S3WalDownloader(object):
         remote_name = None
         # Automatically detect compression based on the file extension
         compression = None
-        for item in self.cloud_interface.list_bucket(source_dir):
+        items = list(self.cloud_interface.list_bucket(source_dir))
+        for item in items:
             # perfect match (uncompressed file)
             if item == wal_path:
                 remote_name = item
@@ -234,13 +291,114 @@ class S3WalDownloader(object):
                          wal_name, self.server_name)
             raise SystemExit(1)
 
-        # Download the file
+        following = []
+        if parallel and is_wal_file(wal_name):
+            following = self._following_wals(items, wal_name, parallel)
+            # At the end of a hash directory, or after a timeline switch,
+            # the following WAL files are in the next hash directory
+            if len(following) < parallel:
+                next_dir = self._next_hash_dir(source_dir)
+                if next_dir:
+                    items += self.cloud_interface.list_bucket(next_dir)
+                    following = self._following_wals(items, wal_name,
+                                                     parallel)
+        if not following:
+            self._download(remote_name, wal_dest, compression)
+            return
+
+        # Download the file while prefetching the following ones.
+        # The requested file is downloaded by this thread.
+        if not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+        pool = ThreadPool(len(following))
+        try:
+            prefetches = [
+                pool.apply_async(self._prefetch, (
+                    item, os.path.join(spool_dir, name), item_compression))
+                for name, item, item_compression in following]
+            self._download(remote_name, wal_dest, compression)
+            for prefetch in prefetches:
+                prefetch.get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _next_hash_dir(self, source_dir):
+        """
+        Find the hash directory following a hash directory in the bucket
+
+        :param str source_dir: the hash directory, ending with a separator
+        :return str|None: the following hash directory, if any
+        """
+        wals_dir = os.path.dirname(source_dir.rstrip(os.path.sep))
+        following = sorted(
+            item for item in self.cloud_interface.list_bucket(
+                wals_dir + os.path.sep)
+            if item.endswith(os.path.sep) and item > source_dir)
+        return following[0] if following else None
+
+    def _following_wals(self, items, wal_name, count):
+        """
+        Select the WAL files following a WAL file in a bucket listing
+
+        :param list[str] items: the keys of the listing
+        :param str wal_name: the name of the WAL file
+        :param int count: the maximum number of WAL files to select
+        :return list[tuple[str,str,str|None]]: the name, the key and the
+          compression of the selected WAL files
+        """
+        wals = []
+        for item in items:
+            name = os.path.basename(item)
+            compression = None
+            for e, c in self.ALLOWED_COMPRESSIONS.items():
+                if name[-len(e):] == e:
+                    name = name[:-len(e)]
+                    compression = c
+                    break
+            if is_wal_file(name) and name > wal_name:
+                wals.append((name, item, compression))
+        return sorted(wals)[:count]
+
+    def _download(self, remote_name, wal_dest, compression):
+        """
+        Download a WAL file
+
+        :param str remote_name: the key of the WAL file
+        :param str wal_dest: Full path of the destination WAL file
+        :param str|None compression: the compression of the WAL file
+        """
         logging.debug("Downloading %s to %s (%s)",
                       remote_name, wal_dest,
                       "decompressing " + compression if compression
                       else "no compression")
         self.cloud_interface.download_file(remote_name, wal_dest, compression)
 
+    def _prefetch(self, remote_name, spool_file, compression):
+        """
+        Download a WAL file in the spool directory. The file is renamed
+        when complete, so a partially downloaded file is never delivered.
+        Errors are only logged, as the file will be downloaded again
+        when requested.
+
+        :param str remote_name: the key of the WAL file
+        :param str spool_file: the destination in the spool directory
+        :param str|None compression: the compression of the WAL file
+        """
+        tmp_file = spool_file + '.tmp'
+        try:
+            self._download(remote_name, tmp_file, compression)
+            os.rename(tmp_file, spool_file)
+        except Exception as exc:
+            logging.warning("Failure prefetching %s: %s",
+                            remote_name, force_str(exc))
+            logging.debug('Exception details:', exc_info=exc)
+            try:
+                os.unlink(tmp_file)
+            except EnvironmentError:
+                # Suppress unlink errors
+                pass
+
 
 if __name__ == '__main__':
     main()
@@ -22,7 +22,10 @@
 
 from __future__ import print_function
 
+import bz2
 import copy
+import errno
+import gzip
 import hashlib
 import os
 import subprocess
@@ -31,6 +34,7 @@ import tarfile
 import time
 from contextlib import closing
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 
 import barman
 
@@ -41,6 +45,8 @@ except ImportError:
 
 DEFAULT_USER = 'barman'
 BUFSIZE = 16 * 1024
+# Compressed WAL files bigger than this are spooled on disk before sending
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
 
 
 def main(args=None):
@@ -72,13 +78,20 @@ def main(args=None):
     # Wait for termination of every subprocess. If CTRL+C is pressed,
     # terminate all of them
     RemotePutWal.wait_for_all()
+    compression_unsupported = \
+        config.compression and ssh_process.compression_unsupported
 
     # If the command succeeded exit here
     if ssh_process.returncode == 0:
         return
 
     # Report the exit code, remapping ssh failure code (255) to 3
-    if ssh_process.returncode == 255:
+    if compression_unsupported:
+        exit_with_error("The Barman server doesn't support WAL files "
+                        "compressed by barman-wal-archive: upgrade it or "
+                        "remove the compression option",
+                        ssh_process.returncode)
+    elif ssh_process.returncode == 255:
         exit_with_error("Connection problem with ssh", 3)
     else:
         exit_with_error("Remote 'barman put-wal' command has failed!",
@@ -105,6 +118,11 @@ def build_ssh_command(config):
 
     ssh_command.extend(['put-wal', config.server_name])
 
+    # Older Barman servers reject this option, instead of failing later
+    # on the checksum of the compressed files
+    if config.compression:
+        ssh_command.append("--compressed")
+
     if config.test:
         ssh_command.append("--test")
 
@@ -164,6 +182,16 @@ def parse_arguments(args=None):
         metavar="CONFIG",
         help='configuration file on the Barman server',
     )
+    parser.add_argument(
+        '-z', '--gzip',
+        help='Transfer the WAL files compressed with gzip',
+        action='store_const', const='gzip', dest='compression',
+    )
+    parser.add_argument(
+        '-j', '--bzip2',
+        help='Transfer the WAL files compressed with bzip2',
+        action='store_const', const='bzip2', dest='compression',
+    )
     parser.add_argument(
         '-t', '--test',
         action='store_true',
@@ -229,6 +257,39 @@ def md5copyfileobj(src, dst, length=None):
     return checksum.hexdigest()
 
 
+def md5compressfileobj(src, dst, compression):
+    """
+    Compress the whole content of fileobj src into fileobj dst using
+    the requested compression algorithm ('gzip' or 'bzip2').
+    This method is used by the ChecksumTarFile.addcompressed().
+    Returns the md5 checksum of the uncompressed content
+    """
+    if compression == 'gzip':
+        ostream = gzip.GzipFile(fileobj=dst, mode='wb')
+        compress = ostream.write
+    elif compression == 'bzip2':
+        # BZ2File accepts a file object only since Python 3
+        ostream = bz2.BZ2Compressor()
+
+        def compress(data):
+            dst.write(ostream.compress(data))
+    else:
+        raise ValueError("Unsupported compression: %s" % compression)
+
+    checksum = hashlib.md5()
+    while 1:
+        buf = src.read(BUFSIZE)
+        if not buf:
+            break
+        checksum.update(buf)
+        compress(buf)
+    if compression == 'gzip':
+        ostream.close()
+    else:
+        dst.write(ostream.flush())
+    return checksum.hexdigest()
+
+
 class ChecksumTarInfo(tarfile.TarInfo):
     """
     Special TarInfo that can hold a file checksum
@@ -250,10 +311,16 @@ class ChecksumTarFile(tarfile.TarFile):
 
     MD5SUMS_FILE = "MD5SUMS"
 
+    COMPRESSION_HEADER = "BARMAN.compression"
+    """
+    PAX header used to tell the compression of a file to the Barman server
+    """
+
     def addfile(self, tarinfo, fileobj=None):
         """
         Add the provided fileobj to the tar using md5copyfileobj
-        and saves the file md5 in the provided ChecksumTarInfo object.
+        and saves the file md5 in the provided ChecksumTarInfo object,
+        unless it already contains the checksum of the original content.
 
         This method completely replaces TarFile.addfile()
         """
@@ -267,8 +334,9 @@ class ChecksumTarFile(tarfile.TarFile):
 
         # If there's data to follow, append it.
         if fileobj is not None:
-            tarinfo.data_checksum = md5copyfileobj(
-                fileobj, self.fileobj, tarinfo.size)
+            checksum = md5copyfileobj(fileobj, self.fileobj, tarinfo.size)
+            if tarinfo.data_checksum is None:
+                tarinfo.data_checksum = checksum
             blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
             if remainder > 0:
                 self.fileobj.write(
@@ -278,6 +346,31 @@ class ChecksumTarFile(tarfile.TarFile):
 
         self.members.append(tarinfo)
 
+    def addcompressed(self, name, arcname, compression):
+        """
+        Add the file name to the tar, compressed with the requested
+        compression algorithm.
+
+        The compression is recorded in the COMPRESSION_HEADER PAX header,
+        while the checksum in the MD5SUMS file refers to the uncompressed
+        content, so that the Barman server can verify it before storing
+        the file as it is.
+
+        :param str name: the path of the file to add
+        :param str arcname: the name of the file in the archive
+        :param str compression: the compression algorithm to use
+        """
+        tarinfo = self.gettarinfo(name, arcname)
+        with open(name, 'rb') as src:
+            with closing(SpooledTemporaryFile(
+                    max_size=SPOOL_MAX_SIZE)) as buf:
+                tarinfo.data_checksum = md5compressfileobj(
+                    src, buf, compression)
+                tarinfo.size = buf.tell()
+                tarinfo.pax_headers[self.COMPRESSION_HEADER] = compression
+                buf.seek(0)
+                self.addfile(tarinfo, buf)
+
     def close(self):
         """
         Add an MD5SUMS file to the tar just before closing.
@@ -320,20 +413,39 @@ class RemotePutWal(object):
         self.config = config
         self.wal_path = wal_path
         self.dest_file = None
+        self.stderr = None
 
-        # Spawn a remote put-wal process
+        # Spawn a remote put-wal process. When compressing, its error
+        # output is captured to detect servers not supporting it.
+        popen_args = {}
+        if config.compression:
+            popen_args['stderr'] = subprocess.PIPE
         self.ssh_process = subprocess.Popen(
             build_ssh_command(config),
-            stdin=subprocess.PIPE)
+            stdin=subprocess.PIPE,
+            **popen_args)
 
         # Register the spawned processes in the class registry
         self.processes.add(self.ssh_process)
 
-        # Send the data as a tar file (containing checksums)
-        with self.ssh_process.stdin as dest_file:
-            with closing(ChecksumTarFile.open(
-                    mode='w|', fileobj=dest_file)) as tar:
-                tar.add(wal_path, os.path.basename(wal_path))
+        # Send the data as a tar file (containing checksums).
+        # The PAX format is required to carry the compression header.
+        try:
+            with self.ssh_process.stdin as dest_file:
+                with closing(ChecksumTarFile.open(
+                        mode='w|', fileobj=dest_file,
+                        format=tarfile.PAX_FORMAT)) as tar:
+                    if config.compression:
+                        tar.addcompressed(wal_path,
+                                          os.path.basename(wal_path),
+                                          config.compression)
+                    else:
+                        tar.add(wal_path, os.path.basename(wal_path))
+        except EnvironmentError as e:
+            # The remote command terminated early, and its exit code
+            # reports the reason
+            if e.errno != errno.EPIPE:
+                raise
 
     @classmethod
     def wait_for_all(cls):
@@ -353,6 +465,22 @@ class RemotePutWal(object):
                 process.kill()
             exit_with_error('SIGINT received! Terminating.')
 
+    @property
+    def compression_unsupported(self):
+        """
+        Whether the remote put-wal process failed because it doesn't
+        support the --compressed option. The captured error output
+        is forwarded to the standard error.
+
+        :rtype: bool
+        """
+        if self.stderr is None:
+            self.stderr = self.ssh_process.stderr.read().decode(
+                'utf-8', 'replace')
+            sys.stderr.write(self.stderr)
+        return self.ssh_process.returncode != 0 and \
+            'unrecognized arguments: --compressed' in self.stderr
+
     @property
     def returncode(self):
         """
@@ -21,6 +21,7 @@ import copy
 import datetime
 import errno
 import gzip
+import heapq
 import json
 import logging
 import multiprocessing
@@ -29,8 +30,11 @@ import os
 import shutil
 import signal
 import tarfile
+import threading
+import zlib
 from functools import partial
 from io import BytesIO, RawIOBase
+from multiprocessing.dummy import Pool as ThreadPool
 from tempfile import NamedTemporaryFile
 
 from barman.backup_executor import (ConcurrentBackupStrategy,
@@ -61,6 +65,12 @@ except ImportError:
     # Python 2.x
     from Queue import Empty as EmptyQueue
 
+try:
+    # Python 3.8+
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
 
 # S3 multipart upload limitations
 # http://docs.aws.amazon.com/AmazonS3/latest/API/mpUploadUploadPart.html
@@ -73,6 +83,29 @@ MIN_CHUNK_SIZE = 5 << 20
 # MAX_ARCHIVE_SIZE - so we set a maximum of 1TB per file
 MAX_ARCHIVE_SIZE = 1 << 40
 
+# Maximum amount of memory used by the buffers of the parts waiting to be
+# uploaded. Parts are buffered in temporary files when they don't fit.
+DEFAULT_MAX_BUFFER_MEMORY = 512 << 20
+
+# S3 permits to delete at most 1000 objects with a DeleteObjects request
+MAX_DELETE_BATCH_SIZE = 1000
+
+# Size of the ranges of an object downloaded in parallel
+DOWNLOAD_CHUNK_SIZE = 8 << 20
+
+# Name of the index of the content of the archives of a backup, stored
+# next to its backup.info file. It is a JSON object listing the members of
+# every archive as [name, offset, length] lists, where offset and length
+# locate the compressed stream containing the member in the archive.
+BACKUP_INDEX = 'backup.index'
+
+# The members of an indexed compressed archive smaller than this size are
+# packed in the same compressed stream, until it holds this amount of data,
+# while the larger ones have their own stream. Compressing every small file
+# in its own stream makes gzip archives about 15% larger and twice as slow
+# to write, and bzip2 archives about 50% larger.
+MAX_PACKED_MEMBERS_SIZE = 1 << 20
+
 BUFSIZE = 16 * 1024
 LOGGING_FORMAT = "%(asctime)s [%(process)s] %(levelname)s: %(message)s"
 
@@ -117,6 +150,31 @@ def copyfileobj_pad_truncate(src, dst, length=None):
             dst.write(tarfile.NUL * (remainder - len(buf)))
 
 
+def walk_directory(src, exclude=None, include=None):
+    """
+    List the content of a directory allowed by some inclusion and exclusion
+    rules, as expected by path_allowed
+
+    :param str src: the directory
+    :param list[str]|None exclude: exclusion rules
+    :param list[str]|None include: inclusion rules
+    :return collections.Iterable[tuple[str,str,bool]]: the path of every
+        entry, its path relative to src and whether it is a directory
+    """
+    for root, dirs, files in os.walk(src):
+        tar_root = os.path.relpath(root, src)
+        if not path_allowed(exclude, include,
+                            tar_root, True):
+            continue
+        yield root, tar_root, True
+        for item in files:
+            tar_item = os.path.join(tar_root, item)
+            if not path_allowed(exclude, include,
+                                tar_item, False):
+                continue
+            yield os.path.join(root, item), tar_item, False
+
+
 class CloudUploadingError(Exception):
     """
     This exception is raised when there are upload errors
@@ -158,23 +216,98 @@ class TarFileIgnoringTruncate(tarfile.TarFile):
         self.members.append(tarinfo)
 
 
+class IndexedTarFile(TarFileIgnoringTruncate):
+    """
+    Tar archive writing to a S3TarUploader, which compresses its members
+    in independent streams and records their position in the uploaded
+    object.
+    """
+
+    def addfile(self, tarinfo, fileobj=None):
+        self.fileobj.start_member(tarinfo.size)
+        super(IndexedTarFile, self).addfile(tarinfo, fileobj)
+        self.fileobj.end_member(tarinfo.name, tarinfo.size)
+
+
+class SharedMemoryBuffer(object):
+    """
+    Buffer holding a part of a multipart upload in a shared memory segment,
+    so that it can be passed by name to the worker processes.
+
+    The worker process uploading the part removes the segment.
+    """
+
+    def __init__(self, size):
+        """
+        :param int size: the capacity of the buffer
+        """
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self.shm.name
+        self.size = size
+        self.position = 0
+
+    def write(self, data):
+        """
+        Append data to the buffer
+
+        :param bytes data: the data to write, which must fit the buffer
+        """
+        end = self.position + len(data)
+        if end > self.size:
+            raise ValueError("Part buffer overflow")
+        self.shm.buf[self.position:end] = data
+        self.position = end
+
+    def tell(self):
+        """
+        :return int: the size of the content of the buffer
+        """
+        return self.position
+
+    def close(self):
+        """
+        Detach the buffer from this process, without removing it
+        """
+        self.shm.close()
+
+    def discard(self):
+        """
+        Remove the buffer
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
 class S3TarUploader(object):
 
-    # This is the method we use to create new buffers
-    # We use named temporary files, so we can pass them by name to
-    # other processes
+    # This is the method we use to create new buffers when shared memory
+    # is not available. We use named temporary files, so we can pass them
+    # by name to other processes
     _buffer = partial(NamedTemporaryFile, delete=False,
                       prefix='barman-upload-', suffix='.part')
 
     def __init__(self, cloud_interface, key,
-                 compression=None, chunk_size=MIN_CHUNK_SIZE):
+                 compression=None, chunk_size=MIN_CHUNK_SIZE, indexed=False):
         """
         A tar archive that resides on S3
 
+        When the archive is indexed, its members are compressed in
+        independent gzip or bzip2 streams, so that they can be downloaded
+        and decompressed on their own. Large members have their own stream,
+        while the small ones are packed together, up to
+        MAX_PACKED_MEMBERS_SIZE. The offset and the length of the stream
+        containing every member are recorded in the index attribute.
+
+        Otherwise the whole archive is a single compressed stream, which
+        can be read by any tar implementation, including the tarfile
+        streams used by the older versions of barman-cloud-restore, which
+        ignore the data following the first compressed stream.
+
         :param CloudInterface cloud_interface: cloud interface instance
         :param str key: path inside the bucket
         :param str compression: required compression
         :param int chunk_size: the upload chunk size
+        :param bool indexed: whether to index the members of the archive
         """
         self.cloud_interface = cloud_interface
         self.key = key
@@ -182,25 +315,119 @@ class S3TarUploader(object):
         self.chunk_size = max(chunk_size, MIN_CHUNK_SIZE)
         self.buffer = None
         self.counter = 0
-        tar_mode = 'w|%s' % (compression or '')
-        self.tar = TarFileIgnoringTruncate.open(fileobj=self,
-                                                mode=tar_mode)
+        self.compression = compression
+        self.compressor = None
+        self.indexed = indexed
+        self.stream_offset = 0
+        self.stream_size = 0
+        self.stream_members = []
+        self.index = []
         self.size = 0
         self.stats = None
+        self.tar = IndexedTarFile.open(fileobj=self, mode='w')
 
-    def write(self, buf):
-        if self.buffer and self.buffer.tell() > self.chunk_size:
-            self.flush()
-        if not self.buffer:
+    def _new_buffer(self):
+        """
+        Create the buffer of the next part, in shared memory if possible
+        """
+        self.buffer = self.cloud_interface.create_part_buffer(
+            self.chunk_size)
+        if self.buffer is None:
             self.buffer = self._buffer()
-        self.buffer.write(buf)
+
+    def _new_compressor(self):
+        """
+        Create the compressor of a new stream of the archive
+
+        :rtype: zlib.Compress|bz2.BZ2Compressor|None
+        """
+        if self.compression == 'gz':
+            # Use a gzip header, as tarfile does
+            return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif self.compression == 'bz2':
+            return bz2.BZ2Compressor(9)
+        return None
+
+    def start_member(self, size):
+        """
+        Start a new stream for a new member, unless it is small and it
+        can be packed with the preceding ones
+
+        :param int size: the size of the member
+        """
+        if not self.indexed:
+            return
+        if not self.compression or size >= MAX_PACKED_MEMBERS_SIZE \
+                or self.stream_size >= MAX_PACKED_MEMBERS_SIZE:
+            self.end_stream()
+
+    def end_member(self, name, size):
+        """
+        Add a member to the current stream, which is terminated if the
+        member is large
+
+        :param str name: the name of the member
+        :param int size: the size of the member
+        """
+        if not self.indexed:
+            return
+        self.stream_members.append(name)
+        if size >= MAX_PACKED_MEMBERS_SIZE:
+            self.end_stream()
+
+    def end_stream(self):
+        """
+        Terminate the current stream, and record the position of its
+        members in the index
+        """
+        if self.compressor:
+            self._write_data(self.compressor.flush())
+            self.compressor = None
+        length = self.size - self.stream_offset
+        for name in self.stream_members:
+            self.index.append([name, self.stream_offset, length])
+        self.stream_offset = self.size
+        self.stream_size = 0
+        self.stream_members = []
+
+    def tell(self):
+        return self.size
+
+    def write(self, buf):
+        self.stream_size += len(buf)
+        if self.compression:
+            if not self.compressor:
+                self.compressor = self._new_compressor()
+            buf = self.compressor.compress(buf)
+        self._write_data(buf)
+
+    def _write_data(self, buf):
+        """
+        Write the (compressed) data to the parts of the upload
+
+        :param bytes buf: the data to write
+        """
         self.size += len(buf)
+        # Split the data in parts of exactly chunk_size bytes, so that
+        # they fit a shared memory buffer
+        view = memoryview(buf)
+        while len(view):
+            if not self.buffer:
+                self._new_buffer()
+            count = min(len(view), self.chunk_size - self.buffer.tell())
+            self.buffer.write(view[:count])
+            view = view[count:]
+            if self.buffer.tell() >= self.chunk_size:
+                self.flush()
 
     def flush(self):
         if not self.mpu:
             self.mpu = self.cloud_interface.create_multipart_upload(self.key)
-        self.buffer.flush()
-        self.buffer.seek(0, os.SEEK_SET)
+        if not self.buffer:
+            self._new_buffer()
+        if not isinstance(self.buffer, SharedMemoryBuffer):
+            self.buffer.flush()
+            self.buffer.seek(0, os.SEEK_SET)
         self.counter += 1
         self.cloud_interface.async_upload_part(
             mpu=self.mpu,
@@ -213,7 +440,10 @@ class S3TarUploader(object):
     def close(self):
         if self.tar:
             self.tar.close()
-        self.flush()
+        self.end_stream()
+        # The last part may be empty only if it is the first one
+        if self.buffer or not self.counter:
+            self.flush()
         self.cloud_interface.async_complete_multipart_upload(
             mpu=self.mpu,
             key=self.key,
@@ -224,7 +454,7 @@ class S3TarUploader(object):
 
 class S3UploadController(object):
     def __init__(self, cloud_interface, key_prefix, max_archive_size,
-                 compression):
+                 compression, indexed=False):
         """
         Create a new controller that upload the backup in S3
 
@@ -232,6 +462,7 @@ class S3UploadController(object):
         :param str|None key_prefix: path inside the bucket
         :param int max_archive_size: the maximum size of an archive
         :param str|None compression: required compression
+        :param bool indexed: whether to index the members of the archives
         """
 
         self.cloud_interface = cloud_interface
@@ -247,11 +478,15 @@ class S3UploadController(object):
         # We aim to a maximum of MAX_CHUNKS_PER_FILE / 2 chinks per file
         self.chunk_size = 2 * int(max_archive_size / MAX_CHUNKS_PER_FILE)
         self.compression = compression
+        self.indexed = indexed
         self.tar_list = {}
 
         self.upload_stats = {}
         """Already finished uploads list"""
 
+        self.index = {}
+        """Members of the finished uploads, by archive name"""
+
         self.copy_start_time = datetime.datetime.now()
         """Copy start time"""
 
@@ -289,6 +524,7 @@ class S3UploadController(object):
                 key=os.path.join(self.key_prefix, self._build_dest_name(name)),
                 compression=self.compression,
                 chunk_size=self.chunk_size,
+                indexed=self.indexed,
             )]
         # If the current uploading file size is over DEFAULT_MAX_TAR_SIZE
         # Close the current file and open the next part
@@ -302,44 +538,200 @@ class S3UploadController(object):
                     self._build_dest_name(name, len(self.tar_list[name]))),
                 compression=self.compression,
                 chunk_size=self.chunk_size,
+                indexed=self.indexed,
             )
             self.tar_list[name].append(uploader)
         return uploader.tar
 
+    def _add_path(self, dst, path, arcname):
+        """
+        Add a file, or a directory without its content, to an archive
+
+        :param str dst: the archive name
+        :param str path: the path to add
+        :param str arcname: the name of the path inside the archive
+        """
+        try:
+            self._get_tar(dst).add(path, arcname=arcname, recursive=False)
+        except EnvironmentError as e:
+            # If a file or a directory disappeared just skip it,
+            # WAL reply will take care during recovery.
+            if e.errno != errno.ENOENT:
+                raise
+
     def upload_directory(self, label, src, dst, exclude=None, include=None):
         logging.info("Uploading '%s' directory '%s' as '%s'",
                      label, src, self._build_dest_name(dst))
-        for root, dirs, files in os.walk(src):
-            tar_root = os.path.relpath(root, src)
-            if not path_allowed(exclude, include,
-                                tar_root, True):
+        for path, arcname, is_dir in walk_directory(src, exclude, include):
+            if not is_dir:
+                logging.debug("Uploading %s", arcname)
+            self._add_path(dst, path, arcname)
+
+    def upload_files(self, label, src, dst, paths):
+        """
+        Upload some files of a directory
+
+        :param str label: the label of the directory, used in logging
+        :param str src: the directory containing the files
+        :param str dst: the archive name
+        :param list[str] paths: the files to upload, relative to src
+        """
+        logging.info("Uploading %s files of '%s' directory '%s' as '%s'",
+                     len(paths), label, src, self._build_dest_name(dst))
+        for path in paths:
+            logging.debug("Uploading %s", path)
+            self._add_path(dst, os.path.join(src, path), path)
+
+    def split_directory(self, label, src, dst, parts, exclude=None,
+                        include=None):
+        """
+        Upload the tree of directories of a directory, and split its files
+        in groups of similar size, uploaded as separate archives by
+        upload_jobs.
+
+        :param str label: the label of the directory, used in logging
+        :param str src: the directory to upload
+        :param str dst: the name of the archive containing the tree of
+            directories. The groups of files are uploaded in archives with
+            the same name followed by a '_streamNN' suffix.
+        :param int parts: the number of groups of files
+        :param list[str]|None exclude: exclusion rules
+        :param list[str]|None include: inclusion rules
+        :return list[tuple]: the jobs uploading the groups of files
+        """
+        logging.info("Uploading '%s' directory '%s' as '%s' and %s "
+                     "parallel archives", label, src,
+                     self._build_dest_name(dst), parts)
+        # Assign every file to the group with the smallest size, starting
+        # from the largest files
+        files = []
+        for path, arcname, is_dir in walk_directory(src, exclude, include):
+            if is_dir:
+                self._add_path(dst, path, arcname)
                 continue
             try:
-                self._get_tar(dst).add(root, arcname=tar_root, recursive=False)
+                files.append((os.lstat(path).st_size, arcname))
             except EnvironmentError as e:
-                if e.errno == errno.ENOENT:
-                    # If a directory disappeared just skip it,
-                    # WAL reply will take care during recovery.
-                    continue
-                else:
+                if e.errno != errno.ENOENT:
                     raise
-
-            for item in files:
-                tar_item = os.path.join(tar_root, item)
-                if not path_allowed(exclude, include,
-                                    tar_item, False):
-                    continue
-                logging.debug("Uploading %s", tar_item)
+        groups = [(0, number, []) for number in range(1, parts + 1)]
+        for size, arcname in sorted(files, reverse=True):
+            group_size, number, paths = heapq.heappop(groups)
+            paths.append(arcname)
+            heapq.heappush(groups, (group_size + size, number, paths))
+        return [('files', dict(label=label, src=src,
+                               dst='%s_stream%02d' % (dst, number),
+                               paths=sorted(paths)))
+                for _, number, paths in sorted(groups, key=lambda g: g[1])
+                if paths]
+
+    def upload_jobs(self, jobs, processes):
+        """
+        Run some upload jobs in parallel, each process building and
+        compressing its own archives.
+
+        Every job is a tuple containing the name of the method of the
+        controller to execute ('directory' for upload_directory, 'files'
+        for upload_files) and a dictionary with its arguments.
+
+        The upload processes of the cloud interface and its buffer memory
+        are shared among the processes. This process keeps a share of the
+        buffer memory for the parts of the archives it is still writing,
+        and it is limited to that share until the jobs are completed.
+
+        :param list[tuple] jobs: the jobs to run
+        :param int processes: the number of parallel processes
+        """
+        if not jobs:
+            return
+        processes = min(processes, len(jobs))
+        max_buffer_memory = self.cloud_interface.max_buffer_memory
+        buffer_memory_share = max_buffer_memory // (processes + 1)
+        self.cloud_interface.max_buffer_memory = buffer_memory_share
+        jobs_queue = multiprocessing.Queue()
+        results_queue = multiprocessing.Queue()
+        for job in jobs:
+            jobs_queue.put(job)
+        for _ in range(processes):
+            jobs_queue.put(None)
+        workers = []
+        for _ in range(processes):
+            worker = multiprocessing.Process(
+                target=self._upload_jobs_worker,
+                args=(jobs_queue, results_queue, processes,
+                      buffer_memory_share))
+            worker.start()
+            workers.append(worker)
+        errors = []
+        try:
+            pending = processes
+            while pending:
                 try:
-                    self._get_tar(dst).add(os.path.join(root, item),
-                                           arcname=tar_item)
-                except EnvironmentError as e:
-                    if e.errno == errno.ENOENT:
-                        # If a file disappeared just skip it,
-                        # WAL reply will take care during recovery.
-                        continue
-                    else:
-                        raise
+                    status, result = results_queue.get(timeout=1)
+                except EmptyQueue:
+                    if not any(worker.is_alive() for worker in workers):
+                        errors.append("upload process terminated")
+                        break
+                    continue
+                pending -= 1
+                if status == 'done':
+                    upload_stats, index = result
+                    self.upload_stats.update(upload_stats)
+                    self.index.update(index)
+                else:
+                    errors.append(result)
+        finally:
+            if errors:
+                # The failed processes left some jobs in the queue
+                jobs_queue.cancel_join_thread()
+            for worker in workers:
+                worker.join()
+            self.cloud_interface.max_buffer_memory = max_buffer_memory
+        if errors:
+            raise CloudUploadingError('; '.join(errors))
+
+    def _upload_jobs_worker(self, jobs_queue, results_queue, processes,
+                            max_buffer_memory):
+        """
+        Main function of the processes started by upload_jobs
+
+        :param multiprocessing.Queue jobs_queue: the queue of the jobs
+        :param multiprocessing.Queue results_queue: the queue receiving
+            the upload statistics and the index or the error of the
+            process
+        :param int processes: the number of parallel processes
+        :param int max_buffer_memory: the buffer memory of the process
+        """
+        interface = self.cloud_interface
+        interface = CloudInterface(
+            url=interface.url,
+            encryption=interface.encryption,
+            jobs=max(1, interface.worker_processes_count // processes),
+            profile_name=interface.profile_name,
+            endpoint_url=interface.endpoint_url,
+            max_buffer_memory=max_buffer_memory)
+        controller = S3UploadController(interface, self.key_prefix,
+                                        self.max_archive_size,
+                                        self.compression, self.indexed)
+        try:
+            while True:
+                job = jobs_queue.get()
+                if job is None:
+                    break
+                method, kwargs = job
+                if method == 'directory':
+                    controller.upload_directory(**kwargs)
+                else:
+                    controller.upload_files(**kwargs)
+            controller.close()
+            interface.close()
+            results_queue.put(('done', (controller.upload_stats,
+                                        controller.index)))
+        except Exception as exc:
+            logging.error("Upload process error: %s", force_str(exc))
+            logging.debug('Exception details:', exc_info=exc)
+            interface.abort()
+            results_queue.put(('error', force_str(exc)))
 
     def add_file(self, label, src, dst, path, optional=False):
         if optional and not os.path.exists(src):
@@ -375,6 +767,9 @@ class S3UploadController(object):
                 self.tar_list[name][-1].close()
                 self.upload_stats[name] = [tar.stats
                                            for tar in self.tar_list[name]]
+                if self.indexed:
+                    for tar in self.tar_list[name]:
+                        self.index[os.path.basename(tar.key)] = tar.index
             self.tar_list[name] = None
 
         # Store the end time
@@ -480,9 +875,153 @@ class StreamingBodyIO(RawIOBase):
         return self.body.read(n)
 
 
+class RangedDownloadIO(RawIOBase):
+    """
+    Read a S3 object downloading ranges of its content in parallel.
+
+    The ranges following the current position are requested in advance,
+    and their content is returned in order as soon as it is available.
+    """
+    def __init__(self, client, bucket_name, key, size, pool, prefetch,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        :param client: the boto3 S3 client, which is thread safe
+        :param str bucket_name: the bucket containing the object
+        :param str key: the key of the object
+        :param int size: the size of the object
+        :param multiprocessing.pool.ThreadPool pool: the pool executing
+          the downloads
+        :param int prefetch: the maximum number of ranges requested in
+          advance
+        :param int chunk_size: the size of a range
+        """
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.pool = pool
+        self.prefetch = prefetch
+        self.chunk_size = chunk_size
+        self.pending = collections.deque()
+        self.next_offset = 0
+        self.chunk = b''
+        self.chunk_offset = 0
+
+    def readable(self):
+        return True
+
+    def _get_range(self, start, end):
+        """
+        Download a range of the object
+
+        :param int start: the first byte of the range
+        :param int end: the last byte of the range, included
+        :rtype: bytes
+        """
+        response = self.client.get_object(
+            Bucket=self.bucket_name, Key=self.key,
+            Range='bytes=%s-%s' % (start, end))
+        return response['Body'].read()
+
+    def _request_ranges(self):
+        """
+        Request the download of the following ranges, up to prefetch
+        """
+        while len(self.pending) < self.prefetch \
+                and self.next_offset < self.size:
+            end = min(self.next_offset + self.chunk_size, self.size) - 1
+            self.pending.append(self.pool.apply_async(
+                self._get_range, (self.next_offset, end)))
+            self.next_offset = end + 1
+
+    def read(self, n=-1):
+        if self.chunk_offset == len(self.chunk):
+            self._request_ranges()
+            if not self.pending:
+                return b''
+            self.chunk = self.pending.popleft().get()
+            self.chunk_offset = 0
+            self._request_ranges()
+        if n < 0:
+            n = len(self.chunk)
+        data = self.chunk[self.chunk_offset:self.chunk_offset + n]
+        self.chunk_offset += len(data)
+        return data
+
+
+class DecompressIO(RawIOBase):
+    """
+    Decompress a stream made of one or more concatenated gzip or bzip2
+    streams, reading it sequentially.
+
+    Unlike the gzip and bz2 modules, it never seeks the source, and
+    unlike tarfile it goes on after the end of the first stream.
+    """
+    def __init__(self, fileobj, compression):
+        """
+        :param fileobj: the compressed stream
+        :param str compression: the compression, 'gz' or 'bz2'
+        """
+        self.fileobj = fileobj
+        self.compression = compression
+        self.decompressor = self._new_decompressor()
+        self.chunk = b''
+        self.chunk_offset = 0
+
+    def readable(self):
+        return True
+
+    def _new_decompressor(self):
+        """
+        Create the decompressor of a new stream
+
+        :rtype: zlib.Decompress|bz2.BZ2Decompressor
+        """
+        if self.compression == 'gz':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        raise ValueError("Unknown compression type: %s" % self.compression)
+
+    def _decompress(self, data):
+        """
+        Decompress some data, starting a new stream after the end of the
+        current one
+
+        :param bytes data: the compressed data
+        :rtype: bytes
+        """
+        result = []
+        while data:
+            try:
+                result.append(self.decompressor.decompress(data))
+            except EOFError:
+                # The bzip2 stream ended exactly with the previous data
+                self.decompressor = self._new_decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self._new_decompressor()
+        return b''.join(result)
+
+    def read(self, n=-1):
+        while self.chunk_offset == len(self.chunk):
+            data = self.fileobj.read(BUFSIZE)
+            if not data:
+                return b''
+            self.chunk = self._decompress(data)
+            self.chunk_offset = 0
+        if n < 0:
+            n = len(self.chunk)
+        data = self.chunk[self.chunk_offset:self.chunk_offset + n]
+        self.chunk_offset += len(data)
+        return data
+
+
 class CloudInterface(object):
     def __init__(self, url, encryption, jobs=2,
-                 profile_name=None, endpoint_url=None):
+                 profile_name=None, endpoint_url=None,
+                 max_buffer_memory=DEFAULT_MAX_BUFFER_MEMORY):
         """
         Create a new S3 interface given the S3 destination url and the profile
         name
@@ -494,6 +1033,8 @@ class CloudInterface(object):
         :param str profile_name: Amazon auth profile identifier
         :param str endpoint_url: override default endpoint detection strategy
           with this one
+        :param int max_buffer_memory: maximum amount of shared memory used
+          by the parts waiting to be uploaded
         """
         self.url = url
         self.profile_name = profile_name
@@ -532,6 +1073,13 @@ class CloudInterface(object):
         # Statistics about uploads
         self.upload_stats = collections.defaultdict(FileUploadStatistics)
 
+        # Shared memory used by the part buffers. The size of the buffers
+        # passed to the workers is kept in a map indexed by key and part
+        # number, and released when the part upload is done.
+        self.max_buffer_memory = max_buffer_memory
+        self.buffer_memory = 0
+        self.buffer_sizes = {}
+
     def close(self):
         """
         Wait for all the asynchronous operations to be done
@@ -581,9 +1129,27 @@ class CloudInterface(object):
         # Wait for all the current jobs to be completed
         self.queue.join()
 
-        touched_keys = []
+        results = []
         while not self.result_queue.empty():
-            result = self.result_queue.get()
+            results.append(self.result_queue.get())
+        self._store_results(results)
+
+        # Read the results of completed uploads
+        while not self.done_queue.empty():
+            result = self.done_queue.get()
+            self.upload_stats[result["key"]].update(result)
+
+        # Raise an error if a job failed
+        self._handle_async_errors()
+
+    def _store_results(self, results):
+        """
+        Update the local parts DB with the results of part uploads
+
+        :param list[dict] results: the results received from the workers
+        """
+        touched_keys = []
+        for result in results:
             touched_keys.append(result["key"])
             self.parts_db[result["key"]].append(result["part"])
 
@@ -591,18 +1157,41 @@ class CloudInterface(object):
             stats = self.upload_stats[result["key"]]
             stats.set_part_end_time(result["part_number"], result['end_time'])
 
+            # Release the memory of the part buffer
+            self.buffer_memory -= self.buffer_sizes.pop(
+                (result["key"], result["part_number"]), 0)
+
         for key in touched_keys:
             self.parts_db[key] = sorted(
                 self.parts_db[key],
                 key=operator.itemgetter("PartNumber"))
 
-        # Read the results of completed uploads
-        while not self.done_queue.empty():
-            result = self.done_queue.get()
-            self.upload_stats[result["key"]].update(result)
+    def create_part_buffer(self, size):
+        """
+        Create a shared memory buffer for a part of a multipart upload.
 
-        # Raise an error if a job failed
-        self._handle_async_errors()
+        If the buffer would exceed the maximum buffer memory, wait for
+        the upload of the parts already queued.
+
+        :param int size: the size of the part
+        :return SharedMemoryBuffer|None: the buffer, or None if shared
+          memory is not available or the part doesn't fit in the maximum
+          buffer memory
+        """
+        if shared_memory is None or size > self.max_buffer_memory:
+            return None
+        # Wait only while some parts are queued: the buffers of the parts
+        # being written are not released until they are full
+        while self.buffer_sizes and \
+                self.buffer_memory + size > self.max_buffer_memory:
+            try:
+                result = self.result_queue.get(timeout=1)
+            except EmptyQueue:
+                self._handle_async_errors()
+                continue
+            self._store_results([result])
+        self.buffer_memory += size
+        return SharedMemoryBuffer(size)
 
     def _handle_async_errors(self):
         """
@@ -677,7 +1266,12 @@ class CloudInterface(object):
                         task["key"],
                         task["part_number"],
                         process_number))
-                os.unlink(task["body"])
+                if "body_buffer" in task:
+                    shm = shared_memory.SharedMemory(name=task["body_buffer"])
+                    shm.close()
+                    shm.unlink()
+                else:
+                    os.unlink(task["body"])
                 return
             else:
                 logging.info(
@@ -685,13 +1279,27 @@ class CloudInterface(object):
                         task["key"],
                         task["part_number"],
                         process_number))
-                with open(task["body"], "rb") as fp:
+                if "body_buffer" in task:
+                    shm = shared_memory.SharedMemory(name=task["body_buffer"])
+                    try:
+                        body = BytesIO(
+                            shm.buf[:task["body_size"]].tobytes())
+                    finally:
+                        shm.close()
+                        shm.unlink()
                     part = self.upload_part(
                         task["mpu"],
                         task["key"],
-                        fp,
+                        body,
                         task["part_number"])
-                os.unlink(task["body"])
+                else:
+                    with open(task["body"], "rb") as fp:
+                        part = self.upload_part(
+                            task["mpu"],
+                            task["key"],
+                            fp,
+                            task["part_number"])
+                    os.unlink(task["body"])
                 self.result_queue.put(
                     {
                         "key": task["key"],
@@ -798,28 +1406,94 @@ class CloudInterface(object):
         """
         List bucket content in a directory manner
         :param str prefix:
-        :param str delimiter:
+        :param str delimiter: an empty delimiter lists all the objects
+          under the prefix, recursively
         :return: List of objects and dirs right under the prefix
         """
-        if prefix.startswith(delimiter):
+        if delimiter and prefix.startswith(delimiter):
             prefix = prefix.lstrip(delimiter)
 
-        res = self.s3.meta.client.list_objects_v2(
+        additional_args = {}
+        if delimiter:
+            additional_args['Delimiter'] = delimiter
+
+        # Every response contains at most 1000 keys, follow the
+        # continuation tokens to get them all
+        paginator = self.s3.meta.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
             Bucket=self.bucket_name,
             Prefix=prefix,
-            Delimiter=delimiter)
+            **additional_args)
+
+        for res in pages:
+            # List "folders"
+            keys = res.get("CommonPrefixes")
+            if keys is not None:
+                for k in keys:
+                    yield k.get("Prefix")
+
+            # List "files"
+            objects = res.get("Contents")
+            if objects is not None:
+                for o in objects:
+                    yield o.get("Key")
+
+    def delete_objects(self, keys):
+        """
+        Delete some objects, with DeleteObjects requests of up to
+        MAX_DELETE_BATCH_SIZE keys executed in parallel by
+        worker_processes_count threads.
 
-        # List "folders"
-        keys = res.get("CommonPrefixes")
-        if keys is not None:
-            for k in keys:
-                yield k.get("Prefix")
+        The keys are consumed while the requests are executed, so they
+        can be produced by a listing of any size.
 
-        # List "files"
-        objects = res.get("Contents")
-        if objects is not None:
-            for o in objects:
-                yield o.get("Key")
+        :param collections.Iterable[str] keys: the keys to delete
+        :return list[str]: the keys that could not be deleted
+        """
+        jobs = self.worker_processes_count
+        pool = ThreadPool(jobs)
+        pending = collections.deque()
+        failed = []
+        try:
+            batch = []
+            for key in keys:
+                batch.append(key)
+                if len(batch) < MAX_DELETE_BATCH_SIZE:
+                    continue
+                # Limit the batches waiting to be executed
+                if len(pending) >= 2 * jobs:
+                    failed += pending.popleft().get()
+                pending.append(pool.apply_async(self._delete_objects_batch,
+                                                (batch,)))
+                batch = []
+            if batch:
+                pending.append(pool.apply_async(self._delete_objects_batch,
+                                                (batch,)))
+            while pending:
+                failed += pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+        return failed
+
+    def _delete_objects_batch(self, keys):
+        """
+        Delete some objects with a single DeleteObjects request
+
+        :param list[str] keys: the keys to delete
+        :return list[str]: the keys that could not be deleted
+        """
+        response = self.s3.meta.client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={
+                'Objects': [{'Key': key} for key in keys],
+                'Quiet': True,
+            })
+        errors = response.get('Errors', [])
+        for error in errors:
+            logging.error("Cannot delete %s: %s",
+                          error['Key'], error.get('Message'))
+        return [error['Key'] for error in errors]
 
     def download_file(self, key, dest_path, decompress):
         """
@@ -829,9 +1503,10 @@ class CloudInterface(object):
         :param str dest_path: Where to put the destination file
         :param bool decompress: Whenever to decompress this file or not
         """
-        # Open the remote file
-        obj = self.s3.Object(self.bucket_name, key)
-        remote_file = obj.get()['Body']
+        # Open the remote file, using the client which can be shared
+        # among threads
+        remote_file = self.s3.meta.client.get_object(
+            Bucket=self.bucket_name, Key=key)['Body']
 
         # Write the dest file in binary mode
         with open(dest_path, 'wb') as dest_file:
@@ -857,8 +1532,10 @@ class CloudInterface(object):
         Returns None is the the Key does not exist
         """
         try:
-            obj = self.s3.Object(self.bucket_name, key)
-            return StreamingBodyIO(obj.get()['Body'])
+            # Use the client, which can be shared among threads
+            res = self.s3.meta.client.get_object(
+                Bucket=self.bucket_name, Key=key)
+            return StreamingBodyIO(res['Body'])
         except ClientError as exc:
             error_code = exc.response['Error']['Code']
             if error_code == 'NoSuchKey':
@@ -866,17 +1543,164 @@ class CloudInterface(object):
             else:
                 raise
 
-    def extract_tar(self, key, dst):
+    def remote_read(self, key, etag=None):
+        """
+        Read the content of a remote S3 object, unless it is unchanged
+
+        :param str key: the key of the object
+        :param str|None etag: the ETag of the known content of the object
+        :return tuple[str,bytes|None]|None: the ETag of the object and its
+          content, which is None if the ETag matches the given one.
+          None if the key does not exist.
+        """
+        additional_args = {}
+        if etag:
+            additional_args['IfNoneMatch'] = etag
+        try:
+            # Use the client, which can be shared among threads
+            res = self.s3.meta.client.get_object(
+                Bucket=self.bucket_name, Key=key, **additional_args)
+            return res['ETag'], res['Body'].read()
+        except ClientError as exc:
+            error_code = exc.response['Error']['Code']
+            if error_code == 'NoSuchKey':
+                return None
+            elif error_code == '304':
+                return etag, None
+            else:
+                raise
+
+    def extract_tar(self, key, dst, download_pool=None, journal=None):
         """
         Extract a tar archive from cloud to the local directory
+
+        When a pool of threads is passed, the archive is downloaded with
+        parallel ranged requests, keeping up to worker_processes_count
+        ranges in flight while the archive is decompressed and extracted.
+
+        More archives can be extracted at the same time in the same
+        directory.
+
+        When a journal is passed, the archive is skipped if the journal
+        marks it as extracted, as well as the files already extracted
+        from it, and the extracted files and the archive are recorded.
+
+        :param str key: the key of the archive
+        :param str dst: the destination directory
+        :param multiprocessing.pool.ThreadPool|None download_pool: the
+          pool executing the ranged downloads
+        :param RestoreJournal|None journal: the journal of the restore
+        """
+        if journal and journal.is_archive_extracted(key):
+            logging.info("Skipping %s, already extracted", key)
+            return
+        # This method runs in more threads at the same time, so it uses
+        # the client, which is thread safe unlike the resource
+        client = self.s3.meta.client
+        size = None
+        if download_pool:
+            size = client.head_object(
+                Bucket=self.bucket_name, Key=key)['ContentLength']
+        if size and size > DOWNLOAD_CHUNK_SIZE:
+            fileobj = RangedDownloadIO(
+                client, self.bucket_name, key, size, download_pool,
+                self.worker_processes_count)
+        else:
+            fileobj = client.get_object(
+                Bucket=self.bucket_name, Key=key)['Body']
+        fileobj = self._decompress_stream(fileobj, key)
+        with tarfile.open(fileobj=fileobj, mode='r|') as tf:
+            tf.extractall(path=dst,
+                          members=self._tar_members(tf, dst, key, journal))
+        if journal:
+            journal.record_archive(key)
+
+    def extract_tar_range(self, key, offset, length, dst, names=None):
+        """
+        Extract some members of a tar archive from cloud to the local
+        directory, downloading only the range of the archive containing
+        them.
+
+        The range must start and end at the boundaries of the compressed
+        streams of the archive, as recorded in the backup index.
+
+        :param str key: the key of the archive
+        :param int offset: the offset of the range in the archive
+        :param int length: the length of the range
+        :param str dst: the destination directory
+        :param list[str]|None names: extract only these members, as a
+          stream can contain other ones
+        """
+        response = self.s3.meta.client.get_object(
+            Bucket=self.bucket_name, Key=key,
+            Range='bytes=%s-%s' % (offset, offset + length - 1))
+        fileobj = self._decompress_stream(response['Body'], key)
+        with tarfile.open(fileobj=fileobj, mode='r|') as tf:
+            tf.extractall(path=dst,
+                          members=self._tar_members(tf, dst, names=names))
+
+    @staticmethod
+    def _decompress_stream(fileobj, key):
+        """
+        Decompress the content of an archive, according to its extension.
+
+        The members of the archive are compressed in more concatenated
+        streams, which tarfile doesn't support.
+
+        :param fileobj: the stream of the content of the archive
+        :param str key: the key of the archive
+        :return: the stream of the tar archive
         """
         extension = os.path.splitext(key)[-1]
-        compression = '' if extension == '.tar' else extension[1:]
-        tar_mode = 'r|%s' % compression
-        obj = self.s3.Object(self.bucket_name, key)
-        fileobj = obj.get()['Body']
-        with tarfile.open(fileobj=fileobj, mode=tar_mode) as tf:
-            tf.extractall(path=dst)
+        if extension in ('.gz', '.bz2'):
+            return DecompressIO(fileobj, extension[1:])
+        return fileobj
+
+    @staticmethod
+    def _tar_members(tf, dst, key=None, journal=None, names=None):
+        """
+        Iterate the members of a tar archive, creating their parent
+        directory, which could be extracted by another archive at the
+        same time.
+
+        With a journal, the files already extracted are skipped, and every
+        file is recorded once extracted, that is when the following member
+        is requested.
+
+        :param tarfile.TarFile tf: the archive
+        :param str dst: the destination directory
+        :param str|None key: the key of the archive
+        :param RestoreJournal|None journal: the journal of the restore
+        :param list[str]|None names: yield only these members
+        :rtype: collections.Iterable[tarfile.TarInfo]
+        """
+        extracted = None
+        if names is not None:
+            names = set(names)
+        for tarinfo in tf:
+            if extracted:
+                journal.record_file(key, extracted)
+                extracted = None
+            if names is not None and tarinfo.name not in names:
+                continue
+            path = os.path.join(dst, tarinfo.name)
+            if journal and tarinfo.isreg():
+                if journal.is_file_extracted(key, tarinfo, path):
+                    continue
+                extracted = tarinfo
+            parent = os.path.dirname(path)
+            try:
+                os.makedirs(parent)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            # A resumed restore overwrites the partially extracted files
+            if journal and not tarinfo.isdir() and os.path.lexists(path) \
+                    and not os.path.isdir(path):
+                os.unlink(path)
+            yield tarinfo
+        if extracted:
+            journal.record_file(key, extracted)
 
     def upload_fileobj(self, fileobj, key):
         """
@@ -915,6 +1739,8 @@ class CloudInterface(object):
 
         # If an error has already been reported, do nothing
         if self.error:
+            if isinstance(body, SharedMemoryBuffer):
+                body.discard()
             return
 
         self._ensure_async()
@@ -924,24 +1750,30 @@ class CloudInterface(object):
         stats = self.upload_stats[key]
         stats.set_part_start_time(part_number, datetime.datetime.now())
 
-        # If the body is a named temporary file use it directly
-        # WARNING: this imply that the file will be deleted after the upload
-        if hasattr(body, 'name') and hasattr(body, 'delete') and \
+        task = {
+            "job_type": "upload_part",
+            "mpu": mpu,
+            "key": key,
+            "part_number": part_number,
+        }
+        # If the body is a shared memory buffer or a named temporary file
+        # use it directly
+        # WARNING: this imply that it will be deleted after the upload
+        if isinstance(body, SharedMemoryBuffer):
+            task["body_buffer"] = body.name
+            task["body_size"] = body.tell()
+            self.buffer_sizes[(key, part_number)] = body.size
+        elif hasattr(body, 'name') and hasattr(body, 'delete') and \
                 not body.delete:
-            fp = body
+            task["body"] = body.name
         else:
             # Write a temporary file with the part contents
             with NamedTemporaryFile(delete=False) as fp:
                 shutil.copyfileobj(body, fp, BUFSIZE)
+            task["body"] = fp.name
 
         # Pass the job to the uploader process
-        self.queue.put({
-            "job_type": "upload_part",
-            "mpu": mpu,
-            "key": key,
-            "body": fp.name,
-            "part_number": part_number,
-        })
+        self.queue.put(task)
 
     def upload_part(self, mpu, key, body, part_number):
         """
@@ -1050,7 +1882,8 @@ class S3BackupUploader(object):
     """
 
     def __init__(self, server_name, postgres, cloud_interface,
-                 max_archive_size, compression=None):
+                 max_archive_size, compression=None, archive_jobs=1,
+                 indexed=False):
         """
         Object responsible for handling interactions with S3
 
@@ -1060,13 +1893,19 @@ class S3BackupUploader(object):
           upload the backup
         :param int max_archive_size: the maximum size of an uploading archive
         :param str compression: Compression algorithm to use
+        :param int archive_jobs: the number of archives built and compressed
+          in parallel
+        :param bool indexed: whether to compress the members of the
+          archives in independent streams, listed in the backup index
         """
 
         self.compression = compression
+        self.indexed = indexed
         self.server_name = server_name
         self.postgres = postgres
         self.cloud_interface = cloud_interface
         self.max_archive_size = max_archive_size
+        self.archive_jobs = archive_jobs
 
         # Stats
         self.copy_start_time = None
@@ -1082,6 +1921,10 @@ class S3BackupUploader(object):
         the process.
         This method is the core of base backup copy using Rsync+Ssh.
 
+        When archive_jobs is greater than one, the tablespaces and the
+        files of the PGDATA directory are uploaded by parallel processes,
+        each one building its own archives.
+
         :param barman.cloud.S3UploadController controller: upload controller
         :param barman.infofile.BackupInfo backup_info: backup information
         """
@@ -1092,6 +1935,9 @@ class S3BackupUploader(object):
         # List of paths to be excluded by the PGDATA copy
         exclude = []
 
+        # Upload jobs executed in parallel, if archive_jobs is greater than 1
+        jobs = []
+
         # Process every tablespace
         if backup_info.tablespaces:
             for tablespace in backup_info.tablespaces:
@@ -1114,7 +1960,7 @@ class S3BackupUploader(object):
                 # It could select some spurious directory if a development or
                 # a beta version have been used, but it's good enough for a
                 # production system as it filters out other major versions.
-                controller.upload_directory(
+                job = dict(
                     label=tablespace.name,
                     src=tablespace.location,
                     dst='%s' % tablespace.oid,
@@ -1122,14 +1968,30 @@ class S3BackupUploader(object):
                     include=['/PG_%s_*' %
                              self.postgres.server_major_version],
                 )
+                if self.archive_jobs > 1:
+                    jobs.append(('directory', job))
+                else:
+                    controller.upload_directory(**job)
 
         # Copy PGDATA directory
-        controller.upload_directory(
-            label='pgdata',
-            src=backup_info.pgdata,
-            dst='data',
-            exclude=PGDATA_EXCLUDE_LIST + EXCLUDE_LIST + exclude
-        )
+        if self.archive_jobs > 1:
+            # The directories are stored in the main archive, while the
+            # files are split among parallel archives of similar size
+            jobs += controller.split_directory(
+                label='pgdata',
+                src=backup_info.pgdata,
+                dst='data',
+                parts=self.archive_jobs,
+                exclude=PGDATA_EXCLUDE_LIST + EXCLUDE_LIST + exclude
+            )
+            controller.upload_jobs(jobs, self.archive_jobs)
+        else:
+            controller.upload_directory(
+                label='pgdata',
+                src=backup_info.pgdata,
+                dst='data',
+                exclude=PGDATA_EXCLUDE_LIST + EXCLUDE_LIST + exclude
+            )
 
         # At last copy pg_control
         controller.add_file(
@@ -1197,6 +2059,7 @@ class S3BackupUploader(object):
             key_prefix,
             self.max_archive_size,
             self.compression,
+            self.indexed,
         )
         if self.postgres.server_version >= 90600 \
                 or self.postgres.has_pgespresso:
@@ -1232,6 +2095,15 @@ class S3BackupUploader(object):
             # Closing the controller will finalize all the running uploads
             controller.close()
 
+            # Upload the index of the content of the archives, allowing
+            # the restore of single files
+            if self.indexed:
+                with BytesIO(json.dumps(controller.index).encode('utf-8')) \
+                        as index_file:
+                    key = os.path.join(controller.key_prefix, BACKUP_INDEX)
+                    logging.info("Uploading '%s'", key)
+                    self.cloud_interface.upload_fileobj(index_file, key)
+
             # Store the end time
             self.copy_end_time = datetime.datetime.now()
 
@@ -1295,6 +2167,132 @@ class S3BackupUploader(object):
         logging.debug('Exception details:', exc_info=exc)
 
 
+class RestoreJournal(object):
+    """
+    Journal of the archives and of the files extracted by a restore,
+    allowing an interrupted restore to be resumed.
+
+    Every line of the journal file is a JSON list, either
+    ["archive", key] for a completely extracted archive, or
+    ["file", key, name, size, mtime] for a file extracted from an archive.
+    Files are recorded with their size and modification time, which are
+    checked again before skipping them.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: the path of the journal file
+        """
+        self.path = path
+        self.archives = set()
+        self.files = {}
+        self.journal = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the content of the journal file, if it exists
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The line written when the restore was interrupted
+                    continue
+                if entry[0] == 'archive':
+                    self.archives.add(entry[1])
+                else:
+                    _, key, name, size, mtime = entry
+                    self.files[(key, name)] = (size, mtime)
+        logging.info("Resuming restore: %s archives and %s files "
+                     "already extracted", len(self.archives),
+                     len(self.files))
+
+    def open(self):
+        """
+        Open the journal file to record the progress of the restore
+        """
+        self.journal = open(self.path, 'a')
+
+    def close(self):
+        """
+        Close the journal file
+        """
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def remove(self):
+        """
+        Close and remove the journal file, once the restore is complete
+        """
+        self.close()
+        os.unlink(self.path)
+
+    def _write(self, entry, sync=False):
+        """
+        Append an entry to the journal file
+
+        :param list entry: the entry
+        :param bool sync: whether to sync the journal file to disk
+        """
+        with self.lock:
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            if sync:
+                os.fsync(self.journal.fileno())
+
+    def is_archive_extracted(self, key):
+        """
+        Whether an archive has been completely extracted
+
+        :param str key: the key of the archive
+        :rtype: bool
+        """
+        return key in self.archives
+
+    def is_file_extracted(self, key, tarinfo, path):
+        """
+        Whether a file of an archive has been extracted, and it is still
+        unchanged on disk
+
+        :param str key: the key of the archive
+        :param tarfile.TarInfo tarinfo: the file
+        :param str path: the destination of the file
+        :rtype: bool
+        """
+        if self.files.get((key, tarinfo.name)) != \
+                (tarinfo.size, tarinfo.mtime):
+            return False
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            return False
+        return stat.st_size == tarinfo.size \
+            and int(stat.st_mtime) == int(tarinfo.mtime)
+
+    def record_file(self, key, tarinfo):
+        """
+        Record a file extracted from an archive
+
+        :param str key: the key of the archive
+        :param tarfile.TarInfo tarinfo: the file
+        """
+        self._write(['file', key, tarinfo.name, tarinfo.size,
+                     tarinfo.mtime])
+
+    def record_archive(self, key):
+        """
+        Record an archive completely extracted
+
+        :param str key: the key of the archive
+        """
+        self._write(['archive', key], sync=True)
+
+
 class BackupFileInfo(object):
     def __init__(self, oid=None, base=None, path=None, compression=None):
         self.oid = oid
@@ -1309,13 +2307,16 @@ class S3BackupCatalog(object):
     S3 backup catalog
     """
     def __init__(self, cloud_interface,
-                 server_name):
+                 server_name, cache_dir=None):
         """
         Object responsible for retrievin backup catalog from S3
 
         :param CloudInterface cloud_interface: The interface to use to
           upload the backup
         :param str server_name: The name of the server as configured in Barman
+        :param str|None cache_dir: a local directory caching the content of
+          the backup.info files, which are downloaded again only when their
+          ETag changes
         """
 
         self.cloud_interface = cloud_interface
@@ -1324,6 +2325,10 @@ class S3BackupCatalog(object):
             self.cloud_interface.path,
             self.server_name,
             'base')
+        self.cache_dir = None
+        if cache_dir:
+            self.cache_dir = os.path.join(
+                cache_dir, self.cloud_interface.bucket_name, self.prefix)
         self._backup_list = None
 
     def get_backup_list(self):
@@ -1336,15 +2341,22 @@ class S3BackupCatalog(object):
 
             backup_list = {}
 
-            # get backups metadata
+            backup_ids = []
             for backup_dir in self.cloud_interface.list_bucket(
                     self.prefix + '/'):
                 # We want only the directories
                 if backup_dir[-1] != '/':
                     continue
-                backup_id = os.path.basename(backup_dir.rstrip('/'))
-                backup_info = self.get_backup_info(backup_id)
+                backup_ids.append(os.path.basename(backup_dir.rstrip('/')))
 
+            # get backups metadata, in parallel
+            pool = ThreadPool(self.cloud_interface.worker_processes_count)
+            try:
+                backup_infos = pool.map(self.get_backup_info, backup_ids)
+            finally:
+                pool.terminate()
+                pool.join()
+            for backup_id, backup_info in zip(backup_ids, backup_infos):
                 if backup_info:
                     backup_list[backup_id] = backup_info
             self._backup_list = backup_list
@@ -1358,13 +2370,78 @@ class S3BackupCatalog(object):
         :rtype: BackupInfo
         """
         backup_info_path = os.path.join(self.prefix, backup_id, 'backup.info')
-        backup_info_file = self.cloud_interface.remote_open(backup_info_path)
-        if backup_info_file is None:
-            return None
+        if self.cache_dir:
+            content = self._read_cached(backup_id, backup_info_path)
+            if content is None:
+                return None
+            backup_info_file = BytesIO(content)
+        else:
+            backup_info_file = self.cloud_interface.remote_open(
+                backup_info_path)
+            if backup_info_file is None:
+                return None
         backup_info = BackupInfo(backup_id)
         backup_info.load(file_object=backup_info_file)
         return backup_info
 
+    def _read_cached(self, backup_id, key):
+        """
+        Read the content of a backup.info file through the local cache
+
+        :param str backup_id: the backup id
+        :param str key: the key of the backup.info file
+        :return bytes|None: the content of the file, None if it does not
+          exist
+        """
+        cache_path = os.path.join(self.cache_dir, backup_id + '.json')
+        etag = content = None
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            cached_etag = cached['etag']
+            cached_content = cached['content'].encode('utf-8')
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            pass
+        else:
+            # The ETag is sent only along with a valid content, otherwise
+            # an unchanged file would be returned as missing
+            etag, content = cached_etag, cached_content
+        result = self.cloud_interface.remote_read(key, etag)
+        if result is None:
+            return None
+        etag, remote_content = result
+        if remote_content is None:
+            logging.debug("Using cached %s", key)
+            return content
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        tmp_path = cache_path + '.tmp.%s' % os.getpid()
+        with open(tmp_path, 'w') as cache_file:
+            json.dump({'etag': etag,
+                       'content': remote_content.decode('utf-8')},
+                      cache_file)
+        os.rename(tmp_path, cache_path)
+        return remote_content
+
+    def get_backup_index(self, backup_info):
+        """
+        Load the index of the content of the archives of a backup
+
+        :param BackupInfo backup_info: the backup information
+        :return dict[str,list]|None: the members of every archive, as
+          [name, offset, length] lists. None if the backup has no index.
+        """
+        key = os.path.join(self.prefix, backup_info.backup_id, BACKUP_INDEX)
+        index_file = self.cloud_interface.remote_open(key)
+        if index_file is None:
+            return None
+        return json.loads(index_file.read().decode('utf-8'))
+
     def get_backup_files(self, backup_info):
         """
         Get the list of expected files part of a backup
@@ -301,6 +301,128 @@ class Command(object):
                         # original one
                         raise CommandMaxRetryExceeded(*exc.args)
 
+    def iter_output(self, *args, **kwargs):
+        """
+        Run the command and yield the lines of its standard output as soon
+        as they are produced, without keeping the whole output in memory.
+
+        The error string and the return code are not returned, but they can
+        be accessed as attributes of the Command object once the iteration
+        is finished. The `out` attribute is always None.
+
+        The same keyword arguments accepted by `get_output` can be used.
+
+        As the lines already yielded can't be taken back, the command is
+        retried only if it fails before producing any output line.
+
+        :rtype: collections.Iterable[str]
+        :raise: CommandFailedException
+        :raise: CommandMaxRetryExceeded
+        """
+        attempt = 0
+        while True:
+            produced = False
+            try:
+                for line in self._iter_output_once(*args, **kwargs):
+                    produced = True
+                    yield line
+                return
+            except CommandFailedException as exc:
+                # Try again if nothing has been produced and the retry
+                # number is lower than the retry limit
+                if not produced and attempt < self.retry_times:
+                    # If a retry_handler is defined, invoke it passing the
+                    # Command instance and the exception
+                    if self.retry_handler:
+                        self.retry_handler(self, args, kwargs, attempt, exc)
+                    # Sleep for configured time, then try again
+                    time.sleep(self.retry_sleep)
+                    attempt += 1
+                elif attempt == 0:
+                    # No retry requested by the user or possible
+                    # Raise the original exception
+                    raise
+                else:
+                    # There is still an error after retrying, exit raising
+                    # a CommandMaxRetryExceeded exception and wrap the
+                    # original one
+                    raise CommandMaxRetryExceeded(*exc.args)
+
+    def _iter_output_once(self, *args, **kwargs):
+        """
+        Run the command and yield the lines of its standard output as soon
+        as they are produced.
+
+        Every keyword argument can be specified both in the class constructor
+        and during the method call. If specified in both places,
+        the method arguments will take the precedence over
+        the constructor arguments.
+
+        :rtype: collections.Iterable[str]
+        :raises: CommandFailedException
+        """
+        stdin = kwargs.pop('stdin', None)
+        check = kwargs.pop('check', self.check)
+        allowed_retval = kwargs.pop('allowed_retval', self.allowed_retval)
+        close_fds = kwargs.pop('close_fds', self.close_fds)
+        if len(kwargs):
+            raise TypeError('%s() got an unexpected keyword argument %r' %
+                            (inspect.stack()[1][3], kwargs.popitem()[0]))
+
+        # Reset status
+        self.ret = None
+        self.out = None
+        self.err = None
+
+        # Create the subprocess and save it in the current object to be usable
+        # by signal handlers
+        pipe = self._build_pipe(args, close_fds)
+        self.pipe = pipe
+
+        # Send the provided input and close the stdin descriptor
+        if stdin:
+            pipe.stdin.write(stdin)
+        pipe.stdin.close()
+
+        # Lines are collected only until the next round of the loop, while
+        # the error stream is kept to be reported in case of failure
+        out = []
+        err = []
+        processors = [
+            StreamLineProcessor(
+                pipe.stdout, out.append),
+            StreamLineProcessor(
+                pipe.stderr, err.append)]
+        try:
+            for _ in self.pipe_processor_iter(processors):
+                # At the end of the stream the last incomplete line is
+                # always passed to the handler, even if empty
+                if out and pipe.stdout.closed and not out[-1]:
+                    out.pop()
+                for line in out:
+                    yield line
+                del out[:]
+        finally:
+            # If the consumer stops the iteration early, make sure
+            # the subprocess doesn't stay around
+            if pipe.poll() is None:
+                pipe.kill()
+
+            # Reap the zombie and read the exit code
+            pipe.wait()
+            self.ret = pipe.returncode
+            self.err = '\n'.join(err)
+
+            # Remove the closed pipe from the object
+            self.pipe = None
+
+        _logger.debug("Command stderr: %s", self.err)
+        _logger.debug("Command return code: %s", self.ret)
+
+        # Raise if check and the return code is not in the allowed list
+        if check:
+            self.check_return_value(allowed_retval)
+
     def _get_output_once(self, *args, **kwargs):
         """
         Run the command and return the output and the error as a tuple.
@@ -467,6 +589,19 @@ class Command(object):
         Process the output received through the pipe until all the provided
         StreamLineProcessor reach the EOF.
 
+        :param list[StreamLineProcessor] processors: a list of
+            StreamLineProcessor
+        """
+        for _ in Command.pipe_processor_iter(processors):
+            pass
+
+    @staticmethod
+    def pipe_processor_iter(processors):
+        """
+        Process the output received through the pipe until all the provided
+        StreamLineProcessor reach the EOF, yielding control to the caller
+        after every round of reads.
+
         :param list[StreamLineProcessor] processors: a list of
             StreamLineProcessor
         """
@@ -488,6 +623,7 @@ class Command(object):
                 if eof:
                     # Remove the stream from the list of valid processors
                     processors.remove(stream)
+            yield
 
     @classmethod
     def make_logging_handler(cls, level, prefix=None):
@@ -643,6 +779,15 @@ class Rsync(Command):
         # Invoke the base class method
         return super(Rsync, self).get_output(*args, **kwargs)
 
+    def iter_output(self, *args, **kwargs):
+        """
+        Run the command and yield the lines of its output
+        """
+        # Prepares args for SUSE
+        args = self._args_for_suse(args)
+        # Invoke the base class method
+        return super(Rsync, self).iter_output(*args, **kwargs)
+
     def from_file_list(self, filelist, src, dst, *args, **kwargs):
         """
         This method copies filelist from src to dst.
@@ -23,6 +23,7 @@ import bz2
 import gzip
 import logging
 import shutil
+import zlib
 from abc import ABCMeta, abstractmethod
 from contextlib import closing
 
@@ -78,6 +79,18 @@ class CompressionManager(object):
                 config=self.config, compression=compression, path=self.path)
         return None
 
+    def get_stream_compressor(self):
+        """
+        Returns a new default compressor instance if it is able to compress
+        a stream of data within the Barman process, otherwise None
+        """
+        compression = self.config.compression
+        if compression and self.check(compression) and \
+                issubclass(compression_registry[compression],
+                           InternalCompressor):
+            return self.get_compressor(compression)
+        return None
+
     def get_wal_file_info(self, filename):
         """
         Populate a WalFileInfo object taking into account the server
@@ -112,6 +125,24 @@ def identify_compression(filename):
     return None
 
 
+def get_stream_decompressor(compression):
+    """
+    Returns an incremental decompressor for the given compression, or None
+    if it is not possible to decompress it within the Barman process
+
+    The returned object has a ``decompress(data)`` method which returns
+    the uncompressed data available so far.
+
+    :param str compression: the compression schema (e.g. gzip or bzip2)
+    """
+    if compression in ('gzip', 'pigz', 'pygzip'):
+        # Expect a gzip header and trailer around the compressed data
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression in ('bzip2', 'pybzip2'):
+        return bz2.BZ2Decompressor()
+    return None
+
+
 class Compressor(with_metaclass(ABCMeta, object)):
     """
     Base class for all the compressors
@@ -238,6 +269,18 @@ class InternalCompressor(Compressor):
                 ret=None, err=force_str(e), out=None))
         return 0
 
+    @abstractmethod
+    def stream_compressor(self, fileobj):
+        """
+        Abstract stream compressor factory method
+
+        Closing the returned object flushes the remaining compressed data
+        but leaves fileobj open.
+
+        :param fileobj: a writable binary file-like object
+        :return: a file-like writable compressor object writing to fileobj
+        """
+
     @abstractmethod
     def _decompressor(self, src):
         """
@@ -288,6 +331,10 @@ class PyGZipCompressor(InternalCompressor):
     def _compressor(self, name):
         return gzip.GzipFile(name, mode='wb', compresslevel=self._level)
 
+    def stream_compressor(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='wb',
+                             compresslevel=self._level)
+
     def _decompressor(self, name):
         return gzip.GzipFile(name, mode='rb')
 
@@ -340,10 +387,34 @@ class PyBZip2Compressor(InternalCompressor):
     def _compressor(self, name):
         return bz2.BZ2File(name, mode='wb', compresslevel=self._level)
 
+    def stream_compressor(self, fileobj):
+        return BZ2StreamWriter(fileobj, compresslevel=self._level)
+
     def _decompressor(self, name):
         return bz2.BZ2File(name, mode='rb')
 
 
+class BZ2StreamWriter(object):
+    """
+    Minimal writable file-like object that compresses with BZip2 the data
+    written to it into another file object.
+
+    Needed because BZ2File accepts a file object only since Python 3.
+    """
+
+    def __init__(self, fileobj, compresslevel=9):
+        self._fileobj = fileobj
+        self._compressor = bz2.BZ2Compressor(compresslevel)
+
+    def write(self, data):
+        self._fileobj.write(self._compressor.compress(data))
+
+    def close(self):
+        if self._compressor:
+            self._fileobj.write(self._compressor.flush())
+            self._compressor = None
+
+
 class CustomCompressor(CommandCompressor):
     """
     Custom compressor
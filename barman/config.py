@@ -58,7 +58,9 @@ _TIME_INTERVAL_RE = re.compile(r"""
       """, re.IGNORECASE | re.VERBOSE)
 _SLOT_NAME_RE = re.compile("^[0-9a-z_]+$")
 
-REUSE_BACKUP_VALUES = ('copy', 'link', 'off')
+REUSE_BACKUP_VALUES = ('copy', 'link', 'delta', 'off')
+
+BACKUP_STORAGE_VALUES = ('plain', 'chunks', 'tar')
 
 # Possible copy methods for backups (must be all lowercase)
 BACKUP_METHOD_VALUES = ['rsync', 'postgres', 'local-rsync']
@@ -162,9 +164,10 @@ class RecoveryOptions(CsvOption):
     """
     # constants containing labels for allowed values
     GET_WAL = 'get-wal'
+    COMPRESSED_WALS = 'compressed-wals'
 
     # list holding all the allowed values for the RecoveryOptions class
-    value_list = [GET_WAL]
+    value_list = [GET_WAL, COMPRESSED_WALS]
 
 
 def parse_boolean(value):
@@ -218,7 +221,7 @@ def parse_reuse_backup(value):
     """
     Parse a string to a valid reuse_backup value.
 
-    Valid values are "copy", "link" and "off"
+    Valid values are "copy", "link", "delta" and "off"
 
     :param str value: reuse_backup value
     :raises ValueError: if the value is invalid
@@ -232,6 +235,25 @@ def parse_reuse_backup(value):
             "', '".join(REUSE_BACKUP_VALUES[:-1]), REUSE_BACKUP_VALUES[-1]))
 
 
+def parse_backup_storage(value):
+    """
+    Parse a string to a valid backup_storage value.
+
+    Valid values are "plain", "chunks" and "tar"
+
+    :param str value: backup_storage value
+    :raises ValueError: if the value is invalid
+    """
+    if value is None:
+        return None
+    if value.lower() in BACKUP_STORAGE_VALUES:
+        return value.lower()
+    raise ValueError(
+        "Invalid value (use '%s' or '%s')" % (
+            "', '".join(BACKUP_STORAGE_VALUES[:-1]),
+            BACKUP_STORAGE_VALUES[-1]))
+
+
 def parse_backup_method(value):
     """
     Parse a string to a valid backup_method value.
@@ -301,11 +323,13 @@ class ServerConfig(object):
         'backup_directory',
         'backup_method',
         'backup_options',
+        'backup_storage',
         'bandwidth_limit',
         'basebackup_retry_sleep',
         'basebackup_retry_times',
         'basebackups_directory',
         'check_timeout',
+        'chunk_store_directory',
         'compression',
         'conninfo',
         'custom_compression_filter',
@@ -365,10 +389,12 @@ class ServerConfig(object):
         'archiver_batch_size',
         'backup_method',
         'backup_options',
+        'backup_storage',
         'bandwidth_limit',
         'basebackup_retry_sleep',
         'basebackup_retry_times',
         'check_timeout',
+        'chunk_store_directory',
         'compression',
         'configuration_files_directory',
         'custom_compression_filter',
@@ -422,10 +448,12 @@ class ServerConfig(object):
         'backup_directory': '%(barman_home)s/%(name)s',
         'backup_method': 'rsync',
         'backup_options': '',
+        'backup_storage': 'plain',
         'basebackup_retry_sleep': '30',
         'basebackup_retry_times': '0',
         'basebackups_directory': '%(backup_directory)s/base',
         'check_timeout': '30',
+        'chunk_store_directory': '%(basebackups_directory)s/chunks',
         'disabled': 'false',
         'errors_directory': '%(backup_directory)s/errors',
         'immediate_checkpoint': 'false',
@@ -456,6 +484,7 @@ class ServerConfig(object):
         'archiver_batch_size': int,
         'backup_method': parse_backup_method,
         'backup_options': BackupOptions,
+        'backup_storage': parse_backup_storage,
         'basebackup_retry_sleep': int,
         'basebackup_retry_times': int,
         'check_timeout': int,
@@ -24,20 +24,26 @@ and their final destination.
 
 import collections
 import datetime
+import errno
 import logging
 import os.path
 import re
 import shutil
 import signal
+import stat
 import tempfile
+import threading
 from functools import partial
 from multiprocessing import Lock, Pool
+from multiprocessing.dummy import Pool as ThreadPool
 
 import dateutil.tz
 
 from barman.command_wrappers import RsyncPgData
 from barman.exceptions import CommandFailedException, RsyncListFilesFailure
-from barman.utils import human_readable_timedelta, total_seconds
+from barman.infofile import FileManifest
+from barman.utils import (force_str, human_readable_timedelta, pretty_size,
+                          total_seconds)
 
 _logger = logging.getLogger(__name__)
 _logger_lock = Lock()
@@ -49,9 +55,25 @@ Initialized by `_init_worker` and used by `_run_worker` function.
 This variable must be None outside a multiprocessing worker Process.
 """
 
-# Parallel copy bucket size (10GB)
+# Parallel copy maximum bucket size (10GB)
 BUCKET_SIZE = (1024 * 1024 * 1024 * 10)
 
+# Parallel copy minimum bucket size (64MB)
+MIN_BUCKET_SIZE = (1024 * 1024 * 64)
+
+# Expected copy time of a bucket (in seconds), used to size the buckets
+# using the throughput measured on the previous ones
+BUCKET_TARGET_TIME = 60
+
+# Interval between checks for finished jobs (in seconds)
+JOB_POLL_INTERVAL = 0.1
+
+# Size of the chunks used by the native copy (8MB)
+NATIVE_COPY_CHUNK_SIZE = (1024 * 1024 * 8)
+
+# Maximum number of parsed dates cached while reading rsync file lists
+LIST_DATE_CACHE_SIZE = 10000
+
 
 def _init_worker(func):
     """
@@ -82,6 +104,144 @@ def _run_worker(job):
     return _worker_callable(job)
 
 
+def _native_copy_data(src_file, dst_file):
+    """
+    Copy the content of a file into another one, using the fastest system
+    call available: copy_file_range, then sendfile, then read and write.
+
+    :param file src_file: the source file, open for reading
+    :param file dst_file: the destination file, open for writing
+    :return int: the number of bytes copied
+    """
+    src_fd = src_file.fileno()
+    dst_fd = dst_file.fileno()
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        copied = 0
+        try:
+            while True:
+                if method == 'copy_file_range':
+                    count = os.copy_file_range(
+                        src_fd, dst_fd, NATIVE_COPY_CHUNK_SIZE)
+                else:
+                    count = os.sendfile(
+                        dst_fd, src_fd, copied, NATIVE_COPY_CHUNK_SIZE)
+                if not count:
+                    return copied
+                copied += count
+        except OSError as e:
+            # Try the next method if this one is not supported
+            # between these files
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS,
+                                         errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    copied = 0
+    while True:
+        data = src_file.read(NATIVE_COPY_CHUNK_SIZE)
+        if not data:
+            return copied
+        dst_file.write(data)
+        copied += len(data)
+
+
+def _native_same_content(path1, path2):
+    """
+    Compare the content of two files
+
+    :param str path1: the first file
+    :param str path2: the second file
+    :rtype: bool
+    """
+    with open(path1, 'rb') as file1:
+        with open(path2, 'rb') as file2:
+            while True:
+                data1 = file1.read(NATIVE_COPY_CHUNK_SIZE)
+                data2 = file2.read(NATIVE_COPY_CHUNK_SIZE)
+                if data1 != data2:
+                    return False
+                if not data1:
+                    return True
+
+
+def _native_up_to_date(src, src_stat, other, checksum, link=False):
+    """
+    Check if a file matches the source one, using the same rules of rsync
+
+    :param str src: the source file
+    :param os.stat_result src_stat: the stat of the source file
+    :param str other: the file to compare with the source
+    :param bool checksum: if True compare the content of the files,
+        otherwise their size and modification time
+    :param bool link: if True, the other file must also have the same
+        attributes of the source one, to be used as a hard link
+    :rtype: bool
+    """
+    try:
+        other_stat = os.lstat(other)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+            return False
+        raise
+    if not stat.S_ISREG(other_stat.st_mode) or \
+            other_stat.st_size != src_stat.st_size:
+        return False
+    same_mtime = int(other_stat.st_mtime) == int(src_stat.st_mtime)
+    same_mode = stat.S_IMODE(other_stat.st_mode) == \
+        stat.S_IMODE(src_stat.st_mode)
+    if link and not (same_mtime and same_mode):
+        return False
+    if checksum:
+        return _native_same_content(src, other)
+    return same_mtime
+
+
+def _native_copy_file(src, dst, checksum=False, link_dest=None):
+    """
+    Copy a file without using rsync, following the rules of the rsync
+    options used by Barman (-rLKpts, plus --checksum and --link-dest
+    when requested).
+
+    Symbolic links are followed, permissions and modification time
+    are preserved. An existing destination is replaced, and never
+    overwritten, as it could be a hard link to another backup.
+
+    :param str src: the source file
+    :param str dst: the destination file
+    :param bool checksum: whether to compare the content of the files,
+        instead of their size and modification time
+    :param str|None link_dest: if the file is found unchanged in this
+        path, the destination is created as a hard link to it
+    :return int|None: the number of bytes copied, None if the destination
+        was already up to date
+    """
+    src_stat = os.stat(src)
+    if _native_up_to_date(src, src_stat, dst, checksum):
+        if checksum:
+            # The content is the same, but the attributes may differ
+            os.chmod(dst, stat.S_IMODE(src_stat.st_mode))
+            os.utime(dst, (src_stat.st_atime, src_stat.st_mtime))
+        return None
+
+    try:
+        os.unlink(dst)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    if link_dest and _native_up_to_date(src, src_stat, link_dest, checksum,
+                                        link=True):
+        os.link(link_dest, dst)
+        return 0
+
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            copied = _native_copy_data(src_file, dst_file)
+    os.chmod(dst, stat.S_IMODE(src_stat.st_mode))
+    os.utime(dst, (src_stat.st_atime, src_stat.st_mtime))
+    return copied
+
+
 class _RsyncJob(object):
     """
     A job to be executed by a worker Process
@@ -92,8 +252,7 @@ class _RsyncJob(object):
         :param int item_idx: The index of copy item containing this job
         :param str description: The description of the job, used for logging
         :param int id: Job ID (as in bucket)
-        :param list[RsyncCopyController._FileItem] file_list: Path to the file
-            containing the file list
+        :param list[_FileItem]|_FileList file_list: the files to copy
         :param bool checksum: Whether to force the checksum verification
         """
         self.id = id
@@ -102,9 +261,181 @@ class _RsyncJob(object):
         self.file_list = file_list
         self.checksum = checksum
 
+        # Whether rsync < 3.1 compatibility is required
+        self.rsync_pre_31 = False
+
         # Statistics
         self.copy_start_time = None
         self.copy_end_time = None
+        self.worker = None
+        self.transferred_files = None
+        self.transferred_bytes = None
+        self.literal_bytes = None
+        self.matched_bytes = None
+
+
+class _RsyncAnalysisJob(object):
+    """
+    A job analysing a directory item and preparing its destination,
+    to be executed by a worker Process
+    """
+    def __init__(self, item_idx, analyze_description, purge_description):
+        """
+        :param int item_idx: The index of the directory item to analyse
+        :param str analyze_description: The description of the analysis,
+            used for logging
+        :param str purge_description: The description of the destination
+            preparation, used for logging
+        """
+        self.item_idx = item_idx
+        self.analyze_description = analyze_description
+        self.purge_description = purge_description
+
+        # Whether rsync < 3.1 compatibility is required
+        self.rsync_pre_31 = False
+
+        # The analysed item, returned to the caller
+        self.item = None
+
+
+class _RsyncScheduler(object):
+    """
+    Dynamic scheduler for the jobs of a RsyncCopyController.
+
+    The file lists of the directory items are not split in advance:
+    every time a worker is free, it receives a new bucket taken from the
+    largest pending files. The size of the buckets follows the throughput
+    measured on the finished jobs and shrinks as the amount of data still
+    to be copied decreases, so that the workers finish together.
+
+    The file lists stored in the temporary directory are read
+    sequentially, keeping only their current position in memory, and
+    the buckets are slices of them.
+    """
+
+    def __init__(self, workers):
+        """
+        :param int workers: the number of parallel workers
+        """
+        self.workers = workers
+        self.pending = []
+        self.pending_size = 0
+        self.throughput = {}
+
+    def add_job(self, job):
+        """
+        Add a job to the scheduler.
+
+        If the job has a file list, it will be split in buckets.
+
+        :param _RsyncJob|_RsyncAnalysisJob job: the job to add
+        """
+        if isinstance(job, _RsyncJob) and job.file_list is not None:
+            if isinstance(job.file_list, _FileList):
+                self.pending_size += job.file_list.size
+                job.file_list = _FileListReader(job.file_list)
+            else:
+                job.file_list = _FileQueue(job.file_list)
+                self.pending_size += sum(
+                    entry.size for entry in job.file_list.entries)
+            job.id = 0
+        self.pending.append(job)
+
+    def next_job(self):
+        """
+        Return the next job to be executed, or None if there is no job left
+
+        :rtype: _RsyncJob|_RsyncAnalysisJob|None
+        """
+        if not self.pending:
+            return None
+
+        # Analysis jobs are served first, as they generate the copy jobs,
+        # then the job containing the largest pending file.
+        # Jobs without a file list are served after the others.
+        job = max(self.pending, key=self._priority)
+        if not isinstance(job, _RsyncJob) or job.file_list is None:
+            self.pending.remove(job)
+            return job
+
+        # Build a bucket taking the largest files first
+        bucket_size = self._bucket_size(job.checksum)
+        count = 0
+        size = 0
+        files = job.file_list
+        while files:
+            if count and bucket_size is not None \
+                    and size + files.peek() > bucket_size:
+                break
+            size += files.pop()
+            count += 1
+        self.pending_size -= size
+        if not files:
+            self.pending.remove(job)
+
+        bucket_job = _RsyncJob(job.item_idx,
+                               id=job.id,
+                               description=job.description,
+                               file_list=files.slice(),
+                               checksum=job.checksum)
+        job.id += 1
+        return bucket_job
+
+    @staticmethod
+    def _priority(job):
+        """
+        Priority of a pending job, the highest is served first
+
+        :param _RsyncJob|_RsyncAnalysisJob job: the pending job
+        :rtype: tuple
+        """
+        if isinstance(job, _RsyncAnalysisJob):
+            return 1, 0
+        if job.file_list:
+            return 0, job.file_list.peek()
+        return 0, -1
+
+    def job_done(self, job):
+        """
+        Update the throughput measurement using a finished job
+
+        :param _RsyncJob job: the finished job
+        """
+        if not isinstance(job, _RsyncJob) or not job.file_list:
+            return
+        if isinstance(job.file_list, _FileList):
+            size = job.file_list.size
+        else:
+            size = sum(entry.size for entry in job.file_list)
+        elapsed = total_seconds(job.copy_end_time - job.copy_start_time)
+        if size <= 0 or elapsed <= 0:
+            return
+        # The checksum verification has a different speed, so it is
+        # measured separately
+        throughput = size / elapsed
+        previous = self.throughput.get(job.checksum)
+        if previous is not None:
+            throughput = (previous + throughput) / 2
+        self.throughput[job.checksum] = throughput
+
+    def _bucket_size(self, checksum):
+        """
+        Calculate the size of the next bucket
+
+        :param bool checksum: whether the bucket will be copied forcing
+            the checksum verification
+        :return int|None: the size in bytes, None if there is no limit
+        """
+        # If there is only one worker, copy all the files at once
+        if self.workers < 2:
+            return None
+        size = BUCKET_SIZE
+        throughput = self.throughput.get(checksum)
+        if throughput:
+            size = min(size, int(throughput * BUCKET_TARGET_TIME))
+        # Split what is left among the workers
+        size = min(size, self.pending_size // self.workers)
+        return max(size, MIN_BUCKET_SIZE)
 
 
 class _FileItem(collections.namedtuple('_FileItem', 'mode size date path')):
@@ -114,6 +445,178 @@ class _FileItem(collections.namedtuple('_FileItem', 'mode size date path')):
     """
 
 
+class _FileList(object):
+    """
+    A list of files stored in a file of the temporary directory.
+
+    Every line contains the size and the path of a file, and the files
+    are sorted by size, largest first. A _FileList can also describe
+    a slice of the file, starting from a given offset.
+    """
+
+    def __init__(self, path, count, size, offset=0):
+        """
+        :param str path: the file containing the list
+        :param int count: the number of files in the list
+        :param int size: the total size of the files in the list
+        :param int offset: the position of the first line of the list
+        """
+        self.path = path
+        self.count = count
+        self.size = size
+        self.offset = offset
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """
+        Read the files of the list
+
+        :rtype: iter[_FileItem]
+        """
+        with open(self.path, 'rb') as list_file:
+            list_file.seek(self.offset)
+            for _ in range(self.count):
+                size, path = list_file.readline()[:-1].split(b' ', 1)
+                yield _FileItem(None, int(size), None, path.decode('utf-8'))
+
+    @classmethod
+    def write(cls, path, entries):
+        """
+        Store a list of files
+
+        :param str path: the file that will contain the list
+        :param list[_FileItem] entries: the files
+        :rtype: _FileList
+        """
+        size = 0
+        with open(path, 'wb') as list_file:
+            for entry in sorted(entries, key=lambda entry: entry.size,
+                                reverse=True):
+                list_file.write(b'%d %s\n' % (entry.size,
+                                              entry.path.encode('utf-8')))
+                size += entry.size
+        return cls(path, len(entries), size)
+
+
+class _FileListReader(object):
+    """
+    Split a _FileList in consecutive slices, reading only the sizes of
+    its files
+    """
+
+    def __init__(self, file_list):
+        """
+        :param _FileList file_list: the list to split
+        """
+        self.file_list = file_list
+        self.list_file = None
+        self.remaining = file_list.count
+        # Position and size of the first file of the current slice
+        self.start = file_list.offset
+        self.slice_count = 0
+        self.slice_size = 0
+        # Position, line length and size of the next file
+        self.offset = file_list.offset
+        self.length = None
+        self.size = None
+
+    def __len__(self):
+        return self.remaining
+
+    def peek(self):
+        """
+        Return the size of the next file
+
+        :rtype: int
+        """
+        if self.size is None:
+            if self.list_file is None:
+                self.list_file = open(self.file_list.path, 'rb')
+                self.list_file.seek(self.offset)
+            line = self.list_file.readline()
+            self.length = len(line)
+            self.size = int(line.split(b' ', 1)[0])
+        return self.size
+
+    def pop(self):
+        """
+        Add the next file to the current slice
+
+        :return int: the size of the file
+        """
+        size = self.peek()
+        self.offset += self.length
+        self.size = None
+        self.remaining -= 1
+        self.slice_count += 1
+        self.slice_size += size
+        if not self.remaining:
+            self.list_file.close()
+            self.list_file = None
+        return size
+
+    def slice(self):
+        """
+        Return the current slice and start a new one
+
+        :rtype: _FileList
+        """
+        file_slice = _FileList(self.file_list.path, self.slice_count,
+                               self.slice_size, self.start)
+        self.start = self.offset
+        self.slice_count = 0
+        self.slice_size = 0
+        return file_slice
+
+
+class _FileQueue(object):
+    """
+    Split a list of files held in memory in consecutive slices, with the
+    same interface of _FileListReader
+    """
+
+    def __init__(self, entries):
+        """
+        :param list[_FileItem] entries: the list to split
+        """
+        self.entries = collections.deque(sorted(
+            entries, key=lambda entry: entry.size, reverse=True))
+        self.current = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def peek(self):
+        """
+        Return the size of the next file
+
+        :rtype: int
+        """
+        return self.entries[0].size
+
+    def pop(self):
+        """
+        Add the next file to the current slice
+
+        :return int: the size of the file
+        """
+        entry = self.entries.popleft()
+        self.current.append(entry)
+        return entry.size
+
+    def slice(self):
+        """
+        Return the current slice and start a new one
+
+        :rtype: list[_FileItem]
+        """
+        file_slice = self.current
+        self.current = []
+        return file_slice
+
+
 class _RsyncCopyItem(object):
     """
     Internal data object that contains the information about one of the items
@@ -127,6 +630,7 @@ class _RsyncCopyItem(object):
                  is_directory=False,
                  bwlimit=None,
                  reuse=None,
+                 reuse_manifest=None,
                  item_class=None,
                  optional=False):
         """
@@ -152,6 +656,8 @@ class _RsyncCopyItem(object):
         :param bool is_directory: Whether the item points to a directory.
         :param bwlimit: bandwidth limit to be enforced. (KiB)
         :param str|None reuse: the reference path for incremental mode.
+        :param str|None reuse_manifest: the path of a FileManifest listing
+            the content of the reference path, used instead of listing it.
         :param str|None item_class: If specified carries a meta information
             about what the object to be copied is.
         :param bool optional: Whether a failure copying this object should be
@@ -167,6 +673,7 @@ class _RsyncCopyItem(object):
         self.is_directory = is_directory
         self.bwlimit = bwlimit
         self.reuse = reuse
+        self.reuse_manifest = reuse_manifest
         self.item_class = item_class
         self.optional = optional
 
@@ -238,9 +745,12 @@ class RsyncCopyController(object):
             # "Thu Jun  5 18:00:00 2014" otherwise
             \w+\s+\w+\s+\d+\s+[\d:]+\s+\d+
         )
-        \s+
 
-        # all the remaining characters are part of filename
+        # rsync separates the filename with exactly one space
+        [ ]
+
+        # all the remaining characters are part of filename,
+        # including any leading whitespace
         (?P<path>.+)
 
         $ # end of the line
@@ -269,6 +779,33 @@ class RsyncCopyController(object):
         $ # end of the line
     """, re.VERBOSE + re.IGNORECASE)
 
+    # This regular expression is used to parse the statistics printed by
+    # rsync when invoked with the `--stats` option
+    STATS_RE = re.compile(r"""
+        ^ # start of the line
+        (?P<name>
+            # "Number of files transferred" before rsync 3.1
+            Number\ of\ (regular\ )?files\ transferred
+        |
+            Total\ transferred\ file\ size
+        |
+            Literal\ data
+        |
+            Matched\ data
+        )
+        :\s+
+        (?P<value>\d[\d,.]*)
+    """, re.VERBOSE)
+
+    # The _RsyncJob attributes containing the values parsed by STATS_RE
+    STATS_FIELDS = {
+        'Number of files transferred': 'transferred_files',
+        'Number of regular files transferred': 'transferred_files',
+        'Total transferred file size': 'transferred_bytes',
+        'Literal data': 'literal_bytes',
+        'Matched data': 'matched_bytes',
+    }
+
     def __init__(self, path=None, ssh_command=None, ssh_options=None,
                  network_compression=False,
                  reuse_backup=None, safe_horizon=None,
@@ -313,6 +850,12 @@ class RsyncCopyController(object):
         self.rsync_cache = {}
         """A cache of RsyncPgData objects"""
 
+        self._list_tzinfo = dateutil.tz.tzlocal()
+        """The tzlocal object used to build dates from rsync listings"""
+
+        self._list_date_cache = {}
+        """A cache of the dates parsed from rsync listings"""
+
         # Attributes used for progress reporting
 
         self.total_steps = None
@@ -339,7 +882,8 @@ class RsyncCopyController(object):
                       exclude=None,
                       exclude_and_protect=None,
                       include=None,
-                      bwlimit=None, reuse=None, item_class=None):
+                      bwlimit=None, reuse=None, reuse_manifest=None,
+                      item_class=None):
         """
         Add a directory that we want to copy.
 
@@ -362,6 +906,9 @@ class RsyncCopyController(object):
             copy even if excluded.
         :param bwlimit: bandwidth limit to be enforced. (KiB)
         :param str|None reuse: the reference path for incremental mode.
+        :param str|None reuse_manifest: the path of a FileManifest listing
+            the content of the reference path. If the file exists, it is
+            used instead of listing the reference path.
         :param str item_class: If specified carries a meta information about
             what the object to be copied is.
         """
@@ -373,6 +920,7 @@ class RsyncCopyController(object):
                 is_directory=True,
                 bwlimit=bwlimit,
                 reuse=reuse,
+                reuse_manifest=reuse_manifest,
                 item_class=item_class,
                 optional=False,
                 exclude=exclude,
@@ -403,15 +951,17 @@ class RsyncCopyController(object):
                 item_class=item_class,
                 optional=optional))
 
-    def _rsync_factory(self, item):
+    def _rsync_factory(self, item, cache=True):
         """
         Build the RsyncPgData object required for copying the provided item
 
         :param _RsyncCopyItem item: information about a copy operation
+        :param bool cache: if False, always build a new object, which is
+            not shared with other callers
         :rtype: RsyncPgData
         """
         # If the object already exists, use it
-        if item in self.rsync_cache:
+        if cache and item in self.rsync_cache:
             return self.rsync_cache[item]
 
         # Prepare the command arguments
@@ -452,7 +1002,8 @@ class RsyncCopyController(object):
             retry_sleep=self.retry_sleep,
             retry_handler=partial(self._retry_handler, item)
         )
-        self.rsync_cache[item] = rsync
+        if cache:
+            self.rsync_cache[item] = rsync
         return rsync
 
     def _rsync_set_pre_31_mode(self):
@@ -483,52 +1034,36 @@ class RsyncCopyController(object):
             self._progress_init()
             _logger.info("Copy started (safe before %r)", self.safe_horizon)
 
-            # Execute some preliminary steps for each item to be copied
-            for item in self.item_list:
-
-                # The initial preparation is necessary only for directories
-                if not item.is_directory:
-                    continue
-
-                # Store the analysis start time
-                item.analysis_start_time = datetime.datetime.now()
-
-                # Analyze the source and destination directory content
-                _logger.info(self._progress_message(
-                             "[global] analyze %s" % item))
-                self._analyze_directory(item)
-
-                # Prepare the target directories, removing any unneeded file
-                _logger.info(self._progress_message(
-                    "[global] create destination directories and delete "
-                    "unknown files for %s" % item))
-                self._create_dir_and_purge(item)
-
-                # Store the analysis end time
-                item.analysis_end_time = datetime.datetime.now()
-
             # Init the list of jobs done. Every job will be added to this list
             # once finished. The content will be used to calculate statistics
             # about the copy process.
             self.jobs_done = []
 
             # The jobs are executed using a parallel processes pool
-            # Each job is generated by `self._job_generator`, it is executed by
-            # `_run_worker` using `self._execute_job`, which has been set
-            # calling `_init_worker` function during the Pool initialization.
-            pool = Pool(processes=self.workers,
-                        initializer=_init_worker,
-                        initargs=(self._execute_job,))
-            for job in pool.imap_unordered(_run_worker, self._job_generator(
-                    exclude_classes=[self.PGCONTROL_CLASS])):
-                # Store the finished job for further analysis
-                self.jobs_done.append(job)
+            # Each job is generated by `self._job_generator`, split by
+            # `self._run_jobs` and it is executed by `_run_worker` using
+            # `self._execute_job`, which has been set calling `_init_worker`
+            # function during the Pool initialization.
+            # The directories are analysed by the workers too, and their
+            # files are copied as soon as the analysis is finished, while
+            # other directories are still being analysed.
+            # If all the items are copied without rsync, the copy is
+            # performed by threads, which can execute `self._execute_job`
+            # directly.
+            if all(self._is_native(item) for item in self.item_list):
+                pool = ThreadPool(processes=self.workers)
+                worker = self._execute_job
+            else:
+                pool = Pool(processes=self.workers,
+                            initializer=_init_worker,
+                            initargs=(self._execute_job,))
+                worker = _run_worker
+            self._run_jobs(pool, worker, self._job_generator(
+                exclude_classes=[self.PGCONTROL_CLASS]))
 
             # The PGCONTROL_CLASS items must always be copied last
-            for job in pool.imap_unordered(_run_worker, self._job_generator(
-                    include_classes=[self.PGCONTROL_CLASS])):
-                # Store the finished job for further analysis
-                self.jobs_done.append(job)
+            self._run_jobs(pool, worker, self._job_generator(
+                include_classes=[self.PGCONTROL_CLASS]))
 
         except KeyboardInterrupt:
             _logger.info("Copy interrupted by the user (safe before %s)",
@@ -559,15 +1094,67 @@ class RsyncCopyController(object):
             # Store the end time
             self.copy_end_time = datetime.datetime.now()
 
+    def _run_jobs(self, pool, worker, jobs):
+        """
+        Execute the jobs using the workers of the pool.
+
+        The file lists are split in buckets by a _RsyncScheduler when a
+        worker becomes free. Every finished job is stored in
+        `self.jobs_done`.
+
+        :param multiprocessing.Pool pool: the pool of workers
+        :param callable worker: the function executing a job in the pool
+        :param iter[_RsyncJob|_RsyncAnalysisJob] jobs: the jobs to execute
+        """
+        scheduler = _RsyncScheduler(self.workers)
+        for job in jobs:
+            scheduler.add_job(job)
+
+        running = []
+        while True:
+            # Give some work to every idle worker
+            while len(running) < self.workers:
+                job = scheduler.next_job()
+                if job is None:
+                    break
+                job.rsync_pre_31 = not self.rsync_has_ignore_missing_args
+                running.append(pool.apply_async(worker, (job,)))
+            if not running:
+                break
+
+            # Wait for a job to finish
+            finished = [result for result in running if result.ready()]
+            if not finished:
+                running[0].wait(JOB_POLL_INTERVAL)
+                continue
+            for result in finished:
+                running.remove(result)
+                # This raises any exception raised by the worker
+                job = result.get()
+                if job.rsync_pre_31 and self.rsync_has_ignore_missing_args:
+                    self._rsync_set_pre_31_mode()
+                if isinstance(job, _RsyncAnalysisJob):
+                    # Store the analysed item and schedule its copy
+                    self.item_list[job.item_idx] = job.item
+                    for copy_job in self._item_jobs(job.item_idx, job.item):
+                        scheduler.add_job(copy_job)
+                    continue
+                scheduler.job_done(job)
+                # Store the finished job for further analysis
+                self.jobs_done.append(job)
+
     def _job_generator(self, include_classes=None, exclude_classes=None):
         """
-        Generate the jobs to be executed by the workers
+        Generate the jobs to be executed by the workers.
+
+        Directory items generate an analysis job, the copy jobs are
+        generated by `self._item_jobs` once the analysis is finished.
 
         :param list[str]|None include_classes: If not none, copy only the items
             which have one of the specified classes.
         :param list[str]|None exclude_classes: If not none, skip all items
             which have one of the specified classes.
-        :rtype: iter[_RsyncJob]
+        :rtype: iter[_RsyncJob|_RsyncAnalysisJob]
         """
         for item_idx, item in enumerate(self.item_list):
 
@@ -577,107 +1164,88 @@ class RsyncCopyController(object):
             if exclude_classes and item.item_class in exclude_classes:
                 continue
 
-            # If the item is a directory then copy it in two stages,
-            # otherwise copy it using a plain rsync
             if item.is_directory:
-
-                # Copy the safe files using the default rsync algorithm
-                msg = self._progress_message(
-                    "[%%s] %%s copy safe files from %s" % item)
-                phase_skipped = True
-                for i, bucket in enumerate(
-                        self._fill_buckets(item.safe_list)):
-                    phase_skipped = False
-                    yield _RsyncJob(item_idx,
-                                    id=i,
-                                    description=msg,
-                                    file_list=bucket,
-                                    checksum=False)
-                if phase_skipped:
-                    _logger.info(msg, 'global', 'skipping')
-
-                # Copy the check files forcing rsync to verify the checksum
-                msg = self._progress_message(
-                    "[%%s] %%s copy files with checksum from %s" % item)
-                phase_skipped = True
-                for i, bucket in enumerate(
-                        self._fill_buckets(item.check_list)):
-                    phase_skipped = False
-                    yield _RsyncJob(item_idx,
-                                    id=i,
-                                    description=msg,
-                                    file_list=bucket,
-                                    checksum=True)
-                if phase_skipped:
-                    _logger.info(msg, 'global', 'skipping')
-
+                yield _RsyncAnalysisJob(
+                    item_idx,
+                    analyze_description=self._progress_message(
+                        "[global] analyze %s" % item),
+                    purge_description=self._progress_message(
+                        "[global] create destination directories and delete "
+                        "unknown files for %s" % item))
             else:
-                # Copy the file using plain rsync
-                msg = self._progress_message("[%%s] %%s copy %s" % item)
-                yield _RsyncJob(item_idx, description=msg)
+                for job in self._item_jobs(item_idx, item):
+                    yield job
 
-    def _fill_buckets(self, file_list):
+    def _item_jobs(self, item_idx, item):
         """
-        Generate buckets for parallel copy
+        Generate the copy jobs of an item.
 
-        :param list[_FileItem] file_list: list of file to transfer
-        :rtype: iter[list[_FileItem]]
+        The jobs of directory items contain the whole file list of a copy
+        phase, which is split in buckets by the _RsyncScheduler, so the
+        directory must have been already analysed.
+
+        :param int item_idx: the index of the item
+        :param _RsyncCopyItem item: the item to copy
+        :rtype: iter[_RsyncJob]
         """
-        # If there is only one worker, fall back to copying all file at once
-        if self.workers < 2:
-            yield file_list
-            return
+        # If the item is a directory then copy it in two stages,
+        # otherwise copy it using a plain rsync
+        if item.is_directory:
 
-        # Create `self.workers` buckets
-        buckets = [[] for _ in range(self.workers)]
-        bucket_sizes = [0 for _ in range(self.workers)]
-        pos = -1
-        # Sort the list by size
-        for entry in sorted(file_list, key=lambda item: item.size):
-            # Try to fill the file in a bucket
-            for i in range(self.workers):
-                pos = (pos + 1) % self.workers
-                new_size = bucket_sizes[pos] + entry.size
-                if new_size < BUCKET_SIZE:
-                    bucket_sizes[pos] = new_size
-                    buckets[pos].append(entry)
-                    break
+            # Copy the safe files using the default rsync algorithm
+            msg = self._progress_message(
+                "[%%s] %%s copy safe files from %s" % item)
+            if item.safe_list:
+                yield _RsyncJob(item_idx,
+                                description=msg,
+                                file_list=item.safe_list,
+                                checksum=False)
             else:
-                # All the buckets are filled, so return them all
-                for i in range(self.workers):
-                    if len(buckets[i]) > 0:
-                        yield buckets[i]
-                    # Clear the bucket
-                    buckets[i] = []
-                    bucket_sizes[i] = 0
-                # Put the current file in the first bucket
-                bucket_sizes[0] = entry.size
-                buckets[0].append(entry)
-                pos = 0
-        # Send all the remaining buckets
-        for i in range(self.workers):
-            if len(buckets[i]) > 0:
-                yield buckets[i]
+                _logger.info(msg, 'global', 'skipping')
+
+            # Copy the check files forcing rsync to verify the checksum
+            msg = self._progress_message(
+                "[%%s] %%s copy files with checksum from %s" % item)
+            if item.check_list:
+                yield _RsyncJob(item_idx,
+                                description=msg,
+                                file_list=item.check_list,
+                                checksum=True)
+            else:
+                _logger.info(msg, 'global', 'skipping')
+
+        else:
+            # Copy the file using plain rsync
+            msg = self._progress_message("[%%s] %%s copy %s" % item)
+            yield _RsyncJob(item_idx, description=msg)
 
     def _execute_job(self, job):
         """
-        Execute a `_RsyncJob` in a worker process
+        Execute a `_RsyncJob` or a `_RsyncAnalysisJob` in a worker process
 
-        :type job: _RsyncJob
+        :type job: _RsyncJob|_RsyncAnalysisJob
         """
+        # The main process could have detected an old rsync version
+        if job.rsync_pre_31 and self.rsync_has_ignore_missing_args:
+            self._rsync_set_pre_31_mode()
+        if isinstance(job, _RsyncAnalysisJob):
+            return self._execute_analysis(job)
         item = self.item_list[job.item_idx]
         if job.id is not None:
             bucket = 'bucket %s' % job.id
         else:
             bucket = 'global'
-        # Build the rsync object required for the copy
-        rsync = self._rsync_factory(item)
-        # Store the start time
+        # Store the worker identity and the start time
+        job.worker = (os.getpid(), threading.current_thread().ident)
         job.copy_start_time = datetime.datetime.now()
         # Write in the log that the job is starting
         with _logger_lock:
             _logger.info(job.description, bucket, 'starting')
-        if item.is_directory:
+        if self._is_native(item):
+            self._native_copy(item, job)
+        elif item.is_directory:
+            # Build the rsync object required for the copy
+            rsync = self._rsync_factory(item)
             # A directory item must always have checksum and file_list set
             assert job.file_list is not None, \
                 'A directory item must not have a None `file_list` attribute'
@@ -698,18 +1266,19 @@ class RsyncCopyController(object):
                         "expect %r to be a _FileItem" % entry
                     file_list.write(entry.path + "\n")
 
-            self._copy(rsync,
-                       item.src,
-                       item.dst,
-                       file_list=file_list_path,
-                       checksum=job.checksum)
+            self._store_stats(job, self._copy(rsync,
+                                              item.src,
+                                              item.dst,
+                                              file_list=file_list_path,
+                                              checksum=job.checksum))
         else:
             # A file must never have checksum and file_list set
             assert job.file_list is None, \
                 'A file item must have a None `file_list` attribute'
             assert job.checksum is None, \
                 'A file item must have a None `checksum` attribute'
-            rsync(item.src, item.dst, allowed_retval=(0, 23, 24))
+            rsync = self._rsync_factory(item)
+            rsync('--stats', item.src, item.dst, allowed_retval=(0, 23, 24))
             if rsync.ret == 23:
                 if item.optional:
                     _logger.warning(
@@ -717,16 +1286,132 @@ class RsyncCopyController(object):
                 else:
                     raise CommandFailedException(dict(
                         ret=rsync.ret, out=rsync.out, err=rsync.err))
+            self._store_stats(job, rsync.out)
         # Store the stop time
         job.copy_end_time = datetime.datetime.now()
         # Write in the log that the job is finished
+        details = 'duration: %s' % human_readable_timedelta(
+            job.copy_end_time - job.copy_start_time)
+        if job.transferred_files is not None:
+            details += ', transferred: %s files, %s' % (
+                job.transferred_files, pretty_size(job.transferred_bytes))
         with _logger_lock:
-            _logger.info(job.description, bucket,
-                         'finished (duration: %s)' % human_readable_timedelta(
-                             job.copy_end_time - job.copy_start_time))
+            _logger.info(job.description, bucket, 'finished (%s)' % details)
         # Return the job to the caller, for statistics purpose
         return job
 
+    def _execute_analysis(self, job):
+        """
+        Analyse a directory item and prepare its destination
+
+        :param _RsyncAnalysisJob job: the job to be executed
+        """
+        item = self.item_list[job.item_idx]
+
+        # Store the analysis start time
+        item.analysis_start_time = datetime.datetime.now()
+
+        # Analyze the source and destination directory content
+        with _logger_lock:
+            _logger.info(job.analyze_description)
+        self._analyze_directory(item)
+
+        # Store the file lists in the temporary directory, so only their
+        # path is returned to the main process
+        item.safe_list = _FileList.write(
+            os.path.join(self.temp_dir, '%s_safe_files.list' % item.label),
+            item.safe_list)
+        item.check_list = _FileList.write(
+            os.path.join(self.temp_dir, '%s_check_files.list' % item.label),
+            item.check_list)
+
+        # Prepare the target directories, removing any unneeded file
+        with _logger_lock:
+            _logger.info(job.purge_description)
+        self._create_dir_and_purge(item)
+
+        # Store the analysis end time
+        item.analysis_end_time = datetime.datetime.now()
+
+        # Return the analysed item to the caller, along with the rsync
+        # compatibility mode eventually detected during the analysis
+        job.item = item
+        job.rsync_pre_31 = not self.rsync_has_ignore_missing_args
+        return job
+
+    def _is_native(self, item):
+        """
+        Whether an item can be copied without using rsync.
+
+        This happens when both the source and the destination are local
+        paths and no bandwidth limit is required.
+
+        :param _RsyncCopyItem item: information about a copy operation
+        :rtype: bool
+        """
+        return not item.src.startswith(':') and \
+            not item.dst.startswith(':') and not item.bwlimit
+
+    def _native_copy(self, item, job):
+        """
+        Execute a `_RsyncJob` of a local item without using rsync
+
+        The number of files and bytes transferred are stored in the job.
+        The data is always copied literally, as the native copy never
+        transfers only the differences between files.
+
+        :param _RsyncCopyItem item: information about a copy operation
+        :param _RsyncJob job: the job to be executed
+        """
+        job.transferred_files = 0
+        job.transferred_bytes = 0
+        job.matched_bytes = 0
+        try:
+            if item.is_directory:
+                link_dest = None
+                if self.reuse_backup == 'link':
+                    link_dest = item.reuse
+                for entry in job.file_list:
+                    src = os.path.join(item.src, entry.path)
+                    try:
+                        copied = _native_copy_file(
+                            src,
+                            os.path.join(item.dst, entry.path),
+                            checksum=job.checksum,
+                            link_dest=link_dest and os.path.join(
+                                link_dest, entry.path))
+                    except (IOError, OSError) as e:
+                        # Like rsync, ignore the files which have vanished
+                        # after the analysis
+                        if e.errno != errno.ENOENT or os.path.exists(src):
+                            raise
+                        _logger.debug("File vanished during the copy: %s",
+                                      src)
+                        continue
+                    if copied is not None:
+                        job.transferred_files += 1
+                        job.transferred_bytes += copied
+            else:
+                dst = item.dst
+                if os.path.isdir(dst):
+                    dst = os.path.join(dst, os.path.basename(item.src))
+                try:
+                    copied = _native_copy_file(item.src, dst)
+                except (IOError, OSError) as e:
+                    if e.errno != errno.ENOENT or not item.optional:
+                        raise
+                    _logger.warning("Ignoring error reading %s", item)
+                    return
+                if copied is not None:
+                    job.transferred_files += 1
+                    job.transferred_bytes += copied
+        except (IOError, OSError) as e:
+            raise CommandFailedException(dict(
+                ret=None, out='',
+                err="error copying %s: %s" % (item, force_str(e))))
+        finally:
+            job.literal_bytes = job.transferred_bytes
+
     def _progress_init(self):
         """
         Init counters used by progress logging
@@ -820,22 +1505,24 @@ class RsyncCopyController(object):
             ref += '/'
 
         # Build a hash containing all files present on reference directory.
-        # Directories are not included
-        try:
-            ref_hash = dict((
-                (item.path, item)
-                for item in self._list_files(item, ref)
-                if item.mode[0] != 'd'))
-        except (CommandFailedException, RsyncListFilesFailure) as e:
-            # Here we set ref_hash to None, thus disable the code that marks as
-            # "safe matching" those destination files with different time or
-            # size, even if newer than "safe_horizon". As a result, all files
-            # newer than "safe_horizon" will be checked through checksums.
-            ref_hash = None
-            _logger.error(
-                "Unable to retrieve reference directory file list. "
-                "Using only source file information to decide which files"
-                " need to be copied with checksums enabled: %s" % e)
+        # Directories are not included.
+        # The reference directory is listed by a separate thread, while
+        # the source directory listing is processed.
+        ref_hash = {}
+        ref_errors = []
+
+        def build_ref_hash(ref_files):
+            try:
+                for entry in ref_files:
+                    ref_hash[entry.path] = entry
+            except BaseException as e:
+                ref_errors.append(e)
+
+        ref_thread = threading.Thread(
+            target=build_ref_hash,
+            args=(self._list_reference_files(item, ref),))
+        ref_thread.daemon = True
+        ref_thread.start()
 
         # The 'dir.list' file will contain every directory in the
         # source tree
@@ -855,6 +1542,9 @@ class RsyncCopyController(object):
         # The `check_list` will contain all items that need
         # to be copied with checksum option enabled
         item.check_list = []
+        # The files which need to be compared with the reference directory
+        # are kept aside until its listing is complete
+        ref_check_list = []
         for entry in self._list_files(item, item.src):
             # If item is a directory, we only need to save it in 'dir.list'
             if entry.mode[0] == 'd':
@@ -872,6 +1562,30 @@ class RsyncCopyController(object):
                 item.safe_list.append(entry)
                 continue
 
+            ref_check_list.append(entry)
+
+        # Close all the control files
+        dir_list.close()
+        exclude_and_protect_filter.close()
+
+        # Wait for the reference directory listing
+        ref_thread.join()
+        if ref_errors:
+            e = ref_errors[0]
+            if not isinstance(e, (CommandFailedException,
+                                  RsyncListFilesFailure)):
+                raise e
+            # Here we set ref_hash to None, thus disable the code that marks as
+            # "safe matching" those destination files with different time or
+            # size, even if newer than "safe_horizon". As a result, all files
+            # newer than "safe_horizon" will be checked through checksums.
+            ref_hash = None
+            _logger.error(
+                "Unable to retrieve reference directory file list. "
+                "Using only source file information to decide which files"
+                " need to be copied with checksums enabled: %s" % e)
+
+        for entry in ref_check_list:
             # If ref_hash is None, it means we failed to retrieve the
             # destination file list. We assume the only safe way is to
             # check every file that is older than safe_horizon
@@ -896,9 +1610,29 @@ class RsyncCopyController(object):
             # All remaining files must be checked with checksums enabled
             item.check_list.append(entry)
 
-        # Close all the control files
-        dir_list.close()
-        exclude_and_protect_filter.close()
+    def _list_reference_files(self, item, ref):
+        """
+        Retrieve the list of files (directories excluded) contained in the
+        reference directory of an item.
+
+        When the reference directory is reused from a previous backup which
+        has a manifest, the manifest content is returned, otherwise the
+        directory is listed through rsync.
+
+        :param _RsyncCopyItem item: information about a copy operation
+        :param str ref: the reference directory
+        :rtype: collections.Iterable[_FileItem|ManifestEntry]
+        """
+        if item.reuse and item.reuse_manifest:
+            manifest = FileManifest(item.reuse_manifest)
+            if manifest.exists():
+                _logger.debug("list_files: using manifest %r for %r",
+                              item.reuse_manifest, ref)
+                prefix = os.path.relpath(
+                    item.reuse, os.path.dirname(item.reuse_manifest))
+                return manifest.read(prefix)
+        return (entry for entry in self._list_files(item, ref)
+                if entry.mode[0] != 'd')
 
     def _create_dir_and_purge(self, item):
         """
@@ -933,13 +1667,34 @@ class RsyncCopyController(object):
         :param str dst: destination directory
         :param str file_list: path to the file containing the sources for rsync
         :param bool checksum: if checksum argument for rsync is required
+        :return str: the output of rsync, containing the transfer statistics
         """
         # Build the rsync call args
-        args = ['--files-from=%s' % file_list]
+        args = ['--files-from=%s' % file_list, '--stats']
         if checksum:
             # Add checksum option if needed
             args.append('--checksum')
-        self._rsync_ignore_vanished_files(rsync, src, dst, *args, check=True)
+        out, _ = self._rsync_ignore_vanished_files(
+            rsync, src, dst, *args, check=True)
+        return out
+
+    def _store_stats(self, job, output):
+        """
+        Store in a job the transfer statistics printed by rsync
+        when invoked with the `--stats` option
+
+        :param _RsyncJob job: the job to update
+        :param str|None output: the output of rsync
+        """
+        if not output:
+            return
+        for line in output.splitlines():
+            match = self.STATS_RE.match(line)
+            if not match:
+                continue
+            # Remove digit groupings, which depend on the locale
+            value = int(re.sub(r'\D', '', match.group('value')))
+            setattr(job, self.STATS_FIELDS[match.group('name')], value)
 
     def _list_files(self, item, path):
         """
@@ -953,21 +1708,29 @@ class RsyncCopyController(object):
         """
         _logger.debug("list_files: %r", path)
 
-        # Build the rsync object required for the analysis
-        rsync = self._rsync_factory(item)
+        # Build the rsync object required for the analysis.
+        # Listings can run concurrently, so each one uses its own object.
+        rsync = self._rsync_factory(item, cache=False)
 
+        # The output is parsed while rsync produces it, so the whole
+        # listing is never held in memory
+        produced = False
         try:
             # Use the --no-human-readable option to avoid digit groupings
             # in "size" field with rsync >= 3.1.0.
             # Ref: http://ftp.samba.org/pub/rsync/src/rsync-3.1.0-NEWS
-            rsync.get_output('--no-human-readable', '--list-only',
-                             '-r', path, check=True)
+            for line in rsync.iter_output('--no-human-readable',
+                                          '--list-only', '-r', path,
+                                          check=True):
+                produced = True
+                yield self._parse_list_line(line.rstrip())
         except CommandFailedException:
             # This could fail due to the local or the remote rsync
             # older than 3.1. IF so, fallback to pre 3.1 mode
-            if self.rsync_has_ignore_missing_args and rsync.ret in (
-                    12,  # Error in rsync protocol data stream (remote)
-                    1):  # Syntax or usage error (local)
+            if not produced and self.rsync_has_ignore_missing_args and \
+                    rsync.ret in (
+                        12,  # Error in rsync protocol data stream (remote)
+                        1):  # Syntax or usage error (local)
                 self._rsync_set_pre_31_mode()
                 # Recursive call, uses the compatibility mode
                 for item in self._list_files(item, path):
@@ -976,44 +1739,90 @@ class RsyncCopyController(object):
             else:
                 raise
 
-        # Cache tzlocal object we need to build dates
-        tzinfo = dateutil.tz.tzlocal()
-        for line in rsync.out.splitlines():
-            line = line.rstrip()
-            match = self.LIST_ONLY_RE.match(line)
-            if match:
-                mode = match.group('mode')
-                # no exceptions here: the regexp forces 'size' to be an integer
-                size = int(match.group('size'))
-                try:
-                    date_str = match.group('date')
-                    # The date format has been validated by LIST_ONLY_RE.
-                    # Use "2014/06/05 18:00:00" format if the sending rsync
-                    # is compiled with HAVE_STRFTIME, otherwise use
-                    # "Thu Jun  5 18:00:00 2014" format
-                    if date_str[0].isdigit():
-                        date = datetime.datetime.strptime(
-                            date_str, "%Y/%m/%d %H:%M:%S")
-                    else:
-                        date = datetime.datetime.strptime(
-                            date_str, "%a %b %d %H:%M:%S %Y")
-                    date = date.replace(tzinfo=tzinfo)
-                except (TypeError, ValueError):
-                    # This should not happen, due to the regexp
-                    msg = ("Unable to parse rsync --list-only output line "
-                           "(date): '%s'" % line)
-                    _logger.exception(msg)
-                    raise RsyncListFilesFailure(msg)
-                path = match.group('path')
-                yield _FileItem(mode, size, date, path)
+    def _parse_list_line(self, line):
+        """
+        Parse a line of the output of a "rsync --list-only" call
+
+        The common output format is split without using the LIST_ONLY_RE
+        regular expression, which is used only for the other formats
+        and to report errors.
+
+        :param str line: the line to parse
+        :rtype: _FileItem
+        :except RsyncListFilesFailure: if the line can't be parsed
+        """
+        # Fast path for the "mode size 2014/06/05 18:00:00 path" format.
+        # The path follows the time after exactly one space, and it can
+        # start with whitespace, so it is sliced from the rest of the line.
+        fields = line.split(None, 3)
+        if len(fields) == 4 and fields[1].isdigit() and \
+                len(fields[2]) == 10 and fields[2][4] == '/':
+            time_str, _, path = fields[3].partition(' ')
+            date = self._parse_list_date(fields[2] + ' ' + time_str)
+            if date and path:
+                return _FileItem(fields[0], int(fields[1]), date, path)
+
+        match = self.LIST_ONLY_RE.match(line)
+        if not match:
+            # This is a hard error, as we are unable to parse the output
+            # of rsync. It can only happen with a modified or unknown
+            # rsync version (perhaps newer than 3.1?)
+            msg = ("Unable to parse rsync --list-only output line: "
+                   "'%s'" % line)
+            _logger.error(msg)
+            raise RsyncListFilesFailure(msg)
+
+        mode = match.group('mode')
+        # no exceptions here: the regexp forces 'size' to be an integer
+        size = int(match.group('size'))
+        date_str = match.group('date')
+        try:
+            # The date format has been validated by LIST_ONLY_RE.
+            # Use "2014/06/05 18:00:00" format if the sending rsync
+            # is compiled with HAVE_STRFTIME, otherwise use
+            # "Thu Jun  5 18:00:00 2014" format
+            if date_str[0].isdigit():
+                date = datetime.datetime.strptime(
+                    date_str, "%Y/%m/%d %H:%M:%S")
             else:
-                # This is a hard error, as we are unable to parse the output
-                # of rsync. It can only happen with a modified or unknown
-                # rsync version (perhaps newer than 3.1?)
-                msg = ("Unable to parse rsync --list-only output line: "
-                       "'%s'" % line)
-                _logger.error(msg)
-                raise RsyncListFilesFailure(msg)
+                date = datetime.datetime.strptime(
+                    date_str, "%a %b %d %H:%M:%S %Y")
+            date = date.replace(tzinfo=self._list_tzinfo)
+        except (TypeError, ValueError):
+            # This should not happen, due to the regexp
+            msg = ("Unable to parse rsync --list-only output line "
+                   "(date): '%s'" % line)
+            _logger.exception(msg)
+            raise RsyncListFilesFailure(msg)
+        path = match.group('path')
+        return _FileItem(mode, size, date, path)
+
+    def _parse_list_date(self, date_str):
+        """
+        Parse a "2014/06/05 18:00:00" date using a cache, as many files
+        usually share the same modification time.
+
+        Returns None if the date can't be parsed, leaving the caller
+        to deal with the error.
+
+        :param str date_str: the date string
+        :rtype: datetime.datetime|None
+        """
+        date = self._list_date_cache.get(date_str)
+        if date is not None:
+            return date
+        try:
+            date = datetime.datetime(
+                int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]),
+                int(date_str[11:13]), int(date_str[14:16]),
+                int(date_str[17:19]), tzinfo=self._list_tzinfo)
+        except ValueError:
+            return None
+        # Keep the cache memory bounded
+        if len(self._list_date_cache) >= LIST_DATE_CACHE_SIZE:
+            self._list_date_cache.clear()
+        self._list_date_cache[date_str] = date
+        return date
 
     def _rsync_ignore_vanished_files(self, rsync, *args, **kwargs):
         """
@@ -1128,4 +1937,73 @@ class RsyncCopyController(object):
         stat['copy_time'] = total_seconds(copy_end - copy_start)
         stat['serialized_copy_time'] = total_seconds(serialized_time)
 
+        self._transfer_statistics(stat)
+
         return stat
+
+    def _transfer_statistics(self, stat):
+        """
+        Add to the statistics the amount of data transferred by the jobs
+        and the resulting throughput, in bytes per second.
+
+        The throughput of the whole copy and of every item is calculated
+        over the time elapsed during the copy, while the throughput of every
+        phase ('safe' and 'checksum' for the directories, 'file' for the
+        single files) and of every worker is calculated over the time spent
+        by the jobs, so it is the speed of a single worker. The workers are
+        identified by strings, as the keys of the statistics stored in the
+        backup info.
+
+        :param dict stat: the statistics to update
+        """
+        jobs = [job for job in self.jobs_done
+                if job.transferred_bytes is not None]
+        if not jobs:
+            return
+
+        stat['transferred_files'] = 0
+        stat['transferred_bytes'] = 0
+        stat['literal_bytes'] = 0
+        stat['matched_bytes'] = 0
+        item_bytes = {}
+        phase_data = {}
+        worker_data = {}
+        for job in jobs:
+            for key in ('transferred_files', 'transferred_bytes',
+                        'literal_bytes', 'matched_bytes'):
+                stat[key] += getattr(job, key) or 0
+            ident = self.item_list[job.item_idx].label
+            item_bytes[ident] = item_bytes.get(ident, 0) + \
+                job.transferred_bytes
+            job_time = total_seconds(job.copy_end_time - job.copy_start_time)
+            if job.checksum is None:
+                phase = 'file'
+            elif job.checksum:
+                phase = 'checksum'
+            else:
+                phase = 'safe'
+            for data, key in ((phase_data, phase), (worker_data, job.worker)):
+                size, elapsed, start = data.get(key, (0, 0, None))
+                if start is None or start > job.copy_start_time:
+                    start = job.copy_start_time
+                data[key] = (size + job.transferred_bytes,
+                             elapsed + job_time, start)
+
+        def throughput(size, elapsed):
+            if elapsed > 0:
+                return size / elapsed
+            return None
+
+        stat['throughput'] = throughput(stat['transferred_bytes'],
+                                        stat['copy_time'])
+        stat['throughput_per_item'] = dict(
+            (ident, throughput(size, stat['copy_time_per_item'][ident]))
+            for ident, size in item_bytes.items())
+        stat['throughput_per_phase'] = dict(
+            (phase, throughput(size, elapsed))
+            for phase, (size, elapsed, _) in phase_data.items())
+        # Workers are numbered in the order they started working
+        workers = sorted(worker_data.values(), key=lambda data: data[2])
+        stat['throughput_per_worker'] = dict(
+            (str(number), throughput(size, elapsed))
+            for number, (size, elapsed, _) in enumerate(workers))
@@ -17,9 +17,11 @@
 
 import ast
 import collections
+import datetime
 import inspect
 import logging
 import os
+from contextlib import contextmanager
 
 import dateutil.parser
 import dateutil.tz
@@ -36,6 +38,11 @@ Tablespace = collections.namedtuple('Tablespace', 'name oid location')
 # Named tuple representing a file 'path' with an associated 'file_type'
 TypedFile = collections.namedtuple('ConfFile', 'file_type path')
 
+# Named tuple representing a file listed in a FileManifest, with its
+# 'mode' (as integer), 'size', modification 'date' (a tz-aware datetime)
+# and 'path'
+ManifestEntry = collections.namedtuple('ManifestEntry', 'mode size date path')
+
 _logger = logging.getLogger(__name__)
 
 
@@ -456,6 +463,12 @@ class BackupInfo(FieldListFile):
                            load=ast.literal_eval, dump=null_repr)
     backup_label = Field('backup_label', load=ast.literal_eval, dump=null_repr)
     copy_stats = Field('copy_stats', load=ast.literal_eval, dump=null_repr)
+    # Backup id of the full backup which the page deltas of this backup
+    # are applied to (reuse_backup = delta)
+    delta_base = Field('delta_base')
+    # How the files of the backup are stored: plain directories or
+    # recipes of chunks kept in a chunk store (backup_storage option)
+    backup_storage = Field('backup_storage', default='plain')
     xlog_segment_size = Field('xlog_segment_size', load=int,
                               default=xlog.DEFAULT_XLOG_SEG_SIZE)
     systemid = Field('systemid')
@@ -705,6 +718,13 @@ class LocalBackupInfo(BackupInfo):
         """
         return os.path.join(self.get_basebackup_directory(), 'backup.info')
 
+    def get_manifest_filename(self):
+        """
+        Get the filename of the manifest listing the files of the backup
+        """
+        return os.path.join(self.get_basebackup_directory(),
+                            FileManifest.FILENAME)
+
     def save(self, filename=None, file_object=None):
         if not file_object:
             # Make sure the containing directory exists
@@ -714,3 +734,76 @@ class LocalBackupInfo(BackupInfo):
                 os.makedirs(dir_name)
         super(LocalBackupInfo, self).save(filename=filename,
                                           file_object=file_object)
+
+
+class FileManifest(object):
+    """
+    Compact list of the files contained in a directory tree, written by
+    Barman once the files are not going to change anymore.
+
+    Every line of the file describes a file using tab separated fields:
+    mode (in octal), size, modification time (seconds since the epoch) and
+    path, relative to the directory containing the manifest.
+    """
+
+    FILENAME = 'files.manifest'
+
+    def __init__(self, filename):
+        """
+        :param str filename: the path of the manifest file
+        """
+        self.filename = filename
+
+    def exists(self):
+        """
+        Whether the manifest file exists
+        """
+        return os.path.exists(self.filename)
+
+    @contextmanager
+    def writer(self):
+        """
+        Context manager to write the manifest, yielding a function which
+        accepts the path of a file (relative to the manifest directory)
+        and its stat result.
+
+        The manifest is written in a temporary file, which replaces the
+        final one only if the block terminates without errors.
+        """
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as manifest:
+                def add(path, file_stat):
+                    manifest.write('%o\t%d\t%d\t%s\n' % (
+                        file_stat.st_mode, file_stat.st_size,
+                        int(file_stat.st_mtime), path))
+                yield add
+                manifest.flush()
+                os.fsync(manifest.fileno())
+            os.rename(tmp_filename, self.filename)
+            fsync_dir(os.path.dirname(self.filename))
+        finally:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+
+    def read(self, prefix=''):
+        """
+        Read the manifest, yielding a ManifestEntry for every file
+
+        :param str prefix: if set, only files inside this directory
+            (relative to the manifest directory) are returned, with paths
+            relative to it
+        :rtype: collections.Iterable[ManifestEntry]
+        """
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        tzinfo = dateutil.tz.tzlocal()
+        with open(self.filename) as manifest:
+            for line in manifest:
+                mode, size, mtime, path = line.rstrip('\n').split('\t', 3)
+                if not path.startswith(prefix):
+                    continue
+                yield ManifestEntry(
+                    int(mode, 8), int(size),
+                    datetime.datetime.fromtimestamp(int(mtime), tzinfo),
+                    path[len(prefix):])
@@ -714,6 +714,24 @@ class ConsoleOutputWriter(object):
                     if number_of_workers > 1:
                         value += " (%s jobs)" % number_of_workers
                     self.info("    Estimated throughput : %s", value)
+                # Copy statistics collected from every copy job
+                transferred_bytes = copy_stats.get('transferred_bytes')
+                if transferred_bytes is not None:
+                    self.info("    Transferred data     : %s in %s files "
+                              "(literal: %s, matched: %s)",
+                              pretty_size(transferred_bytes),
+                              copy_stats.get('transferred_files', 0),
+                              pretty_size(copy_stats.get('literal_bytes', 0)),
+                              pretty_size(copy_stats.get('matched_bytes', 0)))
+                    phases = copy_stats.get('throughput_per_phase', {})
+                    value = "%s/s" % pretty_size(
+                        copy_stats.get('throughput') or 0)
+                    if phases:
+                        value += " (%s)" % ", ".join(
+                            "%s: %s/s" % (phase,
+                                          pretty_size(phases[phase] or 0))
+                            for phase in sorted(phases))
+                    self.info("    Transfer throughput  : %s", value)
             self.info("    Begin Offset         : %s",
                       data['begin_offset'])
             self.info("    End Offset           : %s",
@@ -1310,6 +1328,26 @@ class JsonOutputWriter(ConsoleOutputWriter):
                         number_of_workers=copy_stats.get(
                             'number_of_workers', 1)
                     ))
+                transferred_bytes = copy_stats.get('transferred_bytes')
+                if transferred_bytes is not None:
+                    output['base_backup_information'].update(dict(
+                        transferred_size=pretty_size(transferred_bytes),
+                        transferred_bytes=transferred_bytes,
+                        transferred_files=copy_stats.get(
+                            'transferred_files', 0),
+                        literal_bytes=copy_stats.get('literal_bytes', 0),
+                        matched_bytes=copy_stats.get('matched_bytes', 0),
+                        transfer_throughput="%s/s" % pretty_size(
+                            copy_stats.get('throughput') or 0),
+                        transfer_throughput_bytes=copy_stats.get(
+                            'throughput') or 0,
+                        throughput_per_item=copy_stats.get(
+                            'throughput_per_item', {}),
+                        throughput_per_phase=copy_stats.get(
+                            'throughput_per_phase', {}),
+                        throughput_per_worker=copy_stats.get(
+                            'throughput_per_worker', {}),
+                    ))
 
             output['base_backup_information'].update(dict(
                 begin_offset=data['begin_offset'],
@@ -0,0 +1,337 @@
+# Copyright (C) 2011-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module stores PostgreSQL relation files as page deltas.
+
+A page delta contains only the pages of a relation file which changed
+after a given LSN, which is read from the header of every page. The
+unchanged pages are taken from the same file in a reference backup
+when the file is reconstructed.
+
+A page delta file is made of a header (magic string, block size and
+size of the reconstructed file), followed by the content of the changed
+pages, the page map (the number of every page in the delta) and the
+number of entries in the page map. Pages containing only zeroes are
+flagged in the page map and their content is not stored.
+"""
+
+import errno
+import logging
+import os
+import re
+import shutil
+import struct
+from multiprocessing.dummy import Pool as ThreadPool
+
+_logger = logging.getLogger(__name__)
+
+#: Size of a PostgreSQL page
+BLOCK_SIZE = 8192
+
+#: Suffix of the files containing a page delta
+DELTA_SUFFIX = '.pgdelta'
+
+#: A delta is stored only if it is smaller than this fraction of the file
+MAX_DELTA_RATIO = 0.5
+
+#: Number of pages read from a relation file at once
+READ_PAGES = 128
+
+DELTA_MAGIC = b'PGDELTA\x01'
+DELTA_HEADER = struct.Struct('<8sIQ')
+DELTA_MAP_ENTRY = struct.Struct('<I')
+DELTA_TRAILER = struct.Struct('<I')
+
+#: Flag of the page map entries marking pages containing only zeroes
+ZERO_PAGE_FLAG = 0x80000000
+
+# Path of the main fork of a relation, relative to the data directory
+# or to a tablespace directory
+RELATION_FILE_RE = re.compile(
+    r'^(global|base/\d+|PG_[^/]+/\d+)/\d+(\.\d+)?$')
+
+
+def is_relation_file(path):
+    """
+    Whether a path, relative to a data or tablespace directory, contains
+    the main fork of a relation, which can be stored as a page delta.
+
+    :param str path: the relative path of the file
+    :rtype: bool
+    """
+    return RELATION_FILE_RE.match(path) is not None
+
+
+def page_byte_order(page, block_size=BLOCK_SIZE):
+    """
+    Detect the byte order of a page from its pd_pagesize_version field,
+    which contains the page size.
+
+    :param bytes page: the content of the page
+    :param int block_size: the expected size of the page
+    :return str|None: the struct byte order prefix, or None if the page
+        header is not valid
+    """
+    for order in ('<', '>'):
+        pagesize_version, = struct.unpack_from(order + 'H', page, 18)
+        if pagesize_version & 0xFF00 == block_size:
+            return order
+    return None
+
+
+def page_lsn(page, order='<'):
+    """
+    Read the LSN of the last change of a page, stored in its pd_lsn field
+
+    :param bytes page: the content of the page
+    :param str order: the struct byte order prefix of the page
+    :rtype: int
+    """
+    xlogid, xrecoff = struct.unpack_from(order + 'II', page, 0)
+    return (xlogid << 32) + xrecoff
+
+
+class _DeltaNotApplicable(Exception):
+    """
+    Internal exception raised when a file cannot be stored as a delta
+    """
+
+
+def write_delta(file_path, delta_path, base_size, lsn, max_size=None):
+    """
+    Write the page delta of a relation file, containing every page which
+    changed after the given LSN or which is not present in the
+    reference file.
+
+    :param str file_path: the relation file
+    :param str delta_path: the page delta file to write
+    :param int base_size: size of the file in the reference backup
+    :param int lsn: pages with an older LSN are unchanged
+    :param int|None max_size: give up if the delta grows over this size
+    :return int|None: the size of the delta, or None if the file cannot
+        be stored as a delta
+    """
+    zero_page = b'\0' * BLOCK_SIZE
+    page_map = []
+    order = None
+    with open(file_path, 'rb') as src:
+        file_size = os.fstat(src.fileno()).st_size
+        if file_size % BLOCK_SIZE or base_size % BLOCK_SIZE:
+            return None
+        base_pages = base_size // BLOCK_SIZE
+        delta_size = DELTA_HEADER.size + DELTA_TRAILER.size
+        with open(delta_path, 'wb') as delta:
+            try:
+                delta.write(DELTA_HEADER.pack(
+                    DELTA_MAGIC, BLOCK_SIZE, file_size))
+                block = 0
+                while True:
+                    data = src.read(BLOCK_SIZE * READ_PAGES)
+                    if not data:
+                        break
+                    for offset in range(0, len(data), BLOCK_SIZE):
+                        page = data[offset:offset + BLOCK_SIZE]
+                        if page == zero_page:
+                            page_map.append(block | ZERO_PAGE_FLAG)
+                            delta_size += DELTA_MAP_ENTRY.size
+                        else:
+                            page_order = page_byte_order(page)
+                            if order is None:
+                                order = page_order
+                            if page_order is None or page_order != order:
+                                _logger.debug(
+                                    "Invalid page %s in %s", block, file_path)
+                                raise _DeltaNotApplicable()
+                            if block >= base_pages or \
+                                    page_lsn(page, order) >= lsn:
+                                page_map.append(block)
+                                delta.write(page)
+                                delta_size += \
+                                    BLOCK_SIZE + DELTA_MAP_ENTRY.size
+                        if max_size is not None and delta_size > max_size:
+                            raise _DeltaNotApplicable()
+                        block += 1
+                for entry in page_map:
+                    delta.write(DELTA_MAP_ENTRY.pack(entry))
+                delta.write(DELTA_TRAILER.pack(len(page_map)))
+            except _DeltaNotApplicable:
+                delta.close()
+                os.unlink(delta_path)
+                return None
+    return delta_size
+
+
+def read_page_map(delta):
+    """
+    Read the header and the page map of a page delta
+
+    :param file delta: the page delta, opened in binary mode
+    :return tuple[int,int,list[int]]: the block size, the size of the
+        reconstructed file and the page map
+    :raise ValueError: if the file does not contain a page delta
+    """
+    delta.seek(0)
+    magic, block_size, file_size = DELTA_HEADER.unpack(
+        delta.read(DELTA_HEADER.size))
+    if magic != DELTA_MAGIC:
+        raise ValueError("%s is not a page delta" % delta.name)
+    delta.seek(-DELTA_TRAILER.size, os.SEEK_END)
+    count, = DELTA_TRAILER.unpack(delta.read(DELTA_TRAILER.size))
+    delta.seek(-DELTA_TRAILER.size - count * DELTA_MAP_ENTRY.size,
+               os.SEEK_END)
+    page_map = list(struct.unpack(
+        '<%dI' % count, delta.read(count * DELTA_MAP_ENTRY.size)))
+    return block_size, file_size, page_map
+
+
+def apply_deltas(base_path, delta_paths, dst_path):
+    """
+    Reconstruct a relation file, overlaying a chain of page deltas,
+    from the oldest to the newest, on the file of the reference backup.
+
+    The reconstructed file gets the permissions and the modification
+    time of the last delta, which are the ones of the original file.
+
+    :param str base_path: the relation file in the reference backup
+    :param list[str] delta_paths: the page deltas to apply
+    :param str dst_path: the file to write
+    """
+    shutil.copyfile(base_path, dst_path)
+    with open(dst_path, 'r+b') as dst:
+        for delta_path in delta_paths:
+            with open(delta_path, 'rb') as delta:
+                block_size, file_size, page_map = read_page_map(delta)
+                dst.truncate(file_size)
+                delta.seek(DELTA_HEADER.size)
+                for entry in page_map:
+                    dst.seek((entry & ~ZERO_PAGE_FLAG) * block_size)
+                    if entry & ZERO_PAGE_FLAG:
+                        dst.write(b'\0' * block_size)
+                    else:
+                        dst.write(delta.read(block_size))
+    shutil.copystat(delta_paths[-1], dst_path)
+
+
+def store_as_delta(file_path, base_path, lsn):
+    """
+    Replace a relation file with its page delta against the same file
+    in the reference backup, if the delta is small enough.
+
+    :param str file_path: the relation file
+    :param str base_path: the relation file in the reference backup
+    :param int lsn: the LSN of the start of the reference backup
+    :return bool: True if the file has been replaced by a page delta
+    """
+    try:
+        base_size = os.path.getsize(base_path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+    delta_path = file_path + DELTA_SUFFIX
+    max_size = os.path.getsize(file_path) * MAX_DELTA_RATIO
+    if write_delta(file_path, delta_path, base_size, lsn,
+                   max_size) is None:
+        return False
+    shutil.copystat(file_path, delta_path)
+    os.unlink(file_path)
+    return True
+
+
+def store_directory_deltas(directory, base_directory, lsn, workers=1):
+    """
+    Replace every changed relation file in a backup directory with its
+    page delta against the same file in the reference backup.
+
+    Files hard linked to the reference backup are unchanged, so only
+    files with a single link are considered.
+
+    :param str directory: the data or tablespace directory of the backup
+    :param str base_directory: the same directory in the reference backup
+    :param int lsn: the LSN of the start of the reference backup
+    :param int workers: number of files processed in parallel
+    :return int: the number of files stored as page deltas
+    """
+    candidates = []
+    for dir_path, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            path = os.path.relpath(file_path, directory)
+            if is_relation_file(path) and \
+                    os.lstat(file_path).st_nlink == 1:
+                candidates.append((file_path,
+                                   os.path.join(base_directory, path)))
+    if not candidates:
+        return 0
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(
+            lambda args: store_as_delta(args[0], args[1], lsn), candidates)
+    finally:
+        pool.terminate()
+        pool.join()
+    return sum(1 for stored in results if stored)
+
+
+def reconstruct_directory(directory, base_directory, dst_directory,
+                          workers=1):
+    """
+    Build in dst_directory a complete copy of a backup directory
+    containing page deltas.
+
+    Files are hard linked, so dst_directory must be on the same filesystem
+    as the backup, while the relation files stored as page deltas are
+    reconstructed from the same file in the reference backup.
+
+    :param str directory: the data or tablespace directory of the backup
+    :param str base_directory: the same directory in the reference backup
+    :param str dst_directory: the directory to create
+    :param int workers: number of files reconstructed in parallel
+    :return int: the number of reconstructed files
+    """
+    deltas = []
+    for dir_path, dir_names, file_names in os.walk(directory):
+        path = os.path.relpath(dir_path, directory)
+        dst_path = os.path.normpath(os.path.join(dst_directory, path))
+        os.mkdir(dst_path)
+        shutil.copymode(dir_path, dst_path)
+        for name in dir_names + file_names:
+            src = os.path.join(dir_path, name)
+            dst = os.path.join(dst_path, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif name in dir_names:
+                continue
+            elif name.endswith(DELTA_SUFFIX):
+                deltas.append((
+                    os.path.join(base_directory, path,
+                                 name[:-len(DELTA_SUFFIX)]),
+                    src,
+                    dst[:-len(DELTA_SUFFIX)]))
+            else:
+                os.link(src, dst)
+    if not deltas:
+        return 0
+    pool = ThreadPool(workers)
+    try:
+        pool.map(lambda args: apply_deltas(args[0], [args[1]], args[2]),
+                 deltas)
+    finally:
+        pool.terminate()
+        pool.join()
+    return len(deltas)
@@ -31,11 +31,12 @@ import socket
 import tempfile
 import time
 from io import BytesIO
+from multiprocessing.dummy import Pool as ThreadPool
 
 import dateutil.parser
 import dateutil.tz
 
-from barman import output, xlog
+from barman import chunkstore, output, tarstorage, xlog
 from barman.command_wrappers import RsyncPgData
 from barman.config import RecoveryOptions
 from barman.copy_controller import RsyncCopyController
@@ -46,11 +47,41 @@ from barman.exceptions import (BadXlogSegmentName, CommandFailedException,
                                RecoveryTargetActionException)
 from barman.fs import UnixLocalCommand, UnixRemoteCommand
 from barman.infofile import BackupInfo, LocalBackupInfo
+from barman.pagedelta import reconstruct_directory
 from barman.utils import force_str, mkpath
 
 # generic logger for this module
 _logger = logging.getLogger(__name__)
 
+# Number of hash directories of WAL files decompressed in advance
+# while transferring the current one during a remote recovery
+WAL_DECOMPRESSION_AHEAD = 2
+
+# Programs able to decompress, on the target host of a remote recovery,
+# the WAL files archived with each compression method
+REMOTE_DECOMPRESSORS = {
+    'gzip': 'gzip',
+    'pigz': 'gzip',
+    'pygzip': 'gzip',
+    'bzip2': 'bzip2',
+    'pybzip2': 'bzip2',
+}
+
+# Options of barman-wal-restore retrieving WAL files compressed with
+# the program able to decompress them
+WAL_RESTORE_COMPRESSION_OPTIONS = {
+    'gzip': '-z',
+    'bzip2': '-j',
+}
+
+# Shell script decompressing WAL files in place on the target host of a
+# remote recovery. Its arguments are the destination directory, the number
+# of parallel jobs, the decompression program and the WAL file names.
+REMOTE_DECOMPRESSION_SCRIPT = (
+    'cd "$1" || exit 1; jobs="$2"; program="$3"; shift 3; '
+    'printf "%s\\n" "$@" | xargs -n 1 -P "$jobs" sh -c '
+    '\'"$0" -d -c "$1" > "$1.tmp" && mv "$1.tmp" "$1"\' "$program"')
+
 # regexp matching a single value in Postgres configuration file
 PG_CONF_SETTING_RE = re.compile(r"^\s*([^\s=]+)\s*=?\s*(.*)$")
 
@@ -225,17 +256,21 @@ class RecoveryExecutor(object):
 
             required_xlog_files = ()  # Makes static analysers happy
             try:
-                # TODO: Stop early if taget-immediate
                 # Retrieve a list of required log files
                 required_xlog_files = tuple(
                     self.server.get_required_xlog_files(
                         backup_info, target_tli,
-                        recovery_info['target_epoch']))
+                        recovery_info['target_epoch'],
+                        target_lsn=target_lsn,
+                        target_immediate=target_immediate))
 
                 # Restore WAL segments into the wal_dest directory
+                remote_cmd = None
+                if recovery_info['compressed_wals']:
+                    remote_cmd = recovery_info['cmd']
                 self._xlog_copy(required_xlog_files,
                                 recovery_info['wal_dest'],
-                                remote_command)
+                                remote_command, remote_cmd)
             except DataTransferFailure as e:
                 output.error("Failure copying WAL files: %s", e)
                 output.close_and_exit()
@@ -327,6 +362,9 @@ class RecoveryExecutor(object):
             'is_pitr': False,
             'wal_dest': wal_dest,
             'get_wal': RecoveryOptions.GET_WAL in self.config.recovery_options,
+            'compressed_wals':
+                RecoveryOptions.COMPRESSED_WALS in
+                self.config.recovery_options,
         }
         # A map that will keep track of the results of the recovery.
         # Used for output generation
@@ -634,6 +672,17 @@ class RecoveryExecutor(object):
         if remote_command:
             dest_prefix = ':'
 
+        # Backups containing page deltas or not stored as plain
+        # directories must be rebuilt before being copied
+        view_dir = None
+        if backup_info.delta_base or backup_info.backup_storage != 'plain':
+            view_dir = self._reconstruct_backup(backup_info)
+
+        def data_directory(oid=None):
+            if view_dir is None:
+                return backup_info.get_data_directory(oid)
+            return os.path.join(view_dir, str(oid or 'data'))
+
         # Create the copy controller object, specific for rsync,
         # which will drive all the copy operations. Items to be
         # copied are added before executing the copy() method
@@ -675,7 +724,7 @@ class RecoveryExecutor(object):
                 # to be copied by the controller
                 controller.add_directory(
                     label=tablespace.name,
-                    src='%s/' % backup_info.get_data_directory(tablespace.oid),
+                    src='%s/' % data_directory(tablespace.oid),
                     dst=dest_prefix + location,
                     bwlimit=self.config.get_bwlimit(tablespace),
                     item_class=controller.TABLESPACE_CLASS
@@ -685,7 +734,7 @@ class RecoveryExecutor(object):
         # by the controller
         controller.add_directory(
             label='pgdata',
-            src='%s/' % backup_info.get_data_directory(),
+            src='%s/' % data_directory(),
             dst=dest_prefix + dest,
             bwlimit=self.config.get_bwlimit(),
             exclude=[
@@ -711,8 +760,91 @@ class RecoveryExecutor(object):
             msg = "data transfer failure"
             raise DataTransferFailure.from_command_error(
                 'rsync', e, msg)
+        finally:
+            if view_dir is not None:
+                shutil.rmtree(view_dir, ignore_errors=True)
+
+    def _reconstruct_backup(self, backup_info):
+        """
+        Build a complete copy of a backup which cannot be copied as it is:
+        a backup containing page deltas, which are applied to the relation
+        files of its base backup, a backup stored in the chunk store,
+        whose files are rebuilt from their chunks, or a backup stored in
+        compressed archives, which are extracted.
+
+        The copy is created in a temporary directory inside the backup
+        directory, so that every other file can be hard linked. The files
+        of a backup stored in the chunk store or in archives are written
+        in full, so the copy requires as much free space as the size of
+        the backup.
+
+        :param barman.infofile.LocalBackupInfo backup_info: the backup
+            to recover
+        :return str: the directory containing the copy, which has the
+            same layout of the backup directory
+        :raise DataTransferFailure: if the copy cannot be built
+        """
+        base_info = None
+        if backup_info.delta_base:
+            base_info = self.backup_manager.get_backup(backup_info.delta_base)
+            if base_info is None:
+                raise DataTransferFailure(
+                    "base backup %s is not available" %
+                    backup_info.delta_base)
+        view_dir = tempfile.mkdtemp(
+            prefix='.recover-', dir=backup_info.get_basebackup_directory())
+        try:
+            if backup_info.backup_storage == 'chunks':
+                _logger.info("Rebuilding the files of backup %s from "
+                             "the chunk store", backup_info.backup_id)
+                chunkstore.restore_backup(
+                    backup_info.get_basebackup_directory(), view_dir,
+                    workers=self.config.parallel_jobs)
+            elif backup_info.backup_storage == 'tar':
+                _logger.info("Extracting the archives of backup %s",
+                             backup_info.backup_id)
+                tarstorage.restore_backup(
+                    backup_info.get_basebackup_directory(), view_dir,
+                    workers=self.config.parallel_jobs)
+            else:
+                self._apply_page_deltas(backup_info, base_info, view_dir)
+        except (IOError, OSError) as e:
+            shutil.rmtree(view_dir, ignore_errors=True)
+            raise DataTransferFailure(
+                "failure rebuilding backup %s: %s" % (
+                    backup_info.backup_id, force_str(e)))
+        return view_dir
+
+    def _apply_page_deltas(self, backup_info, base_info, view_dir):
+        """
+        Rebuild in view_dir the data and tablespace directories of a backup
+        containing page deltas
 
-    def _xlog_copy(self, required_xlog_files, wal_dest, remote_command):
+        :param barman.infofile.LocalBackupInfo backup_info: the backup
+            to recover
+        :param barman.infofile.LocalBackupInfo base_info: the base backup
+            of the page deltas
+        :param str view_dir: the directory containing the copy
+        """
+        _logger.info("Applying page deltas of backup %s to backup %s",
+                     backup_info.backup_id, base_info.backup_id)
+        oids = [None]
+        if backup_info.tablespaces:
+            oids += [tablespace.oid for tablespace in backup_info.tablespaces]
+        for oid in oids:
+            try:
+                base_directory = base_info.get_data_directory(oid)
+            except ValueError:
+                # A tablespace created after the base backup
+                base_directory = None
+            reconstruct_directory(
+                backup_info.get_data_directory(oid),
+                base_directory,
+                os.path.join(view_dir, str(oid or 'data')),
+                workers=self.config.parallel_jobs)
+
+    def _xlog_copy(self, required_xlog_files, wal_dest, remote_command,
+                   remote_cmd=None):
         """
         Restore WAL segments
 
@@ -720,36 +852,43 @@ class RecoveryExecutor(object):
         :param wal_dest: the destination directory for xlog recover
         :param remote_command: default None. The remote command to recover
                the xlog, in case of remote backup.
+        :param barman.fs.UnixRemoteCommand remote_cmd: default None. If
+               set during a remote recovery, compressed WAL files are
+               transferred as they are and decompressed on the target host
+               using this command.
         """
         # List of required WAL files partitioned by containing directory
         xlogs = collections.defaultdict(list)
         # add '/' suffix to ensure it is a directory
         wal_dest = '%s/' % wal_dest
-        # Map of every compressor used with any WAL file in the archive,
+        # Set of every compression used with any WAL file in the archive,
         # to be used during this recovery
-        compressors = {}
+        compressions = set()
         compression_manager = self.backup_manager.compression_manager
-        # Fill xlogs and compressors maps from required_xlog_files
+        # Fill xlogs map and compressions set from required_xlog_files
         for wal_info in required_xlog_files:
             hashdir = xlog.hash_dir(wal_info.name)
             xlogs[hashdir].append(wal_info)
-            # If a compressor is required, make sure it exists in the cache
-            if wal_info.compression is not None and \
-                    wal_info.compression not in compressors:
-                compressors[wal_info.compression] = \
-                    compression_manager.get_compressor(
-                        compression=wal_info.compression)
+            if wal_info.compression is not None:
+                compressions.add(wal_info.compression)
 
         rsync = RsyncPgData(
             path=self.server.path,
             ssh=remote_command,
             bwlimit=self.config.bandwidth_limit,
             network_compression=self.config.network_compression)
+        # Compressed WAL files can be shipped as they are to the target
+        # host only if it is able to decompress all of them
+        remote_decompression = False
+        if compressions and remote_command and remote_cmd:
+            remote_decompression = all(
+                compression in REMOTE_DECOMPRESSORS
+                for compression in compressions)
         # If compression is used and this is a remote recovery, we need a
         # temporary directory where to spool uncompressed files,
         # otherwise we either decompress every WAL file in the local
         # destination, or we ship the uncompressed file remotely
-        if compressors:
+        if compressions and not remote_decompression:
             if remote_command:
                 # Decompress to a temporary spool directory
                 wal_decompression_dest = tempfile.mkdtemp(
@@ -767,65 +906,79 @@ class RecoveryExecutor(object):
             # add ':' prefix to mark it as remote
             wal_dest = ':%s' % wal_dest
         total_wals = sum(map(len, xlogs.values()))
-        partial_count = 0
-        for prefix in sorted(xlogs):
-            batch_len = len(xlogs[prefix])
-            partial_count += batch_len
-            source_dir = os.path.join(self.config.wals_directory, prefix)
-            _logger.info(
-                "Starting copy of %s WAL files %s/%s from %s to %s",
-                batch_len,
-                partial_count,
-                total_wals,
-                xlogs[prefix][0],
-                xlogs[prefix][-1])
-            # If at least one compressed file has been found, activate
-            # compression check and decompression for each WAL files
-            if compressors:
-                for segment in xlogs[prefix]:
-                    dst_file = os.path.join(wal_decompression_dest,
-                                            segment.name)
-                    if segment.compression is not None:
-                        compressors[segment.compression].decompress(
-                            os.path.join(source_dir, segment.name),
-                            dst_file)
-                    else:
-                        shutil.copy2(os.path.join(source_dir, segment.name),
-                                     dst_file)
-                if remote_command:
+
+        def restore_segment(segment):
+            """
+            Decompress or copy a WAL file in wal_decompression_dest
+            """
+            src_file = os.path.join(self.config.wals_directory,
+                                    xlog.hash_dir(segment.name),
+                                    segment.name)
+            dst_file = os.path.join(wal_decompression_dest, segment.name)
+            if segment.compression is not None:
+                # The compressors keep the state of the last command they
+                # executed, so they can't be shared by concurrent threads
+                compressor = compression_manager.get_compressor(
+                    compression=segment.compression)
+                compressor.decompress(src_file, dst_file)
+            else:
+                shutil.copy2(src_file, dst_file)
+
+        # Decompression is executed by external commands or by the
+        # compression modules, which release the GIL, so threads are
+        # enough to decompress the WAL files in parallel
+        pool = ThreadPool(max(1, self.config.parallel_jobs))
+        try:
+            if compressions and not remote_command:
+                # Decompress every WAL file directly in the destination
+                _logger.info(
+                    "Starting decompression of %s WAL files from %s to %s",
+                    total_wals,
+                    required_xlog_files[0],
+                    required_xlog_files[-1])
+                pool.map(restore_segment, required_xlog_files)
+            elif compressions and not remote_decompression:
+                self._xlog_decompress_and_transfer(
+                    xlogs, pool, restore_segment, rsync,
+                    wal_decompression_dest, wal_dest)
+            else:
+                # Transfer the archived WAL files as they are. If they are
+                # compressed, they are decompressed on the target host
+                # while the following hash directory is transferred.
+                decompression = None
+                partial_count = 0
+                for prefix in sorted(xlogs):
+                    batch_len = len(xlogs[prefix])
+                    partial_count += batch_len
+                    _logger.info(
+                        "Starting copy of %s WAL files %s/%s from %s to %s",
+                        batch_len,
+                        partial_count,
+                        total_wals,
+                        xlogs[prefix][0],
+                        xlogs[prefix][-1])
                     try:
-                        # Transfer the WAL files
                         rsync.from_file_list(
                             list(segment.name for segment in xlogs[prefix]),
-                            wal_decompression_dest, wal_dest)
+                            "%s/" % os.path.join(self.config.wals_directory,
+                                                 prefix),
+                            wal_dest)
                     except CommandFailedException as e:
-                        msg = ("data transfer failure while copying WAL files "
-                               "to directory '%s'") % (wal_dest[1:],)
+                        msg = "data transfer failure while copying WAL " \
+                              "files to directory '%s'" % (wal_dest[1:],)
                         raise DataTransferFailure.from_command_error(
                             'rsync', e, msg)
-
-                    # Cleanup files after the transfer
-                    for segment in xlogs[prefix]:
-                        file_name = os.path.join(wal_decompression_dest,
-                                                 segment.name)
-                        try:
-                            os.unlink(file_name)
-                        except OSError as e:
-                            output.warning(
-                                "Error removing temporary file '%s': %s",
-                                file_name, e)
-            else:
-                try:
-                    rsync.from_file_list(
-                        list(segment.name for segment in xlogs[prefix]),
-                        "%s/" % os.path.join(self.config.wals_directory,
-                                             prefix),
-                        wal_dest)
-                except CommandFailedException as e:
-                    msg = "data transfer failure while copying WAL files " \
-                          "to directory '%s'" % (wal_dest[1:],)
-                    raise DataTransferFailure.from_command_error(
-                        'rsync', e, msg)
+                    if remote_decompression:
+                        if decompression:
+                            decompression.get()
+                        decompression = pool.apply_async(
+                            self._xlog_remote_decompress,
+                            (remote_cmd, xlogs[prefix], wal_dest[1:]))
+                if decompression:
+                    decompression.get()
+        finally:
+            pool.terminate()
+            pool.join()
 
         _logger.info("Finished copying %s WAL files.", total_wals)
 
@@ -835,6 +988,108 @@ class RecoveryExecutor(object):
         if wal_decompression_dest and wal_decompression_dest != wal_dest:
             shutil.rmtree(wal_decompression_dest)
 
+    def _xlog_decompress_and_transfer(self, xlogs, pool, restore_segment,
+                                      rsync, wal_decompression_dest,
+                                      wal_dest):
+        """
+        Decompress the WAL files in a local spool directory and transfer
+        them to the remote destination, one hash directory at a time.
+
+        The WAL files of the following WAL_DECOMPRESSION_AHEAD hash
+        directories are decompressed while the current one is transferred,
+        limiting the space used by the spool directory.
+
+        :param dict[str,list[WalFileInfo]] xlogs: the WAL files to restore,
+            partitioned by hash directory
+        :param multiprocessing.pool.ThreadPool pool: the decompression pool
+        :param callable restore_segment: function decompressing a WAL file
+            in the spool directory
+        :param RsyncPgData rsync: the rsync command used for the transfer
+        :param str wal_decompression_dest: the spool directory
+        :param str wal_dest: the remote destination, with a ':' prefix
+        """
+        total_wals = sum(map(len, xlogs.values()))
+        prefixes = iter(sorted(xlogs))
+        pending = collections.deque()
+
+        def decompress_next():
+            prefix = next(prefixes, None)
+            if prefix is not None:
+                pending.append(
+                    (prefix, pool.map_async(restore_segment, xlogs[prefix])))
+
+        for _ in range(1 + WAL_DECOMPRESSION_AHEAD):
+            decompress_next()
+        partial_count = 0
+        while pending:
+            prefix, result = pending.popleft()
+            # Wait for the WAL files of the directory to be decompressed
+            result.get()
+            decompress_next()
+            batch_len = len(xlogs[prefix])
+            partial_count += batch_len
+            _logger.info(
+                "Starting copy of %s WAL files %s/%s from %s to %s",
+                batch_len,
+                partial_count,
+                total_wals,
+                xlogs[prefix][0],
+                xlogs[prefix][-1])
+            try:
+                # Transfer the WAL files
+                rsync.from_file_list(
+                    list(segment.name for segment in xlogs[prefix]),
+                    wal_decompression_dest, wal_dest)
+            except CommandFailedException as e:
+                msg = ("data transfer failure while copying WAL files "
+                       "to directory '%s'") % (wal_dest[1:],)
+                raise DataTransferFailure.from_command_error(
+                    'rsync', e, msg)
+
+            # Cleanup files after the transfer
+            for segment in xlogs[prefix]:
+                file_name = os.path.join(wal_decompression_dest,
+                                         segment.name)
+                try:
+                    os.unlink(file_name)
+                except OSError as e:
+                    output.warning(
+                        "Error removing temporary file '%s': %s",
+                        file_name, e)
+
+    def _xlog_remote_decompress(self, remote_cmd, segments, wal_dest):
+        """
+        Decompress in place, on the target host of a remote recovery,
+        some WAL files transferred as they are archived.
+
+        The WAL files are decompressed in parallel using up to
+        parallel_jobs processes.
+
+        :param barman.fs.UnixRemoteCommand remote_cmd: the command
+            executing a shell on the target host
+        :param list[WalFileInfo] segments: the transferred WAL files
+        :param str wal_dest: the directory containing the WAL files
+            on the target host
+        """
+        programs = collections.defaultdict(list)
+        for segment in segments:
+            if segment.compression is not None:
+                programs[REMOTE_DECOMPRESSORS[segment.compression]].append(
+                    segment.name)
+        for program in sorted(programs):
+            _logger.info(
+                "Decompressing %s WAL files with %s on the target host",
+                len(programs[program]), program)
+            args = ['-c', REMOTE_DECOMPRESSION_SCRIPT, 'sh', wal_dest,
+                    str(max(1, self.config.parallel_jobs)), program]
+            args.extend(programs[program])
+            ret = remote_cmd.cmd('sh', args=args)
+            if ret != 0:
+                out, err = remote_cmd.get_last_output()
+                raise DataTransferFailure(
+                    "failure decompressing WAL files in directory "
+                    "'%s' with %s:\n%s%s" % (wal_dest, program, out, err))
+
     def _generate_archive_status(self, recovery_info, remote_command,
                                  required_xlog_files):
         """
@@ -913,9 +1168,17 @@ class RecoveryExecutor(object):
                 recovery_conf_lines.append(
                     "# The 'barman-wal-restore' command "
                     "is provided in the 'barman-cli' package")
+                # Transfer the WAL files compressed, if requested
+                compression_option = ''
+                if recovery_info['compressed_wals'] and \
+                        self.config.compression in REMOTE_DECOMPRESSORS:
+                    compression_option = ' %s' % (
+                        WAL_RESTORE_COMPRESSION_OPTIONS[
+                            REMOTE_DECOMPRESSORS[self.config.compression]])
                 recovery_conf_lines.append(
-                    "restore_command = 'barman-wal-restore %s -U %s "
+                    "restore_command = 'barman-wal-restore %s%s -U %s "
                     "%s %s %%f %%p'" % (partial_option,
+                                        compression_option,
                                         self.config.config.user,
                                         fqdn, self.config.name))
             else:
@@ -1039,9 +1302,24 @@ class RecoveryExecutor(object):
         # `pg_ident.conf` which is an optional file.
         hardcoded_files = ['pg_hba.conf', 'pg_ident.conf']
         conf_files = recovery_info['configuration_files'] + hardcoded_files
+        data_dir = backup_info.get_data_directory()
+        if backup_info.backup_storage == 'chunks':
+            # Rebuild the configuration files from the chunk store
+            chunkstore.restore_backup(
+                backup_info.get_basebackup_directory(),
+                recovery_info['tempdir'],
+                paths=[os.path.join('data', conf_file)
+                       for conf_file in conf_files])
+            data_dir = os.path.join(recovery_info['tempdir'], 'data')
+        elif backup_info.backup_storage == 'tar':
+            # Extract the configuration files from the archive
+            data_dir = os.path.join(recovery_info['tempdir'], 'data')
+            tarstorage.extract_top_level_files(
+                os.path.join(backup_info.get_basebackup_directory(),
+                             'data' + tarstorage.TAR_SUFFIX),
+                conf_files, data_dir)
         for conf_file in conf_files:
-            source_path = os.path.join(
-                backup_info.get_data_directory(), conf_file)
+            source_path = os.path.join(data_dir, conf_file)
             if not os.path.exists(source_path):
                 recovery_info['results']['missing_files'].append(conf_file)
                 # Remove the file from the list of configuration files
@@ -1057,8 +1335,7 @@ class RecoveryExecutor(object):
                 conf_file_path = os.path.join(
                     recovery_info['tempdir'], conf_file)
                 shutil.copy2(
-                    os.path.join(backup_info.get_data_directory(),
-                                 conf_file), conf_file_path)
+                    os.path.join(data_dir, conf_file), conf_file_path)
             else:
                 # Otherwise use the local destination path.
                 conf_file_path = os.path.join(
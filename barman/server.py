@@ -20,6 +20,7 @@ This module represents a Server.
 Barman is able to manage multiple servers.
 """
 import errno
+import hashlib
 import json
 import logging
 import os
@@ -37,6 +38,7 @@ import barman
 from barman import output, xlog
 from barman.backup import BackupManager
 from barman.command_wrappers import BarmanSubProcess, Command, Rsync
+from barman.compression import get_stream_decompressor
 from barman.copy_controller import RsyncCopyController
 from barman.exceptions import (ArchiverFailure, BadXlogSegmentName,
                                CommandFailedException, ConninfoException,
@@ -61,11 +63,12 @@ from barman.postgres import PostgreSQLConnection, StreamingConnection
 from barman.process import ProcessManager
 from barman.remote_status import RemoteStatusMixin
 from barman.retention_policies import RetentionPolicyFactory
-from barman.utils import (BarmanEncoder, file_md5, force_str, fsync_dir,
-                          fsync_file, human_readable_timedelta,
-                          is_power_of_two, mkpath, pretty_size, timeout)
+from barman.utils import (BarmanEncoder, force_str, fsync_dir,
+                          human_readable_timedelta, is_power_of_two, mkpath,
+                          pretty_size, timeout)
 from barman.wal_archiver import (FileWalArchiver, StreamingWalArchiver,
                                  WalArchiver)
+from barman.xlogdb_index import XlogdbIndex
 
 PARTIAL_EXTENSION = '.partial'
 PRIMARY_INFO_FILE = 'primary.info'
@@ -1320,9 +1323,24 @@ class Server(RemoteStatusMixin):
         return self.backup_manager.get_next_backup(backup_id)
 
     def get_required_xlog_files(self, backup, target_tli=None,
-                                target_time=None, target_xid=None):
+                                target_time=None, target_xid=None,
+                                target_lsn=None, target_immediate=False):
         """
         Get the xlog files required for a recovery
+
+        The WAL files from the beginning of the backup are returned, up to
+        the first one past the recovery target, together with every
+        history file. The target_xid parameter cannot bound the result,
+        as the transaction ids contained in a WAL file are unknown.
+
+        :param BackupInfo backup: the backup to recover
+        :param int|None target_tli: the target timeline
+        :param float|None target_time: the target time, as epoch
+        :param str|None target_xid: the target transaction id
+        :param str|None target_lsn: the target LSN
+        :param bool target_immediate: whether the recovery ends as soon as
+            the backup is consistent
+        :rtype: collections.Iterable[WalFileInfo]
         """
         begin = backup.begin_wal
         end = backup.end_wal
@@ -1330,13 +1348,26 @@ class Server(RemoteStatusMixin):
         # of the backup
         if not target_tli:
             target_tli, _, _ = xlog.decode_segment_name(end)
-        with self.xlogdb() as fxlogdb:
-            for line in fxlogdb:
+        # The last WAL file required to reach the target
+        target_wal = None
+        if target_lsn:
+            target_wal = xlog.location_to_xlogfile_name_offset(
+                target_lsn, target_tli,
+                backup.xlog_segment_size)['file_name']
+        elif target_immediate:
+            target_wal = end
+        with self.xlogdb('rb') as fxlogdb:
+            # The index allows to skip the beginning of xlog.db, which
+            # only lists WAL files older than the backup
+            index = XlogdbIndex(fxlogdb.name)
+            index.update(fxlogdb)
+            # Handle .history files: add all of them to the output,
+            # regardless of their age
+            for line in index.history_lines():
+                yield WalFileInfo.from_xlogdb_line(line)
+            for line in index.lines_from(fxlogdb, begin):
                 wal_info = WalFileInfo.from_xlogdb_line(line)
-                # Handle .history files: add all of them to the output,
-                # regardless of their age
                 if xlog.is_history_file(wal_info.name):
-                    yield wal_info
                     continue
                 if wal_info.name < begin:
                     continue
@@ -1348,11 +1379,8 @@ class Server(RemoteStatusMixin):
                     end = wal_info.name
                     if target_time and target_time < wal_info.time:
                         break
-            # return all the remaining history files
-            for line in fxlogdb:
-                wal_info = WalFileInfo.from_xlogdb_line(line)
-                if xlog.is_history_file(wal_info.name):
-                    yield wal_info
+                    if target_wal and target_wal < wal_info.name:
+                        break
 
     # TODO: merge with the previous
     def get_wal_until_next_backup(self, backup, include_history=False):
@@ -1771,6 +1799,49 @@ class Server(RemoteStatusMixin):
         if compressed_file is not None:
             compressed_file.close()
 
+    @staticmethod
+    def _write_incoming_file(src, dst, compressor=None, decompressor=None,
+                             buffer_size=1024 * 64):
+        """
+        Write the content of a stream into a new file in a single pass,
+        calculating its md5 checksum and executing fsync on it.
+
+        If a compressor is provided, the content is compressed while being
+        written, but the checksum still refers to the uncompressed data.
+        If a decompressor is provided, the content is already compressed:
+        it is written as it is and only decompressed to calculate the
+        checksum of the uncompressed data.
+
+        :param src: readable file-like object
+        :param str dst: destination file path
+        :param barman.compression.InternalCompressor|None compressor: the
+            compressor to use for the destination file, if any
+        :param decompressor: the incremental decompressor for the content
+            of a compressed stream, if any
+        :param int buffer_size: read buffer size, default 64k
+        :return str: Hexadecimal md5 string of the uncompressed content
+        """
+        md5 = hashlib.md5()
+        with open(dst, 'wb') as dst_file:
+            if compressor:
+                ostream = compressor.stream_compressor(dst_file)
+            else:
+                ostream = dst_file
+            while 1:
+                buf = src.read(buffer_size)
+                if not buf:
+                    break
+                if decompressor:
+                    md5.update(decompressor.decompress(buf))
+                else:
+                    md5.update(buf)
+                ostream.write(buf)
+            if ostream is not dst_file:
+                ostream.close()
+            dst_file.flush()
+            os.fsync(dst_file.fileno())
+        return md5.hexdigest()
+
     def put_wal(self, fileobj):
         """
         Receive a WAL file from SERVER_NAME and securely store it in the
@@ -1801,6 +1872,12 @@ class Server(RemoteStatusMixin):
             'checksum',
         ])
 
+        # If the configured compressor is able to work on a stream,
+        # files are compressed while being extracted, sparing the archiver
+        # from reading them again later
+        compressor = self.backup_manager.compression_manager \
+            .get_stream_compressor()
+
         # Stream read tar from stdin, store content in incoming directory
         # The closing wrapper is needed only for Python 2.6
         extracted_files = {}
@@ -1847,16 +1924,37 @@ class Server(RemoteStatusMixin):
                                 path = path[2:]
                             md5sums[path] = checksum
                     else:
+                        # Files compressed by the client are stored as they
+                        # are, while checksums refer to the original content
+                        file_compressor = compressor
+                        decompressor = None
+                        compression = item.pax_headers.get(
+                            'BARMAN.compression')
+                        if compression:
+                            decompressor = get_stream_decompressor(
+                                compression)
+                            if not decompressor:
+                                output.error(
+                                    "Unsupported compression '%s' "
+                                    "for file '%s' "
+                                    "in put-wal for server '%s'%s",
+                                    compression, name, self.config.name,
+                                    source_suffix)
+                                return
+                            file_compressor = None
                         # Extract using a temp name (with PID)
                         tmp_path = os.path.join(dest_dir, '.%s-%s' % (
                             os.getpid(), name))
                         path = os.path.join(dest_dir, name)
-                        tar.makefile(item, tmp_path)
+                        # Write, checksum and fsync the file in one pass
+                        checksum = self._write_incoming_file(
+                            tar.extractfile(item), tmp_path,
+                            file_compressor, decompressor)
                         # Set the original timestamp
                         tar.utime(item, tmp_path)
                         # Add the tuple to the dictionary of extracted files
                         extracted_files[name] = incoming_file(
-                            name, tmp_path, path, file_md5(tmp_path))
+                            name, tmp_path, path, checksum)
                         validated_files[name] = False
 
             # For each received checksum verify the corresponding file
@@ -1903,8 +2001,9 @@ class Server(RemoteStatusMixin):
                         "in put-wal for server '%s'%s",
                         item.name, self.config.name, source_suffix)
                     return
+                # The content has been already synced to disk on write,
+                # so syncing the directory makes the rename durable
                 os.rename(item.tmp_path, item.path)
-                fsync_file(item.path)
             fsync_dir(dest_dir)
         finally:
             # Cleanup of any remaining temp files (where applicable)
@@ -3166,6 +3265,9 @@ class Server(RemoteStatusMixin):
                     # NOTE: safe_horizon is a tz-aware timestamp because
                     # BackupInfo class ensures that property
                     reuse_mode = self.config.reuse_backup
+                    # Page deltas are synchronised as they are
+                    if reuse_mode == 'delta':
+                        reuse_mode = 'link'
                     safe_horizon = None
                     reuse_dir = None
                     if reuse_mode:
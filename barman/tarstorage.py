@@ -0,0 +1,310 @@
+# Copyright (C) 2011-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module stores the directories of a backup as compressed tar archives.
+
+Every directory becomes a gzip compressed tar archive, in the same format
+produced by pg_basebackup with the tar format. The archive is compressed
+in parallel by splitting the tar stream in blocks, which are compressed
+independently and written as consecutive gzip members, as pigz does.
+"""
+
+import collections
+import logging
+import os
+import shutil
+import tarfile
+import zlib
+from multiprocessing.dummy import Pool as ThreadPool
+
+from barman.utils import fsync_dir, mkpath
+
+_logger = logging.getLogger(__name__)
+
+#: Suffix of the archive containing a directory of the backup
+TAR_SUFFIX = '.tar.gz'
+
+#: Size of the blocks of the tar stream compressed in parallel
+COMPRESSION_BLOCK_SIZE = 4 * 1024 * 1024
+
+#: Compression level of the archives
+COMPRESSION_LEVEL = 6
+
+
+def _gzip_member(data, level=COMPRESSION_LEVEL):
+    """
+    Compress a block of data as a complete gzip member
+
+    :param bytes data: the data to compress
+    :param int level: the compression level
+    :rtype: bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+    """
+    File-like object compressing the data written to it in parallel,
+    producing a sequence of gzip members, which is a valid gzip stream.
+
+    zlib releases the GIL while compressing, so a pool of threads is
+    enough to compress the blocks concurrently.
+    """
+
+    def __init__(self, fileobj, workers=1, block_size=COMPRESSION_BLOCK_SIZE):
+        """
+        :param file fileobj: the file where the compressed data is written
+        :param int workers: number of blocks compressed in parallel
+        :param int block_size: size of the compressed blocks
+        """
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.workers = workers
+        self.pool = ThreadPool(workers)
+        self.buffer = []
+        self.buffered = 0
+        self.pending = collections.deque()
+        self.size = 0
+
+    def write(self, data):
+        """
+        Add data to the stream, compressing it once a block is complete
+
+        :param bytes data: the data to write
+        """
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.size += len(data)
+        if self.buffered >= self.block_size:
+            data = b''.join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            for offset in range(0, len(data), self.block_size):
+                self._compress(data[offset:offset + self.block_size])
+
+    def _compress(self, block):
+        """
+        Compress a block in the pool, writing the completed blocks in order
+
+        :param bytes block: the block to compress
+        """
+        self.pending.append(self.pool.apply_async(_gzip_member, (block,)))
+        # Limit the memory used by the blocks waiting to be written
+        while len(self.pending) > 2 * self.workers:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def close(self):
+        """
+        Compress the remaining data and wait for every block to be written
+        """
+        try:
+            if self.buffer or not self.size:
+                self._compress(b''.join(self.buffer))
+                self.buffer = []
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+
+def archive_directory(directory, archive_path, workers=1):
+    """
+    Store the content of a directory in a compressed tar archive
+
+    The entries of the top level of the directory which are not
+    directories, like the configuration files, are archived first,
+    so that they can be extracted without reading the whole archive.
+
+    :param str directory: the directory to archive
+    :param str archive_path: the archive to write
+    :param int workers: number of blocks compressed in parallel
+    :return list[tuple[str,os.stat_result]]: the archived files, with
+        their path relative to the directory
+    """
+    def is_directory(name):
+        path = os.path.join(directory, name)
+        return os.path.isdir(path) and not os.path.islink(path)
+
+    names = sorted(os.listdir(directory))
+    names.sort(key=is_directory)
+    files = []
+
+    def add_file(tarinfo):
+        if tarinfo.isfile():
+            files.append(tarinfo.name)
+        return tarinfo
+
+    tmp_path = archive_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as archive:
+            writer = ParallelGzipWriter(archive, workers)
+            try:
+                tar = tarfile.open(fileobj=writer, mode='w|',
+                                   format=tarfile.GNU_FORMAT)
+                try:
+                    for name in names:
+                        tar.add(os.path.join(directory, name), arcname=name,
+                                filter=add_file)
+                finally:
+                    tar.close()
+            finally:
+                writer.close()
+            archive.flush()
+            os.fsync(archive.fileno())
+        os.rename(tmp_path, archive_path)
+        fsync_dir(os.path.dirname(archive_path))
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return [(path, os.lstat(os.path.join(directory, path)))
+            for path in files]
+
+
+def store_backup(backup_dir, directories, workers=1):
+    """
+    Replace some directories of a backup with compressed tar archives.
+
+    :param str backup_dir: the backup directory
+    :param list[str] directories: the directories to archive, relative to
+        the backup directory
+    :param int workers: number of blocks compressed in parallel
+    :return list[tuple[str,os.stat_result]]: the archived files, with
+        their path relative to the backup directory
+    """
+    files = []
+    for directory in directories:
+        path = os.path.join(backup_dir, directory)
+        _logger.debug("Archiving directory %s", path)
+        files.extend(
+            (os.path.join(directory, file_path), file_stat)
+            for file_path, file_stat in archive_directory(
+                path, path + TAR_SUFFIX, workers))
+        shutil.rmtree(path)
+    return files
+
+
+def list_archives(backup_dir):
+    """
+    List the names of the directories archived in a backup
+
+    :param str backup_dir: the backup directory
+    :rtype: list[str]
+    """
+    return sorted(name[:-len(TAR_SUFFIX)]
+                  for name in os.listdir(backup_dir)
+                  if name.endswith(TAR_SUFFIX))
+
+
+def _open_archive(archive_path):
+    """
+    Open an archive for reading
+
+    :param str archive_path: the archive
+    :rtype: tarfile.TarFile
+    """
+    return tarfile.open(archive_path, mode='r:gz')
+
+
+def _extract(tar, member, dst_dir):
+    """
+    Extract a member of an archive, keeping its permissions and
+    modification time
+
+    :param tarfile.TarFile tar: the archive
+    :param tarfile.TarInfo member: the member to extract
+    :param str dst_dir: the destination directory
+    """
+    if hasattr(tarfile, 'tar_filter'):
+        # The archives are written by Barman, but refuse absolute paths
+        # and files outside the destination anyway
+        tar.extract(member, dst_dir, filter='tar')
+    else:
+        tar.extract(member, dst_dir)
+
+
+def extract_archive(archive_path, dst_dir):
+    """
+    Extract a whole archive in a directory
+
+    :param str archive_path: the archive
+    :param str dst_dir: the destination directory
+    """
+    mkpath(dst_dir)
+    directories = []
+    tar = _open_archive(archive_path)
+    try:
+        for member in tar:
+            _extract(tar, member, dst_dir)
+            if member.isdir():
+                directories.append(member)
+    finally:
+        tar.close()
+    # The modification time of directories changes while extracting
+    # their content, so restore it at the end
+    for member in reversed(directories):
+        path = os.path.join(dst_dir, member.name)
+        os.utime(path, (member.mtime, member.mtime))
+
+
+def extract_top_level_files(archive_path, names, dst_dir):
+    """
+    Extract some files of the top level of an archive, reading only the
+    beginning of the archive, where archive_directory writes them.
+
+    :param str archive_path: the archive
+    :param collections.Container[str] names: the files to extract
+    :param str dst_dir: the destination directory
+    :return list[str]: the extracted files
+    """
+    mkpath(dst_dir)
+    extracted = []
+    tar = _open_archive(archive_path)
+    try:
+        for member in tar:
+            if member.isdir() or '/' in member.name:
+                break
+            if member.name in names:
+                _extract(tar, member, dst_dir)
+                extracted.append(member.name)
+    finally:
+        tar.close()
+    return extracted
+
+
+def restore_backup(backup_dir, dst_dir, workers=1):
+    """
+    Extract in dst_dir every archive of a backup
+
+    :param str backup_dir: the backup directory
+    :param str dst_dir: the directory where archives are extracted, which
+        gets the same layout the backup directory had before archiving
+    :param int workers: number of archives extracted in parallel
+    :return list[str]: the names of the extracted directories
+    """
+    names = list_archives(backup_dir)
+    pool = ThreadPool(workers)
+    try:
+        pool.map(lambda name: extract_archive(
+            os.path.join(backup_dir, name + TAR_SUFFIX),
+            os.path.join(dst_dir, name)), names)
+    finally:
+        pool.terminate()
+        pool.join()
+    return names
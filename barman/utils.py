@@ -19,6 +19,7 @@
 This module contains utility functions used in Barman.
 """
 
+import ctypes
 import datetime
 import decimal
 import errno
@@ -366,6 +367,33 @@ def fsync_file(file_path):
     return file_stat
 
 
+def syncfs(path):
+    """
+    Execute syncfs on the filesystem containing a path, ensuring all
+    its files and directories are synced to disk
+
+    The syncfs(2) system call is only available on Linux, so it is
+    looked up in the C library at run time.
+
+    :param str path: a file or a directory on the filesystem to sync
+    :return bool: True if the filesystem has been synced, False if
+        syncfs is not available on this platform
+    :raise OSError: If something fails
+    """
+    try:
+        libc_syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+    except (AttributeError, OSError):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if libc_syncfs(fd) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+    finally:
+        os.close(fd)
+    return True
+
+
 def simplify_version(version_string):
     """
     Simplify a version number by removing the patch level
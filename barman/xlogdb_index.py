@@ -0,0 +1,220 @@
+# Copyright (C) 2011-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module maintains a sparse index of the xlog.db file of a server.
+
+The xlog.db file lists the archived WAL files in archival order, and
+grows for the whole life of the server. The index splits it in blocks of
+INDEX_BLOCK_LINES lines, recording the range of WAL names in every
+block, so that a recovery reads only the part of the file
+following the first WAL file it requires. The index also keeps the
+history files, which are always required by a recovery.
+
+The index is extended while xlog.db grows, and rebuilt from scratch
+when xlog.db is rewritten.
+"""
+
+import collections
+import logging
+import os
+import zlib
+
+from barman import xlog
+from barman.utils import fsync_dir
+
+_logger = logging.getLogger(__name__)
+
+#: Suffix of the index file, stored next to the xlog.db file
+INDEX_SUFFIX = '.index'
+
+#: Number of xlog.db lines in a block of the index
+INDEX_BLOCK_LINES = 1024
+
+#: A block of the xlog.db file. 'offset' is the position of its first
+#: line in the file. 'first' and 'last' are the lowest and the highest
+#: names of the WAL files listed in the block, ignoring history files,
+#: or None if the block only contains history files.
+IndexBlock = collections.namedtuple('IndexBlock', 'offset first last')
+
+
+class XlogdbIndex(object):
+    """
+    Sparse index of a xlog.db file.
+
+    All the methods must be called while holding the lock of the
+    xlog.db file.
+    """
+
+    def __init__(self, xlogdb_path):
+        """
+        :param str xlogdb_path: the path of the xlog.db file
+        """
+        self.path = xlogdb_path + INDEX_SUFFIX
+        self.size = 0
+        self.checksum = 0
+        self.blocks = []
+        self.history = []
+
+    def _reset(self):
+        """
+        Empty the index
+        """
+        self.size = 0
+        self.checksum = 0
+        self.blocks = []
+        self.history = []
+
+    def _load(self):
+        """
+        Read the index file, if it exists
+
+        :return bool: True if the index has been read
+        """
+        self._reset()
+        try:
+            with open(self.path) as index:
+                header = index.readline().split()
+                self.size = int(header[0])
+                self.checksum = int(header[1])
+                for line in index:
+                    kind, offset, content = line.rstrip('\n').split('\t', 2)
+                    if kind == 'B':
+                        first, last = content.split()
+                        if first == 'None':
+                            first = last = None
+                        self.blocks.append(
+                            IndexBlock(int(offset), first, last))
+                    else:
+                        self.history.append((int(offset), content + '\n'))
+            return True
+        except (IOError, OSError):
+            self._reset()
+            return False
+        except (IndexError, ValueError) as e:
+            _logger.warning("Ignoring invalid xlog.db index %s: %s",
+                            self.path, e)
+            self._reset()
+            return False
+
+    def _save(self):
+        """
+        Atomically write the index file
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as index:
+            index.write('%s\t%s\n' % (self.size, self.checksum))
+            for block in self.blocks:
+                index.write('B\t%s\t%s\t%s\n' % block)
+            for offset, line in self.history:
+                index.write('H\t%s\t%s' % (offset, line))
+            index.flush()
+            os.fsync(index.fileno())
+        os.rename(tmp_path, self.path)
+        fsync_dir(os.path.dirname(self.path))
+
+    def _last_block_checksum(self, fxlogdb, size):
+        """
+        Compute the checksum of the content of the last block of the
+        index, up to the given size of the xlog.db file.
+
+        :param file fxlogdb: the xlog.db file, open in binary mode
+        :param int size: the end of the checksummed content
+        :rtype: int
+        """
+        offset = self.blocks[-1].offset if self.blocks else 0
+        fxlogdb.seek(offset)
+        return zlib.crc32(fxlogdb.read(size - offset)) & 0xffffffff
+
+    def update(self, fxlogdb):
+        """
+        Bring the index up to date with the content of xlog.db
+
+        If xlog.db only grew since the last update, just its new lines are
+        indexed, otherwise the index is built from scratch.
+
+        :param file fxlogdb: the xlog.db file, open in binary mode
+        """
+        size = os.fstat(fxlogdb.fileno()).st_size
+        if not self._load() or size < self.size or \
+                self._last_block_checksum(fxlogdb, self.size) != \
+                self.checksum:
+            _logger.debug("Building xlog.db index %s", self.path)
+            self._reset()
+        elif size == self.size:
+            return
+        # The last block is indexed again, as it may be partial
+        offset = 0
+        if self.blocks:
+            offset = self.blocks.pop().offset
+            self.history = [entry for entry in self.history
+                            if entry[0] < offset]
+        fxlogdb.seek(offset)
+        block = None
+        count = 0
+        for line in iter(fxlogdb.readline, b''):
+            if not line.endswith(b'\n'):
+                # Never index a partially written line
+                break
+            if block is None:
+                block = IndexBlock(offset, None, None)
+            length = len(line)
+            line = line.decode('utf-8')
+            name = line.split(None, 1)[0]
+            if xlog.is_history_file(name):
+                self.history.append((offset, line))
+            elif block.first is None:
+                block = block._replace(first=name, last=name)
+            else:
+                block = block._replace(first=min(block.first, name),
+                                       last=max(block.last, name))
+            offset += length
+            count += 1
+            if count == INDEX_BLOCK_LINES:
+                self.blocks.append(block)
+                block = None
+                count = 0
+        if block is not None:
+            self.blocks.append(block)
+        self.size = offset
+        self.checksum = self._last_block_checksum(fxlogdb, offset)
+        self._save()
+
+    def history_lines(self):
+        """
+        The xlog.db lines of the history files
+
+        :rtype: list[str]
+        """
+        return [line for _, line in self.history]
+
+    def lines_from(self, fxlogdb, begin):
+        """
+        Read the lines of xlog.db starting from the first block containing
+        a WAL file which is not older than begin. The lines of the
+        previous blocks only contain older WAL files and history files.
+
+        :param file fxlogdb: the xlog.db file, open in binary mode
+        :param str begin: the name of the first required WAL file
+        :rtype: collections.Iterable[str]
+        """
+        for block in self.blocks:
+            if block.last is not None and block.last >= begin:
+                fxlogdb.seek(block.offset)
+                for line in fxlogdb:
+                    yield line.decode('utf-8')
+                return
@@ -77,6 +77,7 @@ sed -i -e "3s/^%.*/% ${release_date}/; 1s/| Version .*/| Version ${release_versi
     doc/barman-wal-restore.1.md \
     doc/barman-cloud-backup.1.md \
     doc/barman-cloud-backup-list.1.md \
+    doc/barman-cloud-backup-delete.1.md \
     doc/barman-cloud-restore.1.md \
     doc/barman-cloud-wal-archive.1.md \
     doc/barman-cloud-wal-restore.1.md
@@ -93,6 +94,7 @@ git add doc/barman.1.d/00-header.md \
     doc/barman-wal-restore.1.md \
     doc/barman-cloud-backup.1.md \
     doc/barman-cloud-backup-list.1.md \
+    doc/barman-cloud-backup-delete.1.md \
     doc/barman-cloud-restore.1.md \
     doc/barman-cloud-wal-archive.1.md \
     doc/barman-cloud-wal-restore.1.md \
@@ -104,6 +106,7 @@ git add doc/barman.1.d/00-header.md \
     doc/barman-wal-restore.1 \
     doc/barman-cloud-backup.1 \
     doc/barman-cloud-backup-list.1 \
+    doc/barman-cloud-backup-delete.1 \
     doc/barman-cloud-restore.1 \
     doc/barman-cloud-wal-archive.1 \
     doc/barman-cloud-wal-restore.1
@@ -73,6 +73,7 @@ setup(
         ('share/man/man1', ['doc/barman.1',
                             'doc/barman-cloud-backup.1',
                             'doc/barman-cloud-backup-list.1',
+                            'doc/barman-cloud-backup-delete.1',
                             'doc/barman-cloud-restore.1',
                             'doc/barman-cloud-wal-archive.1',
                             'doc/barman-cloud-wal-restore.1',
@@ -88,6 +89,8 @@ setup(
             'barman-cloud-restore=barman.clients.cloud_restore:main',
             'barman-cloud-wal-restore=barman.clients.cloud_walrestore:main',
             'barman-cloud-backup-list=barman.clients.cloud_backup_list:main',
+            'barman-cloud-backup-delete='
+            'barman.clients.cloud_backup_delete:main',
             'barman-wal-archive=barman.clients.walarchive:main',
             'barman-wal-restore=barman.clients.walrestore:main',
         ],
@@ -26,9 +26,14 @@ import pytest
 from mock import Mock, patch
 
 import barman.utils
+from barman.backup_executor import MAX_DELTA_BACKUPS
+from barman.chunkstore import CHUNK_DIRECTORY, CHUNK_SIZE, FileRecipe
 from barman.exceptions import (CompressionIncompatibility,
                                RecoveryInvalidTargetException)
-from barman.infofile import BackupInfo
+from barman.infofile import BackupInfo, FileManifest
+from barman.retention_policies import RetentionPolicyFactory
+from barman.tarstorage import TAR_SUFFIX
+from barman.utils import fsync_dir, fsync_file
 from testing_helpers import (build_backup_directories, build_backup_manager,
                              build_test_backup_info, caplog_reset)
 
@@ -236,6 +241,17 @@ class TestBackup(object):
         assert os.path.exists(wal_history_file03.strpath)
         assert os.path.exists(wal_history_file04.strpath)
 
+        # Test 1b: the backup is the base of the page deltas of another one
+        caplog_reset(caplog)
+        backup_manager.server.config.minimum_redundancy = 1
+        b_pre_info.set_attribute('delta_base', 'fake_backup_id')
+        assert not backup_manager.delete_backup(b_info)
+        assert re.search('WARNING .* Skipping delete of backup .* base of '
+                         'the page deltas of backups: fake_backup',
+                         caplog.text)
+        assert os.path.exists(pg_data.strpath)
+        b_pre_info.set_attribute('delta_base', None)
+
         # Test 2: normal delete expecting no errors (old format)
         caplog_reset(caplog)
         backup_manager.server.config.minimum_redundancy = 1
@@ -328,6 +344,81 @@ class TestBackup(object):
             assert os.path.exists(wal_history_file03.strpath)
             assert os.path.exists(wal_history_file04.strpath)
 
+    @patch('barman.backup.BackupManager.remove_wal_before_backup')
+    @patch('barman.backup.BackupManager.delete_basebackup')
+    @patch('barman.backup.BackupManager.delete_backup_data')
+    def test_delta_backups_retention(self, delete_data_mock,
+                                     delete_basebackup_mock, remove_wal_mock,
+                                     tmpdir):
+        """
+        Test successive backups storing page deltas, followed by the
+        enforcement of the retention policy
+        """
+        backup_manager = build_backup_manager()
+        server = backup_manager.server
+        server.config.barman_lock_directory = tmpdir.strpath
+        server.config.backup_options = []
+        server.config.minimum_redundancy = 1
+        server.config.retention_policy = RetentionPolicyFactory.create(
+            server, 'retention_policy', 'REDUNDANCY 2')
+        server.enforce_retention_policies = True
+        remove_wal_mock.return_value = []
+
+        # The catalog of the server
+        catalog = {}
+
+        def get_available_backups(status_filter=BackupInfo.STATUS_NOT_EMPTY):
+            return dict((backup_id, backup) for backup_id, backup
+                        in catalog.items() if backup.status in status_filter)
+        backup_manager.get_available_backups = Mock(
+            side_effect=get_available_backups)
+        server.get_available_backups = backup_manager.get_available_backups
+        backup_manager.backup_cache_remove = Mock(
+            side_effect=lambda backup: catalog.pop(backup.backup_id))
+        backup_manager.get_backup = Mock(side_effect=catalog.get)
+
+        def take_backups(*backup_ids):
+            for backup_id in backup_ids:
+                backup_info = build_test_backup_info(
+                    backup_id=backup_id, server=server, size=1000)
+                backup_info.systemid = '1'
+                backup_info.deduplicated_size = 100
+                if catalog:
+                    delta_base = backup_manager.executor._delta_base(
+                        backup_info, catalog[max(catalog)])
+                    if delta_base:
+                        backup_info.delta_base = delta_base.backup_id
+                catalog[backup_id] = backup_info
+            return dict((backup_id, backup.delta_base)
+                        for backup_id, backup in catalog.items())
+
+        # The full backup is used as base until it becomes obsolete
+        assert take_backups('b1', 'b2', 'b3', 'b4', 'b5', 'b6') == {
+            'b1': None, 'b2': 'b1', 'b3': 'b1',
+            'b4': None, 'b5': 'b4', 'b6': 'b4'}
+
+        # The retention policy removes the obsolete backups, the full one
+        # after its page deltas, but keeps the base of the valid backups
+        backup_manager.cron_retention_policy()
+        assert sorted(catalog) == ['b4', 'b5', 'b6']
+        assert [call[0][0].backup_id
+                for call in delete_data_mock.call_args_list] == [
+            'b2', 'b3', 'b1']
+
+        # A new full backup allows removing the previous one
+        assert take_backups('b7', 'b8') == {
+            'b4': None, 'b5': 'b4', 'b6': 'b4', 'b7': None, 'b8': 'b7'}
+        backup_manager.cron_retention_policy()
+        assert sorted(catalog) == ['b7', 'b8']
+
+        # Without a retention policy, the number of backups storing
+        # page deltas against the same full backup is limited
+        server.config.retention_policy = None
+        take_backups(*('c%s' % i for i in range(MAX_DELTA_BACKUPS + 1)))
+        assert [backup_id for backup_id in sorted(catalog)
+                if not catalog[backup_id].delta_base] == [
+            'b7', 'c%s' % (MAX_DELTA_BACKUPS - 1)]
+
     def test_available_backups(self, tmpdir):
         """
         Test the get_available_backups that retrieves all the
@@ -661,3 +752,163 @@ class TestBackup(object):
         assert len(latest) == 2
         assert latest['00000001'].name == '000000010000000100000001'
         assert latest['00000002'].name == '000000020000000000000003'
+
+    @pytest.mark.parametrize('has_syncfs', [True, False])
+    @patch('barman.backup.fsync_dir', wraps=fsync_dir)
+    @patch('barman.backup.fsync_file', wraps=fsync_file)
+    @patch('barman.backup.syncfs')
+    def test_backup_fsync_and_set_sizes(self, syncfs_mock, fsync_file_mock,
+                                        fsync_dir_mock, has_syncfs, tmpdir):
+        """
+        Test the backup_fsync_and_set_sizes method
+        """
+        syncfs_mock.return_value = has_syncfs
+        backup_manager = build_backup_manager(
+            global_conf={'barman_home': tmpdir.strpath})
+        backup_info = build_test_backup_info(
+            server=backup_manager.server,
+            backup_id='fake_backup_id')
+        backup_info.save()
+        data_dir = backup_info.get_data_directory()
+        os.makedirs(os.path.join(data_dir, 'base', '1'))
+        with open(os.path.join(data_dir, 'PG_VERSION'), 'w') as f:
+            f.write('12\n')
+        with open(os.path.join(data_dir, 'base', '1', '1234'), 'w') as f:
+            f.write('x' * 8192)
+
+        backup_manager.backup_fsync_and_set_sizes(backup_info)
+
+        backup_size = os.path.getsize(backup_info.filename) + 3 + 8192
+        assert backup_info.size == backup_size
+        assert backup_info.deduplicated_size == backup_size
+
+        # The manifest contains only the data files
+        manifest = FileManifest(backup_info.get_manifest_filename())
+        assert manifest.exists()
+        entries = sorted(manifest.read(), key=lambda entry: entry.path)
+        assert [(entry.path, entry.size) for entry in entries] == [
+            ('data/PG_VERSION', 3),
+            ('data/base/1/1234', 8192),
+        ]
+        assert not os.path.exists(manifest.filename + '.tmp')
+
+        # Files and directories are synced one by one only if
+        # syncfs is not available
+        syncfs_mock.assert_called_once_with(
+            backup_info.get_basebackup_directory())
+        if has_syncfs:
+            assert not fsync_file_mock.called
+            assert not fsync_dir_mock.called
+        else:
+            assert sorted(call[0][0] for call in
+                          fsync_file_mock.call_args_list) == [
+                backup_info.filename,
+                os.path.join(data_dir, 'PG_VERSION'),
+                os.path.join(data_dir, 'base', '1', '1234'),
+            ]
+            assert fsync_dir_mock.call_count == 4
+
+    def test_store_backup_chunks(self, tmpdir):
+        """
+        Test storing backups in the chunk store, their sizes and
+        the removal of their chunks
+        """
+        backup_manager = build_backup_manager(
+            global_conf={'barman_home': tmpdir.strpath,
+                         'backup_storage': 'chunks'})
+        store_dir = backup_manager.config.chunk_store_directory
+        backups = []
+        for backup_id, content in (('first', b'a'), ('second', b'b')):
+            backup_info = build_test_backup_info(
+                server=backup_manager.server, backup_id=backup_id,
+                tablespaces=None)
+            backup_info.set_attribute('backup_storage', 'chunks')
+            backup_info.save()
+            data_dir = backup_info.get_data_directory()
+            os.makedirs(os.path.join(data_dir, 'base', '1'))
+            # The first chunk is shared by the two backups
+            with open(os.path.join(data_dir, 'base', '1', '1234'),
+                      'wb') as f:
+                f.write(b'x' * CHUNK_SIZE + content)
+            backup_manager.store_backup_chunks(backup_info)
+            backup_manager.backup_fsync_and_set_sizes(backup_info)
+            backups.append(backup_info)
+
+        first, second = backups
+        assert not os.path.exists(first.get_data_directory())
+        info_size = os.path.getsize(first.filename)
+        recipe_size = os.path.getsize(os.path.join(
+            first.get_basebackup_directory(), FileRecipe.FILENAME))
+        assert first.size == CHUNK_SIZE + 1 + info_size + recipe_size
+        # The shared chunk was not yet linked by the second backup
+        assert first.deduplicated_size == \
+            CHUNK_SIZE + 1 + info_size + recipe_size
+        assert second.size == CHUNK_SIZE + 1 + info_size + recipe_size
+        assert second.deduplicated_size == 1 + info_size + recipe_size
+        # The chunks are not part of the manifest
+        manifest = FileManifest(first.get_manifest_filename())
+        assert list(manifest.read()) == []
+
+        # Unused chunks are removed from the store along with the backup
+        stored_chunks = sorted(
+            name for _, _, names in os.walk(store_dir) for name in names)
+        assert len(stored_chunks) == 3
+        backup_manager.delete_backup_data(first)
+        assert not os.path.exists(
+            os.path.join(first.get_basebackup_directory(), CHUNK_DIRECTORY))
+        assert len([name for _, _, names in os.walk(store_dir)
+                    for name in names]) == 2
+        backup_manager.delete_backup_data(second)
+        assert [name for _, _, names in os.walk(store_dir)
+                for name in names] == []
+
+    def test_store_backup_archives(self, tmpdir):
+        """
+        Test storing a backup in compressed archives, its sizes and
+        the removal of its archives
+        """
+        backup_manager = build_backup_manager(
+            global_conf={'barman_home': tmpdir.strpath,
+                         'backup_storage': 'tar'})
+        backup_info = build_test_backup_info(
+            server=backup_manager.server, backup_id='fake_backup_id')
+        backup_info.set_attribute('backup_storage', 'tar')
+        backup_info.save()
+        backup_dir = backup_info.get_basebackup_directory()
+        data_dir = backup_info.get_data_directory()
+        os.makedirs(os.path.join(data_dir, 'base', '1'))
+        with open(os.path.join(data_dir, 'base', '1', '1234'), 'wb') as f:
+            f.write(b'x' * 100000)
+        tbs_dir = backup_info.get_data_directory(16387)
+        os.makedirs(tbs_dir)
+        with open(os.path.join(tbs_dir, 'PG_VERSION'), 'wb') as f:
+            f.write(b'13\n')
+
+        backup_manager.store_backup_archives(backup_info)
+        backup_manager.backup_fsync_and_set_sizes(backup_info)
+
+        archives = ['16387' + TAR_SUFFIX, 'data' + TAR_SUFFIX]
+        assert sorted(os.listdir(backup_dir)) == sorted(
+            ['backup.info', FileManifest.FILENAME] + archives)
+        # The manifest lists the archived files
+        manifest = FileManifest(backup_info.get_manifest_filename())
+        assert sorted((entry.path, entry.size)
+                      for entry in manifest.read()) == [
+            ('16387/PG_VERSION', 3),
+            ('data/base/1/1234', 100000),
+        ]
+        other_size = os.path.getsize(backup_info.filename) + \
+            os.path.getsize(manifest.filename)
+        archives_size = sum(os.path.getsize(os.path.join(backup_dir, name))
+                            for name in archives)
+        assert backup_info.size == 100003 + other_size
+        assert backup_info.deduplicated_size == archives_size + other_size
+        assert archives_size < 100000
+        # list-files reports the archives
+        assert sorted(backup_info.get_list_of_files('data')) == sorted(
+            os.path.join(backup_dir, name) for name in
+            ['backup.info', FileManifest.FILENAME] + archives)
+
+        backup_manager.delete_backup_data(backup_info)
+        assert sorted(os.listdir(backup_dir)) == [
+            'backup.info', FileManifest.FILENAME]
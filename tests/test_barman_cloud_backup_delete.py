@@ -0,0 +1,138 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# Client Utilities for Barman, Backup and Recovery Manager for PostgreSQL
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+import mock
+import pytest
+from dateutil import tz
+
+from barman.clients import cloud_backup_delete
+from barman.clients.cloud_backup_delete import S3BackupDeleter
+from barman.infofile import BackupInfo
+
+
+def build_backup_info(backup_id, begin_wal, status=BackupInfo.DONE):
+    return mock.Mock(
+        backup_id=backup_id, begin_wal=begin_wal, status=status,
+        end_time=datetime.datetime(2020, 10, 1, tzinfo=tz.tzlocal()))
+
+
+class TestMain(object):
+    """
+    Test the main method
+    """
+    def test_invalid_retention_policy(self, caplog):
+        with pytest.raises(SystemExit) as excinfo:
+            cloud_backup_delete.main(
+                ['--retention-policy', 'invalid',
+                 's3://test-bucket/testfolder', 'test-server'])
+        assert excinfo.value.code == 1
+        assert 'Cannot parse retention policy: invalid' in caplog.text
+
+    @mock.patch('barman.clients.cloud_backup_delete.S3BackupDeleter')
+    @mock.patch('barman.clients.cloud_backup_delete.CloudInterface')
+    def test_ok(self, cloud_interface_mock, deleter_mock):
+        cloud_backup_delete.main(
+            ['--retention-policy', 'REDUNDANCY 2', '--dry-run',
+             's3://test-bucket/testfolder', 'test-server'])
+        retention_policy = deleter_mock.call_args[1]['retention_policy']
+        assert str(retention_policy) == 'REDUNDANCY 2'
+        deleter_mock.return_value.delete_obsolete.assert_called_once_with(
+            True)
+
+
+class TestBackupDeleter(object):
+    """
+    Test the S3BackupDeleter class
+    """
+    @pytest.fixture
+    def cloud_interface(self):
+        cloud_interface = mock.Mock(path='folder')
+        base = 'folder/main/base/'
+        wals = 'folder/main/wals/'
+        listing = {
+            (wals, '/'): [wals + '0000000100000000/',
+                          wals + '0000000100000001/',
+                          wals + '0000000100000002/',
+                          wals + '00000002.history'],
+            (wals + '0000000100000000/', ''): [
+                wals + '0000000100000000/0000000100000000000000FF.gz'],
+            (wals + '0000000100000001/', ''): [
+                wals + '0000000100000001/000000010000000100000001.gz',
+                wals + '0000000100000001/000000010000000100000002.gz',
+                wals + '0000000100000001/'
+                       '000000010000000100000002.00000028.backup.gz'],
+            (base + '20201001T000000/', ''): [
+                base + '20201001T000000/backup.info',
+                base + '20201001T000000/data.tar',
+                base + '20201001T000000/data_0001.tar'],
+        }
+        cloud_interface.list_bucket.side_effect = \
+            lambda prefix, delimiter='/': listing[(prefix, delimiter)]
+        return cloud_interface
+
+    def test_delete_obsolete(self, cloud_interface, capsys):
+        retention_policy = cloud_backup_delete.create_retention_policy(
+            mock.Mock(server_name='main', minimum_redundancy=0,
+                      retention_policy='REDUNDANCY 2'))
+        deleter = S3BackupDeleter(cloud_interface, 'main', retention_policy)
+        deleted = []
+        cloud_interface.delete_objects.side_effect = \
+            lambda keys: deleted.append(list(keys)) or []
+        with mock.patch.object(deleter.catalog, 'get_backup_list') as gbl:
+            gbl.return_value = {
+                '20201001T000000': build_backup_info(
+                    '20201001T000000', '0000000100000000000000FF'),
+                '20201002T000000': build_backup_info(
+                    '20201002T000000', '000000010000000100000002'),
+                '20201003T000000': build_backup_info(
+                    '20201003T000000', '000000010000000200000001'),
+            }
+            assert deleter.delete_obsolete()
+
+        base = 'folder/main/base/20201001T000000/'
+        wals = 'folder/main/wals/'
+        # The archives are deleted before the backup.info files
+        assert deleted == [
+            [base + 'data.tar', base + 'data_0001.tar'],
+            [base + 'backup.info'],
+            [wals + '0000000100000000/0000000100000000000000FF.gz',
+             wals + '0000000100000001/000000010000000100000001.gz'],
+        ]
+        out, _ = capsys.readouterr()
+        assert 'Deleting backup 20201001T000000' in out
+        assert 'Deleting 2 WAL files older than 000000010000000100000002' \
+            in out
+
+    def test_dry_run(self, cloud_interface, capsys):
+        retention_policy = cloud_backup_delete.create_retention_policy(
+            mock.Mock(server_name='main', minimum_redundancy=0,
+                      retention_policy='REDUNDANCY 1'))
+        deleter = S3BackupDeleter(cloud_interface, 'main', retention_policy)
+        with mock.patch.object(deleter.catalog, 'get_backup_list') as gbl:
+            gbl.return_value = {
+                '20201001T000000': build_backup_info(
+                    '20201001T000000', '0000000100000000000000FF'),
+                '20201002T000000': build_backup_info(
+                    '20201002T000000', '000000010000000100000002'),
+            }
+            assert deleter.delete_obsolete(dry_run=True)
+        assert not cloud_interface.delete_objects.called
+        out, _ = capsys.readouterr()
+        assert 'Would delete backup 20201001T000000' in out
+        assert 'Would delete 2 WAL files' in out
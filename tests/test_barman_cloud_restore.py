@@ -0,0 +1,86 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# Client Utilities for Barman, Backup and Recovery Manager for PostgreSQL
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import mock
+import pytest
+
+from barman.clients.cloud_restore import S3BackupDownloader
+from barman.cloud import BackupFileInfo
+
+
+class TestBackupDownloader(object):
+    """
+    Test the S3BackupDownloader class
+    """
+    @pytest.fixture
+    def downloader(self):
+        cloud_interface = mock.Mock(path='path', worker_processes_count=2)
+        downloader = S3BackupDownloader(cloud_interface, 'main')
+        downloader.catalog = mock.Mock()
+        downloader.catalog.get_backup_index.return_value = {
+            'data.tar.gz': [['.', 0, 20],
+                            ['./base', 0, 20],
+                            ['./base/1/a', 20, 60],
+                            ['./base/1/b', 20, 60],
+                            ['./global/pg_control', 80, 30]],
+            'data_0001.tar.gz': [['./base/1/c', 0, 40],
+                                 ['./base/1/d', 40, 10]],
+            '16385.tar.gz': [['./PG_13_1/16386/d', 0, 40]],
+        }
+        return downloader
+
+    @pytest.fixture
+    def copy_jobs(self):
+        data = BackupFileInfo(None, 'base/id/data', 'base/id/data.tar.gz')
+        data_0001 = BackupFileInfo(None, 'base/id/data',
+                                   'base/id/data_0001.tar.gz')
+        tablespace = BackupFileInfo(16385, 'base/id/16385',
+                                    'base/id/16385.tar.gz')
+        return [[data, '/pgdata'], [data_0001, '/pgdata'],
+                [tablespace, '/tblspc']]
+
+    def test_download_paths(self, downloader, copy_jobs):
+        downloader._download_paths(
+            mock.Mock(backup_id='id'), copy_jobs,
+            ['base/1/', 'pg_tblspc/16385/PG_13_1'])
+        extract_tar_range = downloader.cloud_interface.extract_tar_range
+        # The members of the same stream, and the contiguous streams, are
+        # downloaded with a single request
+        assert sorted(call[0] for call in
+                      extract_tar_range.call_args_list) == [
+            ('base/id/16385.tar.gz', 0, 40, '/tblspc',
+             ['./PG_13_1/16386/d']),
+            ('base/id/data.tar.gz', 20, 60, '/pgdata',
+             ['./base/1/a', './base/1/b']),
+            ('base/id/data_0001.tar.gz', 0, 50, '/pgdata',
+             ['./base/1/c', './base/1/d']),
+        ]
+
+    def test_download_paths_missing(self, downloader, copy_jobs, caplog):
+        with pytest.raises(SystemExit):
+            downloader._download_paths(
+                mock.Mock(backup_id='id'), copy_jobs,
+                ['global/pg_control', 'base/2'])
+        assert 'Paths not found in backup id: base/2' in caplog.text
+        assert not downloader.cloud_interface.extract_tar_range.called
+
+    def test_download_paths_no_index(self, downloader, copy_jobs, caplog):
+        downloader.catalog.get_backup_index.return_value = None
+        with pytest.raises(SystemExit):
+            downloader._download_paths(
+                mock.Mock(backup_id='id'), copy_jobs, ['base'])
+        assert 'Backup id has no index' in caplog.text
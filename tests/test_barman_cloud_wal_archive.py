@@ -24,7 +24,7 @@ import mock
 import pytest
 
 from barman.clients import cloud_walarchive
-from barman.clients.cloud_walarchive import S3WalUploader
+from barman.clients.cloud_walarchive import CompressedFileIO, S3WalUploader
 from barman.cloud import CloudInterface
 from barman.xlog import hash_dir
 
@@ -132,6 +132,77 @@ class TestMain(object):
             ) in caplog.record_tuples
             assert e.value.code == 1
 
+    @mock.patch('barman.clients.cloud_walarchive.S3WalUploader')
+    @mock.patch('barman.clients.cloud_walarchive.CloudInterface')
+    def test_batch(self, cloud_interface_mock, uploader_mock, tmpdir):
+        """
+        Upload other ready WAL files in batch mode
+        """
+        wal_dir = tmpdir.mkdir('pg_wal')
+        status_dir = wal_dir.mkdir('archive_status')
+        for name in ('000000080000ABFF000000C1', '000000080000ABFF000000C2',
+                     '000000080000ABFF000000C3', '000000080000ABFF000000C4'):
+            wal_dir.join(name).write('')
+            status_dir.join(name + '.ready').write('')
+        status_dir.join('000000080000ABFF000000C0.done').write('')
+        uploader = uploader_mock.return_value
+        uploader.upload_wal_batch.side_effect = \
+            lambda wal_path, additional_paths: additional_paths[:1]
+        state_dir = tmpdir.join('state')
+
+        def archive(wal_name, destination='s3://test-bucket/testfolder'):
+            cloud_walarchive.main(
+                ['--batch', '2', '--state-dir', state_dir.strpath,
+                 destination, 'test-server',
+                 wal_dir.join(wal_name).strpath])
+
+        # The state file is named after the server and the destination
+        archive('000000080000ABFF000000C1')
+        uploader.upload_wal_batch.assert_called_once_with(
+            wal_dir.join('000000080000ABFF000000C1').strpath,
+            [wal_dir.join('000000080000ABFF000000C2').strpath,
+             wal_dir.join('000000080000ABFF000000C3').strpath])
+        state_files = state_dir.listdir()
+        assert len(state_files) == 1
+        state_file = state_files[0]
+        assert state_file.basename.startswith('test-server-')
+        assert state_file.basename.endswith('.uploaded')
+        wal_stat = os.stat(wal_dir.join('000000080000ABFF000000C2').strpath)
+        assert state_file.read() == '000000080000ABFF000000C2 0 %r\n' % (
+            wal_stat.st_mtime,)
+
+        # The WAL file uploaded in advance is not skipped when archived
+        # to a different destination
+        uploader_mock.reset_mock()
+        uploader.upload_wal_batch.side_effect = \
+            lambda wal_path, additional_paths: []
+        archive('000000080000ABFF000000C2', 's3://test-bucket/other')
+        assert uploader.upload_wal_batch.call_args[0][0] == \
+            wal_dir.join('000000080000ABFF000000C2').strpath
+
+        # The WAL file uploaded in advance is skipped
+        uploader_mock.reset_mock()
+        cloud_interface_mock.reset_mock()
+        with pytest.raises(SystemExit) as excinfo:
+            archive('000000080000ABFF000000C2')
+        assert excinfo.value.code == 0
+        assert not cloud_interface_mock.called
+        assert state_file.read() == ''
+
+        # A WAL file changed after being uploaded in advance is
+        # uploaded again
+        for name in ('000000080000ABFF000000C1', '000000080000ABFF000000C2'):
+            status_dir.join(name + '.ready').remove()
+        uploader.upload_wal_batch.side_effect = \
+            lambda wal_path, additional_paths: additional_paths[:1]
+        archive('000000080000ABFF000000C3')
+        assert '000000080000ABFF000000C4 ' in state_file.read()
+        wal_dir.join('000000080000ABFF000000C4').write('changed')
+        uploader_mock.reset_mock()
+        archive('000000080000ABFF000000C4')
+        assert uploader.upload_wal_batch.call_args[0][0] == \
+            wal_dir.join('000000080000ABFF000000C4').strpath
+
 
 # noinspection PyProtectedMember
 class TestWalUploader(object):
@@ -260,6 +331,53 @@ class TestWalUploader(object):
         # Decompress on the fly to check content
         assert bz2.decompress(open_file.read()) == 'something'.encode('utf-8')
 
+    def test_upload_wal_batch(self):
+        """
+        Test the parallel upload of a batch of WAL files
+        """
+        uploader = S3WalUploader(mock.MagicMock(), 'test-server')
+
+        def upload_wal(wal_path):
+            if wal_path == '/wal_dir/000000080000ABFF000000C2':
+                raise IOError('failure')
+
+        with mock.patch.object(uploader, 'upload_wal',
+                               side_effect=upload_wal) as upload_wal_mock:
+            uploaded = uploader.upload_wal_batch(
+                '/wal_dir/000000080000ABFF000000C1',
+                ['/wal_dir/000000080000ABFF000000C2',
+                 '/wal_dir/000000080000ABFF000000C3'])
+        assert upload_wal_mock.call_count == 3
+        # Failures of the additional WAL files are not fatal
+        assert uploaded == ['/wal_dir/000000080000ABFF000000C3']
+
+    @pytest.mark.parametrize('compression, decompress', [
+        ('gzip', gzip.decompress if hasattr(gzip, 'decompress') else None),
+        ('bzip2', bz2.decompress),
+    ])
+    def test_compressed_file_io(self, compression, decompress, tmpdir):
+        """
+        Test the streaming compression of a WAL file
+        """
+        if decompress is None:
+            pytest.skip("gzip.decompress requires Python 3")
+        content = os.urandom(100000) * 3
+        source = tmpdir.join('000000080000ABFF000000C1')
+        source.write(content, mode='wb')
+        stream = CompressedFileIO(open(source.strpath, 'rb'), compression)
+        # The content is compressed while it is read
+        chunks = []
+        while True:
+            chunk = stream.read(4096)
+            if not chunk:
+                break
+            assert len(chunk) <= 4096
+            # Memory is bounded by the block size of the compressor
+            assert len(stream.buffer) < 1 << 20
+            chunks.append(chunk)
+        stream.close()
+        assert decompress(b''.join(chunks)) == content
+
     def test_retrieve_normal_file_name(self):
         """
         Test the retrieve_wal_name method with an uncompressed file
@@ -0,0 +1,137 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# Client Utilities for Barman, Backup and Recovery Manager for PostgreSQL
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import mock
+import pytest
+
+from barman.clients import cloud_walrestore
+from barman.clients.cloud_walrestore import S3WalDownloader
+
+
+class TestMain(object):
+    """
+    Test the main method
+    """
+    @mock.patch('barman.clients.cloud_walrestore.S3WalDownloader')
+    @mock.patch('barman.clients.cloud_walrestore.CloudInterface')
+    def test_ok(self, cloud_interface_mock, downloader_mock, tmpdir):
+        spool_dir = tmpdir.mkdir('spool')
+        wal_dest = tmpdir.join('wal_dest')
+        args = ['--parallel', '2', '--spool-dir', spool_dir.strpath,
+                's3://test-bucket/testfolder', 'test-server',
+                '000000080000ABFF000000C1', wal_dest.strpath]
+
+        # The WAL file is downloaded
+        cloud_walrestore.main(args)
+        downloader_mock.return_value.download_wal.assert_called_once_with(
+            '000000080000ABFF000000C1', wal_dest.strpath, 2,
+            spool_dir.strpath)
+
+        # The WAL file is delivered from the spool directory
+        downloader_mock.reset_mock()
+        spool_dir.join('000000080000ABFF000000C1').write('content')
+        with pytest.raises(SystemExit) as excinfo:
+            cloud_walrestore.main(args)
+        assert excinfo.value.code == 0
+        assert not downloader_mock.called
+        assert wal_dest.read() == 'content'
+        assert not spool_dir.join('000000080000ABFF000000C1').check()
+
+
+class TestWalDownloader(object):
+    """
+    Test the S3WalDownloader class
+    """
+    def test_download_wal_prefetch(self, tmpdir):
+        cloud_interface = mock.Mock(path='testfolder')
+        source_dir = 'testfolder/test-server/wals/000000080000ABFF/'
+        cloud_interface.list_bucket.return_value = [
+            source_dir + '000000080000ABFF000000C0.gz',
+            source_dir + '000000080000ABFF000000C1.gz',
+            source_dir + '000000080000ABFF000000C1.00000028.backup.gz',
+            source_dir + '000000080000ABFF000000C2.bz2',
+            source_dir + '000000080000ABFF000000C3',
+            source_dir + '000000080000ABFF000000C4.gz',
+        ]
+
+        def download_file(key, dest_path, decompress):
+            with open(dest_path, 'w') as dest_file:
+                dest_file.write(key)
+
+        cloud_interface.download_file.side_effect = download_file
+        spool_dir = tmpdir.join('spool')
+        wal_dest = tmpdir.join('wal_dest')
+        downloader = S3WalDownloader(cloud_interface, 'test-server')
+        downloader.download_wal('000000080000ABFF000000C1', wal_dest.strpath,
+                                2, spool_dir.strpath)
+
+        assert wal_dest.read() == source_dir + '000000080000ABFF000000C1.gz'
+        # The following WAL files are prefetched
+        assert sorted(spool_dir.listdir()) == [
+            spool_dir.join('000000080000ABFF000000C2'),
+            spool_dir.join('000000080000ABFF000000C3'),
+        ]
+        cloud_interface.download_file.assert_any_call(
+            source_dir + '000000080000ABFF000000C2.bz2',
+            spool_dir.join('000000080000ABFF000000C2.tmp').strpath,
+            'bzip2')
+        assert cloud_interface.list_bucket.call_count == 1
+
+    def test_download_wal_prefetch_next_dir(self, tmpdir):
+        cloud_interface = mock.Mock(path='testfolder')
+        wals_dir = 'testfolder/test-server/wals/'
+        listing = {
+            wals_dir: [wals_dir + '000000080000ABFF/',
+                       wals_dir + '00000009.history',
+                       wals_dir + '0000000900000000/',
+                       wals_dir + '000000090000ABFF/'],
+            wals_dir + '000000080000ABFF/': [
+                wals_dir + '000000080000ABFF/000000080000ABFF000000FE',
+                wals_dir + '000000080000ABFF/000000080000ABFF000000FF'],
+            wals_dir + '0000000900000000/': [
+                wals_dir + '0000000900000000/000000090000000000000001',
+                wals_dir + '0000000900000000/000000090000000000000002'],
+        }
+        cloud_interface.list_bucket.side_effect = \
+            lambda prefix: iter(listing[prefix])
+
+        def download_file(key, dest_path, decompress):
+            with open(dest_path, 'w') as dest_file:
+                dest_file.write(key)
+
+        cloud_interface.download_file.side_effect = download_file
+        spool_dir = tmpdir.join('spool')
+        downloader = S3WalDownloader(cloud_interface, 'test-server')
+        downloader.download_wal('000000080000ABFF000000FE',
+                                tmpdir.join('wal_dest').strpath,
+                                2, spool_dir.strpath)
+
+        # The prefetch continues in the following hash directory,
+        # which is on a new timeline
+        assert sorted(spool_dir.listdir()) == [
+            spool_dir.join('000000080000ABFF000000FF'),
+            spool_dir.join('000000090000000000000001'),
+        ]
+
+    def test_prefetch_failure(self, tmpdir):
+        cloud_interface = mock.Mock()
+        cloud_interface.download_file.side_effect = IOError('failure')
+        downloader = S3WalDownloader(cloud_interface, 'test-server')
+        spool_file = tmpdir.join('000000080000ABFF000000C2')
+        # Prefetch failures are not fatal
+        downloader._prefetch('key', spool_file.strpath, None)
+        assert not tmpdir.listdir()
@@ -15,6 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
+import bz2
+import errno
+import gzip
 import hashlib
 import random
 import re
@@ -89,6 +92,74 @@ class TestMain(object):
             '%s *000000080000ABFF000000C1\n' % source_hash
         assert tar.next() is None
 
+    @pytest.mark.parametrize('option, compression, decompress', [
+        ['-z', 'gzip', lambda data: gzip.GzipFile(
+            fileobj=BytesIO(data)).read()],
+        ['-j', 'bzip2', bz2.decompress],
+    ])
+    @mock.patch('barman.clients.walarchive.subprocess.Popen')
+    def test_ok_compression(self, popen_mock, option, compression,
+                            decompress, tmpdir):
+        # Prepare some content
+        source = tmpdir.join('wal_dir/000000080000ABFF000000C1')
+        source.write('something', ensure=True)
+        source_hash = source.computehash()
+
+        # Prepare the fake Pipe
+        input_mock, output_mock = pipe_helper()
+        popen_mock.return_value.stdin = input_mock
+        popen_mock.return_value.stderr = BytesIO()
+        popen_mock.return_value.returncode = 0
+
+        # The compression header requires the PAX format, which is not
+        # the default one before Python 3.8
+        with mock.patch.object(walarchive.ChecksumTarFile, 'format',
+                               tarfile.GNU_FORMAT):
+            walarchive.main([option, 'a.host', 'a-server', source.strpath])
+
+        # Verify the tar content: the file is compressed, while the
+        # checksum refers to the uncompressed content
+        tar = tarfile.open(mode='r|', fileobj=output_mock)
+        first = tar.next()
+        with closing(tar.extractfile(first)) as fp:
+            first_content = decompress(fp.read()).decode()
+        assert first.name == '000000080000ABFF000000C1'
+        assert first.pax_headers['BARMAN.compression'] == compression
+        assert first_content == 'something'
+        second = tar.next()
+        with closing(tar.extractfile(second)) as fp:
+            second_content = fp.read().decode()
+        assert second.name == 'MD5SUMS'
+        assert second_content == \
+            '%s *000000080000ABFF000000C1\n' % source_hash
+        assert tar.next() is None
+
+    @mock.patch('barman.clients.walarchive.subprocess.Popen')
+    def test_error_compression_unsupported(self, popen_mock, tmpdir,
+                                           capsys):
+        source = tmpdir.join('wal_dir/000000080000ABFF000000C1')
+        source.write('something', ensure=True)
+
+        # An old server rejects the option, and exits without reading
+        # the WAL file
+        input_mock = mock.Mock()
+        input_mock.__enter__ = mock.Mock(return_value=input_mock)
+        input_mock.__exit__ = mock.Mock(return_value=False)
+        input_mock.write.side_effect = IOError(errno.EPIPE, 'Broken pipe')
+        popen_mock.return_value.stdin = input_mock
+        popen_mock.return_value.stderr = BytesIO(
+            b'barman: error: unrecognized arguments: --compressed\n')
+        popen_mock.return_value.returncode = 2
+
+        with pytest.raises(SystemExit) as exc:
+            walarchive.main(['-z', 'a.host', 'a-server', source.strpath])
+
+        assert exc.value.code == 2
+        assert popen_mock.call_args[0][0][-1] == '--compressed'
+        out, err = capsys.readouterr()
+        assert 'unrecognized arguments: --compressed' in err
+        assert "doesn't support WAL files compressed" in err
+
     @mock.patch('barman.clients.walarchive.RemotePutWal')
     def test_error_dir(self, rpw_mock, tmpdir, capsys):
 
@@ -193,6 +264,7 @@ class TestRemotePutWal(object):
             barman_host='remote.barman.host',
             config=None,
             server_name='this-server',
+            compression=None,
             test=False)
         source_file = tmpdir.join('test-source/000000010000000000000001')
         source_file.write("test-content", ensure=True)
@@ -234,6 +306,7 @@ class TestRemotePutWal(object):
             barman_host='remote.barman.host',
             config=None,
             server_name='this-server',
+            compression=None,
             test=False)
         source_file = tmpdir.join('test-source/000000010000000000000001')
         source_file.write("test-content", ensure=True)
@@ -0,0 +1,173 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import stat
+
+from barman.chunkstore import (CHUNK_DIRECTORY, CHUNK_SIZE, ChunkStore,
+                               FileRecipe, restore_backup, store_backup)
+
+
+def write_file(path, content, mode=0o600, mtime=1500000000):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.chmod(path, mode)
+    os.utime(path, (mtime, mtime))
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def list_chunks(directory):
+    return sorted(name for _, _, names in os.walk(directory)
+                  for name in names)
+
+
+class TestChunkStore(object):
+
+    def test_store(self, tmpdir):
+        store = ChunkStore(tmpdir.join('store').strpath)
+        store.init()
+        chunk_dirs = []
+        for name in ('backup1', 'backup2'):
+            chunk_dir = tmpdir.join(name).strpath
+            for prefix in range(256):
+                os.makedirs(os.path.join(chunk_dir, '%02x' % prefix))
+            chunk_dirs.append(chunk_dir)
+
+        digest = store.store(b'data', chunk_dirs[0])
+        assert digest == hashlib.sha256(b'data').hexdigest()
+        assert read_file(store.chunk_path(digest)) == b'data'
+        assert os.stat(store.chunk_path(digest)).st_nlink == 2
+        # Storing a chunk twice in the same backup does not add links
+        assert store.store(b'data', chunk_dirs[0]) == digest
+        assert os.stat(store.chunk_path(digest)).st_nlink == 2
+        # Another backup links the same chunk
+        assert store.store(b'data', chunk_dirs[1]) == digest
+        assert os.stat(store.chunk_path(digest)).st_nlink == 3
+        assert list_chunks(store.path) == [digest]
+
+        # The chunk is kept in the store until no backup uses it
+        other = store.store(b'other', chunk_dirs[1])
+        assert store.remove_backup(chunk_dirs[0]) == (0, 0)
+        assert not os.path.exists(chunk_dirs[0])
+        assert list_chunks(store.path) == sorted([digest, other])
+        assert store.remove_backup(chunk_dirs[1]) == (2, 9)
+        assert list_chunks(store.path) == []
+
+    def test_collect_garbage(self, tmpdir):
+        store = ChunkStore(tmpdir.join('store').strpath)
+        store.init()
+        digest = hashlib.sha256(b'data').hexdigest()
+        write_file(store.chunk_path(digest), b'data')
+        # Missing chunks are ignored
+        assert store.collect_garbage(['0' * 64, digest]) == (1, 4)
+        assert not os.path.exists(store.chunk_path(digest))
+
+
+class TestFileRecipe(object):
+
+    def test_write_and_read(self, tmpdir):
+        recipe = FileRecipe(tmpdir.join(FileRecipe.FILENAME).strpath)
+        assert not recipe.exists()
+        file_path = tmpdir.join('file').strpath
+        write_file(file_path, b'content', mode=0o640)
+        with recipe.writer() as add:
+            add('data', os.lstat(tmpdir.strpath), '')
+            add('data/file', os.lstat(file_path), 'abc,def')
+        assert recipe.exists()
+        assert not os.path.exists(recipe.filename + '.tmp')
+        entries = list(recipe.read())
+        assert entries[1] == (stat.S_IFREG | 0o640, 7, 1500000000,
+                              'abc,def', 'data/file')
+        assert stat.S_ISDIR(entries[0][0])
+        assert entries[0][3:] == ('', 'data')
+
+    def test_write_error(self, tmpdir):
+        recipe = FileRecipe(tmpdir.join(FileRecipe.FILENAME).strpath)
+        try:
+            with recipe.writer():
+                raise IOError('error')
+        except IOError:
+            pass
+        assert not recipe.exists()
+        assert not os.path.exists(recipe.filename + '.tmp')
+
+
+class TestStoreBackup(object):
+
+    def test_store_and_restore(self, tmpdir):
+        backup_dir = tmpdir.join('backup').strpath
+        dst_dir = tmpdir.join('restore').strpath
+        store = ChunkStore(tmpdir.join('store').strpath)
+        large = b'a' * CHUNK_SIZE + b'b' * CHUNK_SIZE + b'a' * 10
+        write_file(os.path.join(backup_dir, 'data', 'base', '1', '1234'),
+                   large)
+        write_file(os.path.join(backup_dir, 'data', 'PG_VERSION'), b'13\n',
+                   mode=0o644)
+        write_file(os.path.join(backup_dir, 'data', 'empty'), b'')
+        os.makedirs(os.path.join(backup_dir, 'data', 'pg_wal'))
+        os.symlink('PG_VERSION', os.path.join(backup_dir, 'data', 'link'))
+        write_file(os.path.join(backup_dir, '16385', 'PG_13', '1', '5678'),
+                   b'a' * CHUNK_SIZE)
+        write_file(os.path.join(backup_dir, 'backup.info'), b'info')
+
+        assert store_backup(backup_dir, ['data', '16385'], store,
+                            workers=2) == 4
+        assert sorted(os.listdir(backup_dir)) == [
+            'backup.info', CHUNK_DIRECTORY, FileRecipe.FILENAME]
+        # Identical chunks are stored once
+        assert len(list_chunks(store.path)) == 4
+        assert list_chunks(store.path) == list_chunks(
+            os.path.join(backup_dir, CHUNK_DIRECTORY))
+
+        os.makedirs(dst_dir)
+        assert restore_backup(backup_dir, dst_dir, workers=2) == 4
+        relation = os.path.join(dst_dir, 'data', 'base', '1', '1234')
+        assert read_file(relation) == large
+        assert os.stat(relation).st_mtime == 1500000000
+        assert stat.S_IMODE(os.stat(relation).st_mode) == 0o600
+        version = os.path.join(dst_dir, 'data', 'PG_VERSION')
+        assert stat.S_IMODE(os.stat(version).st_mode) == 0o644
+        assert read_file(os.path.join(dst_dir, 'data', 'empty')) == b''
+        assert os.path.isdir(os.path.join(dst_dir, 'data', 'pg_wal'))
+        assert os.readlink(
+            os.path.join(dst_dir, 'data', 'link')) == 'PG_VERSION'
+        assert read_file(os.path.join(
+            dst_dir, '16385', 'PG_13', '1', '5678')) == b'a' * CHUNK_SIZE
+
+    def test_restore_paths(self, tmpdir):
+        backup_dir = tmpdir.join('backup').strpath
+        dst_dir = tmpdir.join('restore').strpath
+        store = ChunkStore(tmpdir.join('store').strpath)
+        write_file(os.path.join(backup_dir, 'data', 'postgresql.conf'),
+                   b'port = 5432\n')
+        write_file(os.path.join(backup_dir, 'data', 'PG_VERSION'), b'13\n')
+        store_backup(backup_dir, ['data'], store)
+
+        assert restore_backup(
+            backup_dir, dst_dir,
+            paths=['data/postgresql.conf', 'data/pg_hba.conf']) == 1
+        assert os.listdir(os.path.join(dst_dir, 'data')) == [
+            'postgresql.conf']
+        assert read_file(os.path.join(dst_dir, 'data', 'postgresql.conf')) \
+            == b'port = 5432\n'
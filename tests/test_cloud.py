@@ -15,16 +15,24 @@
 # You should have received a copy of the GNU General Public License
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
+import bz2
 import datetime
+import gzip
+import os
+import tarfile
 from io import BytesIO
+from multiprocessing.dummy import Pool as ThreadPool
 
 import mock
 import pytest
 from boto3.exceptions import Boto3Error
 from botocore.exceptions import ClientError, EndpointConnectionError
 
-from barman.cloud import (CloudInterface, CloudUploadingError,
-                          FileUploadStatistics)
+from barman.cloud import (MIN_CHUNK_SIZE, CloudInterface, CloudUploadingError,
+                          DecompressIO, FileUploadStatistics, RangedDownloadIO,
+                          RestoreJournal, S3BackupCatalog, S3TarUploader,
+                          S3UploadController, SharedMemoryBuffer,
+                          shared_memory)
 
 try:
     from queue import Queue
@@ -32,6 +40,16 @@ except ImportError:
     from Queue import Queue
 
 
+def gzip_compress(data):
+    """
+    Compress some data in a gzip stream, like gzip.compress in Python 3
+    """
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
 class TestCloudInterface(object):
     @mock.patch('barman.cloud.boto3')
     def test_uploader_minimal(self, boto_mock):
@@ -361,6 +379,185 @@ class TestCloudInterface(object):
             "part_number": 1,
         }
 
+    @pytest.mark.skipif(shared_memory is None,
+                        reason="shared memory requires Python 3.8")
+    @mock.patch('barman.cloud.CloudInterface.upload_part')
+    @mock.patch('barman.cloud.CloudInterface._handle_async_errors')
+    @mock.patch('barman.cloud.CloudInterface._ensure_async')
+    def test_shared_memory_part(self,
+                                ensure_async_mock,
+                                handle_async_errors_mock,
+                                upload_part_mock):
+        interface = CloudInterface(
+            url='s3://bucket/path/to/dir',
+            encryption=None,
+            max_buffer_memory=1024)
+        interface.queue = Queue()
+        interface.result_queue = Queue()
+
+        # Parts larger than the maximum buffer memory are not buffered
+        # in shared memory
+        assert interface.create_part_buffer(2048) is None
+
+        buf = interface.create_part_buffer(1024)
+        assert isinstance(buf, SharedMemoryBuffer)
+        buf.write(b'test')
+        interface.async_upload_part('mpu', 'test/key', buf, 1)
+        buf.close()
+        task = interface.queue.get()
+        assert task == {
+            "job_type": "upload_part",
+            "mpu": "mpu",
+            "key": "test/key",
+            "body_buffer": buf.name,
+            "body_size": 4,
+            "part_number": 1,
+        }
+        assert interface.buffer_memory == 1024
+
+        # The worker uploads the content of the buffer and removes it
+        bodies = []
+
+        def upload_part(mpu, key, body, part_number):
+            bodies.append(body.read())
+            return {'PartNumber': part_number, 'ETag': 'etag'}
+
+        upload_part_mock.side_effect = upload_part
+        interface.worker_process_execute_job(task, 0)
+        assert bodies == [b'test']
+        with pytest.raises(OSError):
+            shared_memory.SharedMemory(name=buf.name)
+
+        # A new buffer waits for the memory of the uploaded parts
+        buf = interface.create_part_buffer(512)
+        assert interface.buffer_memory == 512
+        assert interface.buffer_sizes == {}
+        assert interface.parts_db['test/key'] == [
+            {'PartNumber': 1, 'ETag': 'etag'}]
+        buf.discard()
+
+    @pytest.mark.skipif(shared_memory is None,
+                        reason="shared memory requires Python 3.8")
+    def test_tar_uploader_parts(self):
+        cloud_interface = mock.Mock()
+        cloud_interface.create_part_buffer.side_effect = SharedMemoryBuffer
+        parts = []
+
+        def async_upload_part(mpu, key, body, part_number):
+            parts.append(body.shm.buf[:body.tell()].tobytes())
+            body.discard()
+
+        cloud_interface.async_upload_part.side_effect = async_upload_part
+        uploader = S3TarUploader(cloud_interface, 'test/key')
+        uploader.tar = None
+        uploader.write(b'a' * (MIN_CHUNK_SIZE - 1))
+        uploader.write(b'bb')
+        uploader.write(b'c' * MIN_CHUNK_SIZE)
+        uploader.close()
+        # Every part but the last has exactly the size of a chunk
+        assert parts == [b'a' * (MIN_CHUNK_SIZE - 1) + b'b',
+                         b'b' + b'c' * (MIN_CHUNK_SIZE - 1),
+                         b'c']
+        assert uploader.size == 2 * MIN_CHUNK_SIZE + 1
+
+    @pytest.mark.parametrize('compression', [None, 'gz', 'bz2'])
+    @mock.patch('barman.cloud.MAX_PACKED_MEMBERS_SIZE', 1000)
+    @mock.patch('barman.cloud.boto3')
+    def test_tar_uploader_index(self, boto_mock, compression, tmpdir):
+        cloud_interface = mock.Mock()
+        cloud_interface.create_part_buffer.return_value = None
+        parts = []
+
+        def async_upload_part(mpu, key, body, part_number):
+            with open(body.name, 'rb') as part:
+                parts.append(part.read())
+            os.unlink(body.name)
+
+        cloud_interface.async_upload_part.side_effect = async_upload_part
+        key = 'path/data.tar' + ('.' + compression if compression else '')
+        uploader = S3TarUploader(cloud_interface, key, compression,
+                                 indexed=True)
+        src = tmpdir.mkdir('src')
+        uploader.tar.add(src.strpath, arcname='base', recursive=False)
+        for name, size in (('a', 1000), ('b', 10), ('c', 10)):
+            src.join(name).write(name * size)
+            uploader.tar.add(src.join(name).strpath, arcname='base/' + name)
+        uploader.close()
+        archive = b''.join(parts)
+
+        # Every member is recorded with the position of its stream in the
+        # archive: the large one has its own stream, while the small ones
+        # are packed together when compressed
+        assert [entry[0] for entry in uploader.index] == \
+            ['base', 'base/a', 'base/b', 'base/c']
+        streams = sorted(set((offset, length)
+                             for name, offset, length in uploader.index))
+        assert len(streams) == 4 if compression is None else 3
+        offset = 0
+        for stream_offset, length in streams:
+            assert stream_offset == offset
+            offset += length
+        assert offset <= len(archive)
+
+        cloud_interface = CloudInterface('s3://bucket/path', encryption=None)
+        s3_client = boto_mock.Session.return_value.resource.return_value.\
+            meta.client
+
+        def get_object(Bucket, Key, Range=None):
+            if Range is None:
+                return {'Body': BytesIO(archive)}
+            start, end = Range[6:].split('-')
+            return {'Body': BytesIO(archive[int(start):int(end) + 1])}
+
+        s3_client.get_object.side_effect = get_object
+
+        # The archive can be extracted completely...
+        dst = tmpdir.join('dst')
+        cloud_interface.extract_tar(key, dst.strpath)
+        assert dst.join('base', 'a').read() == 'a' * 1000
+        assert dst.join('base', 'c').read() == 'c' * 10
+
+        # ... or a member at a time, downloading only its range
+        s3_client.get_object.reset_mock()
+        name, offset, length = uploader.index[3]
+        dst = tmpdir.join('single')
+        cloud_interface.extract_tar_range(key, offset, length, dst.strpath,
+                                          [name])
+        s3_client.get_object.assert_called_once_with(
+            Bucket='bucket', Key=key,
+            Range='bytes=%s-%s' % (offset, offset + length - 1))
+        assert dst.join('base', 'c').read() == 'c' * 10
+        assert not dst.join('base', 'a').check()
+        assert not dst.join('base', 'b').check()
+
+    @pytest.mark.parametrize('compression', [None, 'gz', 'bz2'])
+    @mock.patch('barman.cloud.MAX_PACKED_MEMBERS_SIZE', 1000)
+    def test_tar_uploader_single_stream(self, compression, tmpdir):
+        cloud_interface = mock.Mock()
+        cloud_interface.create_part_buffer.return_value = None
+        parts = []
+
+        def async_upload_part(mpu, key, body, part_number):
+            with open(body.name, 'rb') as part:
+                parts.append(part.read())
+            os.unlink(body.name)
+
+        cloud_interface.async_upload_part.side_effect = async_upload_part
+        key = 'path/data.tar' + ('.' + compression if compression else '')
+        uploader = S3TarUploader(cloud_interface, key, compression)
+        src = tmpdir.mkdir('src')
+        for name, size in (('a', 1000), ('b', 10)):
+            src.join(name).write(name * size)
+            uploader.tar.add(src.join(name).strpath, arcname=name)
+        uploader.close()
+
+        # Without the index, the archive is a single compressed stream,
+        # which can be read by the tarfile streams of the older clients
+        assert uploader.index == []
+        tar = tarfile.open(fileobj=BytesIO(b''.join(parts)), mode='r|*')
+        assert [(member.name, tar.extractfile(member).read())
+                for member in tar] == [('a', b'a' * 1000), ('b', b'b' * 10)]
+
     @mock.patch('barman.cloud.CloudInterface._retrieve_results')
     @mock.patch('barman.cloud.CloudInterface._handle_async_errors')
     @mock.patch('barman.cloud.CloudInterface._ensure_async')
@@ -476,3 +673,315 @@ class TestCloudInterface(object):
         bucket_mock.assert_called_once_with(cloud_interface.bucket_name)
         # Expect the create() metod of the bucket object to be called
         bucket_mock.return_value.create.assert_called_once()
+
+    @mock.patch('barman.cloud.boto3')
+    def test_extract_tar(self, boto_mock, tmpdir):
+        # Build an archive whose member has no parent directory entry
+        src = tmpdir.mkdir('src')
+        src.join('file').write('content')
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w|gz') as tf:
+            tf.add(src.join('file').strpath, arcname='base/1/file')
+        archive.seek(0)
+
+        cloud_interface = CloudInterface('s3://bucket/path', encryption=None)
+        s3_client = boto_mock.Session.return_value.resource.return_value.\
+            meta.client
+        s3_client.head_object.return_value = {
+            'ContentLength': len(archive.getvalue())}
+        s3_client.get_object.return_value = {'Body': archive}
+        dst = tmpdir.join('dst')
+        cloud_interface.extract_tar('path/data.tar.gz', dst.strpath,
+                                    download_pool=mock.Mock())
+        assert dst.join('base', '1', 'file').read() == 'content'
+        # Small archives are downloaded with a single request
+        s3_client.head_object.assert_called_once_with(
+            Bucket='bucket', Key='path/data.tar.gz')
+        s3_client.get_object.assert_called_once_with(
+            Bucket='bucket', Key='path/data.tar.gz')
+
+    @mock.patch('barman.cloud.boto3')
+    def test_extract_tar_journal(self, boto_mock, tmpdir):
+        src = tmpdir.mkdir('src')
+        src.join('a').write('aaa')
+        src.join('b').write('bbb')
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w|') as tf:
+            tf.add(src.join('a').strpath, arcname='a')
+            tf.add(src.join('b').strpath, arcname='b')
+
+        cloud_interface = CloudInterface('s3://bucket/path', encryption=None)
+        s3_client = boto_mock.Session.return_value.resource.return_value.\
+            meta.client
+        s3_client.get_object.side_effect = \
+            lambda Bucket, Key: {'Body': BytesIO(archive.getvalue())}
+
+        # An interrupted restore extracted the first file, and it was
+        # recorded in the journal, while the second one is incomplete
+        dst = tmpdir.mkdir('dst')
+        dst.join('a').write('xxx')
+        os.utime(dst.join('a').strpath, (0, src.join('a').mtime()))
+        dst.join('b').write('b')
+        journal_path = tmpdir.join('journal').strpath
+        journal = RestoreJournal(journal_path)
+        journal.open()
+        with tarfile.open(fileobj=BytesIO(archive.getvalue())) as tf:
+            journal.record_file('path/data.tar', tf.getmember('a'))
+        journal.close()
+
+        journal = RestoreJournal(journal_path)
+        journal.load()
+        journal.open()
+        cloud_interface.extract_tar('path/data.tar', dst.strpath,
+                                    journal=journal)
+        journal.close()
+        assert dst.join('a').read() == 'xxx'
+        assert dst.join('b').read() == 'bbb'
+
+        # The archive is now skipped
+        journal = RestoreJournal(journal_path)
+        journal.load()
+        assert journal.is_archive_extracted('path/data.tar')
+        s3_client.get_object.reset_mock()
+        cloud_interface.extract_tar('path/data.tar', dst.strpath,
+                                    journal=journal)
+        assert not s3_client.get_object.called
+
+    @mock.patch('barman.cloud.boto3')
+    def test_remote_read(self, boto_mock):
+        cloud_interface = CloudInterface('s3://bucket/path', encryption=None)
+        s3_client = boto_mock.Session.return_value.resource.return_value.\
+            meta.client
+        s3_client.get_object.return_value = {
+            'ETag': 'etag', 'Body': BytesIO(b'content')}
+        assert cloud_interface.remote_read('path/key') == \
+            ('etag', b'content')
+        s3_client.get_object.assert_called_once_with(
+            Bucket='bucket', Key='path/key')
+
+        # An unchanged object is not downloaded again
+        s3_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': '304'}}, 'GetObject')
+        assert cloud_interface.remote_read('path/key', 'etag') == \
+            ('etag', None)
+        s3_client.get_object.assert_called_with(
+            Bucket='bucket', Key='path/key', IfNoneMatch='etag')
+
+        s3_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        assert cloud_interface.remote_read('path/key') is None
+
+    @mock.patch('barman.cloud.boto3')
+    def test_list_bucket(self, boto_mock):
+        cloud_interface = CloudInterface('s3://bucket/path', encryption=None)
+        s3_client = boto_mock.Session.return_value.resource.return_value.\
+            meta.client
+        paginator = s3_client.get_paginator.return_value
+        paginator.paginate.return_value = [
+            {'CommonPrefixes': [{'Prefix': 'path/a/'}],
+             'Contents': [{'Key': 'path/b'}]},
+            {'Contents': [{'Key': 'path/c'}]},
+        ]
+        assert list(cloud_interface.list_bucket('/path/')) == [
+            'path/a/', 'path/b', 'path/c']
+        s3_client.get_paginator.assert_called_once_with('list_objects_v2')
+        paginator.paginate.assert_called_once_with(
+            Bucket='bucket', Prefix='path/', Delimiter='/')
+
+    @mock.patch('barman.cloud.boto3')
+    def test_delete_objects(self, boto_mock):
+        cloud_interface = CloudInterface('s3://bucket/path', encryption=None)
+        s3_client = boto_mock.Session.return_value.resource.return_value.\
+            meta.client
+        s3_client.delete_objects.side_effect = lambda Bucket, Delete: {
+            'Errors': [{'Key': obj['Key'], 'Message': 'Access Denied'}
+                       for obj in Delete['Objects']
+                       if obj['Key'] == 'key1500']}
+        keys = ('key%s' % i for i in range(2500))
+        assert cloud_interface.delete_objects(keys) == ['key1500']
+        # The keys are deleted in batches of 1000
+        batches = sorted(len(call[1]['Delete']['Objects']) for call in
+                         s3_client.delete_objects.call_args_list)
+        assert batches == [500, 1000, 1000]
+
+
+class TestS3UploadController(object):
+
+    @mock.patch('barman.cloud.S3UploadController._get_tar')
+    def test_split_directory(self, get_tar_mock, tmpdir):
+        pgdata = tmpdir.mkdir('pgdata')
+        base = pgdata.mkdir('base')
+        for name, size in (('a', 10), ('b', 7), ('c', 5), ('d', 4)):
+            base.join(name).write('x' * size)
+        pgdata.mkdir('pg_wal').join('000000010000000000000001').write('x')
+        controller = S3UploadController(mock.Mock(), 'prefix', 1 << 30, None)
+
+        jobs = controller.split_directory(
+            'pgdata', pgdata.strpath, 'data', 2, exclude=['/pg_wal/*'])
+
+        # The directories are added to the main archive
+        assert sorted(call[1]['arcname'] for call in
+                      get_tar_mock.return_value.add.call_args_list) == \
+            ['.', 'base', 'pg_wal']
+        # The files are split in groups of similar size
+        assert jobs == [
+            ('files', dict(label='pgdata', src=pgdata.strpath,
+                           dst='data_stream01', paths=['base/a', 'base/d'])),
+            ('files', dict(label='pgdata', src=pgdata.strpath,
+                           dst='data_stream02', paths=['base/b', 'base/c'])),
+        ]
+
+        # Every group is uploaded in its own archive
+        get_tar_mock.reset_mock()
+        controller.upload_files(**jobs[0][1])
+        get_tar_mock.assert_called_with('data_stream01')
+        get_tar_mock.return_value.add.assert_has_calls([
+            mock.call(pgdata.join('base', 'a').strpath, arcname='base/a',
+                      recursive=False),
+            mock.call(pgdata.join('base', 'd').strpath, arcname='base/d',
+                      recursive=False),
+        ])
+
+    @mock.patch('barman.cloud.S3UploadController')
+    @mock.patch('barman.cloud.CloudInterface')
+    @mock.patch('barman.cloud.multiprocessing.Process')
+    def test_upload_jobs_buffer_memory(self, process_mock, interface_mock,
+                                       controller_mock):
+        # Run the upload processes synchronously
+        process_mock.side_effect = lambda target, args: mock.Mock(
+            start=lambda: target(*args), is_alive=lambda: False)
+        controller_mock.return_value.upload_stats = {}
+        controller_mock.return_value.index = {}
+        cloud_interface = mock.Mock(worker_processes_count=4,
+                                    max_buffer_memory=300)
+        controller = S3UploadController(cloud_interface, 'prefix',
+                                        1 << 30, None)
+        controller.upload_jobs([('directory', {}), ('files', {})], 2)
+        # The buffer memory is split among the upload processes and the
+        # main one, which gets its whole limit back at the end
+        assert [call[1]['max_buffer_memory'] for call in
+                interface_mock.call_args_list] == [100, 100]
+        assert cloud_interface.max_buffer_memory == 300
+
+    def test_split_directory_few_files(self, tmpdir):
+        pgdata = tmpdir.mkdir('pgdata')
+        pgdata.join('PG_VERSION').write('12')
+        controller = S3UploadController(mock.Mock(), 'prefix', 1 << 30, None)
+        with mock.patch.object(controller, '_get_tar'):
+            jobs = controller.split_directory(
+                'pgdata', pgdata.strpath, 'data', 4)
+        # Empty groups produce no archive
+        assert jobs == [('files', dict(label='pgdata', src=pgdata.strpath,
+                                       dst='data_stream01',
+                                       paths=['./PG_VERSION']))]
+
+
+class TestDecompressIO(object):
+
+    @pytest.mark.parametrize('compress', [
+        gzip_compress, bz2.compress])
+    def test_read_concatenated_streams(self, compress):
+        first = compress(b'a' * 100)
+        second = compress(b'b' * 100)
+        # The source ends every read at the end of a stream
+        source = mock.Mock()
+        source.read.side_effect = [first, second, b'']
+        compression = 'bz2' if compress is bz2.compress else 'gz'
+        stream = DecompressIO(source, compression)
+        content = b''
+        while True:
+            data = stream.read(30)
+            if not data:
+                break
+            content += data
+        assert content == b'a' * 100 + b'b' * 100
+
+        # The streams can also share the same read
+        stream = DecompressIO(BytesIO(first + second), compression)
+        assert stream.read() + stream.read() == b'a' * 100 + b'b' * 100
+
+
+class TestRangedDownloadIO(object):
+
+    def test_read(self):
+        content = bytes(bytearray(range(256))) * 10
+        client = mock.Mock()
+
+        def get_object(Bucket, Key, Range):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': BytesIO(content[int(start):int(end) + 1])}
+
+        client.get_object.side_effect = get_object
+        pool = ThreadPool(3)
+        try:
+            reader = RangedDownloadIO(client, 'bucket', 'key', len(content),
+                                      pool, 3, chunk_size=100)
+            data = b''
+            while True:
+                buf = reader.read(64)
+                if not buf:
+                    break
+                data += buf
+        finally:
+            pool.terminate()
+        assert data == content
+        assert client.get_object.call_count == 26
+        client.get_object.assert_any_call(Bucket='bucket', Key='key',
+                                          Range='bytes=2500-2559')
+
+
+class TestS3BackupCatalog(object):
+
+    def test_get_backup_list_cache(self, tmpdir):
+        cloud_interface = mock.Mock(path='path', bucket_name='bucket',
+                                    worker_processes_count=2)
+        cloud_interface.list_bucket.return_value = [
+            'path/main/base/20201020T000000/',
+            'path/main/base/20201021T000000/',
+            'path/main/base/spurious',
+        ]
+        contents = {}
+        for backup_id in ('20201020T000000', '20201021T000000'):
+            contents['path/main/base/%s/backup.info' % backup_id] = (
+                'etag-%s' % backup_id,
+                b'backup_id=%s\nstatus=DONE\n' % backup_id.encode())
+
+        def remote_read(key, etag=None):
+            if contents[key][0] == etag:
+                return etag, None
+            return contents[key]
+
+        cloud_interface.remote_read.side_effect = remote_read
+        cache_dir = tmpdir.join('cache')
+        catalog = S3BackupCatalog(cloud_interface, 'main',
+                                  cache_dir=cache_dir.strpath)
+        backup_list = catalog.get_backup_list()
+        assert sorted(backup_list) == ['20201020T000000', '20201021T000000']
+        assert backup_list['20201021T000000'].status == 'DONE'
+        assert cache_dir.join('bucket', 'path', 'main', 'base',
+                              '20201020T000000.json').check()
+
+        # The cached content is used when the ETag is unchanged
+        cloud_interface.remote_read.reset_mock()
+        catalog = S3BackupCatalog(cloud_interface, 'main',
+                                  cache_dir=cache_dir.strpath)
+        backup_list = catalog.get_backup_list()
+        assert backup_list['20201020T000000'].status == 'DONE'
+        cloud_interface.remote_read.assert_any_call(
+            'path/main/base/20201020T000000/backup.info',
+            'etag-20201020T000000')
+
+        # A corrupted cache entry is ignored, even if its ETag is valid
+        for corrupted in ('{"etag": "etag-20201020T000000"}',
+                          '{"etag": "etag-20201020T000000", "content": 1}',
+                          '["etag-20201020T000000"]',
+                          '{"etag": "etag-20201020T000000", "cont'):
+            cache_dir.join('bucket', 'path', 'main', 'base',
+                           '20201020T000000.json').write(corrupted)
+            cloud_interface.remote_read.reset_mock()
+            catalog = S3BackupCatalog(cloud_interface, 'main',
+                                      cache_dir=cache_dir.strpath)
+            backup_list = catalog.get_backup_list()
+            assert backup_list['20201020T000000'].status == 'DONE'
+            cloud_interface.remote_read.assert_any_call(
+                'path/main/base/20201020T000000/backup.info', None)
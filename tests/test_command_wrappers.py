@@ -607,6 +607,79 @@ class TestCommand(object):
         assert get_output_no_retry_mock.call_count == 6
 
 
+# noinspection PyMethodMayBeStatic
+class TestCommandIterOutput(object):
+
+    def test_iter_output(self):
+        cmd = command_wrappers.Command(
+            'printf "line1\\nline2\\n"; printf "err1" >&2', shell=True)
+        lines = cmd.iter_output()
+        assert next(lines) == 'line1'
+        assert next(lines) == 'line2'
+        with pytest.raises(StopIteration):
+            next(lines)
+        assert cmd.ret == 0
+        assert cmd.out is None
+        assert cmd.err == 'err1'
+
+    def test_iter_output_incomplete_line(self):
+        cmd = command_wrappers.Command('printf "line1\\nline2"', shell=True)
+        assert list(cmd.iter_output()) == ['line1', 'line2']
+
+    def test_iter_output_check(self):
+        cmd = command_wrappers.Command(
+            'printf "line1\\n"; printf "err1" >&2; exit 5', shell=True,
+            check=True)
+        lines = []
+        with pytest.raises(CommandFailedException) as exc_info:
+            for line in cmd.iter_output():
+                lines.append(line)
+        assert lines == ['line1']
+        assert exc_info.value.args[0]['ret'] == 5
+        assert exc_info.value.args[0]['err'] == 'err1'
+
+        # Allowed return values are not errors
+        assert list(cmd.iter_output(allowed_retval=(5,))) == ['line1']
+
+    @mock.patch('barman.command_wrappers.time.sleep')
+    def test_iter_output_retry(self, sleep_mock, tmpdir):
+        # The command fails before producing any output the first time
+        marker = tmpdir.join('marker')
+        retry_handler = mock.Mock()
+        cmd = command_wrappers.Command(
+            'test -f %s || { touch %s; exit 1; }; echo done' % (
+                marker.strpath, marker.strpath),
+            shell=True, check=True, retry_times=2, retry_sleep=10,
+            retry_handler=retry_handler)
+        assert list(cmd.iter_output()) == ['done']
+        assert retry_handler.call_count == 1
+        sleep_mock.assert_called_once_with(10)
+
+        # A failure after producing some output is not retried
+        retry_handler.reset_mock()
+        cmd = command_wrappers.Command(
+            'echo line1; exit 1', shell=True, check=True,
+            retry_times=2, retry_handler=retry_handler)
+        with pytest.raises(CommandFailedException):
+            list(cmd.iter_output())
+        assert not retry_handler.called
+
+        # Retries are limited
+        cmd = command_wrappers.Command(
+            'exit 1', shell=True, check=True, retry_times=2)
+        with pytest.raises(CommandMaxRetryExceeded):
+            list(cmd.iter_output())
+
+    def test_iter_output_early_stop(self):
+        cmd = command_wrappers.Command('yes', shell=True)
+        lines = cmd.iter_output()
+        assert next(lines) == 'y'
+        # Closing the generator terminates the subprocess
+        lines.close()
+        assert cmd.ret is not None
+        assert cmd.pipe is None
+
+
 # noinspection PyMethodMayBeStatic
 class TestCommandPipeProcessorLoop(object):
 
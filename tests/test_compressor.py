@@ -78,6 +78,23 @@ class TestCompressionManager(object):
         comp_manager = CompressionManager(config_mock, None)
         assert comp_manager.get_default_compressor() is not None
 
+    def test_get_stream_compressor(self):
+        config_mock = mock.Mock()
+
+        # Compressors based on external commands can't work on streams
+        config_mock.compression = "gzip"
+        comp_manager = CompressionManager(config_mock, None)
+        assert comp_manager.get_stream_compressor() is None
+
+        config_mock.compression = "pygzip"
+        comp_manager = CompressionManager(config_mock, None)
+        assert isinstance(comp_manager.get_stream_compressor(),
+                          PyGZipCompressor)
+
+        config_mock.compression = None
+        comp_manager = CompressionManager(config_mock, None)
+        assert comp_manager.get_stream_compressor() is None
+
     def test_get_compressor_invalid(self):
         # prepare mock obj
         config_mock = mock.Mock()
@@ -225,6 +242,41 @@ class TestInternalCompressors(object):
         f = open('%s/bzipfile.uncompressed' % tmpdir.strpath).read()
         assert f == 'content'
 
+    def test_gzip_stream(self, tmpdir):
+        config_mock = mock.Mock()
+        compressor = PyGZipCompressor(config=config_mock, compression='pygzip')
+
+        dst = tmpdir.join('zipfile.gz')
+        with open(dst.strpath, 'wb') as dst_file:
+            ostream = compressor.stream_compressor(dst_file)
+            ostream.write(b'con')
+            ostream.write(b'tent')
+            ostream.close()
+            # The destination file must still be open
+            assert not dst_file.closed
+        assert identify_compression(dst.strpath) == 'gzip'
+
+        compressor.decompress(dst.strpath, tmpdir.join('out').strpath)
+        assert tmpdir.join('out').read() == 'content'
+
+    def test_bzip2_stream(self, tmpdir):
+        config_mock = mock.Mock()
+        compressor = PyBZip2Compressor(config=config_mock,
+                                       compression='pybzip2')
+
+        dst = tmpdir.join('bzipfile.bz2')
+        with open(dst.strpath, 'wb') as dst_file:
+            ostream = compressor.stream_compressor(dst_file)
+            ostream.write(b'con')
+            ostream.write(b'tent')
+            ostream.close()
+            # The destination file must still be open
+            assert not dst_file.closed
+        assert identify_compression(dst.strpath) == 'bzip2'
+
+        compressor.decompress(dst.strpath, tmpdir.join('out').strpath)
+        assert tmpdir.join('out').read() == 'content'
+
 
 # noinspection PyMethodMayBeStatic
 class TestCustomCompressor(object):
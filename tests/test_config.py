@@ -22,7 +22,8 @@ import pytest
 from mock import patch
 
 from barman.config import (BackupOptions, Config, RecoveryOptions,
-                           parse_slot_name, parse_time_interval)
+                           parse_backup_storage, parse_slot_name,
+                           parse_time_interval)
 from testing_helpers import build_config_dictionary, build_config_from_dicts
 
 try:
@@ -139,6 +140,7 @@ class TestConfig(object):
             'config': web.config,
             'backup_directory': '/some/barman/home/web',
             'basebackups_directory': '/some/barman/home/web/base',
+            'chunk_store_directory': '/some/barman/home/web/base/chunks',
             'compression': None,
             'conninfo': 'host=web01 user=postgres port=5432',
             'description': 'Web applications database',
@@ -282,6 +284,7 @@ class TestConfig(object):
             'config': main.config,
             'disabled': True,
             'basebackups_directory': '/some/barman/home/main/wals',
+            'chunk_store_directory': '/some/barman/home/main/wals/chunks',
             'msg_list': [
                 'Conflicting path: wals_directory=/some/barman/home/main/wals '
                 'conflicts with \'basebackups_directory\' '
@@ -372,6 +375,17 @@ class TestConfig(object):
         with pytest.raises(ValueError):
             parse_slot_name('barman slot name')
 
+    def test_parse_backup_storage(self):
+        """
+        Test the parse_backup_storage method
+        """
+        assert parse_backup_storage(None) is None
+        assert parse_backup_storage('plain') == 'plain'
+        assert parse_backup_storage('Chunks') == 'chunks'
+        assert parse_backup_storage('tar') == 'tar'
+        with pytest.raises(ValueError):
+            parse_backup_storage('tape')
+
 
 # noinspection PyMethodMayBeStatic
 class TestCsvParsing(object):
@@ -621,6 +635,9 @@ class TestCsvParsing(object):
             RecoveryOptions('', '', '')
         assert set([RecoveryOptions.GET_WAL]) == \
             RecoveryOptions(RecoveryOptions.GET_WAL, '', '')
+        assert set([RecoveryOptions.GET_WAL,
+                    RecoveryOptions.COMPRESSED_WALS]) == \
+            RecoveryOptions('get-wal, compressed-wals', '', '')
         # build using a not allowed value
         with pytest.raises(ValueError):
             BackupOptions("test_string", "", "")
@@ -15,21 +15,47 @@
 # You should have received a copy of the GNU General Public License
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import multiprocessing.dummy
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import dateutil.tz
 import mock
 import pytest
 from mock import patch
 
-from barman.copy_controller import (BUCKET_SIZE, RsyncCopyController,
-                                    _FileItem, _RsyncCopyItem)
+import barman.copy_controller
+from barman.copy_controller import (BUCKET_SIZE, BUCKET_TARGET_TIME,
+                                    MIN_BUCKET_SIZE, RsyncCopyController,
+                                    _FileItem, _FileList, _native_copy_data,
+                                    _native_copy_file, _RsyncAnalysisJob,
+                                    _RsyncCopyItem, _RsyncJob, _RsyncScheduler)
 from barman.exceptions import CommandFailedException, RsyncListFilesFailure
+from barman.infofile import FileManifest
 from testing_helpers import (build_backup_manager, build_real_server,
                              build_test_backup_info)
 
+RSYNC_STATS = """\
+>f+++++++++ base/1/1234
+
+Number of files: 2 (reg: 1, dir: 1)
+Number of created files: 1 (reg: 1)
+Number of deleted files: 0
+Number of regular files transferred: 1
+Total file size: 1,048,576 bytes
+Total transferred file size: 1,048,576 bytes
+Literal data: 1,000,000 bytes
+Matched data: 48,576 bytes
+File list size: 0
+File list generation time: 0.001 seconds
+Total bytes sent: 1,000,123
+Total bytes received: 35
+
+sent 1,000,123 bytes  received 35 bytes  2,000,316.00 bytes/sec
+total size is 1,048,576  speedup is 1.05
+"""
+
 
 # noinspection PyMethodMayBeStatic
 class TestRsyncCopyController(object):
@@ -143,6 +169,7 @@ class TestRsyncCopyController(object):
         rsync_mock.return_value.out = ''
         rsync_mock.return_value.err = ''
         rsync_mock.return_value.ret = 0
+        copy_mock.return_value = ''
 
         # Mock analyze directory
         def analyse_func(item):
@@ -247,7 +274,7 @@ class TestRsyncCopyController(object):
                       exclude=None, exclude_and_protect=None, include=None,
                       retry_sleep=0, retry_times=0, retry_handler=mock.ANY),
             mock.call()(
-                ':/etc/postgresql.conf',
+                '--stats', ':/etc/postgresql.conf',
                 backup_info.get_data_directory(),
                 allowed_retval=(0, 23, 24)),
             mock.call(network_compression=False,
@@ -262,7 +289,7 @@ class TestRsyncCopyController(object):
                       exclude=None, exclude_and_protect=None, include=None,
                       retry_sleep=0, retry_times=0, retry_handler=mock.ANY),
             mock.call()(
-                ':/pg/data/global/pg_control',
+                '--stats', ':/pg/data/global/pg_control',
                 '%s/global/pg_control' % backup_info.get_data_directory(),
                 allowed_retval=(0, 23, 24)),
         ]
@@ -325,8 +352,12 @@ class TestRsyncCopyController(object):
         # Mock rsync invocation
         rsync_mock = mock.Mock(name='Rsync()')
         rsync_mock.ret = 0
-        rsync_mock.out = 'drwxrwxrwt       69632 2015/02/09 15:01:00 tmp\n' \
-                         'drwxrwxrwt       69612 Thu Feb 19 15:01:22 2015 tmp2'
+        rsync_mock.iter_output.side_effect = lambda *args, **kwargs: iter([
+            'drwxrwxrwt       69632 2015/02/09 15:01:00 tmp',
+            'drwxrwxrwt       69612 Thu Feb 19 15:01:22 2015 tmp2',
+            '-rw-------    8192 2015/02/09 15:01:00 base/1/file name',
+            '-rw-------       0 2015/02/09 15:01:00  leading space',
+            '-rw-------       0 Thu Feb 19 15:01:22 2015  leading space'])
         rsync_mock.err = 'err'
 
         # Mock _rsync_factory() invocation
@@ -345,16 +376,16 @@ class TestRsyncCopyController(object):
         rcc = RsyncCopyController()
         return_values = list(rcc._list_files(item, 'some/path'))
 
-        # Returned list must contain two elements
-        assert len(return_values) == 2
+        # Returned list must contain five elements
+        assert len(return_values) == 5
 
         # Verify that _rsync_factory has been called correctly
         assert rsync_factory_mock.mock_calls == [
-            mock.call(item),
+            mock.call(item, cache=False),
         ]
 
-        # Check rsync.get_output has called correctly
-        rsync_mock.get_output.assert_called_with(
+        # Check rsync.iter_output has called correctly
+        rsync_mock.iter_output.assert_called_with(
             '--no-human-readable', '--list-only', '-r', 'some/path',
             check=True)
 
@@ -373,24 +404,62 @@ class TestRsyncCopyController(object):
                      hour=15, minute=1, second=22,
                      tzinfo=dateutil.tz.tzlocal()),
             'tmp2')
+        # Dates are shared through the cache
+        assert return_values[2] == _FileItem(
+            '-rw-------', 8192, return_values[0].date, 'base/1/file name')
+        assert return_values[2].date is return_values[0].date
+        # The leading whitespace of a filename is preserved
+        assert return_values[3].path == ' leading space'
+        assert return_values[4].path == ' leading space'
 
         # Test the _list_files internal method with a wrong output (added TZ)
-        rsync_mock.out = (
-            'drwxrwxrwt       69612 Thu Feb 19 15:01:22 CET 2015 tmp2\n')
+        rsync_mock.iter_output.side_effect = lambda *args, **kwargs: iter([
+            'drwxrwxrwt       69612 Thu Feb 19 15:01:22 CET 2015 tmp2'])
 
         rcc = RsyncCopyController()
         with pytest.raises(RsyncListFilesFailure):
             # The list() call is needed to consume the generator
             list(rcc._list_files(rsync_mock, 'some/path'))
 
-        # Check rsync.get_output has called correctly
-        rsync_mock.get_output.assert_called_with(
+        # Check rsync.iter_output has called correctly
+        rsync_mock.iter_output.assert_called_with(
             '--no-human-readable', '--list-only', '-r', 'some/path',
             check=True)
 
-    def test_fill_buckets(self):
+        # An invalid date in the common format is reported as well
+        rsync_mock.iter_output.side_effect = lambda *args, **kwargs: iter([
+            'drwxrwxrwt       69612 2015/02/30 15:01:22 tmp2'])
+
+        rcc = RsyncCopyController()
+        with pytest.raises(RsyncListFilesFailure):
+            list(rcc._list_files(rsync_mock, 'some/path'))
+
+    @patch('barman.copy_controller.RsyncCopyController._rsync_factory')
+    def test_list_files_pre_31(self, rsync_factory_mock):
         """
-        Unit test for RsyncCopyController._fill_buckets's code
+        Unit test for the fallback to rsync < 3.1 mode in _list_file
+        """
+        rsync_mock = mock.Mock(name='Rsync()')
+
+        def iter_output(*args, **kwargs):
+            # Fail with a syntax error using rsync >= 3.1 options
+            if rcc.rsync_has_ignore_missing_args:
+                rsync_mock.ret = 1
+                raise CommandFailedException(dict(ret=1, out=None, err=''))
+            rsync_mock.ret = 0
+            yield 'drwxrwxrwt       69632 2015/02/09 15:01:00 tmp'
+
+        rsync_mock.iter_output.side_effect = iter_output
+        rsync_factory_mock.return_value = rsync_mock
+
+        rcc = RsyncCopyController()
+        return_values = list(rcc._list_files(mock.Mock(), 'some/path'))
+        assert [item.path for item in return_values] == ['tmp']
+        assert not rcc.rsync_has_ignore_missing_args
+
+    def test_scheduler(self):
+        """
+        Unit test for the _RsyncScheduler class
         """
 
         # Create a fake file list af about 525 GB of files
@@ -411,27 +480,125 @@ class TestRsyncCopyController(object):
                 'tmp%08d' % i))
             total_size += size
 
-        # Test the _fill_buckets internal method with only one worker:
-        # the result must be a bucket with the same list passed as argument
-        rcc = RsyncCopyController(workers=1)
-        buckets = list(rcc._fill_buckets(file_list))
-        assert len(buckets) == 1
-        assert buckets[0] == file_list
-
-        # Test the _fill_buckets internal method with multiple workers
-        # the result must be a bucket with the same list passed as argument
+        def schedule(workers):
+            scheduler = _RsyncScheduler(workers)
+            scheduler.add_job(_RsyncJob(
+                0, 'safe', file_list=file_list, checksum=False))
+            scheduler.add_job(_RsyncJob(1, 'file'))
+            jobs = []
+            job = scheduler.next_job()
+            while job is not None:
+                jobs.append(job)
+                job = scheduler.next_job()
+            return jobs
+
+        # Analysis jobs are served before the others
+        scheduler = _RsyncScheduler(2)
+        scheduler.add_job(_RsyncJob(1, 'file'))
+        scheduler.add_job(_RsyncJob(
+            0, 'safe', file_list=file_list, checksum=False))
+        analysis_job = _RsyncAnalysisJob(2, 'analyze', 'purge')
+        scheduler.add_job(analysis_job)
+        assert scheduler.next_job() is analysis_job
+        scheduler.job_done(analysis_job)
+        assert scheduler.next_job().item_idx == 0
+
+        # With only one worker the result must be a bucket with all the
+        # files, largest first, followed by the job without a file list
+        jobs = schedule(1)
+        assert len(jobs) == 2
+        assert jobs[0].file_list == sorted(
+            file_list, key=lambda f: f.size, reverse=True)
+        assert jobs[0].id == 0
+        assert jobs[1].file_list is None
+
+        # With multiple workers every file is copied exactly once
         for workers in range(2, 17):
-            rcc = RsyncCopyController(workers=workers)
-            buckets = list(rcc._fill_buckets(file_list))
-            # There is enough buckets to contains all the files
-            assert len(buckets) >= int(total_size / BUCKET_SIZE)
-            for i, bucket in enumerate(buckets):
-                size = sum([f.size for f in bucket])
+            jobs = schedule(workers)
+            assert jobs[-1].file_list is None
+            buckets = [job.file_list for job in jobs[:-1]]
+            assert [job.id for job in jobs[:-1]] == list(range(len(buckets)))
+            assert sorted(f.path for bucket in buckets for f in bucket) == \
+                sorted(f.path for f in file_list)
+            sizes = [sum(f.size for f in bucket) for bucket in buckets]
+            for i, size in enumerate(sizes):
                 # The bucket is not bigger than BUCKET_SIZE
-                assert size < BUCKET_SIZE, "Bucket %s (%s) size %s too big" % (
-                    i, workers, size)
+                assert size <= BUCKET_SIZE, \
+                    "Bucket %s (%s) size %s too big" % (i, workers, size)
                 # The bucket cannot be empty
-                assert len(bucket), "Bucket %s (%s) is empty" % (i, workers)
+                assert buckets[i], "Bucket %s (%s) is empty" % (i, workers)
+            # The buckets shrink while the copy proceeds, so the last ones
+            # don't keep a worker busy while the others are idle
+            assert sizes[-1] <= total_size // workers
+            assert sizes[0] >= sizes[-1]
+
+    def test_scheduler_file_list(self, tmpdir):
+        """
+        Unit test for the _RsyncScheduler class splitting a file list
+        stored in the temporary directory
+        """
+        file_list = [_FileItem('-rw-------', 1024 * 1024 * 1024, None,
+                               'base/%s' % i) for i in range(25)]
+        file_list.append(_FileItem('-rw-------', 0, None, 'base/empty'))
+        stored = _FileList.write(tmpdir.join('files.list').strpath,
+                                 file_list)
+        scheduler = _RsyncScheduler(2)
+        scheduler.add_job(_RsyncJob(
+            0, 'safe', file_list=stored, checksum=False))
+        assert scheduler.pending_size == 25 * 1024 * 1024 * 1024
+
+        # The buckets are consecutive slices of the stored list
+        buckets = []
+        job = scheduler.next_job()
+        while job is not None:
+            assert isinstance(job.file_list, _FileList)
+            assert job.file_list.size == \
+                sum(f.size for f in job.file_list)
+            buckets.append(job.file_list)
+            job = scheduler.next_job()
+        assert [len(bucket) for bucket in buckets] == [10, 7, 4, 2, 1, 1, 1]
+        assert [f.path for bucket in buckets for f in bucket] == \
+            [f.path for f in file_list]
+        assert scheduler.pending_size == 0
+
+    def test_scheduler_throughput(self):
+        """
+        Unit test for the adaptive bucket size of _RsyncScheduler
+        """
+        filedate = datetime(2015, 2, 19, tzinfo=dateutil.tz.tzlocal())
+        file_list = [_FileItem('-rw-------', 1024 * 1024 * 1024, filedate,
+                               'base/%s' % i) for i in range(100)]
+        scheduler = _RsyncScheduler(4)
+        scheduler.add_job(_RsyncJob(
+            0, 'safe', file_list=file_list, checksum=False))
+
+        # Before any measurement the bucket size is BUCKET_SIZE
+        job = scheduler.next_job()
+        assert sum(f.size for f in job.file_list) == BUCKET_SIZE
+
+        # A job copied at 10MB/s gives buckets of BUCKET_TARGET_TIME seconds
+        job.file_list = job.file_list[:1]
+        job.copy_start_time = filedate
+        job.copy_end_time = filedate + timedelta(seconds=102.4)
+        scheduler.job_done(job)
+        assert scheduler.throughput == {False: 1024 * 1024 * 10}
+        assert scheduler._bucket_size(False) == \
+            1024 * 1024 * 10 * BUCKET_TARGET_TIME
+        # A bucket always contains at least a file
+        job = scheduler.next_job()
+        assert len(job.file_list) == 1
+        # The checksum phase has its own measurement
+        assert scheduler._bucket_size(True) == BUCKET_SIZE
+
+        # New measurements are averaged with the previous ones
+        job.copy_start_time = filedate
+        job.copy_end_time = filedate + timedelta(seconds=32)
+        scheduler.job_done(job)
+        assert scheduler.throughput == {False: 1024 * 1024 * 21}
+
+        # A slow copy doesn't make the buckets smaller than MIN_BUCKET_SIZE
+        scheduler.throughput[False] = 1024
+        assert scheduler._bucket_size(False) == MIN_BUCKET_SIZE
 
     @patch('barman.copy_controller.RsyncCopyController._list_files')
     def test_analyze_directory(self, list_files_mock, tmpdir):
@@ -602,6 +769,163 @@ class TestRsyncCopyController(object):
         assert item.safe_list[2].path == 'tmp/diff_size'
         assert item.safe_list[3].path == 'tmp/new'
 
+    @patch('barman.copy_controller.RsyncCopyController._list_files')
+    def test_analyze_directory_ref_failure(self, list_files_mock, tmpdir):
+        """
+        Unit test for RsyncCopyController._analyze_directory's code
+        when the reference directory can't be listed
+        """
+        date = datetime(year=2015, month=2, day=20,
+                        hour=18, minute=15, second=33,
+                        tzinfo=dateutil.tz.tzlocal())
+
+        def ref_listing():
+            yield _FileItem('-rw-------', 1024, date, 'base/new')
+            raise RsyncListFilesFailure('fake error')
+
+        list_files_mock.side_effect = [ref_listing(), [
+            _FileItem('-rw-------', 1024, date, 'base/old'),
+            _FileItem('-rw-------', 1024, date, 'base/new'),
+        ]]
+        rcc = RsyncCopyController(
+            safe_horizon=date + timedelta(seconds=-1))
+        rcc.temp_dir = tmpdir.strpath
+        item = _RsyncCopyItem(
+            label='pgdata',
+            src=':/pg/data/',
+            dst=tmpdir.mkdir('dst').strpath,
+            is_directory=True,
+            item_class=rcc.PGDATA_CLASS)
+        rcc._analyze_directory(item)
+
+        # Without the reference listing, every file newer than
+        # safe_horizon is checked
+        assert item.safe_list == []
+        assert [f.path for f in item.check_list] == ['base/old', 'base/new']
+
+        # Any other error in the reference listing is raised
+        def broken_listing():
+            raise ValueError('fake error')
+            yield
+
+        list_files_mock.side_effect = [broken_listing(), []]
+        with pytest.raises(ValueError):
+            rcc._analyze_directory(item)
+
+    @patch('barman.copy_controller.RsyncCopyController._create_dir_and_purge')
+    @patch('barman.copy_controller.RsyncCopyController._analyze_directory')
+    def test_execute_analysis(self, analyze_mock, purge_mock, tmpdir):
+        """
+        Unit test for the execution of a _RsyncAnalysisJob
+        """
+        rcc = RsyncCopyController()
+        rcc.temp_dir = tmpdir.strpath
+        rcc.add_directory(
+            label='pgdata',
+            src=':/pg/data/',
+            dst='/some/dir',
+            item_class=rcc.PGDATA_CLASS)
+
+        def analyze(item):
+            # The old rsync version is detected during the analysis
+            rcc.rsync_has_ignore_missing_args = False
+            item.safe_list = [_FileItem('-rw-------', 1, None, 'base/small'),
+                              _FileItem('-rw-------', 3, None, u'base/b\xe9g')]
+            item.check_list = []
+        analyze_mock.side_effect = analyze
+
+        job = _RsyncAnalysisJob(0, 'analyze', 'purge')
+        assert rcc._execute_job(job) is job
+        analyze_mock.assert_called_once_with(rcc.item_list[0])
+        purge_mock.assert_called_once_with(rcc.item_list[0])
+        assert job.item is rcc.item_list[0]
+        # The file lists are stored in the temporary directory,
+        # largest files first
+        assert isinstance(job.item.safe_list, _FileList)
+        assert job.item.safe_list.path == \
+            tmpdir.join('pgdata_safe_files.list').strpath
+        assert len(job.item.safe_list) == 2
+        assert job.item.safe_list.size == 4
+        assert list(job.item.safe_list) == [
+            _FileItem(None, 3, None, u'base/b\xe9g'),
+            _FileItem(None, 1, None, 'base/small')]
+        assert not job.item.check_list
+        assert job.item.analysis_start_time <= job.item.analysis_end_time
+        assert job.rsync_pre_31
+
+        # The compatibility mode requested by the main process is applied
+        rcc.rsync_has_ignore_missing_args = True
+        rcc.rsync_cache['fake'] = 'rsync'
+        job = _RsyncAnalysisJob(0, 'analyze', 'purge')
+        job.rsync_pre_31 = True
+        analyze_mock.side_effect = None
+        rcc.item_list[0].safe_list = []
+        rcc.item_list[0].check_list = []
+        rcc._execute_job(job)
+        assert not rcc.rsync_has_ignore_missing_args
+        assert rcc.rsync_cache == {}
+
+    @patch('barman.copy_controller.RsyncCopyController._list_files')
+    def test_analyze_directory_manifest(self, list_files_mock, tmpdir):
+        """
+        Unit test for RsyncCopyController._analyze_directory's code
+        when the reference directory has a file manifest
+        """
+        date = datetime(year=2015, month=2, day=20,
+                        hour=18, minute=15, second=33,
+                        tzinfo=dateutil.tz.tzlocal())
+        mtime = int((date - datetime.fromtimestamp(
+            0, dateutil.tz.tzlocal())).total_seconds())
+
+        # Build the reference backup directory and its manifest
+        ref_backup = tmpdir.mkdir('ref_backup')
+        ref_backup.mkdir('data')
+        manifest = FileManifest(
+            ref_backup.join(FileManifest.FILENAME).strpath)
+        file_stat = mock.Mock(st_mode=0o100600, st_size=1024, st_mtime=mtime)
+        with manifest.writer() as add:
+            add('data/base/safe', file_stat)
+            add('data/base/changed', file_stat)
+            add('16387/PG_12/other', file_stat)
+
+        # The source contains an unchanged and a changed file
+        list_files_mock.return_value = [
+            _FileItem('drwx------', 4096, date, 'base'),
+            _FileItem('-rw-------', 1024, date, 'base/safe'),
+            _FileItem('-rw-------', 2048, date, 'base/changed'),
+        ]
+
+        rcc = RsyncCopyController(
+            reuse_backup='link',
+            safe_horizon=datetime(
+                year=2015, month=2, day=20,
+                hour=19, minute=0, second=0,
+                tzinfo=dateutil.tz.tzlocal()))
+        rcc.temp_dir = tmpdir.mkdir('tmp').strpath
+        item = _RsyncCopyItem(
+            label='pgdata',
+            src=':/pg/data/',
+            dst=tmpdir.mkdir('dst').strpath,
+            is_directory=True,
+            reuse=ref_backup.join('data').strpath,
+            reuse_manifest=manifest.filename,
+            item_class=rcc.PGDATA_CLASS)
+        rcc._analyze_directory(item)
+
+        # The reference directory has not been listed
+        assert list_files_mock.mock_calls == [mock.call(item, ':/pg/data/')]
+        assert [f.path for f in item.safe_list] == [
+            'base/safe', 'base/changed']
+        assert item.check_list == []
+
+        # Without the manifest the reference directory is listed
+        os.unlink(manifest.filename)
+        list_files_mock.reset_mock()
+        rcc._analyze_directory(item)
+        assert list_files_mock.mock_calls == [
+            mock.call(item, ref_backup.join('data').strpath + '/'),
+            mock.call(item, ':/pg/data/')]
+
     @patch('barman.copy_controller.RsyncCopyController._rsync_factory')
     @patch('barman.copy_controller.RsyncCopyController.'
            '_rsync_ignore_vanished_files')
@@ -709,16 +1033,18 @@ class TestRsyncCopyController(object):
 
         # Create an rsync mock
         rsync_mock = mock.Mock(name='Rsync()')
+        rsync_ignore_mock.return_value = ('rsync output', '')
 
         # Then run the _copy method
-        rcc._copy(rsync_mock, ':/pg/data/', backup_info.get_data_directory(),
-                  '/path/to/file.list', checksum=True)
+        assert rcc._copy(
+            rsync_mock, ':/pg/data/', backup_info.get_data_directory(),
+            '/path/to/file.list', checksum=True) == 'rsync output'
 
         # Verify that _rsync_ignore_vanished_files has been called correctly
         assert rsync_ignore_mock.mock_calls == [
             mock.call(rsync_mock, ':/pg/data/',
                       backup_info.get_data_directory(),
-                      '--files-from=/path/to/file.list',
+                      '--files-from=/path/to/file.list', '--stats',
                       '--checksum', check=True),
         ]
 
@@ -731,7 +1057,7 @@ class TestRsyncCopyController(object):
         assert rsync_ignore_mock.mock_calls == [
             mock.call(rsync_mock, ':/pg/data/',
                       backup_info.get_data_directory(),
-                      '--files-from=/path/to/file.list',
+                      '--files-from=/path/to/file.list', '--stats',
                       check=True),
         ]
 
@@ -862,10 +1188,11 @@ class TestRsyncCopyController(object):
         # This is to check that all the preparation is done correctly
         assert os.path.exists(backup_info.filename)
 
-        # Silence the access to result properties
-        rsync_mock.return_value.out = ''
+        # Every rsync execution reports the same transfer statistics
+        rsync_mock.return_value.out = RSYNC_STATS
         rsync_mock.return_value.err = ''
         rsync_mock.return_value.ret = 0
+        copy_mock.return_value = RSYNC_STATS
 
         # Mock analyze directory
         def analyse_func(item):
@@ -937,7 +1264,203 @@ class TestRsyncCopyController(object):
         assert result.get('number_of_workers') == rcc.workers
         assert result.get('total_time') > 0
 
+        # Every item has a safe and a checksum job, every file one job
+        assert result['transferred_files'] == 8
+        assert result['transferred_bytes'] == 8 * 1048576
+        assert result['literal_bytes'] == 8 * 1000000
+        assert result['matched_bytes'] == 8 * 48576
+        assert result['throughput'] > 0
+        for tbs in ('pgdata', 'tbs1', 'tbs2', 'config_file', 'pg_control'):
+            assert result['throughput_per_item'][tbs] > 0
+        assert sorted(result['throughput_per_phase']) == [
+            'checksum', 'file', 'safe']
+        assert 0 < len(result['throughput_per_worker']) <= workers
+        assert sorted(result['throughput_per_worker']) == [
+            str(number)
+            for number in range(len(result['throughput_per_worker']))]
+
+    def test_store_stats(self):
+        """
+        Unit test for RsyncCopyController._store_stats's code
+        """
+        rcc = RsyncCopyController()
+        job = _RsyncJob(0, 'description')
+        rcc._store_stats(job, None)
+        assert job.transferred_bytes is None
+
+        rcc._store_stats(job, RSYNC_STATS)
+        assert job.transferred_files == 1
+        assert job.transferred_bytes == 1048576
+        assert job.literal_bytes == 1000000
+        assert job.matched_bytes == 48576
+
+        # rsync < 3.1 output has no digit groupings
+        rcc._store_stats(job, (
+            "Number of files: 2\n"
+            "Number of files transferred: 2\n"
+            "Total file size: 2048 bytes\n"
+            "Total transferred file size: 2048 bytes\n"
+            "Literal data: 2048 bytes\n"
+            "Matched data: 0 bytes\n"))
+        assert job.transferred_files == 2
+        assert job.transferred_bytes == 2048
+        assert job.literal_bytes == 2048
+        assert job.matched_bytes == 0
+
     def test_rsync_copy_item_class(self):
         # A value for the item_class attribute is mandatory for this resource
         with pytest.raises(AssertionError):
             _RsyncCopyItem('symbolic_name', 'source', 'destination')
+
+    @pytest.mark.parametrize('checksum', [False, True])
+    def test_native_copy_file(self, checksum, tmpdir):
+        """
+        Unit test for the _native_copy_file function
+        """
+        src = tmpdir.join('src')
+        src.write('content')
+        src.chmod(0o600)
+        src.setmtime(1500000000)
+        dst = tmpdir.join('dst')
+
+        # A missing destination is copied with its attributes
+        assert _native_copy_file(src.strpath, dst.strpath, checksum) == 7
+        assert dst.read() == 'content'
+        assert dst.mtime() == 1500000000
+        assert dst.stat().mode & 0o777 == 0o600
+
+        # An up to date destination is not copied again
+        assert _native_copy_file(src.strpath, dst.strpath, checksum) is None
+
+        # A destination with the same size and time but a different content
+        # is detected only when the checksum is requested
+        dst.write('CONTENT')
+        dst.setmtime(1500000000)
+        copied = _native_copy_file(src.strpath, dst.strpath, checksum)
+        if checksum:
+            assert copied == 7
+            assert dst.read() == 'content'
+        else:
+            assert copied is None
+            assert dst.read() == 'CONTENT'
+
+        # An existing destination is replaced, never written in place
+        ref = tmpdir.join('ref')
+        ref.mklinkto(dst)
+        old_content = ref.read()
+        src.write('new content')
+        src.setmtime(1600000000)
+        assert _native_copy_file(src.strpath, dst.strpath, checksum) == 11
+        assert dst.read() == 'new content'
+        assert ref.read() == old_content
+
+        # An unchanged file in the link_dest path is hard linked
+        ref.remove()
+        link_dest = tmpdir.join('link_dest')
+        link_dest.write('new content')
+        link_dest.chmod(0o600)
+        link_dest.setmtime(1600000000)
+        dst.remove()
+        assert _native_copy_file(src.strpath, dst.strpath, checksum,
+                                 link_dest.strpath) == 0
+        assert dst.stat().ino == link_dest.stat().ino
+
+        # A different file in the link_dest path is not used
+        link_dest.chmod(0o644)
+        dst.remove()
+        assert _native_copy_file(src.strpath, dst.strpath, checksum,
+                                 link_dest.strpath) == 11
+        assert dst.stat().ino != link_dest.stat().ino
+
+    @pytest.mark.parametrize('method', ['copy_file_range', 'sendfile', None])
+    def test_native_copy_data(self, method, tmpdir):
+        """
+        Unit test for the _native_copy_data function
+        """
+        data = os.urandom(1024 * 1024 * 10 + 123)
+        src = tmpdir.join('src')
+        src.write(data, 'wb')
+        dst = tmpdir.join('dst')
+        calls = []
+
+        def unsupported(*args):
+            calls.append(args)
+            raise OSError(errno.ENOSYS, 'Function not implemented')
+
+        with mock.patch.multiple('barman.copy_controller.os',
+                                 copy_file_range=unsupported,
+                                 sendfile=unsupported, create=True):
+            # Restore only the method under test
+            if method:
+                setattr(barman.copy_controller.os, method,
+                        getattr(os, method, unsupported))
+            with open(src.strpath, 'rb') as src_file:
+                with open(dst.strpath, 'wb') as dst_file:
+                    assert _native_copy_data(src_file, dst_file) == len(data)
+        assert dst.read('rb') == data
+
+    def test_native_copy(self, tmpdir):
+        """
+        Unit test for the native copy of RsyncCopyController jobs
+        """
+        src = tmpdir.mkdir('src')
+        src.join('base', '1', '1234').write('x' * 100, ensure=True)
+        src.join('PG_VERSION').write('12\n')
+        dst = tmpdir.mkdir('dst')
+        dst.mkdir('base').mkdir('1')
+
+        rcc = RsyncCopyController()
+        rcc.add_directory(
+            label='pgdata',
+            src=src.strpath + '/',
+            dst=dst.strpath,
+            item_class=rcc.PGDATA_CLASS)
+        rcc.add_file(
+            label='config_file',
+            src=src.join('postgresql.conf').strpath,
+            dst=dst.strpath,
+            item_class=rcc.CONFIG_CLASS,
+            optional=True)
+        rcc.add_file(
+            label='pg_version',
+            src=src.join('PG_VERSION').strpath,
+            dst=dst.strpath,
+            item_class=rcc.CONFIG_CLASS)
+        assert all(rcc._is_native(item) for item in rcc.item_list)
+
+        # A directory job copies its files, ignoring the vanished ones
+        job = _RsyncJob(0, '%s %s', file_list=[
+            _FileItem('-rw-------', 100, None, 'base/1/1234'),
+            _FileItem('-rw-------', 1, None, 'base/1/vanished'),
+        ], checksum=False)
+        rcc._execute_job(job)
+        assert dst.join('base', '1', '1234').read() == 'x' * 100
+        assert not dst.join('base', '1', 'vanished').check()
+        assert job.transferred_files == 1
+        assert job.transferred_bytes == 100
+        assert job.copy_end_time >= job.copy_start_time
+
+        # A missing optional file is ignored
+        job = _RsyncJob(1, '%s %s')
+        rcc._execute_job(job)
+        assert job.transferred_files == 0
+
+        # A single file is copied into the destination directory
+        job = _RsyncJob(2, '%s %s')
+        rcc._execute_job(job)
+        assert dst.join('PG_VERSION').read() == '12\n'
+        assert job.transferred_files == 1
+
+        # Any other error is reported as a CommandFailedException
+        rcc.item_list[2].optional = False
+        src.join('PG_VERSION').remove()
+        with pytest.raises(CommandFailedException):
+            rcc._execute_job(_RsyncJob(2, '%s %s'))
+
+        # Remote items are copied using rsync
+        rcc.add_file(
+            label='remote',
+            src=':/pg/data/PG_VERSION',
+            dst=dst.strpath,
+            item_class=rcc.CONFIG_CLASS)
+        assert not rcc._is_native(rcc.item_list[-1])
@@ -23,7 +23,8 @@ import pytest
 from dateutil import tz
 from mock import Mock, patch
 
-from barman.backup_executor import PostgresBackupExecutor, RsyncBackupExecutor
+from barman.backup_executor import (MAX_DELTA_BACKUPS, PostgresBackupExecutor,
+                                    RsyncBackupExecutor)
 from barman.config import BackupOptions
 from barman.exceptions import (CommandFailedException, DataTransferFailure,
                                FsOperationFailed, SshCommandException)
@@ -85,6 +86,76 @@ class TestRsyncBackupExecutor(object):
         assert backup_manager.executor._reuse_path(backup_info) == \
             '/some/barman/home/main/base/1234567890/data'
 
+        # check for the expected path with delta
+        backup_manager.executor.config.reuse_backup = 'delta'
+        assert backup_manager.executor._reuse_path(backup_info) == \
+            '/some/barman/home/main/base/1234567890/data'
+
+    def test_delta_base(self, capsys):
+        """
+        Test the choice of the full backup page deltas are stored against
+        """
+        backup_manager = build_backup_manager()
+        executor = backup_manager.executor
+        backup_info = build_test_backup_info(backup_id='new')
+        full = build_test_backup_info(backup_id='full')
+        delta = build_test_backup_info(backup_id='delta')
+        delta.delta_base = 'full'
+        for info in (backup_info, full, delta):
+            info.systemid = '1'
+        full.size = 1000
+        delta.deduplicated_size = 500
+        backup_manager.get_backup = Mock(return_value=full)
+        backup_manager.get_available_backups = Mock(
+            return_value={'full': full, 'delta': delta})
+
+        # The previous backup is a full backup
+        assert executor._delta_base(backup_info, full) is full
+
+        # The previous backup contains page deltas
+        assert executor._delta_base(backup_info, delta) is full
+        backup_manager.get_backup.assert_called_once_with('full')
+
+        # The base is obsolete according to the retention policy
+        backup_manager.config.retention_policy = Mock()
+        backup_manager.config.retention_policy.report.return_value = {
+            'full': BackupInfo.OBSOLETE, 'delta': BackupInfo.VALID}
+        assert executor._delta_base(backup_info, delta) is None
+        assert 'Backup full is obsolete according to the retention ' \
+            'policy, taking a full backup' in capsys.readouterr()[0]
+        backup_manager.config.retention_policy.report.return_value = {
+            'full': BackupInfo.VALID, 'delta': BackupInfo.VALID}
+        assert executor._delta_base(backup_info, delta) is full
+
+        # Too many backups store page deltas against the base
+        backup_manager.get_available_backups.return_value = dict(
+            ('delta%s' % i, delta) for i in range(MAX_DELTA_BACKUPS))
+        assert executor._delta_base(backup_info, delta) is None
+        assert '%s backups store page deltas against backup full, ' \
+            'taking a full backup' % MAX_DELTA_BACKUPS in \
+            capsys.readouterr()[0]
+        backup_manager.get_available_backups.return_value = {'delta': delta}
+
+        # The previous backup stored too much data
+        delta.deduplicated_size = 501
+        assert executor._delta_base(backup_info, delta) is None
+        assert 'Backup delta stored 501 B of page deltas and changed ' \
+            'files against backup full (1000 B), taking a full backup' in \
+            capsys.readouterr()[0]
+        delta.deduplicated_size = 500
+
+        # The base of the previous backup is missing
+        backup_manager.get_backup.return_value = None
+        assert executor._delta_base(backup_info, delta) is None
+        assert 'base backup full of backup delta is not available' in \
+            capsys.readouterr()[1]
+
+        # The PostgreSQL cluster changed
+        backup_info.systemid = '2'
+        assert executor._delta_base(backup_info, full) is None
+        assert 'The system identifier of backup full differs' in \
+            capsys.readouterr()[1]
+
     @patch('barman.backup_executor.UnixRemoteCommand')
     def test_check(self, command_mock, capsys):
         """
@@ -286,6 +357,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/fake/location/',
                 dst=backup_info.get_data_directory(16387),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.TABLESPACE_CLASS,
                 exclude=["/*"] + EXCLUDE_LIST,
@@ -295,6 +367,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/another/location/',
                 dst=backup_info.get_data_directory(16405),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.TABLESPACE_CLASS,
                 exclude=["/*"] + EXCLUDE_LIST,
@@ -304,6 +377,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/pg/data/',
                 dst=backup_info.get_data_directory(),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.PGDATA_CLASS,
                 exclude=(PGDATA_EXCLUDE_LIST + EXCLUDE_LIST),
@@ -371,6 +445,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/pg/data/tbs1/',
                 dst=backup_info.get_data_directory(16387),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.TABLESPACE_CLASS,
                 exclude=["/*"] + EXCLUDE_LIST,
@@ -380,6 +455,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/pg/data/pg_tblspc/tbs2/',
                 dst=backup_info.get_data_directory(16405),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.TABLESPACE_CLASS,
                 exclude=["/*"] + EXCLUDE_LIST,
@@ -389,6 +465,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/pg/data3/',
                 dst=backup_info.get_data_directory(123456),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.TABLESPACE_CLASS,
                 exclude=["/*"] + EXCLUDE_LIST,
@@ -398,6 +475,7 @@ class TestRsyncBackupExecutor(object):
                 src=':/pg/data/',
                 dst=backup_info.get_data_directory(),
                 reuse=None,
+                reuse_manifest=None,
                 bwlimit=None,
                 item_class=rsync_mock.return_value.PGDATA_CLASS,
                 exclude=(PGDATA_EXCLUDE_LIST + EXCLUDE_LIST),
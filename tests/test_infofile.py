@@ -24,8 +24,8 @@ import mock
 import pytest
 from dateutil.tz import tzlocal, tzoffset
 
-from barman.infofile import (BackupInfo, Field, FieldListFile, LocalBackupInfo,
-                             WalFileInfo, load_datetime_tz)
+from barman.infofile import (BackupInfo, Field, FieldListFile, FileManifest,
+                             LocalBackupInfo, WalFileInfo, load_datetime_tz)
 from testing_helpers import (build_backup_manager, build_mocked_server,
                              build_real_server)
 
@@ -602,3 +602,44 @@ class TestBackupInfo(object):
         # The following constructor will raise a RuntimeError if we are
         # needing a PostgreSQL connection
         LocalBackupInfo(server, backup_id="fake_backup_id")
+
+
+class TestFileManifest(object):
+    def test_write_and_read(self, tmpdir):
+        manifest = FileManifest(tmpdir.join('files.manifest').strpath)
+        assert not manifest.exists()
+
+        data = tmpdir.join('data', 'base', 'file with spaces')
+        data.write('x' * 100, ensure=True)
+        pg_version = tmpdir.join('data', 'PG_VERSION')
+        pg_version.write('12\n')
+        with manifest.writer() as add:
+            add('data/base/file with spaces', os.stat(data.strpath))
+            add('data/PG_VERSION', os.stat(pg_version.strpath))
+        assert manifest.exists()
+        assert not tmpdir.join('files.manifest.tmp').check()
+
+        entries = list(manifest.read())
+        assert [entry.path for entry in entries] == [
+            'data/base/file with spaces', 'data/PG_VERSION']
+        assert entries[0].size == 100
+        assert entries[0].mode == os.stat(data.strpath).st_mode
+        assert entries[0].date == datetime.fromtimestamp(
+            int(data.mtime()), tzlocal())
+
+        # Reading with a prefix returns relative paths
+        entries = list(manifest.read('data/base'))
+        assert [entry.path for entry in entries] == ['file with spaces']
+        assert list(manifest.read('other')) == []
+
+    def test_write_error(self, tmpdir):
+        manifest_file = tmpdir.join('files.manifest')
+        manifest_file.write('data/old\n')
+        manifest = FileManifest(manifest_file.strpath)
+        with pytest.raises(OSError):
+            with manifest.writer() as add:
+                add('data/PG_VERSION', os.stat(tmpdir.strpath))
+                raise OSError('fake error')
+        # The existing manifest has not been touched
+        assert manifest_file.read() == 'data/old\n'
+        assert not tmpdir.join('files.manifest.tmp').check()
@@ -1182,6 +1182,27 @@ class TestConsoleWriter(object):
         # TODO: this test can be expanded
         assert err == ''
 
+    def test_result_show_backup_copy_stats(self, capsys):
+        # mock the backup ext info with transfer statistics
+        copy_stats = dict(
+            copy_time=10, analysis_time=0, number_of_workers=2,
+            transferred_files=42, transferred_bytes=2097152,
+            literal_bytes=1048576, matched_bytes=1048576,
+            throughput=209715.2,
+            throughput_per_phase=dict(safe=1048576, checksum=104857.6))
+        ext_info = mock_backup_ext_info(status=BackupInfo.DONE)
+        ext_info['copy_stats'] = copy_stats
+
+        writer = output.ConsoleOutputWriter()
+        writer.result_show_backup(ext_info)
+        writer.close()
+        (out, err) = capsys.readouterr()
+        assert 'Transferred data     : 2.0 MiB in 42 files ' \
+            '(literal: 1.0 MiB, matched: 1.0 MiB)' in out
+        assert 'Transfer throughput  : 204.8 KiB/s ' \
+            '(checksum: 102.4 KiB/s, safe: 1.0 MiB/s)' in out
+        assert err == ''
+
     def test_result_show_backup_error(self, capsys):
         # mock the backup ext info
         msg = 'test error message'
@@ -1767,6 +1788,43 @@ class TestJsonWriter(object):
 
         assert err == ''
 
+    def test_result_show_backup_copy_stats(self, capsys):
+        # mock the backup ext info with transfer statistics
+        copy_stats = dict(
+            copy_time=10, analysis_time=0, number_of_workers=2,
+            transferred_files=42, transferred_bytes=2097152,
+            literal_bytes=1048576, matched_bytes=1048576,
+            throughput=209715.2,
+            throughput_per_item=dict(pgdata=209715.2),
+            throughput_per_phase=dict(safe=1048576, checksum=104857.6),
+            throughput_per_worker={'0': 104857.6, '1': 104857.6})
+        ext_info = mock_backup_ext_info(status=BackupInfo.DONE)
+        ext_info['copy_stats'] = copy_stats
+        server_name = ext_info['server_name']
+
+        writer = output.JsonOutputWriter()
+        writer.result_show_backup(ext_info)
+        writer.close()
+
+        (out, err) = capsys.readouterr()
+        json_output = json.loads(out)
+
+        base_information = json_output[server_name]['base_backup_information']
+        assert base_information['transferred_size'] == '2.0 MiB'
+        assert base_information['transferred_bytes'] == 2097152
+        assert base_information['transferred_files'] == 42
+        assert base_information['literal_bytes'] == 1048576
+        assert base_information['matched_bytes'] == 1048576
+        assert base_information['transfer_throughput'] == '204.8 KiB/s'
+        assert base_information['transfer_throughput_bytes'] == 209715.2
+        assert base_information['throughput_per_item'] == dict(
+            pgdata=209715.2)
+        assert base_information['throughput_per_phase'] == dict(
+            safe=1048576, checksum=104857.6)
+        assert base_information['throughput_per_worker'] == {
+            '0': 104857.6, '1': 104857.6}
+        assert err == ''
+
     def test_result_show_backup_error(self, capsys):
         # mock the backup ext info
         msg = 'test error message'
@@ -0,0 +1,225 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+from barman import pagedelta
+from barman.pagedelta import (BLOCK_SIZE, DELTA_SUFFIX, ZERO_PAGE_FLAG,
+                              apply_deltas, is_relation_file, page_byte_order,
+                              page_lsn, read_page_map, reconstruct_directory,
+                              store_as_delta, store_directory_deltas,
+                              write_delta)
+from testing_helpers import build_relation_page as make_page
+from testing_helpers import write_relation_file as write_pages
+
+ZERO_PAGE = b'\0' * BLOCK_SIZE
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class TestPageDelta(object):
+
+    @pytest.mark.parametrize(('path', 'expected'), [
+        ('base/16384/1234', True),
+        ('base/16384/1234.12', True),
+        ('global/1262', True),
+        ('PG_13_202007201/16384/1234', True),
+        ('base/16384/1234_fsm', False),
+        ('base/16384/1234_vm', False),
+        ('base/16384/pg_filenode.map', False),
+        ('global/pg_control', False),
+        ('pg_xact/0000', False),
+        ('PG_VERSION', False),
+    ])
+    def test_is_relation_file(self, path, expected):
+        assert is_relation_file(path) == expected
+
+    def test_page_header(self):
+        page = make_page(0x100000002)
+        assert page_byte_order(page) == '<'
+        assert page_lsn(page) == 0x100000002
+
+        page = make_page(0x100000002, order='>')
+        assert page_byte_order(page) == '>'
+        assert page_lsn(page, '>') == 0x100000002
+
+        assert page_byte_order(b'y' * BLOCK_SIZE) is None
+
+    def test_write_and_apply_delta(self, tmpdir):
+        base = tmpdir.join('base').strpath
+        relation = tmpdir.join('relation').strpath
+        delta = tmpdir.join('relation' + DELTA_SUFFIX).strpath
+        dst = tmpdir.join('dst').strpath
+        write_pages(base, [make_page(0x100, b'a')] * 4)
+        new_pages = [
+            make_page(0x100, b'a'),
+            # Changed after the start of the base backup
+            make_page(0x2000, b'b'),
+            make_page(0x100, b'a'),
+            # Zeroed
+            ZERO_PAGE,
+            # New pages are always part of the delta
+            make_page(0x200, b'c'),
+            make_page(0x3000, b'd'),
+        ]
+        write_pages(relation, new_pages)
+
+        size = write_delta(relation, delta, os.path.getsize(base), 0x1000)
+        assert size == os.path.getsize(delta)
+        with open(delta, 'rb') as f:
+            block_size, file_size, page_map = read_page_map(f)
+        assert block_size == BLOCK_SIZE
+        assert file_size == 6 * BLOCK_SIZE
+        assert page_map == [1, 3 | ZERO_PAGE_FLAG, 4, 5]
+
+        apply_deltas(base, [delta], dst)
+        assert read_file(dst) == b''.join(new_pages)
+
+    def test_apply_delta_chain(self, tmpdir):
+        base = tmpdir.join('base').strpath
+        relation = tmpdir.join('relation').strpath
+        dst = tmpdir.join('dst').strpath
+        write_pages(base, [make_page(0x100, b'a')] * 4)
+
+        # The first delta changes the second page
+        delta1 = tmpdir.join('delta1').strpath
+        write_pages(relation, [make_page(0x100, b'a'),
+                               make_page(0x2000, b'b'),
+                               make_page(0x100, b'a'),
+                               make_page(0x100, b'a')])
+        write_delta(relation, delta1, 4 * BLOCK_SIZE, 0x1000)
+
+        # The second delta changes the first page and truncates the file
+        delta2 = tmpdir.join('delta2').strpath
+        pages = [make_page(0x3000, b'c'), make_page(0x2000, b'b')]
+        write_pages(relation, pages)
+        write_delta(relation, delta2, 4 * BLOCK_SIZE, 0x2001)
+
+        apply_deltas(base, [delta1, delta2], dst)
+        assert read_file(dst) == b''.join(pages)
+
+    def test_write_delta_not_applicable(self, tmpdir):
+        relation = tmpdir.join('relation').strpath
+        delta = tmpdir.join('relation' + DELTA_SUFFIX).strpath
+
+        # Not a relation file
+        write_pages(relation, [make_page(0x100), b'y' * BLOCK_SIZE])
+        assert write_delta(relation, delta, BLOCK_SIZE, 0x1000) is None
+        assert not os.path.exists(delta)
+
+        # The size of the reference file is not a multiple of a page
+        write_pages(relation, [make_page(0x100)])
+        assert write_delta(relation, delta, 100, 0x1000) is None
+        assert not os.path.exists(delta)
+
+        # The delta would be too large
+        write_pages(relation, [make_page(0x2000)] * 4)
+        assert write_delta(relation, delta, 4 * BLOCK_SIZE, 0x1000,
+                           max_size=2 * BLOCK_SIZE) is None
+        assert not os.path.exists(delta)
+
+    def test_store_as_delta(self, tmpdir):
+        base = tmpdir.join('base').strpath
+        relation = tmpdir.join('relation').strpath
+        delta = relation + DELTA_SUFFIX
+        write_pages(base, [make_page(0x100)] * 4)
+        pages = [make_page(0x100)] * 3 + [make_page(0x2000, b'b')]
+        write_pages(relation, pages)
+        os.chmod(relation, 0o600)
+        os.utime(relation, (1500000000, 1500000000))
+
+        assert store_as_delta(relation, base, 0x1000)
+        assert not os.path.exists(relation)
+        assert os.stat(delta).st_mtime == 1500000000
+        assert os.stat(delta).st_mode & 0o777 == 0o600
+
+        # Missing reference file
+        write_pages(relation, pages)
+        assert not store_as_delta(
+            relation, tmpdir.join('missing').strpath, 0x1000)
+        assert os.path.exists(relation)
+
+        # Most of the pages changed
+        os.unlink(delta)
+        write_pages(relation, [make_page(0x2000)] * 4)
+        assert not store_as_delta(relation, base, 0x1000)
+        assert os.path.exists(relation)
+        assert not os.path.exists(delta)
+
+    def test_store_and_reconstruct_directory(self, tmpdir):
+        base_dir = tmpdir.join('base_backup').strpath
+        backup_dir = tmpdir.join('backup').strpath
+        view_dir = tmpdir.join('view').strpath
+        unchanged = [make_page(0x100, b'u')] * 4
+        changed = [make_page(0x100, b'a')] * 3 + [make_page(0x2000, b'b')]
+        for name in ('1234', '5678'):
+            write_pages(os.path.join(base_dir, 'base', '1', name),
+                        [make_page(0x100, b'a')] * 4)
+        write_pages(os.path.join(base_dir, 'base', '1', '9012'), unchanged)
+        # A changed relation file
+        write_pages(os.path.join(backup_dir, 'base', '1', '1234'), changed)
+        # A relation file with too many changes
+        write_pages(os.path.join(backup_dir, 'base', '1', '5678'),
+                    [make_page(0x2000, b'c')] * 4)
+        # An unchanged relation file, hard linked to the base backup
+        os.link(os.path.join(base_dir, 'base', '1', '9012'),
+                os.path.join(backup_dir, 'base', '1', '9012'))
+        # Other files are always kept
+        write_pages(os.path.join(backup_dir, 'PG_VERSION'), [b'13\n'])
+        write_pages(os.path.join(backup_dir, 'pg_xact', '0000'), changed)
+        os.symlink('PG_VERSION', os.path.join(backup_dir, 'link'))
+
+        assert store_directory_deltas(
+            backup_dir, base_dir, 0x1000, workers=2) == 1
+        assert sorted(os.listdir(os.path.join(backup_dir, 'base', '1'))) \
+            == ['1234' + DELTA_SUFFIX, '5678', '9012']
+
+        assert reconstruct_directory(
+            backup_dir, base_dir, view_dir, workers=2) == 1
+        relation = os.path.join(view_dir, 'base', '1', '1234')
+        assert read_file(relation) == b''.join(changed)
+        assert os.stat(relation).st_mtime == os.stat(os.path.join(
+            backup_dir, 'base', '1', '1234' + DELTA_SUFFIX)).st_mtime
+        assert read_file(os.path.join(view_dir, 'base', '1', '5678')) == \
+            b''.join([make_page(0x2000, b'c')] * 4)
+        assert os.stat(
+            os.path.join(view_dir, 'base', '1', '9012')).st_nlink == 3
+        assert read_file(os.path.join(view_dir, 'PG_VERSION')) == b'13\n'
+        assert os.readlink(os.path.join(view_dir, 'link')) == 'PG_VERSION'
+        assert os.path.exists(os.path.join(view_dir, 'pg_xact', '0000'))
+        assert not os.path.exists(
+            os.path.join(view_dir, 'base', '1', '1234' + DELTA_SUFFIX))
+
+    def test_store_directory_deltas_empty(self, tmpdir):
+        tmpdir.join('backup', 'PG_VERSION').ensure()
+        assert store_directory_deltas(
+            tmpdir.join('backup').strpath,
+            tmpdir.join('base').strpath, 0x1000) == 0
+
+    def test_max_delta_ratio(self, tmpdir, monkeypatch):
+        base = tmpdir.join('base').strpath
+        relation = tmpdir.join('relation').strpath
+        write_pages(base, [make_page(0x100)] * 4)
+        write_pages(relation, [make_page(0x2000)] * 3 + [make_page(0x100)])
+        assert not store_as_delta(relation, base, 0x1000)
+        monkeypatch.setattr(pagedelta, 'MAX_DELTA_RATIO', 1)
+        assert store_as_delta(relation, base, 0x1000)
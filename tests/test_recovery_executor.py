@@ -15,8 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
+import bz2
+import gzip
 import os
 import shutil
+import threading
 import time
 from contextlib import closing
 
@@ -26,13 +29,17 @@ import pytest
 from mock import MagicMock
 
 import testing_helpers
-from barman import xlog
-from barman.exceptions import (CommandFailedException,
+from barman import tarstorage, xlog
+from barman.chunkstore import ChunkStore, store_backup
+from barman.exceptions import (CommandFailedException, DataTransferFailure,
                                RecoveryInvalidTargetException,
                                RecoveryStandbyModeException,
                                RecoveryTargetActionException)
+from barman.fs import UnixLocalCommand
 from barman.infofile import BackupInfo, WalFileInfo
+from barman.pagedelta import store_directory_deltas
 from barman.recovery_executor import Assertion, RecoveryExecutor
+from barman.xlog import parse_lsn
 
 
 # noinspection PyMethodMayBeStatic
@@ -185,6 +192,7 @@ class TestRecoveryExecutor(object):
             'is_pitr': False,
             'wal_dest': wal_dest.strpath,
             'get_wal': False,
+            'compressed_wals': False,
         }
         backup_info = testing_helpers.build_test_backup_info(
             end_time=dateutil.parser.parse('2015-06-03 16:11:01.71038+02'))
@@ -354,6 +362,7 @@ class TestRecoveryExecutor(object):
             'tempdir': tmpdir.strpath,
             'results': {'changes': [], 'warnings': []},
             'get_wal': False,
+            'compressed_wals': False,
         }
         backup_info = testing_helpers.build_test_backup_info()
         dest = tmpdir.mkdir('destination')
@@ -460,6 +469,7 @@ class TestRecoveryExecutor(object):
             'tempdir': tmpdir.strpath,
             'results': {'changes': [], 'warnings': []},
             'get_wal': False,
+            'compressed_wals': False,
         }
         backup_info = testing_helpers.build_test_backup_info(
             version=120000,
@@ -603,6 +613,41 @@ class TestRecoveryExecutor(object):
         # standby_mode is not a valid configuration in PostgreSQL 12
         assert 'standby_mode' not in pg_auto_conf
 
+    @mock.patch('barman.recovery_executor.socket.getfqdn')
+    @mock.patch('barman.recovery_executor.RsyncPgData')
+    def test_generate_recovery_conf_compressed_wals(self, rsync_pg_mock,
+                                                    getfqdn_mock, tmpdir):
+        """
+        Test the restore_command using barman-wal-restore when the WAL files
+        are transferred compressed
+        """
+        getfqdn_mock.return_value = 'barman.example.com'
+        recovery_info = {
+            'configuration_files': ['postgresql.conf', 'postgresql.auto.conf'],
+            'tempdir': tmpdir.strpath,
+            'results': {'changes': [], 'warnings': []},
+            'get_wal': True,
+            'compressed_wals': True,
+        }
+        backup_info = testing_helpers.build_test_backup_info(
+            version=120000,
+        )
+        dest = tmpdir.mkdir('destination')
+        for compression, option in (('pigz', ' -z'), ('pybzip2', ' -j'),
+                                    ('custom', '')):
+            server = testing_helpers.build_real_server(
+                main_conf={'compression': compression})
+            executor = RecoveryExecutor(server.backup_manager)
+            executor._generate_recovery_conf(recovery_info, backup_info,
+                                             dest.strpath,
+                                             None, True, 'remote@command',
+                                             None, None, None,
+                                             None, None, None)
+            pg_auto_conf = self.parse_auto_conf_lines(recovery_info)
+            assert pg_auto_conf['restore_command'] == (
+                "'barman-wal-restore -P%s -U {USER} "
+                "barman.example.com main %%f %%p'" % option)
+
     def parse_auto_conf_lines(self, recovery_info):
         assert 'auto_conf_append_lines' in recovery_info
         pg_auto_conf = {}
@@ -665,6 +710,150 @@ class TestRecoveryExecutor(object):
             mock.call().copy(),
         ]
 
+    @mock.patch('barman.recovery_executor.RsyncCopyController')
+    def test_recover_backup_copy_page_deltas(self, copy_controller_mock,
+                                             tmpdir):
+        """
+        Test the copy of a backup containing page deltas during a recovery
+        """
+        dest = tmpdir.mkdir('destination')
+        server = testing_helpers.build_real_server(
+            global_conf={'barman_home': tmpdir.strpath})
+        base_info = testing_helpers.build_test_backup_info(
+            server=server, backup_id='base', tablespaces=None)
+        base_info.save()
+        backup_info = testing_helpers.build_test_backup_info(
+            server=server, backup_id='delta', tablespaces=None)
+        backup_info.set_attribute('delta_base', 'base')
+        backup_info.save()
+        base_dir = base_info.get_data_directory()
+        backup_dir = backup_info.get_data_directory()
+        pages = [testing_helpers.build_relation_page(0x100, b'a')] * 4
+        testing_helpers.write_relation_file(
+            os.path.join(base_dir, 'base', '1', '1234'), pages)
+        pages[3] = testing_helpers.build_relation_page(0x3000000, b'b')
+        testing_helpers.write_relation_file(
+            os.path.join(backup_dir, 'base', '1', '1234'), pages)
+        assert store_directory_deltas(
+            backup_dir, base_dir, parse_lsn(base_info.begin_xlog)) == 1
+
+        # Check the content of the source directory during the copy
+        copied = {}
+
+        def copy():
+            src = copy_controller_mock.return_value.add_directory.call_args[
+                1]['src']
+            with open(os.path.join(src, 'base', '1', '1234'), 'rb') as f:
+                copied['src'] = src
+                copied['content'] = f.read()
+
+        copy_controller_mock.return_value.copy.side_effect = copy
+        executor = RecoveryExecutor(server.backup_manager)
+        executor._backup_copy(backup_info, dest.strpath)
+
+        assert copied['content'] == b''.join(pages)
+        assert copied['src'].startswith(
+            backup_info.get_basebackup_directory())
+        assert not os.path.exists(copied['src'])
+
+        # The base backup must be available
+        server.backup_manager.get_backup = mock.Mock(return_value=None)
+        with pytest.raises(DataTransferFailure) as exc:
+            executor._backup_copy(backup_info, dest.strpath)
+        assert 'base backup base is not available' in str(exc.value)
+
+    @mock.patch('barman.recovery_executor.RsyncCopyController')
+    def test_recover_backup_copy_chunks(self, copy_controller_mock, tmpdir):
+        """
+        Test the copy of a backup stored in the chunk store during a recovery
+        """
+        dest = tmpdir.mkdir('destination')
+        server = testing_helpers.build_real_server(
+            global_conf={'barman_home': tmpdir.strpath})
+        backup_info = testing_helpers.build_test_backup_info(
+            server=server, backup_id='chunks', tablespaces=None)
+        backup_info.set_attribute('backup_storage', 'chunks')
+        backup_info.save()
+        data_dir = backup_info.get_data_directory()
+        os.makedirs(os.path.join(data_dir, 'base', '1'))
+        with open(os.path.join(data_dir, 'base', '1', '1234'), 'wb') as f:
+            f.write(b'x' * 8192)
+        store_backup(backup_info.get_basebackup_directory(), ['data'],
+                     ChunkStore(server.config.chunk_store_directory))
+        assert not os.path.exists(data_dir)
+
+        # Check the content of the source directory during the copy
+        copied = {}
+
+        def copy():
+            src = copy_controller_mock.return_value.add_directory.call_args[
+                1]['src']
+            with open(os.path.join(src, 'base', '1', '1234'), 'rb') as f:
+                copied['src'] = src
+                copied['content'] = f.read()
+
+        copy_controller_mock.return_value.copy.side_effect = copy
+        executor = RecoveryExecutor(server.backup_manager)
+        executor._backup_copy(backup_info, dest.strpath)
+
+        assert copied['content'] == b'x' * 8192
+        assert copied['src'].startswith(
+            backup_info.get_basebackup_directory())
+        assert not os.path.exists(copied['src'])
+
+    @mock.patch('barman.recovery_executor.RsyncCopyController')
+    def test_recover_backup_copy_tar(self, copy_controller_mock, tmpdir):
+        """
+        Test the copy of a backup stored in archives during a recovery
+        """
+        dest = tmpdir.mkdir('destination')
+        server = testing_helpers.build_real_server(
+            global_conf={'barman_home': tmpdir.strpath})
+        backup_info = testing_helpers.build_test_backup_info(
+            server=server, backup_id='tar', tablespaces=None)
+        backup_info.set_attribute('backup_storage', 'tar')
+        backup_info.save()
+        data_dir = backup_info.get_data_directory()
+        os.makedirs(os.path.join(data_dir, 'base', '1'))
+        with open(os.path.join(data_dir, 'base', '1', '1234'), 'wb') as f:
+            f.write(b'x' * 8192)
+        with open(os.path.join(data_dir, 'postgresql.conf'), 'w') as f:
+            f.write('port = 5432\n')
+        tarstorage.store_backup(backup_info.get_basebackup_directory(),
+                                ['data'])
+        assert not os.path.exists(data_dir)
+
+        # Check the content of the source directory during the copy
+        copied = {}
+
+        def copy():
+            src = copy_controller_mock.return_value.add_directory.call_args[
+                1]['src']
+            with open(os.path.join(src, 'base', '1', '1234'), 'rb') as f:
+                copied['src'] = src
+                copied['content'] = f.read()
+
+        copy_controller_mock.return_value.copy.side_effect = copy
+        executor = RecoveryExecutor(server.backup_manager)
+        executor._backup_copy(backup_info, dest.strpath)
+
+        assert copied['content'] == b'x' * 8192
+        assert not os.path.exists(copied['src'])
+
+        # The configuration files are extracted for a remote recovery
+        tempdir = tmpdir.mkdir('tempdir')
+        recovery_info = {
+            'configuration_files': ['postgresql.conf'],
+            'tempdir': tempdir.strpath,
+            'temporary_configuration_files': [],
+            'results': {'changes': [], 'warnings': [], 'missing_files': []},
+        }
+        executor._map_temporary_config_files(recovery_info, backup_info,
+                                             'ssh@something')
+        assert tempdir.join('postgresql.conf').read() == 'port = 5432\n'
+        assert recovery_info['results']['missing_files'] == [
+            'pg_hba.conf', 'pg_ident.conf']
+
     @mock.patch('barman.backup.CompressionManager')
     @mock.patch('barman.recovery_executor.RsyncPgData')
     def test_recover_xlog(self, rsync_pg_mock, cm_mock, tmpdir):
@@ -743,6 +932,179 @@ class TestRecoveryExecutor(object):
         c['bzip2'].decompress.assert_called_once_with(xlog_bz2.strpath,
                                                       mock.ANY)
 
+    @mock.patch('barman.backup.CompressionManager')
+    @mock.patch('barman.recovery_executor.RsyncPgData')
+    def test_recover_xlog_parallel(self, rsync_pg_mock, cm_mock, tmpdir):
+        """
+        Test the parallel decompression of the WAL files, pipelined with
+        their transfer during a remote recovery
+        """
+        dest = tmpdir.mkdir('destination')
+        wals = tmpdir.mkdir('wals')
+        names = ['00000001%08X000000%02X' % (log, seg)
+                 for log in range(4) for seg in range(3)]
+        for name in names:
+            wals.join(xlog.hash_dir(name), name).write('content', ensure=True)
+        server = testing_helpers.build_real_server(
+            main_conf={'wals_directory': wals.strpath,
+                       'parallel_jobs': '4'})
+        gzip_mock = mock.Mock(name='gzip')
+        cm_mock.return_value.get_compressor.return_value = gzip_mock
+        gzip_mock.decompress.side_effect = \
+            lambda src, dst: shutil.copy(src, dst)
+        required_wals = tuple(
+            WalFileInfo.from_xlogdb_line('%s\t42\t43\tgzip\n' % name)
+            for name in names)
+        executor = RecoveryExecutor(server.backup_manager)
+
+        # Local recovery: every file is decompressed in the destination
+        executor._xlog_copy(required_wals, dest.strpath, None)
+        assert sorted(os.listdir(dest.strpath)) == names
+        assert gzip_mock.decompress.call_count == len(names)
+        assert not rsync_pg_mock.return_value.from_file_list.called
+
+        # Remote recovery: the files of a directory are decompressed
+        # before its transfer, and removed after it
+        transferred = []
+
+        def from_file_list(file_list, src, dst):
+            assert sorted(os.listdir(src))[:len(file_list)] == file_list
+            transferred.extend(file_list)
+
+        rsync_pg_mock.return_value.from_file_list.side_effect = \
+            from_file_list
+        executor._xlog_copy(required_wals, dest.strpath, 'remote_command')
+        assert transferred == names
+        assert rsync_pg_mock.return_value.from_file_list.call_count == 4
+        spool = rsync_pg_mock.return_value.from_file_list.call_args[0][1]
+        assert not os.path.exists(spool)
+
+        # Decompression errors stop the recovery
+        gzip_mock.decompress.side_effect = CommandFailedException('error')
+        with pytest.raises(CommandFailedException):
+            executor._xlog_copy(required_wals, dest.strpath,
+                                'remote_command')
+
+    @mock.patch('barman.backup.CompressionManager')
+    @mock.patch('barman.recovery_executor.RsyncPgData')
+    def test_recover_xlog_concurrent_failure(self, rsync_pg_mock, cm_mock,
+                                             tmpdir):
+        """
+        Test that a decompression failure is not hidden by the other
+        decompressions running concurrently
+        """
+        dest = tmpdir.mkdir('destination')
+        wals = tmpdir.mkdir('wals')
+        names = ['000000010000000000000001', '000000010000000000000002']
+        for name in names:
+            wals.join(xlog.hash_dir(name), name).write('content', ensure=True)
+        server = testing_helpers.build_real_server(
+            main_conf={'wals_directory': wals.strpath,
+                       'parallel_jobs': '2'})
+        other_done = threading.Event()
+
+        class StatefulCompressor(object):
+            """
+            Like the Command objects, store the exit code of the
+            decompression and check it afterwards
+            """
+
+            def __init__(self, *args, **kwargs):
+                self.ret = None
+
+            def decompress(self, src, dst):
+                self.ret = 1 if src.endswith(names[0]) else 0
+                if self.ret:
+                    # Let the other decompression finish in the meantime
+                    other_done.wait(5)
+                else:
+                    open(dst, 'w').close()
+                    other_done.set()
+                if self.ret:
+                    raise CommandFailedException(dict(
+                        ret=self.ret, out='', err='error'))
+
+        cm_mock.return_value.get_compressor.side_effect = StatefulCompressor
+        required_wals = tuple(
+            WalFileInfo.from_xlogdb_line('%s\t42\t43\tgzip\n' % name)
+            for name in names)
+        executor = RecoveryExecutor(server.backup_manager)
+        with pytest.raises(CommandFailedException):
+            executor._xlog_copy(required_wals, dest.strpath, None)
+        assert other_done.is_set()
+
+    @mock.patch('barman.backup.CompressionManager')
+    @mock.patch('barman.recovery_executor.RsyncPgData')
+    def test_recover_xlog_remote_decompression(self, rsync_pg_mock, cm_mock,
+                                               tmpdir):
+        """
+        Test the transfer of compressed WAL files during a remote recovery,
+        decompressing them on the target host
+        """
+        dest = tmpdir.mkdir('destination')
+        wals = tmpdir.mkdir('wals')
+        names = ['00000001%08X000000%02X' % (log, seg)
+                 for log in range(2) for seg in range(3)]
+        required_wals = []
+        for name in names:
+            content = ('content of %s' % name).encode()
+            compression = 'bzip2' if name.endswith('2') else 'gzip'
+            wal = wals.join(xlog.hash_dir(name), name)
+            wal.dirpath().ensure(dir=True)
+            if compression == 'gzip':
+                with gzip.open(wal.strpath, 'wb') as f:
+                    f.write(content)
+            else:
+                wal.write_binary(bz2.compress(content))
+            required_wals.append(WalFileInfo.from_xlogdb_line(
+                '%s\t42\t43\t%s\n' % (name, compression)))
+        server = testing_helpers.build_real_server(
+            main_conf={'wals_directory': wals.strpath,
+                       'parallel_jobs': '2'})
+
+        # Simulate the transfer with a local copy
+        def from_file_list(file_list, src, dst):
+            assert dst == ':%s/' % dest.strpath
+            for name in file_list:
+                shutil.copy(os.path.join(src, name), dst[1:])
+
+        rsync_pg_mock.return_value.from_file_list.side_effect = \
+            from_file_list
+        executor = RecoveryExecutor(server.backup_manager)
+        executor._xlog_copy(tuple(required_wals), dest.strpath,
+                            'remote_command', UnixLocalCommand())
+        # The archived files are transferred and decompressed on the target
+        assert rsync_pg_mock.return_value.from_file_list.call_count == 2
+        assert rsync_pg_mock.return_value.from_file_list.call_args[0][1] == \
+            '%s/' % wals.join('0000000100000001').strpath
+        assert sorted(os.listdir(dest.strpath)) == names
+        for name in names:
+            assert dest.join(name).read() == 'content of %s' % name
+        assert not cm_mock.return_value.get_compressor.return_value.\
+            decompress.called
+
+        # Decompression errors stop the recovery
+        dest.join(names[0]).write('not compressed')
+        remote_cmd = mock.Mock()
+        remote_cmd.cmd.return_value = 123
+        remote_cmd.get_last_output.return_value = ('', 'error')
+        with pytest.raises(DataTransferFailure):
+            executor._xlog_copy(tuple(required_wals), dest.strpath,
+                                'remote_command', remote_cmd)
+
+        # Compression methods unknown to the target host are decompressed
+        # locally
+        required_wals[0].compression = 'custom'
+        decompress = cm_mock.return_value.get_compressor.return_value.\
+            decompress
+        decompress.side_effect = lambda src, dst: shutil.copy(src, dst)
+        rsync_pg_mock.return_value.from_file_list.side_effect = None
+        remote_cmd.reset_mock()
+        executor._xlog_copy(tuple(required_wals), dest.strpath,
+                            'remote_command', remote_cmd)
+        assert not remote_cmd.cmd.called
+        assert decompress.call_count == len(names)
+
     def test_prepare_tablespaces(self, tmpdir):
         """
         Test tablespaces preparation for recovery
@@ -861,6 +1223,7 @@ class TestRecoveryExecutor(object):
             'safe_horizon': None,
             'is_pitr': False,
             'get_wal': False,
+            'compressed_wals': False,
         }
         # test remote recovery
         with closing(executor):
@@ -917,6 +1280,7 @@ class TestRecoveryExecutor(object):
             'safe_horizon': None,
             'is_pitr': False,
             'get_wal': False,
+            'compressed_wals': False,
         }
         # test failed rsync
         rsync_pg_mock.side_effect = CommandFailedException()
@@ -28,6 +28,7 @@ from mock import MagicMock, PropertyMock, patch
 from psycopg2.tz import FixedOffsetTimezone
 
 from barman import output
+from barman.clients.walarchive import ChecksumTarFile
 from barman.exceptions import (LockFileBusy, LockFilePermissionDenied,
                                PostgresDuplicateReplicationSlot,
                                PostgresInvalidReplicationSlot,
@@ -253,6 +254,46 @@ class TestServer(object):
         # check for the presence of the .history file
         assert history_info.name in wals
 
+    def test_get_required_xlog_files(self, tmpdir):
+        """
+        Test the selection of the WAL files required by a recovery
+        """
+        names = ['00000001000000000000000%X' % seg for seg in range(1, 10)]
+        lines = ['%s\t42\t%s\tNone\n' % (name, 100 + seg)
+                 for seg, name in enumerate(names)]
+        lines.insert(0, '00000001.history\t42\t99\tNone\n')
+        lines.append('00000002.history\t42\t200\tNone\n')
+        lines.append('000000020000000000000009\t42\t201\tNone\n')
+        wals_dir = tmpdir.mkdir('wals')
+        wals_dir.join('xlog.db').write(''.join(lines))
+        server = build_real_server(
+            global_conf={
+                "barman_lock_directory": tmpdir.mkdir('lock').strpath
+            },
+            main_conf={
+                "wals_directory": wals_dir.strpath
+            })
+        backup = build_test_backup_info(
+            begin_wal='000000010000000000000002',
+            end_wal='000000010000000000000003')
+        history = ['00000001.history', '00000002.history']
+
+        def required(*args, **kwargs):
+            return [wal_info.name for wal_info in
+                    server.get_required_xlog_files(backup, *args, **kwargs)]
+
+        # No target: every WAL file of the timeline
+        assert required() == history + names[1:]
+        assert required(target_tli=2) == history + names[1:] + [
+            '000000020000000000000009']
+        # Stop at the first WAL file past the target
+        assert required(target_time=103.5) == history + names[1:5]
+        assert required(target_lsn='0/5000028') == history + names[1:6]
+        assert required(target_immediate=True) == history + names[1:4]
+        # The target cannot stop the recovery before the end of the backup
+        assert required(target_lsn='0/1000028') == history + names[1:4]
+        assert wals_dir.join('xlog.db.index').check()
+
     @patch('barman.server.Server.get_remote_status')
     def test_pg_stat_archiver_show(self, remote_mock, capsys):
         """
@@ -1524,9 +1565,10 @@ class TestServer(object):
                "for server 'main' (SSH host: 192.168.66.99)\n" in err
         assert output.error_occurred
 
-    @patch('barman.server.fsync_file')
+    @patch('barman.server.os.fsync')
     @patch('barman.server.fsync_dir')
-    def test_put_wal_fsync(self, fd_mock, ff_mock, tmpdir, capsys, caplog):
+    def test_put_wal_fsync(self, fd_mock, fsync_mock, tmpdir, capsys,
+                           caplog):
         # See all logs
         caplog.set_level(0)
 
@@ -1570,14 +1612,132 @@ class TestServer(object):
                "with checksum '34743e1e454e967eb76a16c66372b0ef' " \
                "by put-wal for server 'main'\n" in caplog.text
 
-        # Verify fsync calls
-        ff_mock.assert_called_once_with(dest_file.strpath)
+        # Verify fsync calls: the file is synced only once, while written
+        assert fsync_mock.call_count == 1
         fd_mock.assert_called_once_with(incoming.strpath)
 
         # Verify file mtime
         # Use a round(2) comparison because float is not precise in Python 2.x
         assert round(wal.mtime(), 2) == round(dest_file.mtime(), 2)
 
+    @pytest.mark.parametrize('compression', ['gzip', 'bzip2'])
+    def test_put_wal_client_compression(self, compression, tmpdir, capsys):
+        lab = tmpdir.mkdir('lab')
+        incoming = tmpdir.mkdir('incoming')
+        server = build_real_server(
+            main_conf={
+                "incoming_wals_directory": incoming.strpath,
+                "compression": "pygzip",
+                # Silence the warning for default backup strategy
+                'backup_options': 'exclusive_backup',
+            })
+        output.error_occurred = False
+
+        # Generate a tar containing a compressed file, as sent by
+        # barman-wal-archive
+        tar_file = BytesIO()
+        tar = ChecksumTarFile.open(mode='w|', fileobj=tar_file)
+        wal = lab.join('00000001000000EF000000AB')
+        wal.write('some random content', ensure=True)
+        tar.addcompressed(wal.strpath, wal.basename, compression)
+        tar.close()
+
+        # Feed the data to put-wal
+        tar_file.seek(0)
+        server.put_wal(tar_file)
+        out, err = capsys.readouterr()
+        assert not err
+        assert not output.error_occurred
+
+        # The file is stored as it has been received, without being
+        # compressed again
+        dest_file = incoming.join(wal.basename)
+        comp_manager = server.backup_manager.compression_manager
+        wal_info = comp_manager.get_wal_file_info(dest_file.strpath)
+        assert wal_info.compression == compression
+        uncompressed = lab.join('uncompressed')
+        comp_manager.get_compressor(compression).decompress(
+            dest_file.strpath, uncompressed.strpath)
+        assert uncompressed.read() == wal.read()
+
+    def test_put_wal_client_compression_errors(self, tmpdir, capsys):
+        lab = tmpdir.mkdir('lab')
+        incoming = tmpdir.mkdir('incoming')
+        server = build_real_server(
+            main_conf={
+                "incoming_wals_directory": incoming.strpath,
+            })
+        output.error_occurred = False
+
+        # Send a file with an unknown compression
+        tar_file = BytesIO()
+        tar = ChecksumTarFile.open(mode='w|', fileobj=tar_file)
+        wal = lab.join('00000001000000EF000000AB')
+        wal.write('some random content', ensure=True)
+        tarinfo = tar.gettarinfo(wal.strpath, wal.basename)
+        tarinfo.pax_headers['BARMAN.compression'] = 'unknown'
+        with open(wal.strpath, 'rb') as fileobj:
+            tar.addfile(tarinfo, fileobj)
+        tar.close()
+
+        tar_file.seek(0)
+        server.put_wal(tar_file)
+        out, err = capsys.readouterr()
+        assert "Unsupported compression 'unknown' for file " \
+               "'00000001000000EF000000AB' in put-wal for server 'main'" \
+               in err
+        assert output.error_occurred
+        assert not incoming.listdir()
+
+    @pytest.mark.parametrize('compression, magic', [
+        [None, b'some'],
+        ['gzip', b'some'],
+        ['pygzip', b'\x1f\x8b\x08'],
+        ['pybzip2', b'BZh'],
+    ])
+    def test_put_wal_compression(self, compression, magic, tmpdir, capsys):
+        lab = tmpdir.mkdir('lab')
+        incoming = tmpdir.mkdir('incoming')
+        server = build_real_server(
+            main_conf={
+                "incoming_wals_directory": incoming.strpath,
+                "compression": compression,
+                # Silence the warning for default backup strategy
+                'backup_options': 'exclusive_backup',
+            })
+        output.error_occurred = False
+
+        # Generate some test data in an in_memory tar
+        tar_file = BytesIO()
+        tar = tarfile.open(mode='w|', fileobj=tar_file)
+        wal = lab.join('00000001000000EF000000AB')
+        wal.write('some random content', ensure=True)
+        tar.add(wal.strpath, wal.basename)
+        md5 = lab.join('MD5SUMS')
+        md5.write('%s *%s\n' % (wal.computehash('md5'), wal.basename))
+        tar.add(md5.strpath, md5.basename)
+        tar.close()
+
+        # Feed the data to put-wal
+        tar_file.seek(0)
+        server.put_wal(tar_file)
+        out, err = capsys.readouterr()
+        assert not err
+        assert not output.error_occurred
+
+        # Only compressors working within the Barman process are used
+        # while receiving the file, and the content is preserved
+        dest_file = incoming.join(wal.basename)
+        assert dest_file.read_binary().startswith(magic)
+        wal_info = server.backup_manager.compression_manager \
+            .get_wal_file_info(dest_file.strpath)
+        if wal_info.compression:
+            comp_manager = server.backup_manager.compression_manager
+            uncompressed = lab.join('uncompressed')
+            comp_manager.get_compressor(wal_info.compression).decompress(
+                dest_file.strpath, uncompressed.strpath)
+            assert uncompressed.read() == wal.read()
+
     def test_get_systemid_file_path(self):
         # Basic test for the get_systemid_file_path function
         server = build_real_server()
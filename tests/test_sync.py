@@ -62,6 +62,8 @@ EXPECTED_MINIMAL = {
             'backup_label': None,
             'included_files': None,
             'copy_stats': None,
+            'delta_base': None,
+            'backup_storage': 'plain',
             'xlog_segment_size': 16777216,
             'systemid': None,
         }
@@ -0,0 +1,138 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import io
+import os
+import stat
+import tarfile
+
+from barman.tarstorage import (TAR_SUFFIX, ParallelGzipWriter,
+                               archive_directory, extract_top_level_files,
+                               list_archives, restore_backup, store_backup)
+
+
+def write_file(path, content, mode=0o600, mtime=1500000000):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.chmod(path, mode)
+    os.utime(path, (mtime, mtime))
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class TestParallelGzipWriter(object):
+
+    def test_write(self):
+        data = os.urandom(1000) + b'a' * 10000
+        output = io.BytesIO()
+        writer = ParallelGzipWriter(output, workers=3, block_size=1000)
+        for offset in range(0, len(data), 300):
+            writer.write(data[offset:offset + 300])
+        writer.close()
+        # Every block is a gzip member
+        assert output.getvalue().count(b'\x1f\x8b\x08') >= 11
+        assert gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read() \
+            == data
+
+    def test_empty(self):
+        output = io.BytesIO()
+        ParallelGzipWriter(output).close()
+        assert gzip.GzipFile(
+            fileobj=io.BytesIO(output.getvalue())).read() == b''
+
+
+class TestTarStorage(object):
+
+    def test_archive_directory(self, tmpdir):
+        directory = tmpdir.join('data').strpath
+        archive = tmpdir.join('data' + TAR_SUFFIX).strpath
+        write_file(os.path.join(directory, 'base', '1', '1234'), b'x' * 9000)
+        write_file(os.path.join(directory, 'postgresql.conf'), b'port = 1\n')
+        write_file(os.path.join(directory, 'PG_VERSION'), b'13\n')
+        os.symlink('PG_VERSION', os.path.join(directory, 'link'))
+
+        files = archive_directory(directory, archive, workers=2)
+        assert sorted((path, file_stat.st_size)
+                      for path, file_stat in files) == [
+            ('PG_VERSION', 3),
+            ('base/1/1234', 9000),
+            ('postgresql.conf', 9),
+        ]
+        assert not os.path.exists(archive + '.tmp')
+        # The top level files come before the directories
+        with tarfile.open(archive) as tar:
+            assert tar.getnames() == [
+                'PG_VERSION', 'link', 'postgresql.conf',
+                'base', 'base/1', 'base/1/1234']
+
+    def test_store_and_restore(self, tmpdir):
+        backup_dir = tmpdir.join('backup').strpath
+        dst_dir = tmpdir.join('restore').strpath
+        write_file(os.path.join(backup_dir, 'data', 'base', '1', '1234'),
+                   b'x' * 9000)
+        write_file(os.path.join(backup_dir, 'data', 'postgresql.conf'),
+                   b'port = 1\n', mode=0o644)
+        os.makedirs(os.path.join(backup_dir, 'data', 'pg_wal'))
+        os.symlink('postgresql.conf',
+                   os.path.join(backup_dir, 'data', 'link'))
+        write_file(os.path.join(backup_dir, '16385', 'PG_13', '1', '5678'),
+                   b'y' * 100)
+        write_file(os.path.join(backup_dir, 'backup.info'), b'info')
+
+        files = store_backup(backup_dir, ['data', '16385'], workers=2)
+        assert sorted(path for path, _ in files) == [
+            '16385/PG_13/1/5678', 'data/base/1/1234', 'data/postgresql.conf']
+        assert sorted(os.listdir(backup_dir)) == [
+            '16385' + TAR_SUFFIX, 'backup.info', 'data' + TAR_SUFFIX]
+        assert list_archives(backup_dir) == ['16385', 'data']
+
+        assert restore_backup(backup_dir, dst_dir, workers=2) == \
+            ['16385', 'data']
+        relation = os.path.join(dst_dir, 'data', 'base', '1', '1234')
+        assert read_file(relation) == b'x' * 9000
+        assert os.stat(relation).st_mtime == 1500000000
+        assert stat.S_IMODE(os.stat(relation).st_mode) == 0o600
+        conf = os.path.join(dst_dir, 'data', 'postgresql.conf')
+        assert stat.S_IMODE(os.stat(conf).st_mode) == 0o644
+        assert os.path.isdir(os.path.join(dst_dir, 'data', 'pg_wal'))
+        assert os.readlink(
+            os.path.join(dst_dir, 'data', 'link')) == 'postgresql.conf'
+        assert read_file(os.path.join(
+            dst_dir, '16385', 'PG_13', '1', '5678')) == b'y' * 100
+
+    def test_extract_top_level_files(self, tmpdir):
+        directory = tmpdir.join('data').strpath
+        archive = tmpdir.join('data' + TAR_SUFFIX).strpath
+        dst_dir = tmpdir.join('config').strpath
+        write_file(os.path.join(directory, 'postgresql.conf'), b'port = 1\n')
+        write_file(os.path.join(directory, 'pg_hba.conf'), b'local all\n')
+        write_file(os.path.join(directory, 'base', '1', 'pg_ident.conf'),
+                   b'')
+        archive_directory(directory, archive)
+
+        assert extract_top_level_files(
+            archive, ['postgresql.conf', 'pg_ident.conf'], dst_dir) == [
+            'postgresql.conf']
+        assert os.listdir(dst_dir) == ['postgresql.conf']
+        assert read_file(os.path.join(dst_dir, 'postgresql.conf')) == \
+            b'port = 1\n'
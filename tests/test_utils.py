@@ -16,6 +16,7 @@
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
 import decimal
+import errno
 import json
 import logging
 import signal
@@ -620,6 +621,31 @@ class TestPowerOfTwo(object):
         assert not barman.utils.is_power_of_two(None)
 
 
+class TestSyncfs(object):
+    """
+    Test for the syncfs function
+    """
+    @mock.patch('barman.utils.ctypes')
+    def test_syncfs(self, ctypes_mock, tmpdir):
+        libc_syncfs = ctypes_mock.CDLL.return_value.syncfs
+        libc_syncfs.return_value = 0
+        assert barman.utils.syncfs(tmpdir.strpath)
+        assert libc_syncfs.call_count == 1
+
+    @mock.patch('barman.utils.ctypes')
+    def test_syncfs_error(self, ctypes_mock, tmpdir):
+        ctypes_mock.CDLL.return_value.syncfs.return_value = -1
+        ctypes_mock.get_errno.return_value = errno.EIO
+        with pytest.raises(OSError) as exc_info:
+            barman.utils.syncfs(tmpdir.strpath)
+        assert exc_info.value.errno == errno.EIO
+
+    @mock.patch('barman.utils.ctypes')
+    def test_syncfs_not_available(self, ctypes_mock, tmpdir):
+        del ctypes_mock.CDLL.return_value.syncfs
+        assert not barman.utils.syncfs(tmpdir.strpath)
+
+
 class TestForceText(object):
     """
     Test for the force_text function
@@ -0,0 +1,92 @@
+# Copyright (C) 2013-2020 2ndQuadrant Limited
+#
+# This file is part of Barman.
+#
+# Barman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Barman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Barman.  If not, see <http://www.gnu.org/licenses/>.
+
+import mock
+
+from barman.xlogdb_index import INDEX_SUFFIX, IndexBlock, XlogdbIndex
+
+
+def xlogdb_line(name, time=43):
+    return '%s\t42\t%s\tNone\n' % (name, time)
+
+
+def segment(seg):
+    return '0000000100000000%08X' % seg
+
+
+def update(xlogdb):
+    index = XlogdbIndex(xlogdb.strpath)
+    with open(xlogdb.strpath, 'rb') as fxlogdb:
+        index.update(fxlogdb)
+    return index
+
+
+def lines_from(index, xlogdb, begin):
+    with open(xlogdb.strpath, 'rb') as fxlogdb:
+        return list(index.lines_from(fxlogdb, begin))
+
+
+@mock.patch('barman.xlogdb_index.INDEX_BLOCK_LINES', 4)
+class TestXlogdbIndex(object):
+
+    def test_update(self, tmpdir):
+        xlogdb = tmpdir.join('xlog.db')
+        lines = [xlogdb_line(segment(seg)) for seg in range(1, 10)]
+        lines.insert(2, xlogdb_line('00000001.history'))
+        xlogdb.write(''.join(lines))
+
+        index = update(xlogdb)
+        assert tmpdir.join('xlog.db' + INDEX_SUFFIX).check()
+        assert index.blocks == [
+            IndexBlock(0, segment(1), segment(3)),
+            IndexBlock(len(''.join(lines[:4])), segment(4), segment(7)),
+            IndexBlock(len(''.join(lines[:8])), segment(8), segment(9)),
+        ]
+        assert index.history_lines() == [lines[2]]
+        assert lines_from(index, xlogdb, segment(5)) == lines[4:]
+        assert lines_from(index, xlogdb, segment(2)) == lines
+        assert lines_from(index, xlogdb, segment(10)) == []
+
+        # Appended lines extend the index
+        lines.append(xlogdb_line('00000002.history'))
+        lines.append(xlogdb_line(segment(10)))
+        xlogdb.write(''.join(lines))
+        index = update(xlogdb)
+        assert index.blocks[2:] == [
+            IndexBlock(len(''.join(lines[:8])), segment(8), segment(10))]
+        assert index.history_lines() == [lines[2], lines[10]]
+        assert lines_from(index, xlogdb, segment(10)) == lines[8:]
+
+        # The index is built again when xlog.db is rewritten
+        del lines[:4]
+        xlogdb.write(''.join(lines))
+        index = update(xlogdb)
+        assert index.blocks[0] == IndexBlock(0, segment(4), segment(7))
+        assert index.history_lines() == [lines[6]]
+        assert lines_from(index, xlogdb, segment(5)) == lines
+
+    def test_invalid_index(self, tmpdir):
+        xlogdb = tmpdir.join('xlog.db')
+        lines = [xlogdb_line(segment(seg)) for seg in range(1, 6)]
+        xlogdb.write(''.join(lines))
+        tmpdir.join('xlog.db' + INDEX_SUFFIX).write('invalid\n')
+        index = update(xlogdb)
+        assert len(index.blocks) == 2
+        # A partially written line is not indexed
+        xlogdb.write(''.join(lines) + segment(6))
+        index = update(xlogdb)
+        assert index.size == len(''.join(lines))
@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Barman.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import struct
 import sys
 from datetime import datetime, timedelta
 from shutil import rmtree
@@ -26,6 +28,7 @@ from barman.backup import BackupManager
 from barman.config import BackupOptions, Config
 from barman.infofile import (BackupInfo, LocalBackupInfo, Tablespace,
                              WalFileInfo)
+from barman.pagedelta import BLOCK_SIZE
 from barman.server import Server
 from barman.utils import mkpath
 from barman.xlog import DEFAULT_XLOG_SEG_SIZE
@@ -236,6 +239,7 @@ def build_config_dictionary(config_keys=None):
         'config': None,
         'backup_directory': '/some/barman/home/main',
         'backup_options': BackupOptions("", "", ""),
+        'backup_storage': 'plain',
         'bandwidth_limit': None,
         'barman_home': '/some/barman/home',
         'basebackups_directory': '/some/barman/home/main/base',
@@ -244,6 +248,7 @@ def build_config_dictionary(config_keys=None):
         'conninfo': 'host=pg01.nowhere user=postgres port=5432',
         'backup_method': 'rsync',
         'check_timeout': 30,
+        'chunk_store_directory': '/some/barman/home/main/base/chunks',
         'custom_compression_filter': None,
         'custom_decompression_filter': None,
         'description': ' Text with quotes ',
@@ -451,3 +456,32 @@ else:
         :return:
         """
         return unicode(s.replace(r'\\', r'\\\\'), "unicode_escape")  # noqa
+
+
+def build_relation_page(lsn, fill=b'x', order='<'):
+    """
+    Build a synthetic PostgreSQL page with the given LSN
+
+    :param int lsn: the LSN stored in the page header
+    :param bytes fill: the content of the rest of the page
+    :param str order: the byte order of the page header
+    :rtype: bytes
+    """
+    header = struct.pack(order + 'IIHHHHHH', lsn >> 32, lsn & 0xFFFFFFFF,
+                         0, 0, 24, BLOCK_SIZE, BLOCK_SIZE,
+                         BLOCK_SIZE | 4)
+    return header + fill * (BLOCK_SIZE - len(header))
+
+
+def write_relation_file(path, pages):
+    """
+    Write a synthetic relation file made of the given pages, creating
+    the containing directory if needed
+
+    :param str path: the path of the file
+    :param list[bytes] pages: the content of the file
+    """
+    mkpath(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        for page in pages:
+            f.write(page)